@@ -1,5 +1,6 @@
 # -- coding: utf-8 --
 
+import startup_timing  # 第一個匯入：啟動時間的起點
 from PyQt5.QtWidgets import *
 from PyQt5.QtCore import QTimer, QObject, pyqtSignal, Qt
 from PyQt5.QtGui import QImage, QPixmap
@@ -8,12 +9,18 @@ from MvImport.MvCameraControl_class import *
 from MvImport.MvErrorDefine_const import *
 from MvImport.CameraParams_header import *
 from PyUICBasicDemo import Ui_MainWindow
-from detect import load_model
 from tcp_server import start_tcp_server, get_tcp_server, stop_tcp_server
+from frame_streamer import start_frame_streamer, stop_frame_streamer
+from preview_pipeline import start_preview_pipeline, stop_preview_pipeline
+from frame_budget import start_frame_budget_watchdog, stop_frame_budget_watchdog
+from imgsz_controller import start_imgsz_controller, stop_imgsz_controller
+from model_loader import get_model_loader, start_model_loader, stop_model_loader
+from pipeline_logging import stop_pipeline_logging
+from lazy_import import prefetch_modules
 import sys
 import numpy as np
 import cv2
-from CamOperation_class import set_ai_model, set_ai_parameters_func
+from CamOperation_class import set_ai_parameters_func
 from shared_memory_sender import SharedMemorySender # 引入共享內存發送器
 from CamOperation_class import set_shared_memory_sender, set_auto_share
 from CamOperation_class import (
@@ -23,18 +30,21 @@ from CamOperation_class import (
     is_boundary_filter_enabled
 )
 
+startup_timing.mark(startup_timing.IMPORTS)
+
 # --- 新增: 用於跨執行緒通訊的訊號發射器 ---
 class SignalEmitter(QObject):
     original_image_ready = pyqtSignal(np.ndarray)
     processed_image_ready = pyqtSignal(np.ndarray)
     detection_results_ready = pyqtSignal(str)
+    preview_ready = pyqtSignal(str)  # 預覽管線有新縮圖（通道名稱）
+    model_ready = pyqtSignal(bool, str)  # 背景模型載入結束（成功與否, 說明）
 
 # --- 全域變數 ---
-# 請將此路徑替換為您自己的模型權重檔路徑
-ai_model = load_model(r"C:\Users\user1\Desktop\Yolov11\train20\weights\best_yolov11_PET.pt")#best_yolov11_PET.pt
-print("-----------------------------------Entry Yolo-Model-----7 class , material -------------------------")
-from CamOperation_class import set_ai_model
-set_ai_model(ai_model)
+# 請將此路徑替換為您自己的模型權重檔路徑（介面建立後在背景載入並暖機）
+DEFAULT_WEIGHTS = r"C:\Users\user1\Desktop\Yolov11\train20\weights\best_yolov11_PET.pt"#best_yolov11_PET.pt
+ai_model = None               # 暖機完成並換上後才設定
+model_load_from_dialog = False  # 由「載入模型」按鈕發起時，完成後顯示訊息框
 
 # 新增全域變數用於控制 AI 檢測參數
 ai_conf_thres = 0.4  # 默認信心指數閾值
@@ -145,15 +155,40 @@ if __name__ == "__main__":
         ui.ComboDevices.setCurrentIndex(0)
 
     def load_ai_model():
-        global ai_model
+        global model_load_from_dialog
         weight_path, _ = QFileDialog.getOpenFileName(mainWindow, "選擇 YOLO 權重檔", "", "PyTorch Weights (*.pt)")
         if weight_path:
-            ai_model = load_model(weight_path)
-            if ai_model:
-                set_ai_model(ai_model)
-                QMessageBox.information(mainWindow, "AI 模型", "模型載入成功！")
+            # 背景載入並暖機，完成前舊模型照常辨識
+            if not get_model_loader().load(weight_path, ai_conf_thres, ai_imgsz):
+                QMessageBox.warning(mainWindow, "AI 模型", "模型仍在載入中，請稍候！")
+                return
+            model_load_from_dialog = True
+            ui.lblModelStatus.setText("模型: 載入中...")
+
+    def on_model_ready(success, message):
+        """背景模型載入結束（主執行緒）"""
+        global ai_model, ai_imgsz, model_load_from_dialog
+        loader = get_model_loader()
+        if loader is None:
+            return
+        ai_model = loader.model
+        if success and loader.imgsz is not None and loader.imgsz != ai_imgsz:
+            # 新的影像大小在暖機完成、模型換上之後才生效
+            ai_imgsz = loader.imgsz
+            ui.edtImgSize.setText(str(ai_imgsz))
+            update_ai_param_display()
+        stats = loader.get_statistics()
+        if ai_model is None:
+            ui.lblModelStatus.setText("模型: 未載入")
+        else:
+            ui.lblModelStatus.setText(f"模型: 就緒（載入 {stats['load_ms'] or 0:.0f} ms, "
+                                      f"暖機 {stats['warm_up_ms'] or 0:.0f} ms）")
+        if model_load_from_dialog:
+            model_load_from_dialog = False
+            if success:
+                QMessageBox.information(mainWindow, "AI 模型", f"模型載入成功！\n{message}")
             else:
-                QMessageBox.warning(mainWindow, "AI 模型", "模型載入失敗！")
+                QMessageBox.warning(mainWindow, "AI 模型", f"模型載入失敗！\n{message}")
 
     def update_ai_parameters():
         """更新AI檢測參數"""
@@ -171,15 +206,26 @@ if __name__ == "__main__":
             
             # 獲取影像大小 (建議值: 320, 640, 1280)
             imgsz_value = int(ui.edtImgSize.text())
+            imgsz_note = ""
             if imgsz_value > 0 and imgsz_value % 32 == 0:  # YOLO要求是32的倍數
-                ai_imgsz = imgsz_value
+                if imgsz_value != ai_imgsz:
+                    loader = get_model_loader()
+                    if loader is not None and loader.busy:
+                        QMessageBox.warning(mainWindow, "參數錯誤", "模型仍在載入或暖機中，請稍候再變更影像大小！")
+                        ui.edtImgSize.setText(str(ai_imgsz))
+                        return
+                    if loader is not None and loader.rewarm(conf_value, imgsz_value):
+                        # 新尺寸在背景以另一個模型實例暖機，完成後由 on_model_ready 換上
+                        imgsz_note = f"（{imgsz_value} 暖機中，完成後生效）"
+                    else:
+                        ai_imgsz = imgsz_value
             else:
                 QMessageBox.warning(mainWindow, "參數錯誤", "影像大小必須是正數且為32的倍數！\n建議值: 320, 640, 1280")
                 ui.edtImgSize.setText(str(ai_imgsz))
                 return
                 
             QMessageBox.information(mainWindow, "參數更新", 
-                f"AI檢測參數已更新：\n信心指數: {ai_conf_thres}\n影像大小: {ai_imgsz}")
+                f"AI檢測參數已更新：\n信心指數: {ai_conf_thres}\n影像大小: {ai_imgsz}{imgsz_note}")
             
             # 更新顯示的當前參數
             update_ai_param_display()
@@ -197,6 +243,19 @@ if __name__ == "__main__":
         update_ai_param_display()
         QMessageBox.information(mainWindow, "參數重設", "AI檢測參數已重設為預設值！")
 
+    def toggle_adaptive_imgsz():
+        """切換推論尺寸自動調整（介面設定的影像大小為上限）"""
+        if not ui.chkAdaptiveImgsz.isChecked():
+            stop_imgsz_controller()
+            return
+        if ai_model is None:
+            QMessageBox.warning(mainWindow, "自動調整", "請先載入 AI 模型！")
+            ui.chkAdaptiveImgsz.setChecked(False)
+            return
+        start_imgsz_controller()
+        # 在背景對每個推論尺寸暖機（切換尺寸時不會有第一次推論的延遲）
+        get_model_loader().rewarm(ai_conf_thres, ai_imgsz)
+
     def update_ai_param_display():
         """更新顯示目前的AI參數"""
         ui.lblCurrentParams.setText(f"目前參數 - 信心指數: {ai_conf_thres}, 影像大小: {ai_imgsz}")
@@ -250,11 +309,13 @@ if __name__ == "__main__":
         tcp_server = get_tcp_server()
         if tcp_server and hasattr(ui, 'lblTcpStatus'):
             status = tcp_server.get_connection_status()
+            observers = status.get('observers', 0)
+            observer_text = f", 觀察端: {observers}" if observers else ""
             if status['client_connected']:
-                ui.lblTcpStatus.setText(f"TCP: LabVIEW已連接 (觸發次數: {status['trigger_count']})")
+                ui.lblTcpStatus.setText(f"TCP: LabVIEW已連接 (觸發次數: {status['trigger_count']}{observer_text})")
                 ui.lblTcpStatus.setStyleSheet("color: green; font-weight: bold;")
             elif status['server_running']:
-                ui.lblTcpStatus.setText("TCP: 等待LabVIEW連接...")
+                ui.lblTcpStatus.setText(f"TCP: 等待LabVIEW連接...{observer_text}")
                 ui.lblTcpStatus.setStyleSheet("color: orange; font-weight: bold;")
             else:
                 ui.lblTcpStatus.setText("TCP: 伺服器未啟動")
@@ -363,6 +424,31 @@ if __name__ == "__main__":
             import traceback
             traceback.print_exc()
 
+    def toggle_frame_streamer():
+        """切換遠端影像串流（預設停用，勾選後才開始監聽）"""
+        if not ui.chkFrameStreamer.isChecked():
+            stop_frame_streamer()
+            ui.edtStreamerHost.setEnabled(True)
+            ui.edtStreamerPort.setEnabled(True)
+            ui.lblStreamerStatus.setText("串流: 停用")
+            ui.lblStreamerStatus.setStyleSheet("color: gray; font-size: 10px;")
+            return
+        host = ui.edtStreamerHost.text().strip()
+        try:
+            port = int(ui.edtStreamerPort.text())
+        except ValueError:
+            QMessageBox.warning(mainWindow, "遠端串流", "埠號格式錯誤！")
+            ui.chkFrameStreamer.setChecked(False)
+            return
+        if not start_frame_streamer(host, port):
+            QMessageBox.warning(mainWindow, "遠端串流", f"無法在 {host}:{port} 啟動串流！")
+            ui.chkFrameStreamer.setChecked(False)
+            return
+        ui.edtStreamerHost.setEnabled(False)
+        ui.edtStreamerPort.setEnabled(False)
+        ui.lblStreamerStatus.setText(f"串流: {host}:{port}")
+        ui.lblStreamerStatus.setStyleSheet("color: green; font-size: 10px;")
+
     def toggle_auto_share():
         """切換自動分享模式"""
         global global_sender
@@ -651,9 +737,6 @@ if __name__ == "__main__":
             # 確保數據是連續的並正確複製
             image_copy = np.ascontiguousarray(image_array)
             
-            # 測試：打印第一個像素的顏色值來確認格式
-            print(f"First pixel RGB values: R={image_copy[0,0,0]}, G={image_copy[0,0,1]}, B={image_copy[0,0,2]}")
-            
             # 創建 QImage 並使用 rgbSwapped() 來交換 R 和 B 通道（因為收到的是 BGR）
             q_image = QImage(image_copy.data, width, height, bytes_per_line, QImage.Format_RGB888).copy()
             q_image = q_image.rgbSwapped()  # BGR → RGB
@@ -673,6 +756,26 @@ if __name__ == "__main__":
         if ui.processedDisplayLabel.isVisible():
             update_display(image_array, ui.processedDisplayLabel)
 
+    def update_preview(name):
+        """預覽管線的槽函式：貼上已縮好的 RGB 預覽（GUI 執行緒不再縮放與轉換色彩）"""
+        label = preview_labels.get(name)
+        image = preview.take(name)
+        if label is None or image is None:
+            return
+        try:
+            height, width = image.shape[:2]
+            q_image = QImage(image.data, width, height, image.strides[0], QImage.Format_RGB888)
+            label.setPixmap(QPixmap.fromImage(q_image))  # fromImage 會複製資料
+        except Exception as e:
+            print(f"Error updating preview: {e}")
+        # 顯示元件大小可能已改變，下一張預覽依新大小縮圖
+        preview.set_target(name, label.width(), label.height(), label.isVisible())
+
+    def sync_preview_targets(*args):
+        """切換分頁時更新各預覽通道的大小與可見性（隱藏的分頁不做任何預覽處理）"""
+        for name, label in preview_labels.items():
+            preview.set_target(name, label.width(), label.height(), label.isVisible())
+
     def update_detection_text(result_string):
         """更新「TCP控制」頁面的辨識結果文字"""
         ui.detectionResultText.setText(result_string)
@@ -779,6 +882,14 @@ if __name__ == "__main__":
     ai_btn_layout.addWidget(ui.bnResetAIParams)
     ai_param_layout.addLayout(ai_btn_layout)
     
+    ui.chkAdaptiveImgsz = QCheckBox("自動調整推論尺寸")
+    ui.chkAdaptiveImgsz.setChecked(False)
+    ai_param_layout.addWidget(ui.chkAdaptiveImgsz)
+    
+    ui.lblModelStatus = QLabel("模型: 載入中...")
+    ui.lblModelStatus.setStyleSheet("font-size: 10px;")
+    ai_param_layout.addWidget(ui.lblModelStatus)
+    
     ui.lblCurrentParams = QLabel(f"信心: {ai_conf_thres}, 大小: {ai_imgsz}")
     ui.lblCurrentParams.setStyleSheet("color: blue; font-size: 10px;")
     ai_param_layout.addWidget(ui.lblCurrentParams)
@@ -921,6 +1032,33 @@ if __name__ == "__main__":
     shared_mem_group.setLayout(shared_mem_layout)
     control_layout.addWidget(shared_mem_group)
     
+    # === 遠端影像串流區塊（QA 站以 python frame_streamer.py <host> 觀看） ===
+    streamer_group = QGroupBox("遠端影像串流")
+    streamer_layout = QVBoxLayout()
+    
+    streamer_host_layout = QHBoxLayout()
+    streamer_host_layout.addWidget(QLabel("IP:"))
+    ui.edtStreamerHost = QLineEdit("0.0.0.0")
+    streamer_host_layout.addWidget(ui.edtStreamerHost)
+    streamer_layout.addLayout(streamer_host_layout)
+    
+    streamer_port_layout = QHBoxLayout()
+    streamer_port_layout.addWidget(QLabel("埠號:"))
+    ui.edtStreamerPort = QLineEdit("9100")
+    streamer_port_layout.addWidget(ui.edtStreamerPort)
+    streamer_layout.addLayout(streamer_port_layout)
+    
+    ui.chkFrameStreamer = QCheckBox("啟用遠端串流")
+    ui.chkFrameStreamer.setChecked(False)
+    streamer_layout.addWidget(ui.chkFrameStreamer)
+    
+    ui.lblStreamerStatus = QLabel("串流: 停用")
+    ui.lblStreamerStatus.setStyleSheet("color: gray; font-size: 10px;")
+    streamer_layout.addWidget(ui.lblStreamerStatus)
+    
+    streamer_group.setLayout(streamer_layout)
+    control_layout.addWidget(streamer_group)
+    
     # === 圖片儲存設定區塊 ===
     image_save_group = QGroupBox("圖片儲存設定")
     image_save_layout = QVBoxLayout()
@@ -990,6 +1128,7 @@ if __name__ == "__main__":
     # === 新增 AI 參數控制按鈕事件 ===
     ui.bnUpdateAIParams.clicked.connect(update_ai_parameters)
     ui.bnResetAIParams.clicked.connect(reset_ai_parameters)
+    ui.chkAdaptiveImgsz.stateChanged.connect(toggle_adaptive_imgsz)
 
     # === 新增 邊界線設定事件處理函數 ===
     def update_top_line_from_slider():
@@ -1092,12 +1231,30 @@ if __name__ == "__main__":
     signals.processed_image_ready.connect(update_processed_display)
     signals.detection_results_ready.connect(update_detection_text)
 
+    # 預覽管線：背景縮圖、每通道最多 15 fps、合併尚未處理的通知
+    preview = start_preview_pipeline(max_fps=15, notify=signals.preview_ready.emit)
+    preview_labels = {'original': ui.originalDisplayLabel, 'processed': ui.processedDisplayLabel}
+    signals.preview_ready.connect(update_preview)
+    tabs.currentChanged.connect(sync_preview_targets)
+
+    # 帧預算監控：處理跟不上相機時依序停止疊圖、存檔，降低預覽帧率與推論尺寸，最後隔帧辨識
+    start_frame_budget_watchdog()
+
+    # 模型在背景載入並對設定的影像大小與降載尺寸暖機，完成後才換上（介面不等待）
+    signals.model_ready.connect(on_model_ready)
+    start_model_loader(notify=signals.model_ready.emit).load(DEFAULT_WEIGHTS, ai_conf_thres, ai_imgsz)
+    # 觸發系統（scipy）同樣在背景預先匯入，開啟相機時不必等待
+    prefetch_modules('simple_tracker', 'two_band_filter')
+
     # === 連接共享記憶體相關信號 ===
     ui.bnStartSharedMem.clicked.connect(start_shared_memory)
     ui.bnStopSharedMem.clicked.connect(stop_shared_memory)
     ui.bnManualShare.clicked.connect(manual_share_current_frame)
     ui.chkAutoShare.stateChanged.connect(toggle_auto_share)
     
+    # === 連接遠端影像串流開關 ===
+    ui.chkFrameStreamer.stateChanged.connect(toggle_frame_streamer)
+    
     # === 連接圖片儲存相關按鈕事件 ===
     ui.bnSelectSavePath.clicked.connect(select_save_path)
     ui.chkImageSaveEnabled.stateChanged.connect(toggle_image_save)
@@ -1107,6 +1264,7 @@ if __name__ == "__main__":
 
     # --- 顯示與清理 ---
     mainWindow.show()
+    startup_timing.mark(startup_timing.UI_READY)
     # 設置AI參數函數參考
     set_ai_parameters_func(get_ai_parameters)
     
@@ -1247,6 +1405,7 @@ if __name__ == "__main__":
     auto_init_timer.setSingleShot(True)
     auto_init_timer.timeout.connect(auto_initialize)
     auto_init_timer.start(500)  # 500ms 後執行自動初始化
+    QTimer.singleShot(0, sync_preview_targets)  # 視窗顯示後才有正確的元件大小
     
     def cleanup():
         print("Cleaning up resources...")
@@ -1262,12 +1421,51 @@ if __name__ == "__main__":
         except:
             pass
         
+        # 等待背景寫檔完成
+        try:
+            from CamOperation_class import shutdown_image_writer
+            shutdown_image_writer()
+        except:
+            pass
+        
+        # 停止遠端影像串流
+        try:
+            stop_frame_streamer()
+        except:
+            pass
+        
+        # 停止預覽管線
+        try:
+            stop_preview_pipeline()
+        except:
+            pass
+        
+        # 停止帧預算監控
+        try:
+            stop_frame_budget_watchdog()
+        except:
+            pass
+        
+        # 停止推論尺寸自動調整
+        try:
+            stop_imgsz_controller()
+        except:
+            pass
+        
+        # 停止模型載入器
+        try:
+            stop_model_loader()
+        except:
+            pass
+        
         # 關閉相機
         try:
             close_device()
         except:
             pass
         print("Cleanup finished.")
+        # 最後停止日誌執行緒，輸出佇列中剩餘的訊息
+        stop_pipeline_logging()
     
     app.aboutToQuit.connect(cleanup)
     
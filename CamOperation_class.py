@@ -11,36 +11,49 @@ import ctypes
 import random
 from ctypes import *
 import cv2
-from shared_memory_sender import SharedMemorySender
+import logging
+from pipeline_logging import get_pipeline_logger
+from pipeline_metrics import metrics
+from shared_memory_sender import SharedMemorySender, build_detection_table
+from frame_budget import get_frame_budget_watchdog
+from imgsz_controller import get_imgsz_controller
+from model_loader import get_model_loader
+from lazy_import import lazy_module
+from startup_timing import FIRST_FRAME, FIRST_INFERENCE, mark as mark_startup, print_startup_report
+from frame_streamer import get_frame_streamer
+from frame_trace import (STAGE_CONVERT, STAGE_GRAB, STAGE_INFER, STAGE_SEND, STAGE_SHARE,
+                         STAGE_TRACK, STAGE_TRIGGER, get_frame_tracer)
+from preview_pipeline import get_preview_pipeline
+from overlay_compositor import OverlayScene, compose_overlay
+from frame_pool import FramePoolSet
+from image_writer import AsyncImageWriter
+from shm_ring import DET_FLAG_TRIGGERED
 
 sys.path.append("../MvImport")
 
 from MvImport.CameraParams_header import *
 from MvImport.MvCameraControl_class import *
 
-# 匯入 YOLO 偵測功能
-try:
-    from detect import detect_objects, draw_custom_boxes
-except ImportError:
-    print("Warning: detect module not found. AI detection will be disabled.")
-    detect_objects = None
-    draw_custom_boxes = None
+# YOLO 偵測（ultralytics / torch）、Two-Band Filter 觸發系統（scipy）在第一次使用時才匯入：
+# 有模型時才會辨識（模型由 ModelLoader 在背景載入，同時完成匯入），啟用觸發系統時才建立追蹤器
+_detect = lazy_module('detect')
+_simple_tracker = lazy_module('simple_tracker')
+_two_band_filter = lazy_module('two_band_filter')
 
-# 匯入 TCP 伺服器功能
-try:
-    from tcp_server import get_tcp_server
-except ImportError:
-    print("Warning: tcp_server module not found. TCP functionality will be disabled.")
-    get_tcp_server = None
+# TCP 伺服器只在入口已匯入 tcp_server 時才可能存在，這裡不主動匯入
+_tcp_server = lazy_module('tcp_server')
 
-# 匯入 Two-Band Filter 觸發系統
 try:
-    from simple_tracker import SimpleTracker
-    from two_band_filter import TwoBandFilter
+    from blow_timing import device_timestamp_from_frame_info
 except ImportError:
-    print("Warning: Two-Band Filter system not found. Trigger system will be disabled.")
-    SimpleTracker = None
-    TwoBandFilter = None
+    print("Warning: blow_timing module not found. Device timestamps will be disabled.")
+    device_timestamp_from_frame_info = None
+
+
+def get_tcp_server():
+    """TCP 伺服器實例（tcp_server 尚未匯入時伺服器不可能已啟動）"""
+    module = _tcp_server.peek()
+    return module.get_tcp_server() if module is not None else None
 
 ai_model = None  # 在這邊先定義一個全域變數
 
@@ -59,6 +72,25 @@ boundary_filter_enabled = True  # 是否啟用邊界線過濾
 # 新增：圖片儲存控制參數
 image_save_enabled = False  # 是否啟用圖片儲存
 image_save_path = ""  # 圖片儲存路徑
+image_save_codec = ("jpeg", 95, 3)  # (編碼格式, JPEG 品質, PNG 壓縮等級)
+image_writer = None  # 背景寫檔執行緒池（第一次存檔時建立）
+
+# 原始帧記錄（None 表示不記錄）
+raw_frame_recorder = None
+
+# 擷取執行緒的日誌（背景輸出、限速；逐帧資訊為 DEBUG）
+logger = get_pipeline_logger("CamOperation", rate_per_s=5.0)
+
+# 擷取執行緒的健康指標（事件發生時遞增，由 pipeline_metrics 的 HTTP 端點輸出）
+FRAMES_GRABBED = metrics.counter('nircam_frames_grabbed_total', 'Frames received from the camera')
+FRAMES_PROCESSED = metrics.counter('nircam_frames_processed_total',
+                                   'Frames that completed conversion, inference and triggering')
+FRAMES_MISSED = metrics.counter('nircam_frames_missed_total', 'Gaps in nFrameNum (frames lost before the host)')
+LOST_PACKETS = metrics.counter('nircam_lost_packets_total', 'GigE packets lost (nLostPacket)')
+GRAB_ERRORS = metrics.counter('nircam_grab_errors_total', 'MV_CC_GetOneFrameTimeout failures', ('reason',))
+INFERENCE_ERRORS = metrics.counter('nircam_inference_errors_total', 'Frames whose detection / trigger path raised')
+DETECTIONS_PER_FRAME = metrics.histogram('nircam_detections_per_frame', 'YOLO detections per frame',
+                                         buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34))
 
 def set_boundary_line_positions(top_ratio, bottom_ratio):
     """設定上下邊界線的位置（比例值 0.0 ~ 1.0）"""
@@ -91,12 +123,44 @@ def set_image_save_path(path):
     """設定圖片儲存路徑"""
     global image_save_path
     image_save_path = path
+    if image_writer is not None:
+        image_writer.base_dir = path
     print(f"[圖片儲存] 儲存路徑: {path}")
 
+def set_image_save_codec(codec, jpeg_quality=95, png_level=3):
+    """設定圖片儲存格式（"jpeg"、"png" 或 "raw"）"""
+    global image_save_codec
+    image_save_codec = (codec, jpeg_quality, png_level)
+    if image_writer is not None:
+        image_writer.set_codec(codec, jpeg_quality, png_level)
+    print(f"[圖片儲存] 儲存格式: {codec}")
+
 def get_image_save_settings():
     """獲取圖片儲存設定"""
     return image_save_enabled, image_save_path
 
+def get_image_writer():
+    """獲取背景寫檔執行緒池（第一次呼叫時建立）"""
+    global image_writer
+    if image_writer is None:
+        codec, jpeg_quality, png_level = image_save_codec
+        image_writer = AsyncImageWriter(image_save_path, codec, jpeg_quality, png_level)
+    return image_writer
+
+def shutdown_image_writer():
+    """等待尚未寫完的圖片後停止寫檔執行緒"""
+    global image_writer
+    if image_writer is not None:
+        image_writer.close()
+        image_writer.print_statistics()
+        image_writer = None
+
+def set_raw_frame_recorder(recorder):
+    """設定原始 Bayer 帧記錄器（RawFrameRecorder，None 表示停止記錄）"""
+    global raw_frame_recorder
+    raw_frame_recorder = recorder
+    print(f"[原始帧記錄] {'開始記錄: ' + recorder.directory if recorder is not None else '已停止'}")
+
 def check_box_touches_boundary_lines(y1, y2, image_height):
     """
     檢查邊界框是否觸碰到上下邊界線
@@ -223,30 +287,23 @@ def Is_color_data(enGvspPixelType):
     else:
         return False
 
-# Mono圖像轉為python數組
-def Mono_numpy(data, nWidth, nHeight):
+# Mono圖像轉為python數組（out 為 None 時回傳指向 data 的視圖，不複製）
+def Mono_numpy(data, nWidth, nHeight, out=None):
     data_ = np.frombuffer(data, count=int(nWidth * nHeight), dtype=np.uint8, offset=0)
-    data_mono_arr = data_.reshape(nHeight, nWidth)
-    numArray = np.zeros([nHeight, nWidth, 1], "uint8")
-    numArray[:, :, 0] = data_mono_arr
-    return numArray
+    data_mono_arr = data_.reshape(nHeight, nWidth, 1)
+    if out is None:
+        return data_mono_arr
+    np.copyto(out.reshape(nHeight, nWidth, 1), data_mono_arr)
+    return out
 
-# 彩色圖像轉為python數組
-def Color_numpy(data, nWidth, nHeight):
+# 彩色圖像轉為python數組（RGB 交錯排列，out 為 None 時回傳指向 data 的視圖，不複製）
+def Color_numpy(data, nWidth, nHeight, out=None):
     data_ = np.frombuffer(data, count=int(nWidth * nHeight * 3), dtype=np.uint8, offset=0)
-    data_r = data_[0:nWidth * nHeight * 3:3]
-    data_g = data_[1:nWidth * nHeight * 3:3]
-    data_b = data_[2:nWidth * nHeight * 3:3]
-
-    data_r_arr = data_r.reshape(nHeight, nWidth)
-    data_g_arr = data_g.reshape(nHeight, nWidth)
-    data_b_arr = data_b.reshape(nHeight, nWidth)
-    numArray = np.zeros([nHeight, nWidth, 3], "uint8")
-
-    numArray[:, :, 0] = data_r_arr
-    numArray[:, :, 1] = data_g_arr
-    numArray[:, :, 2] = data_b_arr
-    return numArray
+    data_color_arr = data_.reshape(nHeight, nWidth, 3)
+    if out is None:
+        return data_color_arr
+    np.copyto(out, data_color_arr)
+    return out
 def set_shared_memory_sender(sender):
     """設置共享記憶體發送器"""
     global shared_memory_sender
@@ -285,6 +342,8 @@ class CameraOperation:
         self.exposure_time = exposure_time
         self.gain = gain
         self.buf_lock = threading.Lock()
+        # 每帧轉換結果寫入預先配置的緩衝區（工作執行緒、共享記憶體、串流各持有一個參考）
+        self.frame_pools = FramePoolSet(capacity=6)
         
         # ========== Two-Band Filter 觸發系統 ==========
         self.tracker = None
@@ -293,6 +352,15 @@ class CameraOperation:
         # ==============================================
 
     def Open_device(self):
+        if not self.b_open_device and getattr(self.obj_cam, 'is_replay', False):
+            # 重播來源（raw_frame_log.ReplayCamera）不需要列舉裝置與設定參數
+            ret = self.obj_cam.MV_CC_OpenDevice()
+            if ret != 0:
+                return ret
+            print("open replay source successfully!")
+            self.b_open_device = True
+            self.b_thread_closed = False
+            return MV_OK
         if not self.b_open_device:
             if self.n_connect_num < 0:
                 return MV_E_CALLORDER
@@ -481,7 +549,25 @@ class CameraOperation:
     
     # ========== Two-Band Filter 觸發系統方法 ==========
     
-    def initialize_trigger_system(self, image_width, image_height, lens_type="12mm"):
+    def get_timestamp_tick_hz(self, default=1e9):
+        """
+        讀取相機裝置時間戳頻率（GevTimestampTickFrequency）
+        
+        Parameters:
+            default: 讀取失敗（例如 USB 相機）時使用的頻率
+            
+        Returns:
+            float: 時間戳頻率（Hz）
+        """
+        if self.b_open_device:
+            stTickFreq = MVCC_INTVALUE_EX()
+            ret = self.obj_cam.MV_CC_GetIntValueEx("GevTimestampTickFrequency", stTickFreq)
+            if ret == MV_OK and stTickFreq.nCurValue > 0:
+                return float(stTickFreq.nCurValue)
+        return default
+    
+    def initialize_trigger_system(self, image_width, image_height, lens_type="12mm",
+                                  nozzle_distance_px=None):
         """
         初始化 Two-Band Filter 觸發系統
         
@@ -489,17 +575,20 @@ class CameraOperation:
             image_width: 圖像寬度（像素）
             image_height: 圖像高度（像素）
             lens_type: 鏡頭類型 ("12mm" 或 "8mm")
+            nozzle_distance_px: 噴嘴線與圖像下緣的距離（像素），None 表示不預測到達時間
             
         Returns:
             bool: 是否成功初始化
         """
-        if SimpleTracker is None or TwoBandFilter is None:
+        simple_tracker = _simple_tracker.load()
+        two_band_filter = _two_band_filter.load()
+        if simple_tracker is None or two_band_filter is None:
             print("[Camera] Two-Band Filter system not imported. Cannot initialize.")
             return False
         
         try:
             # 初始化追蹤器
-            self.tracker = SimpleTracker(
+            self.tracker = simple_tracker.SimpleTracker(
                 max_age=15,           # 追蹤失敗後保留 15 帧
                 min_hits=3,           # 至少匹配 3 次才視為穩定追蹤
                 iou_threshold=0.3     # IoU 閾值
@@ -507,15 +596,17 @@ class CameraOperation:
             print("[Camera] SimpleTracker initialized")
             
             # 初始化 Two-Band Filter
-            tcp_server = get_tcp_server() if get_tcp_server is not None else None
+            tcp_server = get_tcp_server()
             
-            self.two_band_filter = TwoBandFilter(
+            self.two_band_filter = two_band_filter.TwoBandFilter(
                 image_width=image_width,
                 image_height=image_height,
                 lens_type=lens_type,
                 confidence_threshold=0.75,
                 tracking_timeout_frames=15,
-                tcp_server=tcp_server
+                tcp_server=tcp_server,
+                nozzle_distance_px=nozzle_distance_px,
+                timestamp_tick_hz=self.get_timestamp_tick_hz()
             )
             print("[Camera] Two-Band Filter initialized")
             
@@ -576,10 +667,15 @@ class CameraOperation:
             print("Get PayloadSize failed!")
             return
         NeedBufSize = int(stPayloadSize.nCurValue)
+        frame_handle = None  # 本帧 RGB 影像的緩衝區（下一帧開始或執行緒結束時釋放）
+        last_frame_num = None  # 上一帧的 nFrameNum（計算遺失帧數）
     
         print("Work thread started...")
     
         while not self.b_exit:
+            if frame_handle is not None:
+                frame_handle.release()
+                frame_handle = None
             try:
                 # 確保緩衝區足夠大
                 if self.buf_grab_image_size < NeedBufSize:
@@ -595,8 +691,43 @@ class CameraOperation:
                 )
     
                 if ret == 0:  # 成功獲取圖像
+                    # 記錄取得此帧的主機時間（用於氣吹時序預測）
+                    frame_received_at = time.monotonic()
+                    
                     # 更新幀信息
                     self.st_frame_info = stFrameInfo
+                    FRAMES_GRABBED.inc()
+                    if stFrameInfo.nLostPacket:
+                        LOST_PACKETS.inc(stFrameInfo.nLostPacket)
+                    if last_frame_num is not None and stFrameInfo.nFrameNum > last_frame_num + 1:
+                        FRAMES_MISSED.inc(stFrameInfo.nFrameNum - last_frame_num - 1)
+                    last_frame_num = stFrameInfo.nFrameNum
+
+                    # 帧預算監控（未啟用時為 None）：依降載狀態決定本帧要做哪些工作
+                    frame_start = time.perf_counter()
+                    mark_startup(FIRST_FRAME)
+                    watchdog = get_frame_budget_watchdog()
+                    degradation = None
+                    if watchdog is not None:
+                        watchdog.frame_arrived(stFrameInfo.nFrameNum, frame_start)
+                        degradation = watchdog.state
+                        preview = get_preview_pipeline()
+                        if preview is not None:
+                            preview.fps_cap = degradation.preview_fps_cap
+
+                    # 逐帧延遲追蹤（未啟用時為 None）
+                    tracer = get_frame_tracer()
+                    if tracer is not None:
+                        grab_ns = tracer.begin(
+                            stFrameInfo.nFrameNum,
+                            device_timestamp_from_frame_info(stFrameInfo)
+                            if device_timestamp_from_frame_info is not None else None
+                        )
+
+                    # 原始帧記錄（只複製一次，寫檔在記錄器的背景執行緒）
+                    recorder = raw_frame_recorder
+                    if recorder is not None:
+                        recorder.record(self.buf_grab_image, stFrameInfo)
     
                     # 獲取緩存鎖，保護共享數據
                     self.buf_lock.acquire()
@@ -615,19 +746,27 @@ class CameraOperation:
                         )
                     finally:
                         self.buf_lock.release()
+                    if tracer is not None:
+                        tracer.record(STAGE_GRAB, grab_ns)
     
                     # 打印幀信息
-                    print(f"Frame: {self.st_frame_info.nFrameNum}, "
-                          f"Size: {self.st_frame_info.nWidth}x{self.st_frame_info.nHeight}, "
-                          f"PixelType: {self.st_frame_info.enPixelType} (0x{self.st_frame_info.enPixelType:08X})")
+                    logger.debug("Frame: %d, Size: %dx%d, PixelType: %d (0x%08X)",
+                                 self.st_frame_info.nFrameNum,
+                                 self.st_frame_info.nWidth, self.st_frame_info.nHeight,
+                                 self.st_frame_info.enPixelType, self.st_frame_info.enPixelType)
     
                     # ========================================
                     # 第一步：影像格式轉換（從 Bayer/Mono 轉為 RGB）
                     # ========================================
+                    stage_ns = time.perf_counter_ns()
                     try:
                         raw_image = np.asarray(self.buf_grab_image).reshape(
                             (self.st_frame_info.nHeight, self.st_frame_info.nWidth)
                         )
+                        frame_handle = self.frame_pools.acquire(
+                            (self.st_frame_info.nHeight, self.st_frame_info.nWidth, 3)
+                        )
+                        image_rgb = frame_handle.array
                         
                         # 根據像素格式進行轉換
                         if Is_color_data(self.st_frame_info.enPixelType):
@@ -635,86 +774,71 @@ class CameraOperation:
                             # 注意：嘗試使用 BG 格式來修正紅藍通道互換問題
                             if self.st_frame_info.enPixelType == PixelType_Gvsp_BayerRG8:
                                 # RG8 使用 BG2RGB 轉換（紅藍互換）
-                                image_rgb = cv2.cvtColor(raw_image, cv2.COLOR_BAYER_BG2RGB)
+                                cv2.cvtColor(raw_image, cv2.COLOR_BAYER_BG2RGB, dst=image_rgb)
                             elif self.st_frame_info.enPixelType == PixelType_Gvsp_BayerGR8:
                                 # GR8 使用 GB2RGB 轉換（紅藍互換）
-                                image_rgb = cv2.cvtColor(raw_image, cv2.COLOR_BAYER_GB2RGB)
+                                cv2.cvtColor(raw_image, cv2.COLOR_BAYER_GB2RGB, dst=image_rgb)
                             elif self.st_frame_info.enPixelType == PixelType_Gvsp_BayerGB8:
                                 # GB8 使用 GR2RGB 轉換（紅藍互換）
-                                image_rgb = cv2.cvtColor(raw_image, cv2.COLOR_BAYER_GR2RGB)
+                                cv2.cvtColor(raw_image, cv2.COLOR_BAYER_GR2RGB, dst=image_rgb)
                             elif self.st_frame_info.enPixelType == PixelType_Gvsp_BayerBG8:
                                 # BG8 使用 RG2RGB 轉換（紅藍互換）
-                                image_rgb = cv2.cvtColor(raw_image, cv2.COLOR_BAYER_RG2RGB)
+                                cv2.cvtColor(raw_image, cv2.COLOR_BAYER_RG2RGB, dst=image_rgb)
                             else:
                                 # 默認使用 BG8（而不是 RG8）
-                                image_rgb = cv2.cvtColor(raw_image, cv2.COLOR_BAYER_BG2RGB)
+                                cv2.cvtColor(raw_image, cv2.COLOR_BAYER_BG2RGB, dst=image_rgb)
                         elif Is_mono_data(self.st_frame_info.enPixelType):
-                            # 單色影像轉換為 3 通道供後續處理
+                            # 單色影像轉換為 3 通道供後續處理（直接讀取接收緩衝區，不複製）
                             mono_array = Mono_numpy(
                                 self.buf_save_image, 
                                 self.st_frame_info.nWidth, 
                                 self.st_frame_info.nHeight
                             )
                             # 單色轉 RGB（三個通道相同）
-                            image_rgb = cv2.cvtColor(mono_array.squeeze(), cv2.COLOR_GRAY2RGB)
+                            cv2.cvtColor(mono_array.squeeze(), cv2.COLOR_GRAY2RGB, dst=image_rgb)
                         else:
                             # 未知格式，跳過此幀
-                            print(f"Unsupported pixel format: {self.st_frame_info.enPixelType}")
+                            logger.warning("Unsupported pixel format: %d", self.st_frame_info.enPixelType)
                             continue
                         
                     except Exception as e:
-                        print(f"Image conversion error: {e}")
+                        logger.error("Image conversion error: %s", e)
                         continue
+                    if tracer is not None:
+                        tracer.record(STAGE_CONVERT, stage_ns)
                     
                     # ========================================
                     # 第二步：共享記憶體自動發送（如果啟用）
                     # ========================================
-                    if auto_share_enabled and shared_memory_sender is not None:
-                        try:
-                            # 複製圖像並轉換為 BGR 格式（共享記憶體可能需要 BGR）
-                            image_for_sharing = cv2.cvtColor(image_rgb, cv2.COLOR_RGB2BGR)
-                            
-                            # 執行您需要的預處理
-                            # 目前不執行鏡像翻轉
-                            image_for_sharing = image_for_sharing
-                            
-                            # 發送到共享記憶體
-                            if hasattr(shared_memory_sender, 'trigger_count'):
-                                shared_memory_sender.trigger_count += 1
-                                trigger_count = shared_memory_sender.trigger_count
-                            else:
-                                shared_memory_sender.trigger_count = 1
-                                trigger_count = 1
-                            
-                            shared_memory_sender.send_image(image_for_sharing, trigger_count)
-                            
-                            print(f"[共享記憶體] 已自動發送第 {trigger_count} 幀")
-                            
-                        except Exception as e:
-                            print(f"[共享記憶體] 發送失敗: {e}")
+                    # AI 辨識啟用時延後到辨識之後發送，讓槽位同時帶有此帧的偵測表
+                    share_pending = auto_share_enabled and shared_memory_sender is not None
+                    model = ai_model   # 每帧只讀一次，背景換上新模型時不會在帧中途切換
+                    detect = _detect.load() if model is not None else None
+                    run_detection = detect is not None
+                    if run_detection and watchdog is not None and not watchdog.should_detect():
+                        run_detection = False   # 降載：此帧不辨識
+                    if share_pending and not run_detection:
+                        self._share_frame(image_rgb)
+                        share_pending = False
+                    
+                    # 遠端串流（沒有觀看端時不做任何處理；裁切模式需等辨識結果）
+                    streamer = get_frame_streamer()
+                    if streamer is not None and streamer.has_viewers and not streamer.crop_mode:
+                        streamer.submit(frame_handle, self.st_frame_info.nFrameNum)
     
                     # ========================================
                     # 第三步：AI 辨識處理（如果啟用）
                     # ========================================
-                    if ai_model is not None and detect_objects is not None:
+                    if run_detection:
                         try:
                             # image_rgb 已經是 RGB 格式，直接使用
                             # 使用原始影像進行處理（不翻轉）
                             image_rgb_processed = image_rgb
                             
                             # 儲存圖像（根據設定決定是否儲存）
-                            if image_save_enabled and image_save_path:
-                                try:
-                                    today = datetime.datetime.now().strftime("%Y%m%d")
-                                    save_dir = os.path.join(image_save_path, today)
-                                    os.makedirs(save_dir, exist_ok=True)
-                                    
-                                    now = datetime.datetime.now()
-                                    timestamp = now.strftime("%Y%m%d_%H%M%S_%f")[:-3]
-                                    filename = os.path.join(save_dir, f"image_{timestamp}.jpg")
-                                    cv2.imwrite(filename, cv2.cvtColor(image_rgb_processed, cv2.COLOR_RGB2BGR))
-                                except Exception as e:
-                                    print(f"[圖片儲存] 儲存失敗: {e}")
+                            # 編碼與寫檔在背景執行緒完成，佇列滿時丟棄此帧，不影響推論帧率
+                            if image_save_enabled and image_save_path and (degradation is None or degradation.saving):
+                                get_image_writer().submit(frame_handle, is_rgb=True)
                             
                             # 獲取當前的AI參數
                             conf_thres = 0.4  # 默認值
@@ -724,18 +848,53 @@ class CameraOperation:
                                 try:
                                     conf_thres, imgsz = get_ai_parameters_func()
                                 except Exception as e:
-                                    print(f"Error getting AI parameters, using defaults: {e}")
+                                    logger.warning("Error getting AI parameters, using defaults: %s", e)
+                            # 推論尺寸自動調整（未啟用時為 None）：介面設定的影像大小為上限
+                            imgsz_controller = get_imgsz_controller()
+                            if imgsz_controller is not None and not imgsz_controller.warmed_up:
+                                imgsz_controller = None     # 各級尚未在換上的模型暖機，先用固定尺寸
+                            if imgsz_controller is not None:
+                                imgsz = imgsz_controller.choose(imgsz)
+                            imgsz_capped = (degradation is not None and degradation.imgsz_cap is not None
+                                            and degradation.imgsz_cap < imgsz)
+                            if imgsz_capped:
+                                imgsz = degradation.imgsz_cap
                             
                             # 執行 AI 辨識
-                            results = detect_objects(ai_model, image_rgb_processed, conf_thres=conf_thres, imgsz=imgsz)
+                            stage_ns = time.perf_counter_ns()
+                            results = detect.detect_objects(model, image_rgb_processed, conf_thres=conf_thres, imgsz=imgsz)
+                            if tracer is not None:
+                                tracer.record(STAGE_INFER, stage_ns)
+                            if mark_startup(FIRST_INFERENCE):
+                                print_startup_report()
+                            if imgsz_controller is not None:
+                                imgsz_controller.observe(imgsz, (time.perf_counter_ns() - stage_ns) / 1e6, results,
+                                                         capped=imgsz_capped)
+                            if results and getattr(results[0], 'boxes', None) is not None:
+                                DETECTIONS_PER_FRAME.observe(len(results[0].boxes))
+                            
+                            # 偵測串流發送給觀察端（沒有觀察端連線時不做任何處理）
+                            stream_server = get_tcp_server()
+                            if stream_server is not None:
+                                stream_server.publish_detection_stream(
+                                    results,
+                                    self.st_frame_info.nWidth,
+                                    self.st_frame_info.nHeight,
+                                    frame_num=self.st_frame_info.nFrameNum
+                                )
                             
                             # ========================================
                             # Two-Band Filter 觸發系統處理
                             # ========================================
+                            tracker_results = None
+                            filter_result = None
                             if self.enable_trigger_system and self.tracker is not None and self.two_band_filter is not None:
                                 try:
                                     # 1. 物體追蹤
+                                    stage_ns = time.perf_counter_ns()
                                     tracker_results = self.tracker.update(results)
+                                    if tracer is not None:
+                                        tracer.record(STAGE_TRACK, stage_ns)
                                     
                                     # 2. 轉換格式給 Two-Band Filter
                                     # tracker_results: [(track_id, bbox, confidence, class_id), ...]
@@ -745,29 +904,34 @@ class CameraOperation:
                                         for track_id, bbox, conf, cls in tracker_results
                                     ]
                                     
-                                    # 3. Two-Band Filter 處理（觸發判斷）
+                                    # 3. Two-Band Filter 處理（觸發判斷，氣吹指令在其中送出）
+                                    stage_ns = time.perf_counter_ns()
                                     filter_result = self.two_band_filter.process_frame(
                                         detections=results,
-                                        tracker_results=filter_input
+                                        tracker_results=filter_input,
+                                        device_timestamp=device_timestamp_from_frame_info(self.st_frame_info),
+                                        received_at=frame_received_at
                                     )
+                                    if tracer is not None:
+                                        tracer.record(STAGE_TRIGGER, stage_ns)
                                     
                                     # 4. 檢查觸發結果
                                     if filter_result.get('triggered_this_frame'):
                                         triggered_count = len(filter_result['triggered_this_frame'])
-                                        print(f"[TriggerSystem] Triggered {triggered_count} objects this frame")
+                                        logger.info("[TriggerSystem] Triggered %d objects this frame", triggered_count)
                                         
                                         # 列印每個觸發物體的詳細資訊
-                                        for trigger in filter_result['triggered_this_frame']:
-                                            print(f"  → Track {trigger['track_id']}: "
-                                                  f"Class={trigger['class_id']}, "
-                                                  f"Pos=({trigger['cx']:.1f}, {trigger['cy']:.1f}), "
-                                                  f"Conf={trigger['confidence']:.2f}")
+                                        if logger.isEnabledFor(logging.DEBUG):
+                                            for trigger in filter_result['triggered_this_frame']:
+                                                logger.debug("  → Track %d: Class=%d, Pos=(%.1f, %.1f), Conf=%.2f",
+                                                             trigger['track_id'], trigger['class_id'],
+                                                             trigger['cx'], trigger['cy'], trigger['confidence'])
                                     
                                     # 注意：氣吹指令已經由 blow_controller 自動發送到 TCP
                                     # 不需要在這裡再次發送
                                     
                                 except Exception as e:
-                                    print(f"[TriggerSystem] Error in Two-Band Filter processing: {e}")
+                                    logger.error("[TriggerSystem] Error in Two-Band Filter processing: %s", e)
                                     import traceback
                                     traceback.print_exc()
                             
@@ -800,22 +964,43 @@ class CameraOperation:
                                             filtered_boxes.append((cls, int(x1), int(y1), int(x2), int(y2), conf))
                                 
                                 # 發送辨識結果到 TCP 服務器
-                                if get_tcp_server is not None:
-                                    tcp_server = get_tcp_server()
-                                    if tcp_server and len(filtered_boxes) > 0:
-                                        # 只有當有符合條件的物件時才傳送
-                                        tcp_server.send_filtered_detection_result(
-                                            filtered_boxes,
-                                            image_width, 
-                                            image_height
-                                        )
-                                    elif tcp_server and not boundary_filter_enabled:
-                                        # 未啟用過濾時，正常傳送所有結果
-                                        tcp_server.send_detection_result(
-                                            results, 
-                                            image_width, 
-                                            image_height
-                                        )
+                                stage_ns = time.perf_counter_ns()
+                                tcp_server = get_tcp_server()
+                                if tcp_server and len(filtered_boxes) > 0:
+                                    # 只有當有符合條件的物件時才傳送
+                                    tcp_server.send_filtered_detection_result(
+                                        filtered_boxes,
+                                        image_width, 
+                                        image_height
+                                    )
+                                elif tcp_server and not boundary_filter_enabled:
+                                    # 未啟用過濾時，正常傳送所有結果
+                                    tcp_server.send_detection_result(
+                                        results, 
+                                        image_width, 
+                                        image_height
+                                    )
+                                if tracer is not None:
+                                    tracer.record(STAGE_SEND, stage_ns)
+
+                            # 共享記憶體：影像與偵測表寫入同一槽位
+                            stream_crops = streamer is not None and streamer.has_viewers and streamer.crop_mode
+                            if share_pending or stream_crops:
+                                triggered_ids = None
+                                if self.two_band_filter is not None:
+                                    triggered_ids = [track_id for track_id, state
+                                                     in self.two_band_filter.track_manager.tracks.items()
+                                                     if state.triggered]
+                                detection_table = build_detection_table(
+                                    results, tracker_results, filter_result, triggered_ids)
+                                if share_pending:
+                                    self._share_frame(image_rgb, detection_table)
+                                    share_pending = False
+                                if stream_crops:
+                                    # 只串流本帧觸發氣吹的區域
+                                    triggered_rows = detection_table[(detection_table['flags'] & DET_FLAG_TRIGGERED) != 0]
+                                    rois = [(d['x1'], d['y1'], d['x2'], d['y2']) for d in triggered_rows]
+                                    streamer.submit(frame_handle, self.st_frame_info.nFrameNum, rois=rois)
 
                             # 準備辨識結果文字
                             detection_text_result = f"Frame: {self.st_frame_info.nFrameNum}\n"
@@ -834,17 +1019,33 @@ class CameraOperation:
                             detection_text_result += f"下邊界線: {boundary_line_bottom:.1%} (Y={bottom_line_y}px)\n"
                             detection_text_result += "------------------------------------\n"
     
+                            # 疊圖只記錄成場景，由預覽管線縮圖後畫在預覽緩衝區上（推論影像不被修改）
+                            # 降載停用疊圖時辨識頁照常更新，只是不畫框
+                            preview = get_preview_pipeline()
+                            if preview is not None:
+                                want_processed = preview.wants('processed')
+                            else:
+                                want_processed = hasattr(signals, 'processed_image_ready')
+                            draw_overlay = want_processed and (degradation is None or degradation.overlays)
+                            scene = None
+                            if draw_overlay:
+                                scene = OverlayScene(image_width, image_height)
+                                detect.add_detection_boxes(scene, results)
+                                scene.add_hline(top_line_y, (255, 255, 0), 3)     # 黃色上線
+                                scene.add_hline(bottom_line_y, (0, 255, 255), 3)  # 青色下線
+                                if self.enable_trigger_system and self.two_band_filter is not None:
+                                    self.two_band_filter.add_zones_to_overlay(scene)
+                                    if tracker_results:
+                                        self.two_band_filter.add_tracks_to_overlay(scene, tracker_results)
+                                    if filter_result:
+                                        triggered_now = len(filter_result.get('triggered_this_frame', []))
+                                        scene.add_stat(f"Frame: {self.st_frame_info.nFrameNum}")
+                                        scene.add_stat(f"Active Tracks: {len(self.two_band_filter.track_manager.tracks)}",
+                                                       (0, 255, 0))
+                                        scene.add_stat(f"Triggered: {triggered_now}",
+                                                       (255, 255, 0) if triggered_now else (255, 255, 255))
+                            
                             if results and hasattr(results[0], 'boxes') and len(results[0].boxes) > 0:
-                                # 在影像上繪製檢測框
-                                if draw_custom_boxes is not None:
-                                    processed_image = draw_custom_boxes(image_rgb_processed.copy(), results)
-                                else:
-                                    processed_image = image_rgb_processed.copy()
-                                
-                                # 繪製邊界線
-                                processed_image = cv2.line(processed_image, (0, top_line_y), (image_width, top_line_y), (255, 255, 0), 3)  # 黃色上線
-                                processed_image = cv2.line(processed_image, (0, bottom_line_y), (image_width, bottom_line_y), (0, 255, 255), 3)  # 青色下線
-    
                                 # 準備文字輸出結果
                                 if 'filtered_boxes' in locals():
                                     detection_text_result += f"檢測到 {all_boxes_count} 個物件, 觸碰邊界線: {len(filtered_boxes)} 個:\n"
@@ -867,67 +1068,96 @@ class CameraOperation:
                                         f"位置=({x1:.0f},{y1:.0f})-({x2:.0f},{y2:.0f}) [{status}]\n"
                                     )
                             else:
-                                processed_image = image_rgb_processed.copy()
-                                # 即使沒有檢測結果，也繪製邊界線
-                                processed_image = cv2.line(processed_image, (0, top_line_y), (image_width, top_line_y), (255, 255, 0), 3)
-                                processed_image = cv2.line(processed_image, (0, bottom_line_y), (image_width, bottom_line_y), (0, 255, 255), 3)
                                 detection_text_result += "未檢測到任何物件。\n"
     
-                            # 發送處理後的影像信號（帶辨識框的）
-                            if hasattr(signals, 'processed_image_ready'):
-                                # 轉成 BGR 格式發送
-                                processed_image_bgr = cv2.cvtColor(processed_image, cv2.COLOR_RGB2BGR)
-                                signals.processed_image_ready.emit(processed_image_bgr)
-    
-                            # 發送原始影像信號（用於相機控制頁面顯示）
-                            if hasattr(signals, 'original_image_ready'):
-                                # 轉成 BGR 格式發送
-                                original_display = cv2.cvtColor(image_rgb_processed, cv2.COLOR_RGB2BGR)
-                                signals.original_image_ready.emit(original_display)
+                            if preview is not None:
+                                # 預覽管線在背景縮圖與疊圖，只交出緩衝區參考
+                                if want_processed:
+                                    preview.submit('processed', frame_handle, overlay=scene)
+                                preview.submit('original', frame_handle)
+                            else:
+                                # 發送處理後的影像信號（帶辨識框的）
+                                # 信號以佇列方式交給 UI 執行緒，發送的陣列必須是新配置的，不能使用池中的緩衝區
+                                if want_processed:
+                                    processed_image = image_rgb_processed
+                                    if scene is not None:
+                                        processed_image = compose_overlay(image_rgb_processed.copy(), scene)
+                                    # 轉成 BGR 格式發送
+                                    processed_image_bgr = cv2.cvtColor(processed_image, cv2.COLOR_RGB2BGR)
+                                    signals.processed_image_ready.emit(processed_image_bgr)
+        
+                                # 發送原始影像信號（用於相機控制頁面顯示）
+                                if hasattr(signals, 'original_image_ready'):
+                                    # 轉成 BGR 格式發送
+                                    original_display = cv2.cvtColor(image_rgb_processed, cv2.COLOR_RGB2BGR)
+                                    signals.original_image_ready.emit(original_display)
     
                             # 發送文字結果信號
                             if hasattr(signals, 'detection_results_ready'):
                                 signals.detection_results_ready.emit(detection_text_result)
     
                         except Exception as e:
-                            print(f"AI Detection error: {e}")
+                            INFERENCE_ERRORS.inc()
+                            logger.error("AI Detection error: %s", e)
                             if hasattr(signals, 'detection_results_ready'):
                                 error_text = f"Frame: {self.st_frame_info.nFrameNum}\n"
                                 error_text += f"AI 辨識時發生錯誤: {str(e)}\n"
                                 signals.detection_results_ready.emit(error_text)
+                        
+                        # 辨識失敗時仍發送影像（不帶偵測表）
+                        if share_pending:
+                            self._share_frame(image_rgb)
                     
                     else:
                         # ========================================
-                        # AI 模型未載入時的處理
+                        # AI 模型未載入（或降載略過此帧）時的處理
                         # ========================================
                         # 僅發送原始影像（不翻轉）
-                        if hasattr(signals, 'original_image_ready'):
+                        preview = get_preview_pipeline()
+                        if preview is not None:
+                            preview.submit('original', frame_handle)
+                        elif hasattr(signals, 'original_image_ready'):
                             display_image = cv2.cvtColor(image_rgb, cv2.COLOR_RGB2BGR)
                             signals.original_image_ready.emit(display_image)
                         
                         if hasattr(signals, 'detection_results_ready'):
                             no_ai_text = f"Frame: {self.st_frame_info.nFrameNum}\n"
-                            no_ai_text += "AI 模型未載入。\n"
+                            if detect is not None:
+                                no_ai_text += "略過辨識（帧預算降載）。\n"
+                            elif get_model_loader() is not None and get_model_loader().busy:
+                                no_ai_text += "AI 模型載入暖機中。\n"
+                            else:
+                                no_ai_text += "AI 模型未載入。\n"
                             signals.detection_results_ready.emit(no_ai_text)
+                    
+                    FRAMES_PROCESSED.inc()
+                    if watchdog is not None:
+                        if self.two_band_filter is not None:
+                            watchdog.update_belt(
+                                self.two_band_filter.blow_controller.velocity_estimator.belt_velocity,
+                                self.two_band_filter.trigger_zone_bottom - self.two_band_filter.trigger_zone_top
+                            )
+                        watchdog.frame_done((time.perf_counter() - frame_start) * 1000.0)
     
                 else:
                     # ========================================
                     # 獲取圖像失敗的處理
                     # ========================================
-                    print(f"Get frame failed, ret = {To_hex_str(ret)}")
-    
                     if ret == MV_E_NODATA:
-                        print("No data available")
+                        GRAB_ERRORS.labels('nodata').inc()
+                        logger.info("Get frame failed, ret = %s: No data available", To_hex_str(ret))
                     elif ret == MV_E_TIMEOUT:
-                        print("Get frame timeout")
+                        GRAB_ERRORS.labels('timeout').inc()
+                        logger.info("Get frame failed, ret = %s: Get frame timeout", To_hex_str(ret))
                     else:
-                        print(f"Unknown error: {ret}")
+                        GRAB_ERRORS.labels('other').inc()
+                        logger.warning("Get frame failed, ret = %s: Unknown error", To_hex_str(ret))
     
                     time.sleep(0.01)  # 短暫休眠避免 CPU 佔用過高
                     continue
                 
             except Exception as e:
-                print(f"Work thread exception: {e}")
+                logger.error("Work thread exception: %s", e)
                 import traceback
                 traceback.print_exc()
                 time.sleep(0.01)
@@ -936,12 +1166,46 @@ class CameraOperation:
         # ========================================
         # 線程結束清理
         # ========================================
+        if frame_handle is not None:
+            frame_handle.release()
         print("Work thread finished.")
+        self.frame_pools.print_statistics()
         if hasattr(self, 'buf_grab_image') and self.buf_grab_image is not None:
             del self.buf_grab_image
         if hasattr(self, 'buf_save_image') and self.buf_save_image is not None:
             del self.buf_save_image
 
+    def _share_frame(self, image_rgb, detection_table=None):
+        """
+        發送影像（與偵測表）到共享記憶體
+        
+        Parameters:
+            image_rgb: RGB 影像
+            detection_table: build_detection_table() 的回傳值，None 表示不帶偵測
+        """
+        tracer = get_frame_tracer()
+        stage_ns = time.perf_counter_ns()
+        try:
+            # 發送到共享記憶體
+            if hasattr(shared_memory_sender, 'trigger_count'):
+                shared_memory_sender.trigger_count += 1
+                trigger_count = shared_memory_sender.trigger_count
+            else:
+                shared_memory_sender.trigger_count = 1
+                trigger_count = 1
+            
+            # 轉換為 BGR 格式寫入池中的暫存緩衝區（環形緩衝區會再複製一次，發送後即可釋放）
+            with self.frame_pools.acquire(image_rgb.shape) as bgr_handle:
+                image_for_sharing = cv2.cvtColor(image_rgb, cv2.COLOR_RGB2BGR, dst=bgr_handle.array)
+                shared_memory_sender.send_image(image_for_sharing, trigger_count, detections=detection_table)
+            
+            logger.debug("[共享記憶體] 已自動發送第 %d 幀", trigger_count)
+            if tracer is not None:
+                tracer.record(STAGE_SHARE, stage_ns)
+            
+        except Exception as e:
+            logger.warning("[共享記憶體] 發送失敗: %s", e)
+
     def Save_jpg(self):
         """保存 JPG 圖像"""
         if self.buf_save_image is None:
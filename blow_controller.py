@@ -4,11 +4,32 @@
 用於發送氣吹指令到 LabVIEW 控制系統，並處理 ACK 確認與超時
 """
 
-import logging
+import threading
 import time
+from collections import deque
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Dict, Iterable, List, Optional
 from dataclasses import dataclass, field
+from blow_timing import BeltVelocityEstimator, BlowTiming, BlowTimingPredictor, CaptureClock
+from frame_trace import STAGE_SEND, get_frame_tracer
+from pipeline_logging import get_pipeline_logger
+from pipeline_metrics import metrics
+
+# 氣吹指令的健康指標（事件發生時遞增）
+BLOW_COMMANDS_SENT = metrics.counter('nircam_blow_commands_sent_total', 'Blow commands handed to the actuator link')
+BLOW_COMMANDS_DROPPED = metrics.counter('nircam_blow_commands_dropped_total',
+                                        'Blow commands never sent, by reason', ('reason',))
+BLOW_LATE = metrics.counter('nircam_blow_late_total', 'Blow commands predicted to arrive after their deadline')
+BLOW_ACKS = metrics.counter('nircam_blow_acks_total', 'Blow commands acknowledged by the actuator')
+BLOW_ACK_TIMEOUTS = metrics.counter('nircam_blow_ack_timeouts_total', 'Blow commands without an ACK in time')
+BLOW_BACKLOG = metrics.gauge('nircam_blow_backlog', 'Blow commands held while the actuator is disconnected')
+# send_blow_batch 的結果
+SEND_SENT = "sent"        # 已交給執行端
+SEND_HELD = "held"        # 執行端未連線或發送失敗，暫存等待補送（結果由 collect_held_results() 取得）
+SEND_FAILED = "failed"    # 無法發送（沒有 TCP 伺服器或沒有指令）
+
+ACK_LATENCY = metrics.histogram('nircam_ack_latency_seconds', 'Command send to ACK latency', ('transport',),
+                                buckets=(0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5))
 
 
 @dataclass
@@ -22,6 +43,35 @@ class BlowCommand:
     confidence: float          # 信度
     timestamp: datetime        # 時間戳記
     ack_received: bool = False # 是否收到 ACK
+    valve_index: int = -1      # 閥門編號（0 起算，-1 表示未指定）
+    timing: Optional[BlowTiming] = None  # 時序預測（曝光時間、到達噴嘴時間、前置位置）
+    deadline: Optional[float] = None     # 最晚發送時間（time.monotonic() 秒），逾期的指令不再發送
+    sent_count: int = 0        # 成功交給執行端的次數（斷線後移回暫存再補送時大於 1）
+    
+    def to_fields(self) -> List[int]:
+        """
+        轉換為訊息中的單一物體欄位
+        格式: label,center_x,center_y,valve,fire_delay_ms
+        - center_x/center_y 有時序預測時為補償處理延遲後的位置（發送當下）
+        - valve 為 1 起算的閥門編號，0 表示未指定（與舊版的 width=0 相容）
+        - fire_delay_ms 為發送後應延遲多久開閥，0 表示立即（與舊版的 height=0 相容）
+        
+        Returns:
+            List[int]: 物體欄位
+        """
+        if self.timing is not None:
+            cx, cy = self.timing.lead_cx, self.timing.lead_cy
+            fire_delay_ms = int(round(self.timing.fire_delay_ms))
+        else:
+            cx, cy = self.cx, self.cy
+            fire_delay_ms = 0
+        return [
+            int(self.class_id),
+            int(cx),
+            int(cy),
+            self.valve_index + 1 if self.valve_index >= 0 else 0,
+            fire_delay_ms
+        ]
     
     def to_message(self, trigger_count: int, image_width: int, image_height: int) -> str:
         """
@@ -31,21 +81,37 @@ class BlowCommand:
         Returns:
             str: TCP 訊息
         """
-        # 單一物體的訊息
-        message_parts = [
-            ";",
-            trigger_count,
-            image_width,
-            image_height,
-            1,  # 單一物體
-            int(self.class_id),
-            int(self.cx),
-            int(self.cy),
-            0,  # width (可選)
-            0,  # height (可選)
-            0, 0, 0, 0  # 結尾標記
-        ]
-        return ",".join(map(str, message_parts)) + "\n"
+        return build_blow_message([self], trigger_count, image_width, image_height)
+
+
+def build_blow_message(commands: List[BlowCommand],
+                       trigger_count: int,
+                       image_width: int,
+                       image_height: int) -> str:
+    """
+    將多個氣吹指令組成單一 TCP 訊息
+    格式: ;,trigger_num,照片寬度,照片高度,物件數量,(label,center_x,center_y,valve,fire_delay_ms)*N,結尾4個點
+    
+    Parameters:
+        commands: 氣吹指令列表
+        trigger_count: 訊息編號
+        image_width: 圖像寬度
+        image_height: 圖像高度
+        
+    Returns:
+        str: TCP 訊息
+    """
+    message_parts = [
+        ";",
+        trigger_count,
+        image_width,
+        image_height,
+        len(commands)
+    ]
+    for command in commands:
+        message_parts.extend(command.to_fields())
+    message_parts.extend([0, 0, 0, 0])  # 結尾標記
+    return ",".join(map(str, message_parts)) + "\n"
 
 
 class BlowController:
@@ -54,31 +120,59 @@ class BlowController:
     def __init__(self, 
                  tcp_server=None,
                  ack_timeout_ms: int = 200,
-                 blow_delay_ms: tuple = (80, 120)):
+                 blow_delay_ms: tuple = (80, 120),
+                 nozzle_distance_px: Optional[float] = None,
+                 timestamp_tick_hz: float = 1e9,
+                 backlog_size: int = 64,
+                 command_ttl_ms: float = 300.0):
         """
         初始化氣吹控制器
         
         Parameters:
             tcp_server: TCP 伺服器實例
             ack_timeout_ms: ACK 超時時間（毫秒）
-            blow_delay_ms: 氣吹延遲範圍（毫秒）
+            blow_delay_ms: 氣吹延遲範圍（毫秒），取中值作為閥門反應延遲的前置補償
+            nozzle_distance_px: 噴嘴線與圖像下緣的距離（沿傳送方向，像素），
+                                None 表示不預測到達時間（fire_delay_ms 固定為 0）
+            timestamp_tick_hz: 相機裝置時間戳頻率（GevTimestampTickFrequency）
+            backlog_size: 斷線期間暫存的氣吹指令上限（超過時丟棄最舊的）
+            command_ttl_ms: 無法預測到達時間時，指令自曝光起的有效時間（毫秒）
         """
-        self.tcp_server = tcp_server
+        self.tcp_server = None
         self.ack_timeout_ms = ack_timeout_ms
         self.blow_delay_ms = blow_delay_ms
+        
+        # 時序預測：裝置時間戳換算、傳送帶速度估計、噴嘴到達時間預測
+        self.capture_clock = CaptureClock(tick_hz=timestamp_tick_hz)
+        self.velocity_estimator = BeltVelocityEstimator()
+        self.timing_predictor = BlowTimingPredictor(
+            nozzle_distance_px=nozzle_distance_px,
+            valve_latency_ms=sum(blow_delay_ms) / 2.0
+        )
+        self.late_blows = 0                              # 預測到達時間已過才發送的氣吹數
         self.pending_blows: Dict[str, BlowCommand] = {}  # blow_id -> BlowCommand
         self.failed_blows: List[Dict] = []               # 未收到 ACK 的氣吹記錄
         self.successful_blows: List[BlowCommand] = []    # 成功的氣吹記錄
-        self.blow_count = 0
+        self.blow_count = 0                              # 已發送的氣吹物體數
+        self.message_count = 0                           # 已發送的氣吹訊息數（訊息中的 trigger_num）
+        self.message_blows: Dict[int, List[str]] = {}    # trigger_num -> 該訊息中等待 ACK 的 blow_id
+        self.unknown_acks = 0                            # 無法對應到等待中指令的 ACK 數
+        
+        # 斷線暫存：重新連線時只補送尚未逾期的指令
+        self.command_ttl_ms = command_ttl_ms
+        self.backlog = deque(maxlen=backlog_size)        # (BlowCommand, image_width, image_height)
+        self.backlog_overflow = 0                        # 暫存已滿被擠掉的指令數
+        self.expired_commands = 0                        # 逾期未發送的指令數
+        self.replayed_commands = 0                       # 重新連線後補送的指令數
+        self.stale_commands = 0                          # 在 TCP 佇列中逾期而未送出的指令數
+        self.held_results = deque()                      # 暫存指令的最終結果，由 collect_held_results() 取出
+        self._send_lock = threading.RLock()
         
         # 設置日誌
-        self.logger = logging.getLogger("BlowController")
-        if not self.logger.handlers:
-            handler = logging.StreamHandler()
-            formatter = logging.Formatter('[%(name)s] %(message)s')
-            handler.setFormatter(formatter)
-            self.logger.addHandler(handler)
-            self.logger.setLevel(logging.INFO)
+        self.logger = get_pipeline_logger("BlowController")
+        
+        if tcp_server is not None:
+            self._attach_tcp_server(tcp_server)
         
         print(f"[BlowController] Initialized with ACK timeout={ack_timeout_ms}ms")
     
@@ -89,9 +183,81 @@ class BlowController:
         Parameters:
             tcp_server: TCP 伺服器實例
         """
-        self.tcp_server = tcp_server
+        self._attach_tcp_server(tcp_server)
         print(f"[BlowController] TCP server connected")
     
+    def _attach_tcp_server(self, tcp_server) -> None:
+        """設置 TCP 伺服器並註冊連線事件（執行端連上時補送暫存指令）"""
+        if self.tcp_server is not None and hasattr(self.tcp_server, 'remove_connection_listener'):
+            self.tcp_server.remove_connection_listener(self._on_connection_changed)
+        if self.tcp_server is not None and hasattr(self.tcp_server, 'remove_message_listener'):
+            self.tcp_server.remove_message_listener(self._on_message)
+        self.tcp_server = tcp_server
+        hello_timeout = getattr(tcp_server, 'hello_timeout', None)
+        if hello_timeout is not None and self.command_ttl_ms / 1000.0 <= hello_timeout:
+            self.logger.warning(
+                "command_ttl_ms=%.0f does not exceed the TCP hello timeout (%.0f ms); held commands "
+                "without a nozzle prediction may expire before a client without HELLO is registered",
+                self.command_ttl_ms, hello_timeout * 1000
+            )
+        if tcp_server is not None and hasattr(tcp_server, 'add_connection_listener'):
+            tcp_server.add_connection_listener(self._on_connection_changed)
+        if tcp_server is not None and hasattr(tcp_server, 'add_message_listener'):
+            tcp_server.add_message_listener(self._on_message)
+    
+    def _on_connection_changed(self, role: str, connected: bool) -> None:
+        """
+        TCP 連線事件回呼
+        
+        Parameters:
+            role: 連線角色（actuator / observer）
+            connected: True 表示連上，False 表示斷線
+        """
+        if role == "actuator" and connected:
+            self.flush_backlog()
+    
+    def _on_message(self, role: str, line: str) -> None:
+        """
+        TCP 訊息回呼（TCP 伺服器的接收線程呼叫），處理執行端的 ACK
+        格式: ACK,<trigger_num>（確認該訊息中的所有指令）或 ACK,<blow_id>，逗號或空白分隔皆可
+        
+        Parameters:
+            role: 連線角色
+            line: 去除換行後的一行
+        """
+        if role != "actuator":
+            return
+        fields = line.replace(",", " ").split()
+        if len(fields) < 2 or fields[0].upper() != "ACK":
+            return
+        key = fields[1]
+        if key.isdigit():
+            self.receive_message_ack(int(key))
+        else:
+            self.receive_ack(key)
+    
+    def capture_time_for(self, device_ticks: Optional[int], received_at: Optional[float] = None) -> float:
+        """
+        將相機裝置時間戳換算為主機時間軸上的曝光時間
+        
+        Parameters:
+            device_ticks: 裝置時間戳（nDevTimeStampHigh/Low 組成的 tick），None 表示無
+            received_at: 主機取得此帧的 time.monotonic() 時間，None 表示現在
+            
+        Returns:
+            float: 曝光時間（time.monotonic() 秒）
+        """
+        return self.capture_clock.to_host(device_ticks, received_at)
+    
+    def update_belt_velocity(self, tracks: Iterable) -> None:
+        """
+        以本帧的追蹤歷史更新傳送帶速度估計
+        
+        Parameters:
+            tracks: TrackState 的可迭代物件
+        """
+        self.velocity_estimator.update(tracks)
+    
     def send_blow_command(self, 
                           cx: float, 
                           cy: float, 
@@ -99,9 +265,10 @@ class BlowController:
                           track_id: int,
                           confidence: float,
                           image_width: int,
-                          image_height: int) -> bool:
+                          image_height: int,
+                          valve_index: int = -1) -> str:
         """
-        發送氣吹指令
+        發送單一物體的氣吹指令
         
         Parameters:
             cx, cy: 中心點座標
@@ -110,52 +277,372 @@ class BlowController:
             confidence: 信度
             image_width: 圖像寬度
             image_height: 圖像高度
+            valve_index: 閥門編號（-1 表示未指定）
             
         Returns:
-            bool: 是否成功發送
+            str: SEND_SENT / SEND_HELD / SEND_FAILED
         """
+        return self.send_blow_batch(
+            [{
+                'cx': cx,
+                'cy': cy,
+                'class_id': class_id,
+                'track_id': track_id,
+                'confidence': confidence,
+                'valve_index': valve_index
+            }],
+            image_width=image_width,
+            image_height=image_height
+        )
+    
+    def send_blow_batch(self,
+                        triggers: List[Dict],
+                        image_width: int,
+                        image_height: int) -> str:
+        """
+        以單一 TCP 訊息發送多個物體的氣吹指令
+        執行端未連線或發送失敗時，指令暫存至重新連線（逾期者捨棄）
+        
+        Parameters:
+            triggers: 觸發列表，每項包含 cx, cy, class_id, track_id, confidence,
+                      以及可選的 valve_index 與 capture_time（曝光時間，time.monotonic() 秒）
+            image_width: 圖像寬度
+            image_height: 圖像高度
+            
+        Returns:
+            str: SEND_SENT 已送出；SEND_HELD 已暫存等待補送（補送或逾期的結果由 collect_held_results() 取得，
+                 逾期的指令記錄於 failed_blows）；SEND_FAILED 無法發送
+        """
+        if not triggers:
+            return SEND_FAILED
+        
         if not self.tcp_server:
             self.logger.warning("TCP server not available, cannot send blow command")
-            return False
+            return SEND_FAILED
         
-        if not hasattr(self.tcp_server, 'is_connected') or not self.tcp_server.is_connected:
-            self.logger.warning("TCP server not connected, cannot send blow command")
-            return False
-        
-        # 生成氣吹 ID
-        blow_id = self._generate_blow_id()
-        self.blow_count += 1
+        now = datetime.now()
+        send_time = time.monotonic()
         
         # 創建氣吹指令
-        command = BlowCommand(
-            blow_id=blow_id,
-            track_id=track_id,
-            cx=cx,
-            cy=cy,
-            class_id=class_id,
-            confidence=confidence,
-            timestamp=datetime.now()
-        )
+        commands = []
+        for trigger in triggers:
+            self.blow_count += 1
+            timing = None
+            capture_time = trigger.get('capture_time')
+            if capture_time is not None:
+                timing = self.timing_predictor.predict(
+                    cx=trigger['cx'],
+                    cy=trigger['cy'],
+                    capture_time=capture_time,
+                    velocity=self.velocity_estimator.velocity_for(trigger['track_id']),
+                    image_height=image_height,
+                    send_time=send_time
+                )
+                if timing.deadline is not None and timing.deadline <= send_time:
+                    self.late_blows += 1
+                    BLOW_LATE.inc()
+            commands.append(BlowCommand(
+                blow_id=self._generate_blow_id(),
+                track_id=trigger['track_id'],
+                cx=trigger['cx'],
+                cy=trigger['cy'],
+                class_id=trigger['class_id'],
+                confidence=trigger['confidence'],
+                timestamp=now,
+                valve_index=trigger.get('valve_index', -1),
+                timing=timing,
+                deadline=self._deadline_for(timing, capture_time, send_time)
+            ))
+        
+        with self._send_lock:
+            if not hasattr(self.tcp_server, 'is_connected') or not self.tcp_server.is_connected:
+                self.logger.warning(
+                    "TCP server not connected, %d blow command(s) held until reconnect", len(commands)
+                )
+                self._hold(commands, image_width, image_height)
+                return SEND_HELD
+            
+            if not self._send_commands(commands, image_width, image_height):
+                self._hold(commands, image_width, image_height)
+                return SEND_HELD
+            return SEND_SENT
+    
+    def _deadline_for(self,
+                      timing: Optional[BlowTiming],
+                      capture_time: Optional[float],
+                      send_time: float) -> float:
+        """
+        計算指令的最晚發送時間
+        有到達噴嘴的預測時取到達時間減閥門延遲，否則以曝光時間加上 command_ttl_ms
+        
+        Returns:
+            float: 最晚發送時間（time.monotonic() 秒）
+        """
+        if timing is not None and timing.deadline is not None:
+            return timing.deadline
+        origin = capture_time if capture_time is not None else send_time
+        return origin + self.command_ttl_ms / 1000.0
+    
+    def _send_commands(self,
+                       commands: List[BlowCommand],
+                       image_width: int,
+                       image_height: int) -> bool:
+        """
+        將指令組成單一訊息送出
+        
+        Returns:
+            bool: 是否成功發送
+        """
+        self.message_count += 1
+        message = build_blow_message(commands, self.message_count, image_width, image_height)
         
-        # 轉換為 TCP 訊息
-        message = command.to_message(self.blow_count, image_width, image_height)
+        # 先登記等待 ACK（發送線程可能在 send_message 返回前就送出，ACK 也可能隨即到達），失敗時撤回
+        message_num = self.message_count
+        self.message_blows[message_num] = [command.blow_id for command in commands]
+        for command in commands:
+            self.pending_blows[command.blow_id] = command
         
         # 發送到 TCP 伺服器
+        tracer = get_frame_tracer()
+        send_ns = time.perf_counter_ns()
+        if tracer is not None:
+            for command in commands:
+                tracer.expect_ack(command.blow_id)
+        sent = False
         try:
-            if self.tcp_server.send_message(message):
-                self.pending_blows[blow_id] = command
-                self.logger.info(
-                    f"Blow #{self.blow_count}: Track={track_id}, "
-                    f"Class={class_id}, Pos=({cx:.1f},{cy:.1f}), "
-                    f"Conf={confidence:.2f}"
-                )
+            on_unsent = lambda: self._requeue_unsent(commands, image_width, image_height)
+            on_expired = lambda: self._drop_stale(commands)
+            deadline = min((c.deadline for c in commands if c.deadline is not None), default=None)
+            sent = self.tcp_server.send_message(message, on_unsent=on_unsent, deadline=deadline,
+                                                on_expired=on_expired)
+            if sent:
+                BLOW_COMMANDS_SENT.inc(len(commands))
+                if tracer is not None:
+                    tracer.record(STAGE_SEND, send_ns)
+                for command in commands:
+                    command.sent_count += 1
+                    if command.timing is not None:
+                        self.logger.info(
+                            "Blow #%d: Track=%d, Class=%s, Pos=(%.1f,%.1f), Valve=%s, Conf=%.2f, "
+                            "Lead=(%.1f,%.1f), Latency=%.1fms, FireDelay=%.1fms",
+                            self.message_count, command.track_id, command.class_id,
+                            command.cx, command.cy, command.valve_index, command.confidence,
+                            command.timing.lead_cx, command.timing.lead_cy,
+                            command.timing.latency_ms, command.timing.fire_delay_ms
+                        )
+                    else:
+                        self.logger.info(
+                            "Blow #%d: Track=%d, Class=%s, Pos=(%.1f,%.1f), Valve=%s, Conf=%.2f",
+                            self.message_count, command.track_id, command.class_id,
+                            command.cx, command.cy, command.valve_index, command.confidence
+                        )
                 return True
             else:
-                self.logger.error(f"Failed to send blow command: {blow_id}")
+                self.logger.error("Failed to send blow message #%d", self.message_count)
                 return False
         except Exception as e:
-            self.logger.error(f"Error sending blow command: {e}")
+            self.logger.error("Error sending blow command: %s", e)
             return False
+        finally:
+            if not sent:
+                self.message_blows.pop(message_num, None)
+                for command in commands:
+                    self.pending_blows.pop(command.blow_id, None)
+                    if tracer is not None:
+                        tracer.cancel_ack(command.blow_id)
+    
+    def _requeue_unsent(self, commands: List[BlowCommand], image_width: int, image_height: int) -> None:
+        """
+        執行端斷線時仍在 TCP 佇列中的訊息（由 TCP 伺服器的發送線程呼叫）
+        尚未收到 ACK 的指令移回斷線暫存，重新連線後補送；仍有其他執行端連線時已由其收到，不再補送
+        """
+        with self._send_lock:
+            if getattr(self.tcp_server, 'is_connected', False):
+                return
+            unsent = [c for c in commands if self.pending_blows.pop(c.blow_id, None) is not None]
+            if not unsent:
+                return
+            self.logger.warning("Actuator disconnected, %d queued blow command(s) held until reconnect", len(unsent))
+            self._hold(unsent, image_width, image_height)
+    
+    def _drop_stale(self, commands: List[BlowCommand]) -> None:
+        """
+        訊息在執行端的 TCP 佇列中逾期而被捨棄（執行端連線但停止讀取時，由 TCP 伺服器呼叫）
+        尚未收到 ACK 的指令記錄為未處理，交由後端人工分選
+        """
+        with self._send_lock:
+            stale = [c for c in commands if self.pending_blows.pop(c.blow_id, None) is not None]
+            for command in stale:
+                self._record_expired(command, 'QUEUE_EXPIRED')
+            if stale:
+                self.stale_commands += len(stale)
+                BLOW_COMMANDS_DROPPED.labels('stale').inc(len(stale))
+                self.logger.warning("Actuator not reading, dropped %d stale blow command(s)", len(stale))
+
+    def _hold(self, commands: List[BlowCommand], image_width: int, image_height: int) -> None:
+        """將未送出的指令放入斷線暫存（順便清除已逾期的指令）"""
+        self._expire_backlog(time.monotonic(), self._handshake_grace())
+        for command in commands:
+            if len(self.backlog) == self.backlog.maxlen:
+                self._record_expired(self.backlog[0][0], 'BACKLOG_OVERFLOW')
+                self._report_held(self.backlog[0][0], 'backlog_overflow')
+                self.backlog_overflow += 1
+                BLOW_COMMANDS_DROPPED.labels('backlog_overflow').inc()
+            self.backlog.append((command, image_width, image_height))
+        BLOW_BACKLOG.set(len(self.backlog))
+    
+    def _handshake_grace(self) -> float:
+        """TCP 伺服器目前握手中的連線已等待的秒數"""
+        handshake_elapsed = getattr(self.tcp_server, 'handshake_elapsed', None)
+        return handshake_elapsed() if handshake_elapsed is not None else 0.0
+
+    def _expire_backlog(self, now: float, handshake_s: float = 0.0) -> None:
+        """
+        移除暫存中已逾期的指令
+
+        Parameters:
+            now: 目前時間（time.monotonic() 秒）
+            handshake_s: 執行端握手等待的秒數，不計入以 command_ttl_ms 決定的有效時間
+                         （有到達噴嘴預測的指令時間點是實際的，不延長）
+        """
+        if not self.backlog:
+            return
+        valid = []
+        for entry in self.backlog:
+            deadline = entry[0].deadline
+            if deadline is not None and (entry[0].timing is None or entry[0].timing.deadline is None):
+                deadline += handshake_s
+            if deadline is not None and deadline <= now:
+                self.expired_commands += 1
+                BLOW_COMMANDS_DROPPED.labels('expired').inc()
+                self._record_expired(entry[0], 'EXPIRED')
+                self._report_held(entry[0], 'expired')
+            else:
+                valid.append(entry)
+        if len(valid) != len(self.backlog):
+            self.backlog.clear()
+            self.backlog.extend(valid)
+    
+    def _record_expired(self, command: BlowCommand, reason: str) -> None:
+        """記錄未能送出的指令，交由後端人工分選"""
+        self.failed_blows.append({
+            'blow_id': command.blow_id,
+            'track_id': command.track_id,
+            'cx': command.cx,
+            'cy': command.cy,
+            'class_id': command.class_id,
+            'confidence': command.confidence,
+            'reason': reason,
+            'timestamp': datetime.now(),
+            'elapsed_ms': (datetime.now() - command.timestamp).total_seconds() * 1000
+        })
+    
+    def _report_held(self, command: BlowCommand, status: str) -> None:
+        """
+        記錄暫存指令的最終結果（只記錄 send_blow_batch 回傳 SEND_HELD、從未送出過的指令；
+        已送出後因斷線移回暫存的指令，其觸發在第一次送出時已計入）
+        
+        Parameters:
+            command: 氣吹指令
+            status: replayed / expired / backlog_overflow
+        """
+        if status == 'replayed' and command.sent_count != 1:
+            return
+        if status != 'replayed' and command.sent_count != 0:
+            return
+        self.held_results.append({
+            'track_id': command.track_id,
+            'cx': command.cx,
+            'cy': command.cy,
+            'class_id': command.class_id,
+            'confidence': command.confidence,
+            'valve_index': command.valve_index,
+            'status': status
+        })
+    
+    def collect_held_results(self) -> List[Dict]:
+        """
+        取出暫存指令的最終結果（補送成功或逾期、被擠掉），每個結果只回傳一次；呼叫時順便清除已逾期的暫存
+        
+        Returns:
+            List[Dict]: {'track_id', 'cx', 'cy', 'class_id', 'confidence', 'valve_index',
+                         'status'}，status 為 replayed / expired / backlog_overflow
+        """
+        if self.backlog:
+            with self._send_lock:
+                self._expire_backlog(time.monotonic(), self._handshake_grace())
+                BLOW_BACKLOG.set(len(self.backlog))
+        results = []
+        while self.held_results:
+            results.append(self.held_results.popleft())
+        return results
+    
+    def flush_backlog(self) -> int:
+        """
+        補送斷線期間暫存的指令
+        逾期的指令計入 expired_commands，其餘依新的發送時間重新計算前置位置與開閥延遲，
+        依圖像尺寸分組後以單一訊息送出
+        
+        Returns:
+            int: 補送的指令數
+        """
+        with self._send_lock:
+            if not self.backlog:
+                return 0
+            if not self.tcp_server or not getattr(self.tcp_server, 'is_connected', False):
+                return 0
+            
+            send_time = time.monotonic()
+            # 剛完成的握手等待（舊版 LabVIEW 不送宣告時為 hello_timeout）不算入有效時間
+            self._expire_backlog(send_time, getattr(self.tcp_server, 'last_handshake_s', 0.0))
+            
+            groups: Dict[tuple, List[BlowCommand]] = {}
+            for command, image_width, image_height in self.backlog:
+                if command.timing is not None:
+                    command.timing = self.timing_predictor.predict(
+                        cx=command.cx,
+                        cy=command.cy,
+                        capture_time=command.timing.capture_time,
+                        velocity=command.timing.velocity,
+                        image_height=image_height,
+                        send_time=send_time
+                    )
+                groups.setdefault((image_width, image_height), []).append(command)
+            self.backlog.clear()
+            
+            replayed = 0
+            for (image_width, image_height), commands in groups.items():
+                if self._send_commands(commands, image_width, image_height):
+                    replayed += len(commands)
+                    for command in commands:
+                        self._report_held(command, 'replayed')
+                else:
+                    for command in commands:
+                        self.backlog.append((command, image_width, image_height))
+            
+            self.replayed_commands += replayed
+            BLOW_BACKLOG.set(len(self.backlog))
+            if replayed:
+                self.logger.info(
+                    "Reconnected: replayed %d blow command(s), %d expired so far",
+                    replayed, self.expired_commands
+                )
+            return replayed
+    
+    def receive_message_ack(self, trigger_num: int) -> None:
+        """
+        接收整則訊息的 ACK（訊息中的每個指令都視為已確認）
+        
+        Parameters:
+            trigger_num: 訊息編號（build_blow_message 的 trigger_num）
+        """
+        blow_ids = self.message_blows.pop(trigger_num, None)
+        if blow_ids is None:
+            self.unknown_acks += 1
+            self.logger.warning("ACK for unknown blow message #%s", trigger_num)
+            return
+        for blow_id in blow_ids:
+            self.receive_ack(blow_id)
     
     def receive_ack(self, blow_id: str) -> None:
         """
@@ -164,14 +651,18 @@ class BlowController:
         Parameters:
             blow_id: 氣吹 ID
         """
-        if blow_id in self.pending_blows:
-            command = self.pending_blows[blow_id]
+        tracer = get_frame_tracer()
+        if tracer is not None:
+            tracer.ack(blow_id)
+        command = self.pending_blows.pop(blow_id, None)
+        if command is not None:
             command.ack_received = True
             self.successful_blows.append(command)
-            del self.pending_blows[blow_id]
             
             elapsed_ms = (datetime.now() - command.timestamp).total_seconds() * 1000
-            self.logger.info(f"ACK received for blow: {blow_id} (elapsed: {elapsed_ms:.1f}ms)")
+            BLOW_ACKS.inc()
+            ACK_LATENCY.labels('tcp').observe(elapsed_ms / 1000.0)
+            self.logger.info("ACK received for blow: %s (elapsed: %.1fms)", blow_id, elapsed_ms)
     
     def check_timeouts(self) -> List[str]:
         """
@@ -204,11 +695,18 @@ class BlowController:
                 })
                 
                 self.logger.warning(
-                    f"Blow timeout: {blow_id}, Track={command.track_id}, "
-                    f"elapsed={elapsed_ms:.1f}ms > {self.ack_timeout_ms}ms"
+                    "Blow timeout: %s, Track=%d, elapsed=%.1fms > %sms",
+                    blow_id, command.track_id, elapsed_ms, self.ack_timeout_ms
                 )
                 
-                del self.pending_blows[blow_id]
+                self.pending_blows.pop(blow_id, None)
+                BLOW_ACK_TIMEOUTS.inc()
+        
+        if len(self.message_blows) > len(self.pending_blows):
+            # 訊息中的指令都已確認、逾時或移回暫存時不再等待該訊息的 ACK
+            for trigger_num, blow_ids in list(self.message_blows.items()):
+                if not any(blow_id in self.pending_blows for blow_id in blow_ids):
+                    self.message_blows.pop(trigger_num, None)
         
         return timeout_ids
     
@@ -236,11 +734,22 @@ class BlowController:
         
         success_rate = (successful / total * 100) if total > 0 else 0
         
+        belt_velocity = self.velocity_estimator.belt_velocity
+        
         return {
             'total_blows': total,
+            'total_messages': self.message_count,
+            'late_blows': self.late_blows,
+            'belt_velocity': belt_velocity,
+            'backlog': len(self.backlog),
+            'backlog_overflow': self.backlog_overflow,
+            'expired': self.expired_commands,
+            'replayed': self.replayed_commands,
+            'stale': self.stale_commands,
             'successful': successful,
             'failed': failed,
             'pending': pending,
+            'unknown_acks': self.unknown_acks,
             'success_rate': success_rate
         }
     
@@ -251,9 +760,17 @@ class BlowController:
         print("BLOW CONTROLLER STATISTICS")
         print("="*60)
         print(f"Total Blows:     {stats['total_blows']}")
+        print(f"Messages Sent:   {stats['total_messages']}")
         print(f"Successful:      {stats['successful']} ({stats['success_rate']:.1f}%)")
         print(f"Failed (Timeout):{stats['failed']}")
-        print(f"Pending:         {stats['pending']}")
+        print(f"Pending:         {stats['pending']} ({stats['unknown_acks']} unknown ACKs)")
+        print(f"Late (Predicted):{stats['late_blows']}")
+        print(f"Backlog:         {stats['backlog']} held, {stats['replayed']} replayed, "
+              f"{stats['expired']} expired, {stats['backlog_overflow']} overflow, "
+              f"{stats['stale']} stale in queue")
+        if stats['belt_velocity'] is not None:
+            vx, vy = stats['belt_velocity']
+            print(f"Belt Velocity:   ({vx:.1f}, {vy:.1f}) px/s")
         print("="*60 + "\n")
     
     def reset_statistics(self) -> None:
@@ -261,4 +778,13 @@ class BlowController:
         self.successful_blows.clear()
         self.failed_blows.clear()
         self.blow_count = 0
+        self.message_count = 0
+        self.message_blows.clear()
+        self.unknown_acks = 0
+        self.late_blows = 0
+        self.backlog_overflow = 0
+        self.expired_commands = 0
+        self.replayed_commands = 0
+        self.stale_commands = 0
+        self.held_results.clear()
         self.logger.info("Statistics reset")
@@ -0,0 +1,297 @@
+# blow_scheduler.py
+"""
+氣吹排程器
+收集同一帧內所有觸發，將 cx 對應到噴嘴陣列的閥門編號，
+只合併同一閥門上預估到達時間相差不到最小駐留時間的觸發（其餘各自成為一個指令），
+每帧只送出一則多物體氣吹訊息
+"""
+
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from blow_controller import SEND_HELD, SEND_SENT
+from pipeline_logging import get_pipeline_logger
+
+
+@dataclass
+class ScheduledTrigger:
+    """單一觸發的排程資料"""
+    track_id: int              # 追蹤 ID
+    cx: float                  # 中心點 X 座標
+    cy: float                  # 中心點 Y 座標
+    class_id: int              # 類別 ID
+    confidence: float          # 信度
+    valve_index: int           # 閥門編號（0 起算）
+    capture_time: Optional[float] = None  # 曝光時間（time.monotonic() 秒）
+    merged: List['ScheduledTrigger'] = field(default_factory=list)  # 併入此次氣吹的其他觸發
+
+
+class BlowScheduler:
+    """氣吹排程器（閥門層級）"""
+
+    def __init__(self,
+                 blow_controller,
+                 image_width: int,
+                 image_height: int,
+                 num_valves: int = 16,
+                 valve_x_start: float = 0.0,
+                 valve_x_end: Optional[float] = None,
+                 min_dwell_ms: float = 50.0):
+        """
+        初始化氣吹排程器
+
+        Parameters:
+            blow_controller: BlowController 實例
+            image_width: 圖像寬度（像素）
+            image_height: 圖像高度（像素）
+            num_valves: 噴嘴陣列的閥門數量
+            valve_x_start: 第一個閥門左緣對應的 X 座標（像素）
+            valve_x_end: 最後一個閥門右緣對應的 X 座標（像素），None 表示圖像寬度
+            min_dwell_ms: 最小駐留時間（毫秒），同一閥門在此時間內的觸發會被合併
+        """
+        if num_valves < 1:
+            raise ValueError("num_valves must be >= 1")
+
+        self.blow_controller = blow_controller
+        self.image_width = image_width
+        self.image_height = image_height
+        self.num_valves = num_valves
+        self.valve_x_start = float(valve_x_start)
+        self.valve_x_end = float(valve_x_end) if valve_x_end is not None else float(image_width)
+        self.min_dwell_ms = min_dwell_ms
+
+        self.valve_pitch = (self.valve_x_end - self.valve_x_start) / num_valves
+
+        # 本帧待送出的觸發: valve_index -> [ScheduledTrigger]（flush 時才依到達時間分組）
+        self._frame_triggers: Dict[int, List[ScheduledTrigger]] = {}
+        # 各閥門最後一次送出氣吹的時間（time.monotonic 秒）
+        self._valve_last_fire: Dict[int, float] = {}
+
+        # 統計資訊
+        self.frames_flushed = 0
+        self.messages_sent = 0
+        self.triggers_received = 0
+        self.triggers_merged = 0
+        self.triggers_deferred = 0
+
+        self.logger = get_pipeline_logger("BlowScheduler")
+
+        print(f"[BlowScheduler] Initialized with {num_valves} valves, "
+              f"pitch={self.valve_pitch:.1f}px, dwell={min_dwell_ms}ms")
+
+    def valve_index_for(self, cx: float) -> int:
+        """
+        將 X 座標對應到閥門編號
+
+        Parameters:
+            cx: 中心點 X 座標
+
+        Returns:
+            int: 閥門編號（0 ~ num_valves-1），超出陣列範圍時取最近的閥門
+        """
+        index = int((cx - self.valve_x_start) // self.valve_pitch)
+        return max(0, min(self.num_valves - 1, index))
+
+    def add_trigger(self,
+                    track_id: int,
+                    cx: float,
+                    cy: float,
+                    class_id: int,
+                    confidence: float,
+                    capture_time: Optional[float] = None) -> int:
+        """
+        加入一個本帧的觸發（同一閥門的觸發在 flush 時依到達時間分組合併）
+
+        Parameters:
+            track_id: 追蹤 ID
+            cx, cy: 中心點座標
+            class_id: 類別 ID
+            confidence: 信度
+            capture_time: 曝光時間（time.monotonic() 秒），用於氣吹時序預測
+
+        Returns:
+            int: 對應的閥門編號
+        """
+        self.triggers_received += 1
+        valve_index = self.valve_index_for(cx)
+        trigger = ScheduledTrigger(
+            track_id=track_id,
+            cx=cx,
+            cy=cy,
+            class_id=class_id,
+            confidence=confidence,
+            valve_index=valve_index,
+            capture_time=capture_time
+        )
+
+        self._frame_triggers.setdefault(valve_index, []).append(trigger)
+        return valve_index
+
+    def _arrival_gap_ms(self, a: ScheduledTrigger, b: ScheduledTrigger) -> Optional[float]:
+        """
+        兩個觸發到達噴嘴的時間差（毫秒），以傳送帶速度換算 cy 的差距
+
+        Returns:
+            Optional[float]: 時間差，尚無傳送帶速度時為 None
+        """
+        estimator = getattr(self.blow_controller, 'velocity_estimator', None)
+        velocity = estimator.belt_velocity if estimator is not None else None
+        if velocity is None or abs(velocity[1]) < 1e-6:
+            return None
+        gap_ms = abs(a.cy - b.cy) / abs(velocity[1]) * 1000.0
+        if a.capture_time is not None and b.capture_time is not None:
+            gap_ms += abs(a.capture_time - b.capture_time) * 1000.0
+        return gap_ms
+
+    def _group_valve(self, triggers: List[ScheduledTrigger]) -> List[ScheduledTrigger]:
+        """
+        將同一閥門的觸發分組：到達時間與組內主觸發相差不到 min_dwell_ms 的併入（保留信度較高者為主觸發），
+        其餘各自成為獨立的指令；無傳送帶速度時不合併
+
+        Returns:
+            List[ScheduledTrigger]: 各組的主觸發（被併入者在 merged 中）
+        """
+        groups: List[ScheduledTrigger] = []
+        for trigger in sorted(triggers, key=lambda t: -t.cy):
+            for index, primary in enumerate(groups):
+                gap_ms = self._arrival_gap_ms(primary, trigger)
+                if gap_ms is None or gap_ms >= self.min_dwell_ms:
+                    continue
+                self.triggers_merged += 1
+                if trigger.confidence > primary.confidence:
+                    trigger.merged = primary.merged + [primary]
+                    primary.merged = []
+                    groups[index] = trigger
+                else:
+                    primary.merged.append(trigger)
+                break
+            else:
+                groups.append(trigger)
+        return groups
+
+    def flush(self) -> List[Dict]:
+        """
+        送出本帧收集的觸發
+        駐留時間內已開啟過的閥門本帧不送，觸發延後（sent=False, deferred=True），
+        追蹤仍未觸發，駐留時間過後的帧會再次觸發並以自己的位置計時；
+        執行端未連線時指令暫存（sent=False, held=True），補送或逾期由 BlowController.collect_held_results() 回報
+
+        Returns:
+            List[Dict]: 每個觸發的處理結果
+                        {'track_id', 'cx', 'cy', 'class_id', 'confidence',
+                         'valve_index', 'merged', 'sent', 'deferred', 'held'}
+        """
+        if not self._frame_triggers:
+            return []
+
+        self.frames_flushed += 1
+        now = time.monotonic()
+
+        to_send: List[ScheduledTrigger] = []
+        deferred: List[ScheduledTrigger] = []
+
+        for valve_index in sorted(self._frame_triggers):
+            groups = self._group_valve(self._frame_triggers[valve_index])
+            last_fire = self._valve_last_fire.get(valve_index)
+            if last_fire is not None and (now - last_fire) * 1000 < self.min_dwell_ms:
+                self.triggers_deferred += sum(1 + len(t.merged) for t in groups)
+                deferred.extend(groups)
+            else:
+                to_send.extend(groups)
+
+        self._frame_triggers.clear()
+
+        sent = held = False
+        if to_send:
+            status = self.blow_controller.send_blow_batch(
+                [
+                    {
+                        'cx': t.cx,
+                        'cy': t.cy,
+                        'class_id': t.class_id,
+                        'track_id': t.track_id,
+                        'confidence': t.confidence,
+                        'valve_index': t.valve_index,
+                        'capture_time': t.capture_time
+                    }
+                    for t in to_send
+                ],
+                image_width=self.image_width,
+                image_height=self.image_height
+            )
+            sent = status == SEND_SENT
+            held = status == SEND_HELD
+            if sent:
+                self.messages_sent += 1
+                for t in to_send:
+                    self._valve_last_fire[t.valve_index] = now
+
+        results = []
+        for t in to_send:
+            results.extend(self._expand(t, merged=False, sent=sent, held=held))
+        for t in deferred:
+            results.extend(self._expand(t, merged=False, sent=False, deferred=True))
+
+        return results
+
+    def _expand(self, trigger: ScheduledTrigger, merged: bool, sent: bool, deferred: bool = False,
+                held: bool = False) -> List[Dict]:
+        """
+        將排程觸發展開為逐追蹤的結果（含被併入的追蹤）
+
+        Parameters:
+            trigger: 排程觸發
+            merged: 主觸發本身是否被併入其他觸發
+            sent: 氣吹是否成功送出
+            deferred: 閥門仍在駐留時間內，本帧未送出
+            held: 執行端未連線，指令已暫存等待補送
+
+        Returns:
+            List[Dict]: 逐追蹤的結果
+        """
+        results = [self._as_dict(trigger, merged=merged, sent=sent, deferred=deferred, held=held)]
+        for other in trigger.merged:
+            results.append(self._as_dict(other, merged=True, sent=sent, deferred=deferred, held=held))
+        return results
+
+    @staticmethod
+    def _as_dict(trigger: ScheduledTrigger, merged: bool, sent: bool, deferred: bool = False,
+                 held: bool = False) -> Dict:
+        """將單一觸發轉為結果字典"""
+        return {
+            'track_id': trigger.track_id,
+            'cx': trigger.cx,
+            'cy': trigger.cy,
+            'class_id': trigger.class_id,
+            'confidence': trigger.confidence,
+            'valve_index': trigger.valve_index,
+            'merged': merged,
+            'sent': sent,
+            'deferred': deferred,
+            'held': held
+        }
+
+    def get_statistics(self) -> Dict:
+        """
+        獲取統計資訊
+
+        Returns:
+            dict: 統計資訊
+        """
+        return {
+            'num_valves': self.num_valves,
+            'frames_flushed': self.frames_flushed,
+            'messages_sent': self.messages_sent,
+            'triggers_received': self.triggers_received,
+            'triggers_merged': self.triggers_merged,
+            'triggers_deferred': self.triggers_deferred
+        }
+
+    def reset_statistics(self) -> None:
+        """重置統計資訊"""
+        self.frames_flushed = 0
+        self.messages_sent = 0
+        self.triggers_received = 0
+        self.triggers_merged = 0
+        self.triggers_deferred = 0
@@ -0,0 +1,252 @@
+# blow_timing.py
+"""
+氣吹時序預測
+利用相機裝置時間戳與追蹤歷史估計傳送帶速度，
+預測物體到達噴嘴的時間，並補償處理延遲造成的位置誤差
+"""
+
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+
+def device_timestamp_from_frame_info(frame_info) -> int:
+    """
+    從 MV_FRAME_OUT_INFO_EX 取出 64 位元裝置時間戳（tick）
+
+    Parameters:
+        frame_info: MV_FRAME_OUT_INFO_EX 結構
+
+    Returns:
+        int: 裝置時間戳（tick）
+    """
+    return (int(frame_info.nDevTimeStampHigh) << 32) | int(frame_info.nDevTimeStampLow)
+
+
+class CaptureClock:
+    """
+    將相機裝置時間戳換算為主機 time.monotonic() 時間軸
+    以「接收時間 - 裝置時間」的最小值作為時鐘偏移，
+    最小值對應傳輸延遲最短的帧，最接近真實曝光時間
+    """
+
+    def __init__(self, tick_hz: float = 1e9, drift_allowance_s: float = 1e-4):
+        """
+        初始化時鐘換算
+
+        Parameters:
+            tick_hz: 裝置時間戳頻率（GevTimestampTickFrequency）
+            drift_allowance_s: 每帧允許偏移量上飄的秒數，用於追蹤兩個時鐘的漂移
+        """
+        self.tick_hz = float(tick_hz)
+        self.drift_allowance_s = drift_allowance_s
+        self.offset: Optional[float] = None
+        self.last_ticks: Optional[int] = None
+
+    def to_host(self, device_ticks: Optional[int], received_at: Optional[float] = None) -> float:
+        """
+        將裝置時間戳換算為主機時間
+
+        Parameters:
+            device_ticks: 裝置時間戳（tick），None 表示無時間戳
+            received_at: 主機收到此帧的 time.monotonic() 時間，None 表示現在
+
+        Returns:
+            float: 估計的曝光時間（time.monotonic() 秒）
+        """
+        if received_at is None:
+            received_at = time.monotonic()
+        if not device_ticks:
+            return received_at
+
+        # 裝置時間戳倒退表示相機重啟或計數器歸零，重新建立偏移
+        if self.last_ticks is not None and device_ticks < self.last_ticks:
+            self.offset = None
+        self.last_ticks = device_ticks
+
+        device_s = device_ticks / self.tick_hz
+        sample = received_at - device_s
+        if self.offset is None:
+            self.offset = sample
+        else:
+            self.offset = min(sample, self.offset + self.drift_allowance_s)
+        return min(device_s + self.offset, received_at)
+
+    def reset(self) -> None:
+        """重置時鐘偏移（例如相機重新連線後）"""
+        self.offset = None
+        self.last_ticks = None
+
+
+@dataclass
+class BlowTiming:
+    """單一氣吹的時序預測結果"""
+    capture_time: float        # 曝光時間（time.monotonic() 秒）
+    send_time: float           # 發送時間（time.monotonic() 秒）
+    lead_cx: float             # 補償處理延遲後的 X 座標（發送當下位置）
+    lead_cy: float             # 補償處理延遲後的 Y 座標（發送當下位置）
+    arrival_time: Optional[float] = None   # 預測到達噴嘴的時間（time.monotonic() 秒）
+    fire_delay_ms: float = 0.0             # 發送後應延遲多久開閥（毫秒），0 表示立即
+    deadline: Optional[float] = None       # 最晚發送時間（到達時間減閥門延遲），超過即無法準時開閥
+    velocity: Tuple[float, float] = (0.0, 0.0)  # 使用的速度 (vx, vy)，像素/秒
+
+    @property
+    def latency_ms(self) -> float:
+        """曝光到發送的處理延遲（毫秒）"""
+        return (self.send_time - self.capture_time) * 1000
+
+
+class BeltVelocityEstimator:
+    """
+    從追蹤歷史估計傳送帶速度
+    每條追蹤以最近幾帧的位置與時間求速度，傳送帶速度取各追蹤縱向速度中位數後做指數平滑
+    """
+
+    def __init__(self,
+                 smoothing: float = 0.2,
+                 min_speed_px_s: float = 1.0,
+                 default_velocity: Optional[Tuple[float, float]] = None):
+        """
+        初始化速度估計器
+
+        Parameters:
+            smoothing: 指數平滑係數（0~1，越大越跟隨最新量測）
+            min_speed_px_s: 低於此速度的量測視為靜止，不納入估計
+            default_velocity: 尚無量測時使用的速度 (vx, vy)，像素/秒
+        """
+        self.smoothing = smoothing
+        self.min_speed_px_s = min_speed_px_s
+        self.belt_velocity: Optional[Tuple[float, float]] = default_velocity
+        self.track_velocities: Dict[int, Tuple[float, float]] = {}
+
+    @staticmethod
+    def track_velocity(centers, times) -> Optional[Tuple[float, float]]:
+        """
+        以最近 n 帧的首尾兩點計算單一追蹤的速度
+
+        Parameters:
+            centers: 中心點歷史 [(cx, cy), ...]
+            times: 對應的時間歷史（秒）
+
+        Returns:
+            Tuple[float, float]: (vx, vy) 像素/秒，資料不足時為 None
+        """
+        n = min(len(centers), len(times))
+        if n < 2:
+            return None
+        centers, times = centers[-n:], times[-n:]
+        dt = times[-1] - times[0]
+        if dt <= 0:
+            return None
+        (x0, y0), (x1, y1) = centers[0], centers[-1]
+        return (x1 - x0) / dt, (y1 - y0) / dt
+
+    def update(self, tracks: Iterable) -> Optional[Tuple[float, float]]:
+        """
+        以本帧所有追蹤狀態更新速度估計
+
+        Parameters:
+            tracks: TrackState 的可迭代物件（需有 center_history 與 time_history）
+
+        Returns:
+            Tuple[float, float]: 目前的傳送帶速度估計，尚無估計時為 None
+        """
+        self.track_velocities = {}
+        samples = []
+        for state in tracks:
+            velocity = self.track_velocity(state.center_history,
+                                           getattr(state, 'time_history', []))
+            if velocity is None:
+                continue
+            self.track_velocities[state.track_id] = velocity
+            if abs(velocity[1]) >= self.min_speed_px_s:
+                samples.append(velocity)
+
+        if samples:
+            vx, vy = np.median(np.asarray(samples), axis=0)
+            if self.belt_velocity is None:
+                self.belt_velocity = (float(vx), float(vy))
+            else:
+                a = self.smoothing
+                self.belt_velocity = (
+                    (1 - a) * self.belt_velocity[0] + a * float(vx),
+                    (1 - a) * self.belt_velocity[1] + a * float(vy)
+                )
+        return self.belt_velocity
+
+    def velocity_for(self, track_id: Optional[int]) -> Optional[Tuple[float, float]]:
+        """
+        取得指定追蹤的速度，無個別估計時退回傳送帶速度
+
+        Parameters:
+            track_id: 追蹤 ID
+
+        Returns:
+            Tuple[float, float]: (vx, vy) 像素/秒，無任何估計時為 None
+        """
+        velocity = self.track_velocities.get(track_id) if track_id is not None else None
+        return velocity if velocity is not None else self.belt_velocity
+
+
+class BlowTimingPredictor:
+    """噴嘴到達時間與前置位置預測"""
+
+    def __init__(self,
+                 nozzle_distance_px: Optional[float] = None,
+                 valve_latency_ms: float = 0.0):
+        """
+        初始化預測器
+
+        Parameters:
+            nozzle_distance_px: 噴嘴線與圖像下緣的距離（沿傳送方向，像素），None 表示不預測到達時間
+            valve_latency_ms: 閥門從收到指令到出氣的反應延遲（毫秒）
+        """
+        self.nozzle_distance_px = nozzle_distance_px
+        self.valve_latency_ms = valve_latency_ms
+
+    def predict(self,
+                cx: float,
+                cy: float,
+                capture_time: float,
+                velocity: Optional[Tuple[float, float]],
+                image_height: int,
+                send_time: Optional[float] = None) -> BlowTiming:
+        """
+        預測單一氣吹的時序
+
+        Parameters:
+            cx, cy: 曝光當下的中心點座標
+            capture_time: 曝光時間（time.monotonic() 秒）
+            velocity: 速度 (vx, vy) 像素/秒，None 表示未知
+            image_height: 圖像高度（像素），噴嘴線位於其下方 nozzle_distance_px
+            send_time: 發送時間，None 表示現在
+
+        Returns:
+            BlowTiming: 預測結果
+        """
+        if send_time is None:
+            send_time = time.monotonic()
+
+        if velocity is None:
+            return BlowTiming(capture_time=capture_time, send_time=send_time,
+                              lead_cx=cx, lead_cy=cy)
+
+        vx, vy = velocity
+        elapsed = max(0.0, send_time - capture_time)
+        timing = BlowTiming(
+            capture_time=capture_time,
+            send_time=send_time,
+            lead_cx=cx + vx * elapsed,
+            lead_cy=cy + vy * elapsed,
+            velocity=(vx, vy)
+        )
+
+        if self.nozzle_distance_px is not None and vy > 0:
+            nozzle_y = image_height + self.nozzle_distance_px
+            timing.arrival_time = capture_time + (nozzle_y - cy) / vy
+            timing.deadline = timing.arrival_time - self.valve_latency_ms / 1000.0
+            timing.fire_delay_ms = max(0.0, (timing.deadline - send_time) * 1000)
+
+        return timing
@@ -5,7 +5,7 @@ Two-Band Filter 配置文件
 """
 
 from dataclasses import dataclass
-from typing import Tuple
+from typing import Optional, Tuple
 
 
 @dataclass
@@ -70,6 +70,12 @@ class BlowConfig:
     blow_delay_min_ms: int = 80          # 氣吹延遲最小值（毫秒）
     blow_delay_max_ms: int = 120         # 氣吹延遲最大值（毫秒）
     ack_timeout_ms: int = 200            # ACK 超時時間（毫秒）
+    num_valves: int = 16                 # 噴嘴陣列閥門數量（沿圖像寬度均分）
+    valve_min_dwell_ms: float = 50.0     # 同一閥門的最小駐留時間（毫秒），期間內的觸發合併
+    nozzle_distance_px: Optional[float] = None  # 噴嘴線與圖像下緣的距離（像素），None 表示不預測到達時間
+    timestamp_tick_hz: float = 1e9       # 相機裝置時間戳頻率（GevTimestampTickFrequency）
+    backlog_size: int = 64               # 斷線期間暫存的氣吹指令上限
+    command_ttl_ms: float = 300.0        # 無法預測到達時間時，指令自曝光起的有效時間（毫秒）
     
     @property
     def blow_delay_range(self) -> Tuple[int, int]:
@@ -82,7 +88,8 @@ class TCPConfig:
     """TCP 通訊配置"""
     host: str = 'localhost'              # TCP 伺服器主機
     port: int = 8888                     # TCP 伺服器埠號
-    heartbeat_interval_s: float = 5.0   # 心跳間隔（秒）
+    hello_timeout_s: float = 0.3         # 等待客戶端宣告角色的時間（秒），逾時視為 LabVIEW 執行端
+    udp_port: int = 0                    # UDP 訂閱者的發送埠（0 表示由系統分配）
 
 
 @dataclass
@@ -227,6 +234,9 @@ class TwoBandFilterConfig:
         print("\n[BLOW CONFIG]")
         print(f"  Blow Delay: {self.blow.blow_delay_min_ms}~{self.blow.blow_delay_max_ms} ms")
         print(f"  ACK Timeout: {self.blow.ack_timeout_ms} ms")
+        print(f"  Valves: {self.blow.num_valves} (dwell {self.blow.valve_min_dwell_ms} ms)")
+        print(f"  Nozzle Distance: {self.blow.nozzle_distance_px} px")
+        print(f"  Backlog: {self.blow.backlog_size} commands (TTL {self.blow.command_ttl_ms} ms)")
         
         print("\n[TCP CONFIG]")
         print(f"  Server: {self.tcp.host}:{self.tcp.port}")
@@ -3,6 +3,7 @@ import numpy as np
 from ultralytics import YOLO
 import math
 import traceback
+from overlay_compositor import OverlayScene, compose_overlay
 
 def load_model(weights):
     """載入YOLOv11模型"""
@@ -32,10 +33,8 @@ def calculate_diagonal_length(x1, y1, x2, y2):
     diagonal = math.sqrt(width**2 + height**2)
     return diagonal
 
-def draw_custom_boxes(frame, results):
-    """自定義繪製邊界框，包含斜邊長度資訊"""
-    annotated_frame = frame.copy()
-    
+def add_detection_boxes(scene, results, color=(0, 255, 0)):
+    """將偵測框（類別、信心度、斜邊長度）加入疊圖場景"""
     if results and results[0].boxes is not None:
         boxes = results[0].boxes.xyxy.cpu().numpy()
         confs = results[0].boxes.conf.cpu().numpy()
@@ -46,20 +45,12 @@ def draw_custom_boxes(frame, results):
             x1, y1, x2, y2 = map(int, box)
             diagonal = calculate_diagonal_length(x1, y1, x2, y2)
             class_name = names[int(cls)]
-            
-            cv2.rectangle(annotated_frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
-            label = f"{class_name} {conf:.2f} Diag:{diagonal:.1f}"
-            
-            font = cv2.FONT_HERSHEY_SIMPLEX
-            font_scale = 0.5
-            thickness = 1
-            (text_width, text_height), baseline = cv2.getTextSize(label, font, font_scale, thickness)
-            cv2.rectangle(annotated_frame, 
-                         (x1, y1 - text_height - baseline - 5), 
-                         (x1 + text_width, y1), 
-                         (0, 255, 0), -1)
-            cv2.putText(annotated_frame, label, 
-                       (x1, y1 - baseline - 2), 
-                       font, font_scale, (0, 0, 0), thickness)
-    
-    return annotated_frame
+            scene.add_box(x1, y1, x2, y2, color, label=f"{class_name} {conf:.2f} Diag:{diagonal:.1f}")
+    return scene
+
+def draw_custom_boxes(frame, results, in_place=False):
+    """自定義繪製邊界框，包含斜邊長度資訊（in_place=True 時直接畫在 frame 上，不複製）"""
+    annotated_frame = frame if in_place else frame.copy()
+    height, width = annotated_frame.shape[:2]
+    scene = add_detection_boxes(OverlayScene(width, height), results)
+    return compose_overlay(annotated_frame, scene)
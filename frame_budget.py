@@ -0,0 +1,342 @@
+# frame_budget.py
+"""
+帧預算監控與分級降載
+每帧的處理時間（取得影像到處理完成）與帧預算比較，持續超出時依序往下一級降載，
+持續有餘裕時再逐級恢復；每次切換都記錄在日誌與指標（nircam_degradation_*）
+
+帧預算取以下兩者較小者:
+- 相機帧間隔：以主機收到的時間與 nFrameNum 的差估計（處理落後、SDK 丟帧時仍是相機真正的間隔）
+- 傳送帶推算的間隔：物體穿過觸發區的時間 / min_frames_in_zone（每個物體在觸發區內至少要處理幾帧）
+
+降載階梯（可設定，由輕到重）:
+    overlay        停止疊圖（不再準備 processed 預覽）
+    save           停止存檔
+    preview_fps    預覽帧率上限降為 value
+    imgsz          推論尺寸上限降為 value
+    skip           每 value 帧只辨識 1 帧（追蹤器以 max_age 容忍中間的帧）
+
+判斷只依整帧時間：各階段在擷取執行緒上依序執行，總和就是是否跟得上相機的依據；
+有 FrameTracer 時，切換記錄會附上最慢的階段
+
+使用方式:
+    watchdog = start_frame_budget_watchdog()
+    watchdog.frame_arrived(frame_num, time.perf_counter())
+    state = watchdog.state          # 依 state 決定本帧要做哪些工作
+    watchdog.frame_done(processing_ms)
+"""
+
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence
+
+from frame_trace import STAGE_CONVERT, STAGE_NAMES, STAGE_SEND, get_frame_tracer
+from pipeline_logging import get_pipeline_logger
+from pipeline_metrics import metrics
+
+DEGRADATION_LEVEL = metrics.gauge('nircam_degradation_level', 'Current step on the frame-budget degradation ladder')
+DEGRADATION_TRANSITIONS = metrics.counter('nircam_degradation_transitions_total',
+                                          'Degradation ladder transitions', ('direction', 'step'))
+FRAME_BUDGET = metrics.gauge('nircam_frame_budget_seconds', 'Per-frame processing budget')
+FRAME_PROCESSING = metrics.gauge('nircam_frame_processing_p90_seconds', 'Recent 90th percentile frame processing time')
+
+ACTIONS = ('overlay', 'save', 'preview_fps', 'imgsz', 'skip')
+
+
+@dataclass
+class DegradationStep:
+    """降載階梯的一級"""
+    action: str                         # ACTIONS 之一
+    value: Optional[float] = None       # preview_fps / imgsz / skip 的值
+
+    def describe(self) -> str:
+        return self.action if self.value is None else f"{self.action}={self.value:g}"
+
+
+@dataclass
+class DegradationState:
+    """目前各項工作是否執行（依階梯累積套用）"""
+    overlays: bool = True                       # 是否疊圖
+    saving: bool = True                         # 是否存檔
+    preview_fps_cap: Optional[float] = None     # 預覽帧率上限，None 表示不限制
+    imgsz_cap: Optional[int] = None             # 推論尺寸上限，None 表示不限制
+    detect_every: int = 1                       # 每 N 帧辨識 1 帧
+
+
+DEFAULT_LADDER = [
+    DegradationStep('overlay'),
+    DegradationStep('save'),
+    DegradationStep('preview_fps', 5),
+    DegradationStep('imgsz', 960),
+    DegradationStep('imgsz', 640),
+    DegradationStep('skip', 2),
+]
+
+
+def build_state(steps: Sequence[DegradationStep]) -> DegradationState:
+    """將前幾級的降載累積成狀態"""
+    state = DegradationState()
+    for step in steps:
+        if step.action == 'overlay':
+            state.overlays = False
+        elif step.action == 'save':
+            state.saving = False
+        elif step.action == 'preview_fps':
+            state.preview_fps_cap = float(step.value)
+        elif step.action == 'imgsz':
+            # 推論尺寸需為 32 的倍數
+            cap = max(32, int(step.value) // 32 * 32)
+            state.imgsz_cap = cap if state.imgsz_cap is None else min(state.imgsz_cap, cap)
+        elif step.action == 'skip':
+            state.detect_every = max(state.detect_every, int(step.value))
+    return state
+
+
+def parse_ladder(config: Sequence) -> List[DegradationStep]:
+    """
+    由設定建立階梯
+
+    Parameters:
+        config: ["overlay", "save", {"action": "imgsz", "value": 960}, ...]
+
+    Returns:
+        List[DegradationStep]: 降載階梯
+    """
+    ladder = []
+    for entry in config:
+        step = DegradationStep(entry) if isinstance(entry, str) else DegradationStep(**entry)
+        if step.action not in ACTIONS:
+            raise ValueError(f"Unknown degradation action '{step.action}'")
+        if step.action in ('preview_fps', 'imgsz', 'skip') and step.value is None:
+            raise ValueError(f"Degradation action '{step.action}' needs a value")
+        ladder.append(step)
+    return ladder
+
+
+class FrameBudgetWatchdog:
+    """帧預算監控（擷取執行緒呼叫，不需加鎖）"""
+
+    def __init__(self,
+                 ladder: Optional[Sequence[DegradationStep]] = None,
+                 window: int = 30,
+                 over_ratio: float = 1.0,
+                 headroom_ratio: float = 0.7,
+                 recover_windows: int = 3,
+                 min_frames_in_zone: int = 2,
+                 fixed_budget_ms: Optional[float] = None):
+        """
+        初始化帧預算監控
+
+        Parameters:
+            ladder: 降載階梯（由輕到重），None 使用 DEFAULT_LADDER
+            window: 評估的帧數（每次切換後也要等滿一個視窗才再次評估）
+            over_ratio: p90 處理時間超過預算的這個倍數時降一級
+            headroom_ratio: p90 處理時間低於預算的這個倍數時才考慮恢復
+            recover_windows: 連續幾個視窗都有餘裕才恢復一級（避免來回切換）
+            min_frames_in_zone: 物體在觸發區內至少要處理的帧數（傳送帶推算的預算）
+            fixed_budget_ms: 固定的帧預算（毫秒），None 表示自動推算
+        """
+        self.ladder = list(ladder) if ladder is not None else list(DEFAULT_LADDER)
+        self.window = window
+        self.over_ratio = over_ratio
+        self.headroom_ratio = headroom_ratio
+        self.recover_windows = recover_windows
+        self.min_frames_in_zone = min_frames_in_zone
+        self.fixed_budget_ms = fixed_budget_ms
+
+        self.level = 0
+        self.state = DegradationState()
+        self.processing_ms = deque(maxlen=window)
+        self.frame_interval_ms: Optional[float] = None     # 相機帧間隔（EWMA）
+        self.belt_budget_ms: Optional[float] = None        # 傳送帶推算的預算
+        self._last_arrival = None                          # (nFrameNum, 收到時間)
+        self._frames_since_change = 0
+        self._headroom_windows = 0
+        self._detect_counter = 0
+        self.transitions: List[Dict] = []
+
+        self.logger = get_pipeline_logger("FrameBudget")
+        print(f"[FrameBudgetWatchdog] Initialized: ladder = "
+              f"{' → '.join(step.describe() for step in self.ladder) or '(empty)'}")
+
+    # ========== 輸入 ==========
+
+    def frame_arrived(self, frame_num: int, received_at: float) -> None:
+        """
+        取得一帧時呼叫，估計相機帧間隔
+
+        Parameters:
+            frame_num: nFrameNum
+            received_at: 主機收到的時間（time.perf_counter() 秒）
+        """
+        if self._last_arrival is not None:
+            last_num, last_time = self._last_arrival
+            frames = frame_num - last_num
+            if frames > 0:
+                interval_ms = (received_at - last_time) * 1000.0 / frames
+                if self.frame_interval_ms is None:
+                    self.frame_interval_ms = interval_ms
+                else:
+                    self.frame_interval_ms += 0.1 * (interval_ms - self.frame_interval_ms)
+        self._last_arrival = (frame_num, received_at)
+
+    def update_belt(self, belt_velocity, zone_height_px: float) -> None:
+        """
+        以傳送帶速度更新預算（觸發區高度 / 速度 / min_frames_in_zone）
+
+        Parameters:
+            belt_velocity: (vx, vy) 像素/秒，None 表示尚未估計
+            zone_height_px: 觸發區高度（像素）
+        """
+        if belt_velocity is None:
+            return
+        speed = abs(belt_velocity[1])
+        if speed > 1e-6:
+            self.belt_budget_ms = zone_height_px / speed / self.min_frames_in_zone * 1000.0
+
+    @property
+    def budget_ms(self) -> Optional[float]:
+        """目前的帧預算（毫秒），尚無資料時為 None"""
+        if self.fixed_budget_ms is not None:
+            return self.fixed_budget_ms
+        candidates = [b for b in (self.frame_interval_ms, self.belt_budget_ms) if b is not None]
+        return min(candidates) if candidates else None
+
+    def should_detect(self) -> bool:
+        """本帧是否要辨識（skip 降載時每 detect_every 帧辨識 1 帧）"""
+        self._detect_counter += 1
+        return self._detect_counter % self.state.detect_every == 0
+
+    def frame_done(self, processing_ms: float) -> None:
+        """
+        一帧處理完成時呼叫
+
+        Parameters:
+            processing_ms: 從取得影像到處理完成的時間（毫秒）
+        """
+        self.processing_ms.append(processing_ms)
+        self._frames_since_change += 1
+        if self._frames_since_change < self.window:
+            return
+        budget = self.budget_ms
+        if budget is None:
+            return
+        p90 = sorted(self.processing_ms)[int(len(self.processing_ms) * 0.9)]
+        FRAME_BUDGET.set(budget / 1000.0)
+        FRAME_PROCESSING.set(p90 / 1000.0)
+
+        if p90 > budget * self.over_ratio:
+            self._headroom_windows = 0
+            if self.level < len(self.ladder):
+                self._change(self.level + 1, p90, budget)
+            else:
+                self._frames_since_change = 0
+        elif p90 < budget * self.headroom_ratio and self.level > 0:
+            self._headroom_windows += 1
+            self._frames_since_change = 0
+            if self._headroom_windows >= self.recover_windows:
+                self._headroom_windows = 0
+                self._change(self.level - 1, p90, budget)
+        else:
+            self._headroom_windows = 0
+            self._frames_since_change = 0
+
+    # ========== 切換 ==========
+
+    def _slowest_stage(self) -> Optional[str]:
+        """FrameTracer 啟用時回傳 p50 最長的處理階段"""
+        tracer = get_frame_tracer()
+        if tracer is None:
+            return None
+        best, best_ms = None, 0.0
+        for stage in range(STAGE_CONVERT, STAGE_SEND + 1):
+            p50 = tracer.quantiles(stage, points=(0.5,)).get('p50', 0.0)
+            if p50 > best_ms:
+                best, best_ms = STAGE_NAMES[stage], p50
+        return best
+
+    def _change(self, level: int, p90: float, budget: float) -> None:
+        down = level > self.level
+        step = self.ladder[level - 1] if down else self.ladder[level]
+        self.level = level
+        self.state = build_state(self.ladder[:level])
+        self._frames_since_change = 0
+        self.processing_ms.clear()
+
+        direction = 'down' if down else 'up'
+        DEGRADATION_TRANSITIONS.labels(direction, step.describe()).inc()
+        DEGRADATION_LEVEL.set(level)
+        slowest = self._slowest_stage()
+        self.transitions.append({
+            'time': time.time(),
+            'direction': direction,
+            'step': step.describe(),
+            'level': level,
+            'p90_ms': p90,
+            'budget_ms': budget,
+            'slowest_stage': slowest
+        })
+        if down:
+            self.logger.warning("Over budget (p90 %.1f ms > %.1f ms%s): level %d, apply %s",
+                                p90, budget, f", slowest stage {slowest}" if slowest else "",
+                                level, step.describe())
+        else:
+            self.logger.warning("Headroom (p90 %.1f ms < %.1f ms): level %d, lift %s",
+                                p90, budget, level, step.describe())
+
+    # ========== 統計 ==========
+
+    def get_statistics(self) -> Dict:
+        """
+        獲取統計資訊
+
+        Returns:
+            dict: 統計資訊
+        """
+        return {
+            'level': self.level,
+            'active_steps': [step.describe() for step in self.ladder[:self.level]],
+            'budget_ms': self.budget_ms,
+            'frame_interval_ms': self.frame_interval_ms,
+            'belt_budget_ms': self.belt_budget_ms,
+            'transitions': len(self.transitions),
+            'last_transition': self.transitions[-1] if self.transitions else None
+        }
+
+    def print_statistics(self) -> None:
+        """列印統計資訊"""
+        stats = self.get_statistics()
+        print("\n" + "=" * 60)
+        print("Frame Budget Watchdog Statistics")
+        print("=" * 60)
+        budget = f"{stats['budget_ms']:.1f} ms" if stats['budget_ms'] is not None else "n/a"
+        print(f"Budget:          {budget}")
+        print(f"Level:           {stats['level']}/{len(self.ladder)} "
+              f"({', '.join(stats['active_steps']) or 'full quality'})")
+        print(f"Transitions:     {stats['transitions']}")
+        print("=" * 60 + "\n")
+
+
+# 全域帧預算監控實例（None 表示不降載）
+frame_budget_watchdog = None
+
+
+def start_frame_budget_watchdog(ladder=None, **kwargs):
+    """啟動帧預算監控"""
+    global frame_budget_watchdog
+    if frame_budget_watchdog is None:
+        frame_budget_watchdog = FrameBudgetWatchdog(ladder, **kwargs)
+    return frame_budget_watchdog
+
+
+def get_frame_budget_watchdog():
+    """獲取帧預算監控實例"""
+    return frame_budget_watchdog
+
+
+def stop_frame_budget_watchdog():
+    """停止帧預算監控（恢復全部功能）"""
+    global frame_budget_watchdog
+    if frame_budget_watchdog:
+        frame_budget_watchdog.print_statistics()
+        frame_budget_watchdog = None
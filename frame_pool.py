@@ -0,0 +1,213 @@
+# frame_pool.py
+"""
+影像緩衝區池
+預先配置固定數量、相同 shape 的影像陣列，每帧的轉換結果直接寫入池中的陣列（cv2 的 dst 參數），
+避免每帧 np.zeros / cvtColor / copy 產生的大量配置與釋放
+
+使用方式:
+    pool = FramePool((height, width, 3), np.uint8, capacity=6)
+    frame = pool.acquire()                     # 參考計數 = 1
+    cv2.cvtColor(raw, code, dst=frame.array)
+    streamer.submit(frame.retain(), ...)       # 交給其他消費者前先 retain()
+    frame.release()                            # 最後一個 release() 時陣列回到池中
+
+池中沒有空閒陣列時 acquire() 不會阻塞生產迴圈，而是臨時配置一個陣列（計入 misses），
+該陣列釋放時若池已滿則直接丟棄
+"""
+
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+class FrameHandle:
+    """參考計數的影像緩衝區"""
+
+    __slots__ = ('array', '_pool', '_refs')
+
+    def __init__(self, array: np.ndarray, pool: 'FramePool'):
+        self.array = array
+        self._pool = pool
+        self._refs = 1
+
+    @property
+    def refs(self) -> int:
+        """目前的參考計數"""
+        return self._refs
+
+    def retain(self) -> 'FrameHandle':
+        """
+        增加一個參考（交給其他消費者前呼叫）
+
+        Returns:
+            FrameHandle: self，方便串接
+        """
+        with self._pool._lock:
+            if self._refs <= 0:
+                raise RuntimeError("retain() on a released frame buffer")
+            self._refs += 1
+        return self
+
+    def release(self) -> None:
+        """釋放一個參考，最後一個參考釋放時陣列回到池中"""
+        with self._pool._lock:
+            if self._refs <= 0:
+                raise RuntimeError("release() on a released frame buffer")
+            self._refs -= 1
+            if self._refs:
+                return
+        self._pool._return(self.array)
+
+    def __enter__(self) -> 'FrameHandle':
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.release()
+
+
+class FramePool:
+    """固定 shape 的影像緩衝區池"""
+
+    def __init__(self, shape: Tuple[int, ...], dtype=np.uint8, capacity: int = 6):
+        """
+        初始化緩衝區池
+
+        Parameters:
+            shape: 影像 shape，例如 (height, width, 3)
+            dtype: 影像 dtype
+            capacity: 預先配置的陣列數（同時在使用中的帧數上限，超過時臨時配置）
+        """
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._free: List[np.ndarray] = [np.empty(self.shape, self.dtype) for _ in range(capacity)]
+
+        # 統計資訊
+        self.acquired = 0
+        self.misses = 0       # 池中沒有空閒陣列而臨時配置的次數
+        self.in_use = 0
+        self.peak_in_use = 0
+
+    @classmethod
+    def for_frame(cls, width: int, height: int, channels: int = 3, capacity: int = 6) -> 'FramePool':
+        """
+        依相機影像尺寸建立緩衝區池
+
+        Parameters:
+            width, height: 影像寬高（MV_FRAME_OUT_INFO_EX 的 nWidth / nHeight）
+            channels: 通道數，1 表示單通道
+            capacity: 預先配置的陣列數
+
+        Returns:
+            FramePool: 緩衝區池
+        """
+        shape = (height, width, channels) if channels > 1 else (height, width)
+        return cls(shape, np.uint8, capacity)
+
+    @property
+    def nbytes(self) -> int:
+        """預先配置的總位元組數"""
+        return int(np.prod(self.shape)) * self.dtype.itemsize * self.capacity
+
+    def acquire(self) -> FrameHandle:
+        """
+        取得一個緩衝區（參考計數 = 1，內容未初始化）
+
+        Returns:
+            FrameHandle: 緩衝區
+        """
+        with self._lock:
+            self.acquired += 1
+            self.in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+            if self._free:
+                array = self._free.pop()
+            else:
+                self.misses += 1
+                array = None
+        if array is None:
+            array = np.empty(self.shape, self.dtype)
+        return FrameHandle(array, self)
+
+    def _return(self, array: np.ndarray) -> None:
+        """由 FrameHandle.release() 呼叫"""
+        with self._lock:
+            self.in_use -= 1
+            if len(self._free) < self.capacity:
+                self._free.append(array)
+
+    def get_statistics(self) -> Dict:
+        """
+        獲取統計資訊
+
+        Returns:
+            dict: 統計資訊
+        """
+        with self._lock:
+            return {
+                'shape': self.shape,
+                'capacity': self.capacity,
+                'free': len(self._free),
+                'in_use': self.in_use,
+                'peak_in_use': self.peak_in_use,
+                'acquired': self.acquired,
+                'misses': self.misses,
+                'preallocated_mb': self.nbytes / 1e6
+            }
+
+
+class FramePoolSet:
+    """
+    依 shape 分開的多個緩衝區池
+    相機解析度或像素格式改變時自動建立新的池，舊池的緩衝區在最後一個消費者釋放後被回收
+    """
+
+    def __init__(self, capacity: int = 6):
+        self.capacity = capacity
+        self._pools: Dict[Tuple, FramePool] = {}
+        self._lock = threading.Lock()
+
+    def pool(self, shape: Tuple[int, ...], dtype=np.uint8) -> FramePool:
+        """取得（必要時建立）指定 shape 的池"""
+        key = (tuple(shape), np.dtype(dtype).str)
+        pool = self._pools.get(key)
+        if pool is None:
+            with self._lock:
+                pool = self._pools.get(key)
+                if pool is None:
+                    pool = FramePool(shape, dtype, self.capacity)
+                    self._pools = {**self._pools, key: pool}
+                    print(f"[FramePool] Preallocated {self.capacity} x {shape} "
+                          f"({pool.nbytes / 1e6:.1f} MB)")
+        return pool
+
+    def acquire(self, shape: Tuple[int, ...], dtype=np.uint8) -> FrameHandle:
+        """取得指定 shape 的緩衝區"""
+        return self.pool(shape, dtype).acquire()
+
+    def get_statistics(self) -> List[Dict]:
+        """
+        獲取統計資訊
+
+        Returns:
+            list: 每個池的統計資訊
+        """
+        return [pool.get_statistics() for pool in self._pools.values()]
+
+    def print_statistics(self) -> None:
+        """列印統計資訊"""
+        print("\n" + "=" * 60)
+        print("Frame Pool Statistics")
+        print("=" * 60)
+        for stats in self.get_statistics():
+            print(f"{stats['shape']}: in_use={stats['in_use']} peak={stats['peak_in_use']} "
+                  f"free={stats['free']}/{stats['capacity']} acquired={stats['acquired']} "
+                  f"misses={stats['misses']} ({stats['preallocated_mb']:.1f} MB)")
+        print("=" * 60 + "\n")
+
+
+def frame_array(frame) -> Optional[np.ndarray]:
+    """取出 FrameHandle 的陣列（一般 ndarray 原樣返回）"""
+    return frame.array if isinstance(frame, FrameHandle) else frame
@@ -0,0 +1,454 @@
+# frame_streamer.py
+"""
+遠端影像串流
+將縮小後的影像（或僅觸發區域的裁切）以執行緒池平行 JPEG 編碼，
+透過長度前綴的 TCP 串流發送給其他機器上的觀看端（例如 QA 站）
+
+設計原則：觀看端永遠不能拖慢生產迴圈
+- submit() 不阻塞也不做任何轉換，只把影像參考（或 FrameHandle 參考計數）放進「最新帧」槽位，沒有觀看端時直接返回
+- 編碼中的帧數上限為執行緒數，新帧到達時取代尚未編碼的舊帧（latest-frame-wins）
+- fps 上限與位元率上限（token bucket）在編碼前後各檢查一次，超出時丟帧
+- 每個觀看端有自己的發送執行緒與單一待送槽位，慢的觀看端只會丟自己的帧
+
+記錄格式（每筆前置 4 位元組大端序長度，見 stream_framing）:
+    <JSON 標頭>\\n<JPEG 資料>
+    標頭: {"seq", "trigger", "timestamp", "width", "height", "scale", "roi", "encode_ms"}
+    roi 為裁切區域在原圖的 [x1, y1, x2, y2]，整張縮圖時為 null
+"""
+
+import json
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Sequence
+
+import cv2
+import numpy as np
+
+from frame_pool import FrameHandle
+from pipeline_logging import get_pipeline_logger
+from pipeline_metrics import LatencyStats
+from stream_framing import LENGTH_PREFIX, pack_length_prefixed, read_exact
+
+
+class _StreamClient:
+    """單一觀看端：最新一筆待送記錄 + 發送執行緒"""
+
+    def __init__(self, sock: socket.socket, address, on_closed):
+        self.sock = sock
+        self.address = address
+        self.sent = 0
+        self.dropped = 0
+        self.bytes_sent = 0
+        self._pending: Optional[bytes] = None
+        self._cond = threading.Condition()
+        self._closed = False
+        self._on_closed = on_closed
+        self.thread = threading.Thread(target=self._run, name=f"StreamClient-{address}", daemon=True)
+        self.thread.start()
+
+    def offer(self, record: bytes) -> None:
+        """放入最新記錄（尚未送出的舊記錄直接捨棄）"""
+        with self._cond:
+            if self._pending is not None:
+                self.dropped += 1
+            self._pending = record
+            self._cond.notify()
+
+    def _run(self) -> None:
+        try:
+            while True:
+                with self._cond:
+                    while self._pending is None and not self._closed:
+                        self._cond.wait()
+                    if self._closed:
+                        return
+                    record, self._pending = self._pending, None
+                self.sock.sendall(record)
+                self.sent += 1
+                self.bytes_sent += len(record)
+        except OSError:
+            pass
+        finally:
+            self.close()
+            self._on_closed(self)
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class FrameStreamer:
+    """遠端影像串流發布端"""
+
+    def __init__(self,
+                 host: str = '0.0.0.0',
+                 port: int = 9100,
+                 max_fps: float = 10.0,
+                 max_bitrate_kbps: float = 20000.0,
+                 scale: float = 0.5,
+                 jpeg_quality: int = 80,
+                 num_workers: int = 2,
+                 crop_mode: bool = False,
+                 crop_margin: int = 32):
+        """
+        初始化影像串流
+
+        Parameters:
+            host: 監聽位址
+            port: 監聽埠號
+            max_fps: 每秒最多發送的帧數（0 表示不限制）
+            max_bitrate_kbps: 位元率上限（kbit/s，0 表示不限制）
+            scale: 整張影像的縮放比例
+            jpeg_quality: JPEG 品質（1~100）
+            num_workers: 編碼執行緒數
+            crop_mode: True 時只發送觸發區域的裁切（原解析度），沒有觸發的帧不發送
+            crop_margin: 裁切區域四周保留的像素
+        """
+        self.host = host
+        self.port = port
+        self.max_fps = max_fps
+        self.max_bitrate_kbps = max_bitrate_kbps
+        self.scale = scale
+        self.jpeg_quality = jpeg_quality
+        self.num_workers = num_workers
+        self.crop_mode = crop_mode
+        self.crop_margin = crop_margin
+
+        self.server_socket = None
+        self.is_running = False
+        self.clients: List[_StreamClient] = []  # 寫入時複製，發送時不需持鎖
+        self._clients_lock = threading.Lock()
+
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pending = None              # 最新一帧 (image, trigger_num, rois, is_rgb, timestamp)
+        self._pending_lock = threading.Lock()
+        self._in_flight = 0
+        self._next_frame_time = 0.0
+        self._tokens = 0.0                # 位元率 token bucket（位元組）
+        self._tokens_time = time.monotonic()
+        self._seq = 0
+
+        # 統計資訊
+        self.submitted = 0
+        self.replaced = 0                 # 尚未編碼就被新帧取代
+        self.rate_limited = 0             # 超過 fps 上限
+        self.bitrate_limited = 0          # 超過位元率上限
+        self.encoded = 0
+        self.encode_ms = LatencyStats()
+
+        self.logger = get_pipeline_logger("FrameStreamer")
+
+        print(f"[FrameStreamer] Initialized on {host}:{port}: "
+              f"{'trigger crops' if crop_mode else f'scale={scale}'}, "
+              f"max {max_fps} fps / {max_bitrate_kbps} kbps, {num_workers} encoders")
+
+    def start(self) -> bool:
+        """啟動監聽"""
+        try:
+            self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.server_socket.bind((self.host, self.port))
+            self.server_socket.listen(4)
+            self.is_running = True
+            self._executor = ThreadPoolExecutor(max_workers=self.num_workers,
+                                                thread_name_prefix="FrameEncoder")
+            threading.Thread(target=self._accept_loop, name="FrameStreamerAccept", daemon=True).start()
+            self.logger.info("Streaming on %s:%d", self.host, self.port)
+            return True
+        except OSError as e:
+            self.logger.error("Failed to start: %s", e)
+            self.server_socket = None
+            return False
+
+    def _accept_loop(self) -> None:
+        while self.is_running:
+            try:
+                sock, address = self.server_socket.accept()
+            except OSError:
+                break
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            client = _StreamClient(sock, address, self._remove_client)
+            with self._clients_lock:
+                self.clients = self.clients + [client]
+            self.logger.info("Viewer connected: %s", address)
+
+    def _remove_client(self, client: _StreamClient) -> None:
+        with self._clients_lock:
+            if client in self.clients:
+                self.clients = [c for c in self.clients if c is not client]
+                self.logger.info("Viewer disconnected: %s", client.address)
+
+    @property
+    def has_viewers(self) -> bool:
+        """是否有觀看端連線"""
+        return bool(self.clients)
+
+    def submit(self,
+               image: np.ndarray,
+               trigger_num: int,
+               rois: Optional[Sequence[Sequence[float]]] = None,
+               is_rgb: bool = True) -> bool:
+        """
+        提交一帧（不阻塞，呼叫端之後不得修改 image）
+
+        Parameters:
+            image: 影像，或 FrameHandle（被接受時由串流 retain()，編碼完成或被取代時 release()）
+            trigger_num: 觸發編號
+            rois: 觸發區域 [[x1, y1, x2, y2], ...]，crop_mode 時使用
+            is_rgb: image 是否為 RGB（編碼前轉為 BGR）
+
+        Returns:
+            bool: 是否被接受（沒有觀看端、超過 fps 上限或 crop_mode 下沒有觸發區域時為 False）
+        """
+        if not self.is_running or not self.clients:
+            return False
+        if self.crop_mode and not rois:
+            return False
+
+        now = time.monotonic()
+        if self.max_fps > 0:
+            if now < self._next_frame_time:
+                self.rate_limited += 1
+                return False
+            period = 1.0 / self.max_fps
+            self._next_frame_time = max(self._next_frame_time, now - period) + period
+
+        self.submitted += 1
+        if isinstance(image, FrameHandle):
+            image.retain()
+        frame = (image, trigger_num, rois, is_rgb, time.time())
+        with self._pending_lock:
+            replaced, self._pending = self._pending, frame
+            if replaced is not None:
+                self.replaced += 1
+                self._release_frame(replaced)
+            if self._in_flight >= self.num_workers:
+                # 編碼執行緒都在忙，完成時會取走最新的一帧
+                return True
+            self._in_flight += 1
+        self._executor.submit(self._encode_loop)
+        return True
+
+    def _encode_loop(self) -> None:
+        """編碼執行緒：持續取出最新一帧直到沒有待編碼的帧"""
+        while True:
+            with self._pending_lock:
+                frame, self._pending = self._pending, None
+                if frame is None:
+                    self._in_flight -= 1
+                    return
+            try:
+                self._encode_and_publish(*frame)
+            except Exception as e:
+                self.logger.error("Encode failed: %s", e)
+            finally:
+                self._release_frame(frame)
+
+    @staticmethod
+    def _release_frame(frame) -> None:
+        """釋放池中緩衝區的參考"""
+        if isinstance(frame[0], FrameHandle):
+            frame[0].release()
+
+    def _encode_and_publish(self, image, trigger_num, rois, is_rgb, timestamp) -> None:
+        if isinstance(image, FrameHandle):
+            image = image.array
+        height, width = image.shape[:2]
+        for roi, part in self._regions(image, rois):
+            start = time.perf_counter()
+            if part.ndim == 3 and is_rgb:
+                part = cv2.cvtColor(part, cv2.COLOR_RGB2BGR)
+            ok, jpeg = cv2.imencode('.jpg', part, [int(cv2.IMWRITE_JPEG_QUALITY), self.jpeg_quality])
+            if not ok:
+                continue
+            encode_ms = (time.perf_counter() - start) * 1000.0
+            self.encode_ms.add(encode_ms)
+            self.encoded += 1
+
+            if not self._take_tokens(len(jpeg)):
+                self.bitrate_limited += 1
+                continue
+            with self._pending_lock:
+                self._seq += 1
+                seq = self._seq
+            header = {
+                'seq': seq,
+                'trigger': trigger_num,
+                'timestamp': timestamp,
+                'width': width,
+                'height': height,
+                'scale': 1.0 if roi is not None else self.scale,
+                'roi': roi,
+                'encode_ms': round(encode_ms, 2)
+            }
+            record = pack_length_prefixed(json.dumps(header).encode('utf-8') + b"\n" + jpeg.tobytes())
+            for client in self.clients:
+                client.offer(record)
+
+    def _regions(self, image: np.ndarray, rois):
+        """產生要編碼的區域 (roi, 影像)：整張縮圖或各觸發區域的裁切"""
+        if not self.crop_mode:
+            if self.scale != 1.0:
+                image = cv2.resize(image, None, fx=self.scale, fy=self.scale,
+                                   interpolation=cv2.INTER_AREA)
+            yield None, image
+            return
+        height, width = image.shape[:2]
+        for x1, y1, x2, y2 in rois:
+            x1 = max(0, int(x1) - self.crop_margin)
+            y1 = max(0, int(y1) - self.crop_margin)
+            x2 = min(width, int(x2) + self.crop_margin)
+            y2 = min(height, int(y2) + self.crop_margin)
+            if x2 > x1 and y2 > y1:
+                yield [x1, y1, x2, y2], image[y1:y2, x1:x2]
+
+    def _take_tokens(self, nbytes: int) -> bool:
+        """位元率 token bucket，最多累積一秒的額度"""
+        if self.max_bitrate_kbps <= 0:
+            return True
+        rate = self.max_bitrate_kbps * 1000 / 8
+        with self._pending_lock:
+            now = time.monotonic()
+            self._tokens = min(rate, self._tokens + (now - self._tokens_time) * rate)
+            self._tokens_time = now
+            if self._tokens < nbytes:
+                return False
+            self._tokens -= nbytes
+            return True
+
+    def get_statistics(self) -> Dict:
+        """
+        獲取統計資訊
+
+        Returns:
+            dict: 統計資訊
+        """
+        clients = self.clients
+        return {
+            'viewers': len(clients),
+            'submitted': self.submitted,
+            'replaced': self.replaced,
+            'rate_limited': self.rate_limited,
+            'bitrate_limited': self.bitrate_limited,
+            'encoded': self.encoded,
+            'encode_ms': self.encode_ms.quantiles(),
+            'per_viewer': [
+                {'address': str(c.address), 'sent': c.sent, 'dropped': c.dropped, 'bytes': c.bytes_sent}
+                for c in clients
+            ]
+        }
+
+    def print_statistics(self) -> None:
+        """列印統計資訊"""
+        stats = self.get_statistics()
+        print("\n" + "=" * 60)
+        print("Frame Streamer Statistics")
+        print("=" * 60)
+        print(f"Viewers:           {stats['viewers']}")
+        print(f"Submitted:         {stats['submitted']}")
+        print(f"Replaced (latest): {stats['replaced']}")
+        print(f"FPS limited:       {stats['rate_limited']}")
+        print(f"Bitrate limited:   {stats['bitrate_limited']}")
+        print(f"Encoded:           {stats['encoded']} "
+              f"(p50 {stats['encode_ms'].get('p50', 0.0):.1f} ms, p99 {stats['encode_ms'].get('p99', 0.0):.1f} ms)")
+        for viewer in stats['per_viewer']:
+            print(f"  {viewer['address']}: sent={viewer['sent']} dropped={viewer['dropped']} "
+                  f"{viewer['bytes'] / 1e6:.1f} MB")
+        print("=" * 60 + "\n")
+
+    def stop(self) -> None:
+        """停止串流"""
+        self.is_running = False
+        if self.server_socket is not None:
+            try:
+                self.server_socket.close()
+            except OSError:
+                pass
+            self.server_socket = None
+        for client in self.clients:
+            client.close()
+        self.clients = []
+        with self._pending_lock:
+            pending, self._pending = self._pending, None
+        if pending is not None:
+            self._release_frame(pending)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+def receive_frames(host: str, port: int = 9100):
+    """
+    連上串流並逐筆產生影像
+
+    Yields:
+        Tuple[dict, np.ndarray]: (標頭, BGR 影像)
+    """
+    with socket.create_connection((host, port)) as sock:
+        while True:
+            prefix = read_exact(sock, LENGTH_PREFIX.size)
+            if prefix is None:
+                return
+            (length,) = LENGTH_PREFIX.unpack(prefix)
+            record = read_exact(sock, length)
+            if record is None:
+                return
+            header, _, jpeg = record.partition(b"\n")
+            image = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+            yield json.loads(header), image
+
+
+# 全域串流實例（與 tcp_server 相同的使用方式）
+frame_streamer = None
+
+
+def start_frame_streamer(host='0.0.0.0', port=9100, **kwargs):
+    """啟動影像串流（綁定失敗時不保留實例，可改用其他位址重試）"""
+    global frame_streamer
+    if frame_streamer is None:
+        frame_streamer = FrameStreamer(host, port, **kwargs)
+    if frame_streamer.is_running:
+        return True
+    if not frame_streamer.start():
+        frame_streamer = None
+        return False
+    return True
+
+
+def get_frame_streamer():
+    """獲取影像串流實例"""
+    return frame_streamer
+
+
+def stop_frame_streamer():
+    """停止影像串流"""
+    global frame_streamer
+    if frame_streamer:
+        frame_streamer.stop()
+        frame_streamer = None
+
+
+if __name__ == "__main__":
+    # 觀看端: python frame_streamer.py <host> [port]
+    import sys
+
+    viewer_host = sys.argv[1] if len(sys.argv) > 1 else '127.0.0.1'
+    viewer_port = int(sys.argv[2]) if len(sys.argv) > 2 else 9100
+    last = time.monotonic()
+    for frame_header, frame in receive_frames(viewer_host, viewer_port):
+        now = time.monotonic()
+        title = f"trigger {frame_header['trigger']}" + (f" roi {frame_header['roi']}" if frame_header['roi'] else "")
+        cv2.putText(frame, f"{title}  {1.0 / max(now - last, 1e-6):.1f} fps", (10, 25),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
+        last = now
+        cv2.imshow("NIRcam stream", frame)
+        if cv2.waitKey(1) & 0xFF == ord('q'):
+            break
+    cv2.destroyAllWindows()
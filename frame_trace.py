@@ -0,0 +1,361 @@
+# frame_trace.py
+"""
+逐帧延遲追蹤
+以 nFrameNum 為帧 ID，記錄每一帧在各階段的起訖時間（time.perf_counter_ns()）：
+曝光 → 取像 → 轉換 → 共享記憶體 → 推論 → 追蹤 → 觸發判斷 → 指令發送 → ACK
+可匯出 Chrome trace / Perfetto 的 JSON（chrome://tracing 或 ui.perfetto.dev 開啟），
+同一帧的各段以 flow 箭頭相連，跨執行緒（例如 ACK 接收執行緒）也能從曝光一路追到閥門
+
+- 記錄不加鎖：事件寫入預先配置的環形陣列（位置由 itertools.count 取得），每個階段的直方圖只由一個執行緒寫入
+- 直方圖為對數刻度（每 2 倍分 4 格，1 us ~ 約 70 s），分位數誤差約 ±10%
+- 同一執行緒上的階段不需要傳帧 ID：begin() 之後的 record() 自動歸到目前這一帧
+- 其他執行緒完成的階段（ACK）以 expect_ack(key) / ack(key) 對應回發送時的帧
+
+使用方式:
+    tracer = start_frame_tracer()
+    tracer.begin(frame_num, device_timestamp)          # 取得影像後（擷取執行緒）
+    start_ns = time.perf_counter_ns()
+    ...轉換...
+    tracer.record(STAGE_CONVERT, start_ns)
+    tracer.export_chrome_trace("trace.json", last_s=5.0)
+"""
+
+import itertools
+import json
+import math
+import threading
+import time
+from typing import Dict, Hashable, List, Optional
+
+import numpy as np
+
+# 階段（陣列中以編號記錄）
+STAGE_EXPOSURE = 0      # 曝光（裝置時間戳換算）到主機取得影像
+STAGE_GRAB = 1          # 取得影像後的複製與記錄
+STAGE_CONVERT = 2       # Bayer / Mono 轉 RGB
+STAGE_SHARE = 3         # 寫入共享記憶體
+STAGE_INFER = 4         # YOLO 推論
+STAGE_TRACK = 5         # 物體追蹤
+STAGE_TRIGGER = 6       # Two-Band Filter 觸發判斷（包含指令發送）
+STAGE_SEND = 7          # 氣吹指令編碼與送出
+STAGE_ACK = 8           # 指令送出到收到 ACK
+
+STAGE_NAMES = ('exposure', 'grab', 'convert', 'share', 'infer', 'track', 'trigger', 'tcp_send', 'ack')
+
+EVENT_DTYPE = np.dtype([
+    ('frame', '<i8'),           # 帧 ID（nFrameNum），-1 表示不屬於任何帧
+    ('stage', 'u1'),            # 階段編號
+    ('start_ns', '<i8'),        # 開始時間（time.perf_counter_ns()）
+    ('end_ns', '<i8'),          # 結束時間，0 表示此位置尚未寫入
+    ('tid', '<u8'),             # 執行緒 ID（threading.get_native_id()）
+    ('device_ts', '<u8'),       # 裝置時間戳（只在 grab 事件上記錄）
+])
+
+BINS_PER_OCTAVE = 4
+NUM_BINS = 26 * BINS_PER_OCTAVE     # 1 us * 2^26 ≈ 67 s
+DEFAULT_CAPACITY = 1 << 16
+MAX_PENDING_ACKS = 4096
+
+
+class FrameTracer:
+    """逐帧、逐階段的延遲記錄器"""
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY):
+        """
+        初始化追蹤器
+
+        Parameters:
+            capacity: 環形事件陣列的大小（事件數），約可保留 capacity / 9 帧
+        """
+        self.capacity = int(capacity)
+        self.events = np.zeros(self.capacity, dtype=EVENT_DTYPE)
+        self._counter = itertools.count()
+        self.histograms = np.zeros((len(STAGE_NAMES), NUM_BINS), dtype=np.int64)
+        self.max_ns = np.zeros(len(STAGE_NAMES), dtype=np.int64)
+        self.thread_names: Dict[int, str] = {}
+        self._local = threading.local()
+        self._pending_acks: Dict[Hashable, tuple] = {}     # key -> (帧 ID, 送出時間)
+        # time.monotonic() 與 perf_counter_ns() 的差（換算曝光時間用）
+        self._monotonic_offset_ns = time.perf_counter_ns() - int(time.monotonic() * 1e9)
+
+        print(f"[FrameTracer] Initialized: {self.capacity} events")
+
+    # ========== 記錄 ==========
+
+    def begin(self, frame_num: int, device_timestamp: Optional[int] = None) -> int:
+        """
+        開始一帧（取得影像的執行緒呼叫），之後同一執行緒的 record() 都歸到這一帧
+
+        Parameters:
+            frame_num: 帧 ID（nFrameNum）
+            device_timestamp: 裝置時間戳（tick），None 表示無
+
+        Returns:
+            int: 取得影像的時間（perf_counter_ns），也就是 STAGE_GRAB 的開始時間
+        """
+        now = time.perf_counter_ns()
+        self._local.frame = int(frame_num)
+        self._local.received_ns = now
+        self._local.device_ts = int(device_timestamp or 0)
+        return now
+
+    def current_frame(self) -> int:
+        """目前執行緒正在處理的帧 ID，-1 表示沒有"""
+        return getattr(self._local, 'frame', -1)
+
+    def record(self, stage: int, start_ns: int, end_ns: Optional[int] = None,
+               frame: Optional[int] = None) -> None:
+        """
+        記錄一個階段
+
+        Parameters:
+            stage: 階段編號（STAGE_*）
+            start_ns: 開始時間（perf_counter_ns）
+            end_ns: 結束時間，None 表示現在
+            frame: 帧 ID，None 表示目前執行緒的帧
+        """
+        if end_ns is None:
+            end_ns = time.perf_counter_ns()
+        if frame is None:
+            frame = getattr(self._local, 'frame', -1)
+        tid = threading.get_native_id()
+        if tid not in self.thread_names:
+            self.thread_names[tid] = threading.current_thread().name
+        device_ts = self._local.device_ts if stage == STAGE_GRAB else 0
+        index = next(self._counter) % self.capacity
+        self.events[index] = (frame, stage, start_ns, end_ns, tid, device_ts)
+
+        duration_ns = end_ns - start_ns
+        self.histograms[stage, _bin_for(duration_ns)] += 1
+        if duration_ns > self.max_ns[stage]:
+            self.max_ns[stage] = duration_ns
+
+    def record_exposure(self, capture_time: float) -> None:
+        """
+        記錄曝光到主機取得影像的時間（擷取執行緒，begin() 之後呼叫）
+
+        Parameters:
+            capture_time: 曝光時間（time.monotonic() 秒，通常由 BlowController.capture_time_for() 換算）
+        """
+        received_ns = getattr(self._local, 'received_ns', None)
+        if received_ns is None:
+            return
+        capture_ns = int(capture_time * 1e9) + self._monotonic_offset_ns
+        self.record(STAGE_EXPOSURE, min(capture_ns, received_ns), received_ns)
+
+    def expect_ack(self, key: Hashable, frame: Optional[int] = None) -> None:
+        """
+        記下一個等待 ACK 的發送（發送的執行緒呼叫）
+
+        Parameters:
+            key: 之後 ack() 使用的鍵（例如 blow_id 或 (位址, 序號)）
+            frame: 帧 ID，None 表示目前執行緒的帧
+        """
+        if frame is None:
+            frame = getattr(self._local, 'frame', -1)
+        if len(self._pending_acks) >= MAX_PENDING_ACKS:
+            # 丟棄最舊的（沒有回覆 ACK 的接收端不會讓字典無限成長）
+            try:
+                del self._pending_acks[next(iter(self._pending_acks))]
+            except (KeyError, RuntimeError, StopIteration):
+                pass
+        self._pending_acks[key] = (frame, time.perf_counter_ns())
+
+    def cancel_ack(self, key: Hashable) -> None:
+        """取消等待中的 ACK（例如訊息沒有送出）"""
+        self._pending_acks.pop(key, None)
+
+    def ack(self, key: Hashable) -> None:
+        """收到 ACK（任何執行緒），記錄從送出到 ACK 的時間"""
+        pending = self._pending_acks.pop(key, None)
+        if pending is not None:
+            self.record(STAGE_ACK, pending[1], frame=pending[0])
+
+    # ========== 查詢與匯出 ==========
+
+    def _snapshot(self) -> np.ndarray:
+        """已寫入的事件（依開始時間排序）"""
+        events = self.events.copy()
+        events = events[events['end_ns'] != 0]
+        return events[np.argsort(events['start_ns'], kind='stable')]
+
+    def get_frame_spans(self, frame_num: int) -> List[Dict]:
+        """
+        取得一帧的所有階段（仍在環形陣列中時）
+
+        Returns:
+            List[Dict]: [{'stage', 'start_ns', 'duration_ms', 'tid'}, ...]，依開始時間排序
+        """
+        events = self._snapshot()
+        events = events[events['frame'] == frame_num]
+        return [{
+            'stage': STAGE_NAMES[event['stage']],
+            'start_ns': int(event['start_ns']),
+            'duration_ms': (int(event['end_ns']) - int(event['start_ns'])) / 1e6,
+            'tid': int(event['tid'])
+        } for event in events]
+
+    def export_chrome_trace(self, filepath: str,
+                            last_s: Optional[float] = None,
+                            start_ns: Optional[int] = None,
+                            end_ns: Optional[int] = None,
+                            frames: Optional[List[int]] = None) -> int:
+        """
+        匯出 Chrome trace / Perfetto JSON
+
+        Parameters:
+            filepath: 輸出檔案路徑
+            last_s: 只匯出最近幾秒（以最新事件為準），None 表示不限
+            start_ns, end_ns: 只匯出與此區間（perf_counter_ns）重疊的事件
+            frames: 只匯出這些帧
+
+        Returns:
+            int: 匯出的事件數
+        """
+        events = self._snapshot()
+        if len(events) and last_s is not None:
+            latest = int(events['end_ns'].max())
+            start_ns = max(start_ns or 0, latest - int(last_s * 1e9))
+        if start_ns is not None:
+            events = events[events['end_ns'] >= start_ns]
+        if end_ns is not None:
+            events = events[events['start_ns'] <= end_ns]
+        if frames is not None:
+            events = events[np.isin(events['frame'], np.asarray(frames, dtype=np.int64))]
+
+        origin = int(events['start_ns'].min()) if len(events) else 0
+        device_ts = {int(e['frame']): int(e['device_ts']) for e in events if e['device_ts']}
+
+        trace = [{'name': 'process_name', 'ph': 'M', 'pid': 1, 'args': {'name': 'NIRcam pipeline'}}]
+        for tid in np.unique(events['tid']):
+            trace.append({'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': int(tid),
+                          'args': {'name': self.thread_names.get(int(tid), str(tid))}})
+
+        last_index: Dict[int, int] = {}
+        for event in events:
+            frame = int(event['frame'])
+            ts_us = (int(event['start_ns']) - origin) / 1000.0
+            args = {'frame': frame}
+            if frame in device_ts:
+                args['device_ts'] = device_ts[frame]
+            trace.append({
+                'name': STAGE_NAMES[event['stage']],
+                'cat': 'frame',
+                'ph': 'X',
+                'ts': ts_us,
+                'dur': (int(event['end_ns']) - int(event['start_ns'])) / 1000.0,
+                'pid': 1,
+                'tid': int(event['tid']),
+                'args': args
+            })
+            if frame >= 0:
+                # 同一帧的各段以 flow 事件相連（起點 s、中間 t，最後一段改為 f）
+                trace.append({'name': f'frame {frame}', 'cat': 'frame', 'ph': 's' if frame not in last_index else 't',
+                              'id': frame, 'ts': ts_us, 'pid': 1, 'tid': int(event['tid'])})
+                last_index[frame] = len(trace) - 1
+        for index in last_index.values():
+            if trace[index]['ph'] == 't':
+                trace[index]['ph'] = 'f'
+                trace[index]['bp'] = 'e'
+
+        with open(filepath, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, f)
+        print(f"[FrameTracer] Exported {len(events)} events "
+              f"({len(last_index)} frames) to {filepath}")
+        return len(events)
+
+    def quantiles(self, stage: int, points=(0.5, 0.99, 0.999)) -> Dict[str, float]:
+        """
+        由直方圖估計分位數
+
+        Returns:
+            dict: {'p50': ..., 'p99': ..., 'p99.9': ..., 'max': ...}（毫秒），無樣本時為空
+        """
+        counts = self.histograms[stage]
+        total = int(counts.sum())
+        if total == 0:
+            return {}
+        cumulative = np.cumsum(counts)
+        max_ms = self.max_ns[stage] / 1e6
+        result = {}
+        for p in points:
+            index = int(np.searchsorted(cumulative, p * total))
+            result[f"p{p * 100:g}"] = min(_bin_upper_ms(index), max_ms)
+        result['max'] = max_ms
+        return result
+
+    def get_statistics(self) -> Dict:
+        """
+        獲取統計資訊
+
+        Returns:
+            dict: 每個階段的樣本數與延遲分位數（毫秒）
+        """
+        stats = {}
+        for stage, name in enumerate(STAGE_NAMES):
+            count = int(self.histograms[stage].sum())
+            if count:
+                stats[name] = {'count': count, **self.quantiles(stage)}
+        stats['pending_acks'] = len(self._pending_acks)
+        return stats
+
+    def print_statistics(self) -> None:
+        """列印統計資訊"""
+        stats = self.get_statistics()
+        print("\n" + "=" * 60)
+        print("Frame Trace Statistics (ms)")
+        print("=" * 60)
+        for name in STAGE_NAMES:
+            stage = stats.get(name)
+            if stage is None:
+                continue
+            print(f"{name:<10} n={stage['count']:<8} p50={stage['p50']:.2f} "
+                  f"p99={stage['p99']:.2f} p99.9={stage['p99.9']:.2f} max={stage['max']:.2f}")
+        print(f"Pending ACKs: {stats['pending_acks']}")
+        print("=" * 60 + "\n")
+
+    def reset(self) -> None:
+        """清除事件與直方圖"""
+        self.events[:] = 0
+        self.histograms[:] = 0
+        self.max_ns[:] = 0
+        self._pending_acks.clear()
+
+
+def _bin_for(duration_ns: int) -> int:
+    """延遲對應的直方圖格（對數刻度）"""
+    if duration_ns < 1000:
+        return 0
+    return min(NUM_BINS - 1, int(math.log2(duration_ns / 1000.0) * BINS_PER_OCTAVE) + 1)
+
+
+def _bin_upper_ms(index: int) -> float:
+    """直方圖格的上緣（毫秒）"""
+    return 2.0 ** (index / BINS_PER_OCTAVE) / 1000.0
+
+
+# 全域追蹤器實例（None 表示不追蹤，各階段只多一次判斷）
+frame_tracer = None
+
+
+def start_frame_tracer(capacity=DEFAULT_CAPACITY):
+    """啟動逐帧延遲追蹤"""
+    global frame_tracer
+    if frame_tracer is None:
+        frame_tracer = FrameTracer(capacity)
+    return frame_tracer
+
+
+def get_frame_tracer():
+    """獲取追蹤器實例"""
+    return frame_tracer
+
+
+def stop_frame_tracer(export_path=None):
+    """停止追蹤（可選擇先匯出 Chrome trace）"""
+    global frame_tracer
+    if frame_tracer:
+        if export_path:
+            frame_tracer.export_chrome_trace(export_path)
+        frame_tracer.print_statistics()
+        frame_tracer = None
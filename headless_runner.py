@@ -0,0 +1,729 @@
+# headless_runner.py
+"""
+無介面的生產執行入口
+不匯入任何 Qt 模組，依設定檔依序建立 TCP 伺服器、YOLO 模型、共享記憶體發送器、相機、追蹤器與 Two-Band Filter，
+啟動順序固定且每一步失敗都會以非零結束碼退出（不再依賴 QTimer 延遲初始化）
+
+健康指標以 Prometheus 文字格式輸出於 http://127.0.0.1:9108/metrics（metrics 區段）
+狀態透過本機控制 socket 查詢（每行一個指令，回應一行 JSON）:
+    status                     完整狀態與統計
+    trigger                    軟體觸發一次
+    ai <conf> <imgsz>          調整 AI 參數
+    share on|off               開關共享記憶體自動發送
+    trace <file> [秒數]        匯出最近幾秒的逐帧延遲追蹤（Chrome trace / Perfetto JSON）
+    stop                       停止並退出
+
+用法:
+    python headless_runner.py --config headless_config.json
+    python headless_runner.py --config headless_config.json --replay recordings/line3
+    python headless_runner.py --config headless_config.json --replay recordings/line3 --startup-benchmark
+    echo status | nc 127.0.0.1 8877
+"""
+
+import startup_timing  # 第一個匯入：啟動時間的起點
+
+import argparse
+import json
+import signal
+import socket
+import sys
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Dict, Optional
+
+import CamOperation_class as cam_module
+import pipeline_logging
+from CamOperation_class import (CameraOperation, set_ai_parameters_func,
+                                set_auto_share, set_raw_frame_recorder, set_shared_memory_sender,
+                                shutdown_image_writer)
+from frame_streamer import start_frame_streamer, stop_frame_streamer
+from frame_budget import (get_frame_budget_watchdog, parse_ladder, start_frame_budget_watchdog,
+                          stop_frame_budget_watchdog)
+from frame_trace import get_frame_tracer, start_frame_tracer, stop_frame_tracer
+from imgsz_controller import get_imgsz_controller, start_imgsz_controller, stop_imgsz_controller
+from model_loader import get_model_loader, start_model_loader, stop_model_loader
+from MvImport.CameraParams_header import *
+from MvImport.MvCameraControl_class import *
+from MvImport.MvErrorDefine_const import *
+from pipeline_logging import configure_pipeline_logging, get_logging_statistics, stop_pipeline_logging
+from pipeline_metrics import metrics, start_metrics_server, stop_metrics_server
+from raw_frame_log import RawFrameLog, RawFrameRecorder, ReplayCamera
+from shared_memory_sender import SharedMemorySender
+from lazy_import import prefetch_modules
+from tcp_server import get_tcp_server, start_tcp_server, stop_tcp_server
+
+startup_timing.mark(startup_timing.IMPORTS)
+
+
+@dataclass
+class CameraSection:
+    """相機設定"""
+    device_index: int = 0                   # 列舉結果中的相機索引
+    trigger_source: Optional[str] = None    # None: 連續模式；"Software" / "Line0" / "Line1": 觸發模式
+    frame_rate: Optional[float] = None      # None 表示不修改相機設定
+    exposure_us: Optional[float] = None
+    gain: Optional[float] = None
+    replay_dir: Optional[str] = None        # 指定時以原始帧記錄取代相機
+    replay_realtime: bool = True            # 重播時依原始時間間隔送帧
+    replay_loop: bool = False
+    record_dir: Optional[str] = None        # 指定時記錄原始 Bayer 帧
+
+
+@dataclass
+class ModelSection:
+    """YOLO 模型設定"""
+    weights: Optional[str] = None           # None 表示不載入模型（只擷取與分享影像）
+    conf_thres: float = 0.4
+    imgsz: int = 1280
+    warm_up_runs: int = 2                   # 每個推論尺寸的暖機次數
+    ready_timeout_s: float = 300.0          # 等待模型載入與暖機完成的上限
+
+
+@dataclass
+class TriggerSection:
+    """Two-Band Filter 觸發系統設定"""
+    enabled: bool = True
+    lens_type: str = "12mm"
+    nozzle_distance_px: Optional[float] = None
+
+
+@dataclass
+class TcpSection:
+    """LabVIEW TCP 伺服器設定"""
+    enabled: bool = True
+    host: str = "localhost"
+    port: int = 8888
+
+
+@dataclass
+class SharedMemorySection:
+    """共享記憶體發送器設定"""
+    enabled: bool = False
+    host: Optional[str] = "127.0.0.1"      # None 表示僅同機門鈴模式（需指定 ring_name）
+    port: int = 9999
+    ring_name: Optional[str] = None
+    num_slots: int = 8
+    auto_share: bool = True
+
+
+@dataclass
+class StreamerSection:
+    """遠端影像串流設定"""
+    enabled: bool = False
+    host: str = '0.0.0.0'
+    port: int = 9100
+
+
+@dataclass
+class ControlSection:
+    """本機控制 socket 設定"""
+    host: str = "127.0.0.1"
+    port: int = 8877
+    status_interval_s: float = 30.0         # 定期在主控台輸出狀態的間隔，0 表示不輸出
+
+
+@dataclass
+class BudgetSection:
+    """帧預算監控與降載階梯設定"""
+    enabled: bool = True
+    ladder: Optional[list] = None           # 例如 ["save", {"action": "imgsz", "value": 960}]，None 使用預設階梯
+    window: int = 30                        # 評估的帧數
+    headroom_ratio: float = 0.7             # 低於預算的這個倍數才恢復
+    min_frames_in_zone: int = 2             # 物體在觸發區內至少要處理的帧數
+    fixed_budget_ms: Optional[float] = None # 固定的帧預算，None 表示依相機帧間隔與傳送帶速度推算
+
+
+@dataclass
+class AdaptiveImgszSection:
+    """推論尺寸自動調整設定（model.imgsz 為上限）"""
+    enabled: bool = False
+    levels: list = field(default_factory=lambda: [640, 960, 1280])   # 預先暖機的推論尺寸
+    target_ms: Optional[float] = None       # 目標推論延遲，None 表示帧預算的 budget_fraction 倍
+    budget_fraction: float = 0.6            # 推論可佔帧預算的比例
+    window: int = 30                        # 評估的帧數
+    headroom_ratio: float = 0.7             # 上一級預估延遲低於目標的這個倍數才升級
+    conf_drop: float = 0.08                 # 平均信心比上一級低這麼多時升級
+
+
+@dataclass
+class MetricsSection:
+    """Prometheus 指標端點設定"""
+    enabled: bool = True
+    host: str = "127.0.0.1"
+    port: int = 9108
+
+
+@dataclass
+class TraceSection:
+    """逐帧延遲追蹤設定"""
+    enabled: bool = False
+    capacity: int = 65536                   # 環形事件陣列大小（每帧約 9 個事件）
+    export_on_stop: Optional[str] = None    # 停止時匯出 Chrome trace 的路徑
+
+
+@dataclass
+class LoggingSection:
+    """各類別的日誌等級、速率上限與取樣"""
+    levels: Dict[str, str] = field(default_factory=dict)          # 例如 {"TrackManager": "WARNING"}
+    rate_limits: Dict[str, float] = field(default_factory=dict)   # 每個訊息模板每秒最多則數
+    sampling: Dict[str, int] = field(default_factory=dict)        # 每 N 則保留 1 則
+
+
+@dataclass
+class HeadlessConfig:
+    """無介面執行設定（JSON 設定檔的每個區段對應一個欄位）"""
+    camera: CameraSection = field(default_factory=CameraSection)
+    model: ModelSection = field(default_factory=ModelSection)
+    trigger: TriggerSection = field(default_factory=TriggerSection)
+    tcp: TcpSection = field(default_factory=TcpSection)
+    shared_memory: SharedMemorySection = field(default_factory=SharedMemorySection)
+    streamer: StreamerSection = field(default_factory=StreamerSection)
+    control: ControlSection = field(default_factory=ControlSection)
+    logging: LoggingSection = field(default_factory=LoggingSection)
+    trace: TraceSection = field(default_factory=TraceSection)
+    metrics: MetricsSection = field(default_factory=MetricsSection)
+    budget: BudgetSection = field(default_factory=BudgetSection)
+    adaptive_imgsz: AdaptiveImgszSection = field(default_factory=AdaptiveImgszSection)
+
+
+def load_config(filepath: Optional[str]) -> HeadlessConfig:
+    """
+    載入設定檔（未列出的欄位使用預設值）
+
+    Parameters:
+        filepath: JSON 設定檔路徑，None 表示全部使用預設值
+
+    Returns:
+        HeadlessConfig: 設定
+    """
+    config = HeadlessConfig()
+    if filepath is None:
+        return config
+    with open(filepath, 'r', encoding='utf-8') as f:
+        config_dict = json.load(f)
+    for section_name, values in config_dict.items():
+        section = getattr(config, section_name, None)
+        if section is None:
+            raise ValueError(f"Unknown config section '{section_name}'")
+        for key, value in values.items():
+            if not hasattr(section, key):
+                raise ValueError(f"Unknown config key '{section_name}.{key}'")
+            setattr(section, key, value)
+    print(f"[Config] Loaded from {filepath}")
+    return config
+
+
+class StartupError(RuntimeError):
+    """啟動步驟失敗"""
+
+
+class HeadlessRunner:
+    """依設定檔建立並執行整條生產管線"""
+
+    def __init__(self, config: HeadlessConfig):
+        self.config = config
+        self.camera: Optional[CameraOperation] = None
+        self.sender: Optional[SharedMemorySender] = None
+        self.recorder: Optional[RawFrameRecorder] = None
+        self.control_socket: Optional[socket.socket] = None
+        self.conf_thres = config.model.conf_thres
+        self.imgsz = config.model.imgsz
+        self.stop_event = threading.Event()
+        self.start_time = None
+        self.steps = []
+        print("[HeadlessRunner] Initialized")
+
+    # ========== 啟動 ==========
+
+    def start(self) -> None:
+        """
+        依固定順序啟動所有元件
+
+        Raises:
+            StartupError: 任一步驟失敗
+        """
+        self.start_time = time.monotonic()
+        log_config = self.config.logging
+        configure_pipeline_logging(log_config.levels, log_config.rate_limits, log_config.sampling)
+        if self.config.trace.enabled:
+            start_frame_tracer(self.config.trace.capacity)
+        budget = self.config.budget
+        if budget.enabled:
+            start_frame_budget_watchdog(
+                parse_ladder(budget.ladder) if budget.ladder is not None else None,
+                window=budget.window,
+                headroom_ratio=budget.headroom_ratio,
+                min_frames_in_zone=budget.min_frames_in_zone,
+                fixed_budget_ms=budget.fixed_budget_ms
+            )
+        adaptive = self.config.adaptive_imgsz
+        if adaptive.enabled:
+            start_imgsz_controller(
+                adaptive.levels,
+                target_ms=adaptive.target_ms,
+                budget_fraction=adaptive.budget_fraction,
+                window=adaptive.window,
+                headroom_ratio=adaptive.headroom_ratio,
+                conf_drop=adaptive.conf_drop
+            )
+        if self.config.trigger.enabled:
+            # 觸發系統（scipy）在背景匯入，與模型載入、相機開啟同時進行
+            prefetch_modules('simple_tracker', 'two_band_filter')
+        # 控制 socket 與指標端點在開始採集之前綁定：埠被佔用時相機與閥門都還沒啟動
+        steps = [
+            ("TCP 伺服器", self._start_tcp),
+            ("控制 socket", self._start_control_socket),
+            ("指標端點", self._start_metrics),
+            ("YOLO 模型", self._load_model),
+            ("共享記憶體", self._start_shared_memory),
+            ("遠端串流", self._start_streamer),
+            ("相機", self._open_camera),
+            ("觸發系統", self._start_trigger_system),
+            ("模型就緒", self._wait_model_ready),
+            ("開始採集", self._start_grabbing),
+        ]
+        print("=" * 60)
+        for i, (name, step) in enumerate(steps, 1):
+            print(f"[步驟 {i}/{len(steps)}] {name}...")
+            step_start = time.perf_counter()
+            result = step()
+            elapsed_ms = (time.perf_counter() - step_start) * 1000.0
+            self.steps.append({'step': name, 'result': result, 'ms': round(elapsed_ms, 1)})
+            print(f"[成功] {name}: {result} ({elapsed_ms:.0f} ms)")
+        print("=" * 60)
+        startup_timing.mark(startup_timing.PIPELINE_STARTED)
+        print(f"啟動完成 ({(time.monotonic() - self.start_time):.1f} s)")
+
+    def _start_metrics(self) -> str:
+        section = self.config.metrics
+        if not section.enabled:
+            return "停用"
+        metrics.register_collector('headless', self._collect_metrics)
+        try:
+            server = start_metrics_server(section.host, section.port)
+        except OSError as e:
+            raise StartupError(f"Metrics endpoint failed to bind {section.host}:{section.port}: {e}")
+        return f"http://{server.host}:{server.port}/metrics"
+
+    def _collect_metrics(self) -> list:
+        """抓取時讀取的瞬時值：佇列深度、佇列丟棄數與共享記憶體消費者 lag"""
+        depth, dropped = [], []
+        tcp_server = get_tcp_server()
+        if tcp_server is not None:
+            for subscriber in list(tcp_server.subscribers):
+                status = subscriber.get_status()
+                labels = {'queue': f"{status['role']}_{status['address'][0]}:{status['address'][1]}"}
+                depth.append((labels, status['queued']))
+                dropped.append((labels, status['dropped']))
+        writer = cam_module.image_writer
+        if writer is not None:
+            depth.append(({'queue': 'image_writer'}, writer.queue.qsize()))
+            dropped.append(({'queue': 'image_writer'}, writer.dropped))
+        if self.recorder is not None:
+            depth.append(({'queue': 'raw_recorder'}, self.recorder.queue.qsize()))
+            dropped.append(({'queue': 'raw_recorder'}, self.recorder.dropped))
+        logs = pipeline_logging.pipeline_logging
+        if logs is not None:
+            depth.append(({'queue': 'logging'}, logs.queue.qsize()))
+            dropped.append(({'queue': 'logging'}, logs.queue_handler.dropped))
+        families = [
+            ('nircam_queue_depth', 'gauge', 'Items waiting in each pipeline queue', depth),
+            ('nircam_queue_dropped_total', 'counter', 'Items dropped because a queue was full', dropped),
+        ]
+        if self.sender is not None:
+            lag, consumer_dropped = [], []
+            if self.sender.ring is not None:
+                for consumer in self.sender.ring.consumer_metrics():
+                    labels = {'consumer': str(consumer['consumer']), 'pid': str(consumer['pid']),
+                              'policy': consumer['policy']}
+                    lag.append((labels, consumer['lag']))
+                    consumer_dropped.append((labels, consumer['dropped']))
+            families += [
+                ('nircam_shm_consumer_lag_frames', 'gauge', 'Frames published but not yet read by each consumer', lag),
+                ('nircam_shm_consumer_dropped_total', 'counter', 'Frames each consumer skipped', consumer_dropped),
+                ('nircam_shm_frames_dropped_total', 'counter', 'Frames not published because every slot was leased',
+                 [({}, self.sender.dropped_frames)]),
+            ]
+        return families
+
+    def _start_tcp(self) -> str:
+        tcp = self.config.tcp
+        if not tcp.enabled:
+            return "停用"
+        if not start_tcp_server(tcp.host, tcp.port):
+            raise StartupError(f"TCP server failed to start on {tcp.host}:{tcp.port}")
+        return f"{tcp.host}:{tcp.port}"
+
+    def _load_model(self) -> str:
+        weights = self.config.model.weights
+        if not weights:
+            return "未設定（不進行辨識）"
+        # 背景載入，與相機開啟同時進行；「模型就緒」步驟再等待暖機完成
+        set_ai_parameters_func(lambda: (self.conf_thres, self.imgsz))
+        loader = start_model_loader(runs=self.config.model.warm_up_runs, notify=self._on_model_ready)
+        loader.load(weights, self.conf_thres, self.imgsz)
+        return f"{weights}（背景載入中）"
+
+    def _on_model_ready(self, success: bool, message: str) -> None:
+        """背景載入或重新暖機結束（載入執行緒呼叫）：換上之後才改用暖機時的影像大小"""
+        loader = get_model_loader()
+        if success and loader is not None and loader.imgsz is not None:
+            self.imgsz = loader.imgsz
+
+    def _start_shared_memory(self) -> str:
+        shm = self.config.shared_memory
+        if not shm.enabled:
+            return "停用"
+        self.sender = SharedMemorySender(shm.host, shm.port, num_slots=shm.num_slots, ring_name=shm.ring_name)
+        if not self.sender.is_connected():
+            raise StartupError(f"Shared-memory receiver not reachable at {shm.host}:{shm.port}")
+        set_shared_memory_sender(self.sender)
+        set_auto_share(shm.auto_share)
+        return f"{shm.host}:{shm.port}" if shm.host else f"門鈴 {shm.ring_name}"
+
+    def _start_streamer(self) -> str:
+        streamer = self.config.streamer
+        if not streamer.enabled:
+            return "停用"
+        if not start_frame_streamer(streamer.host, streamer.port):
+            raise StartupError(f"Frame streamer failed to start on {streamer.host}:{streamer.port}")
+        return f"{streamer.host}:{streamer.port}"
+
+    def _open_camera(self) -> str:
+        cam = self.config.camera
+        if cam.replay_dir:
+            log = RawFrameLog(cam.replay_dir)
+            if not len(log):
+                raise StartupError(f"Replay log '{cam.replay_dir}' has no frames")
+            self.camera = CameraOperation(ReplayCamera(log, realtime=cam.replay_realtime, loop=cam.replay_loop),
+                                          None, 0)
+            description = f"重播 {cam.replay_dir} ({len(log)} 帧)"
+        else:
+            device_list = MV_CC_DEVICE_INFO_LIST()
+            ret = MvCamera.MV_CC_EnumDevices(MV_GIGE_DEVICE | MV_USB_DEVICE, device_list)
+            if ret != 0:
+                raise StartupError(f"Enum devices failed, ret = {cam_module.To_hex_str(ret)}")
+            if device_list.nDeviceNum <= cam.device_index:
+                raise StartupError(f"Camera {cam.device_index} not found ({device_list.nDeviceNum} devices)")
+            self.camera = CameraOperation(MvCamera(), device_list, cam.device_index)
+            description = f"裝置 {cam.device_index}/{device_list.nDeviceNum}"
+
+        ret = self.camera.Open_device()
+        if ret != 0:
+            raise StartupError(f"Open device failed, ret = {cam_module.To_hex_str(ret)}")
+
+        if cam.trigger_source:
+            ret = self.camera.Set_trigger_mode(True, cam.trigger_source)
+        else:
+            ret = self.camera.Set_trigger_mode(False)
+        if ret != 0:
+            raise StartupError(f"Set trigger mode failed, ret = {cam_module.To_hex_str(ret)}")
+
+        if cam.frame_rate is not None or cam.exposure_us is not None or cam.gain is not None:
+            self.camera.Get_parameter()
+            ret = self.camera.Set_parameter(
+                cam.frame_rate if cam.frame_rate is not None else self.camera.frame_rate,
+                cam.exposure_us if cam.exposure_us is not None else self.camera.exposure_time,
+                cam.gain if cam.gain is not None else self.camera.gain)
+            if ret != 0:
+                raise StartupError(f"Set parameters failed, ret = {cam_module.To_hex_str(ret)}")
+
+        if cam.record_dir:
+            self.recorder = RawFrameRecorder(cam.record_dir, timestamp_tick_hz=self.camera.get_timestamp_tick_hz())
+            set_raw_frame_recorder(self.recorder)
+        return description
+
+    def _image_size(self):
+        """從相機讀取影像寬高"""
+        size = []
+        for name in ("Width", "Height"):
+            value = MVCC_INTVALUE_EX()
+            ret = self.camera.obj_cam.MV_CC_GetIntValueEx(name, value)
+            if ret != MV_OK:
+                raise StartupError(f"Get {name} failed, ret = {cam_module.To_hex_str(ret)}")
+            size.append(int(value.nCurValue))
+        return size
+
+    def _start_trigger_system(self) -> str:
+        trigger = self.config.trigger
+        if not trigger.enabled:
+            return "停用"
+        width, height = self._image_size()
+        if not self.camera.initialize_trigger_system(width, height, trigger.lens_type,
+                                                     nozzle_distance_px=trigger.nozzle_distance_px):
+            raise StartupError("Trigger system initialization failed")
+        return f"{trigger.lens_type}, {width}x{height}"
+
+    def _wait_model_ready(self) -> str:
+        loader = get_model_loader()
+        if loader is None:
+            return "未設定（不進行辨識）"
+        if not loader.wait(self.config.model.ready_timeout_s):
+            raise StartupError(loader.error or
+                               f"Model not ready after {self.config.model.ready_timeout_s:.0f} s")
+        # 暖機影像尺寸在相機開啟前未知；解析度不同時以相機尺寸再暖機一次
+        width, height = self._image_size()
+        if loader.image_shape[:2] != (height, width):
+            loader.set_image_shape(height, width)
+            loader.rewarm(self.conf_thres, self.imgsz)
+            if not loader.wait(self.config.model.ready_timeout_s):
+                raise StartupError(loader.error or "Model warm-up at camera resolution failed")
+        stats = loader.get_statistics()
+        return f"load {stats['load_ms']:.0f} ms, warm-up {stats['warm_up_ms']:.0f} ms"
+
+    def _start_grabbing(self) -> str:
+        # 沒有 GUI 時不傳入訊號物件，工作執行緒略過所有顯示相關的處理
+        ret = self.camera.Start_grabbing(None)
+        if ret != 0:
+            raise StartupError(f"Start grabbing failed, ret = {cam_module.To_hex_str(ret)}")
+        return "採集中"
+
+    def _start_control_socket(self) -> str:
+        control = self.config.control
+        self.control_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.control_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            self.control_socket.bind((control.host, control.port))
+            self.control_socket.listen(4)
+        except OSError as e:
+            self.control_socket.close()
+            self.control_socket = None
+            raise StartupError(f"Control socket failed to bind {control.host}:{control.port}: {e}")
+        threading.Thread(target=self._control_loop, name="HeadlessControl", daemon=True).start()
+        return f"{control.host}:{control.port}"
+
+    # ========== 控制 socket ==========
+
+    def _control_loop(self) -> None:
+        while not self.stop_event.is_set():
+            try:
+                conn, _ = self.control_socket.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve_control, args=(conn,), daemon=True).start()
+
+    def _serve_control(self, conn: socket.socket) -> None:
+        with conn, conn.makefile('rwb') as stream:
+            for raw_line in stream:
+                line = raw_line.decode('utf-8', errors='replace').strip()
+                if not line:
+                    continue
+                try:
+                    reply = self.handle_command(line)
+                except Exception as e:
+                    reply = {'ok': False, 'error': str(e)}
+                stream.write((json.dumps(reply, default=str, ensure_ascii=False) + "\n").encode('utf-8'))
+                stream.flush()
+
+    def handle_command(self, line: str) -> Dict:
+        """
+        執行一個控制指令
+
+        Parameters:
+            line: 指令列（例如 "status"、"ai 0.5 960"）
+
+        Returns:
+            dict: 回應
+        """
+        parts = line.split()
+        command, args = parts[0].lower(), parts[1:]
+        if command == 'status':
+            return {'ok': True, 'status': self.get_status()}
+        if command == 'trigger':
+            if self.camera is None:
+                return {'ok': False, 'error': 'camera not open'}
+            return {'ok': self.camera.Trigger_once() == MV_OK}
+        if command == 'ai' and len(args) == 2:
+            conf_thres, imgsz = float(args[0]), int(args[1])
+            loader = get_model_loader()
+            if imgsz != self.imgsz and loader is not None and loader.busy:
+                return {'ok': False, 'error': 'model is loading or warming up'}
+            # 新尺寸先以另一個模型實例暖機，完成後才由 _on_model_ready 改用
+            warming = imgsz != self.imgsz and loader is not None and loader.rewarm(conf_thres, imgsz)
+            self.conf_thres = conf_thres
+            if not warming:
+                self.imgsz = imgsz
+            return {'ok': True, 'conf_thres': self.conf_thres, 'imgsz': self.imgsz, 'warming': bool(warming),
+                    'pending_imgsz': imgsz if warming else None}
+        if command == 'share' and args and args[0] in ('on', 'off'):
+            if self.sender is None:
+                return {'ok': False, 'error': 'shared memory not enabled'}
+            set_auto_share(args[0] == 'on')
+            return {'ok': True, 'auto_share': args[0] == 'on'}
+        if command == 'trace' and args:
+            tracer = get_frame_tracer()
+            if tracer is None:
+                return {'ok': False, 'error': 'frame trace not enabled'}
+            last_s = float(args[1]) if len(args) > 1 else None
+            return {'ok': True, 'events': tracer.export_chrome_trace(args[0], last_s=last_s)}
+        if command == 'stop':
+            self.stop_event.set()
+            return {'ok': True}
+        return {'ok': False, 'error': f"unknown command '{line}'"}
+
+    # ========== 狀態 ==========
+
+    def get_status(self) -> Dict:
+        """
+        獲取所有元件的狀態
+
+        Returns:
+            dict: 狀態
+        """
+        status = {
+            'uptime_s': time.monotonic() - self.start_time if self.start_time else 0.0,
+            'startup': self.steps,
+            'ai': {'conf_thres': self.conf_thres, 'imgsz': self.imgsz},
+        }
+        loader = get_model_loader()
+        if loader is not None:
+            status['model'] = loader.get_statistics()
+        if self.camera is not None:
+            frame_info = self.camera.st_frame_info
+            status['camera'] = {
+                'open': self.camera.b_open_device,
+                'grabbing': self.camera.b_start_grabbing,
+                'last_frame_num': frame_info.nFrameNum if frame_info is not None else None,
+                'frame_pools': self.camera.frame_pools.get_statistics(),
+            }
+            status['trigger_system'] = self.camera.get_trigger_statistics()
+        tcp_server = get_tcp_server()
+        if tcp_server is not None:
+            status['tcp'] = tcp_server.get_connection_status()
+        if self.sender is not None:
+            status['shared_memory'] = self.sender.get_statistics()
+        if self.recorder is not None:
+            status['raw_recorder'] = self.recorder.get_statistics()
+        status['logging'] = get_logging_statistics()
+        status['startup_timing'] = startup_timing.get_startup_statistics()
+        tracer = get_frame_tracer()
+        if tracer is not None:
+            status['latency_ms'] = tracer.get_statistics()
+        watchdog = get_frame_budget_watchdog()
+        if watchdog is not None:
+            status['frame_budget'] = watchdog.get_statistics()
+        controller = get_imgsz_controller()
+        if controller is not None:
+            status['adaptive_imgsz'] = controller.get_statistics()
+        return status
+
+    # ========== 執行與停止 ==========
+
+    def run(self) -> None:
+        """執行直到收到 stop 指令或 SIGINT / SIGTERM"""
+        interval = self.config.control.status_interval_s
+        next_report = time.monotonic() + interval
+        # 以短間隔等待，讓 Windows 上的 Ctrl+C 也能及時處理
+        while not self.stop_event.wait(1.0):
+            if interval <= 0 or time.monotonic() < next_report:
+                continue
+            next_report += interval
+            status = self.get_status()
+            camera = status.get('camera', {})
+            tcp = status.get('tcp', {})
+            print(f"[HeadlessRunner] uptime {status['uptime_s']:.0f}s, "
+                  f"frame {camera.get('last_frame_num')}, "
+                  f"LabVIEW {'connected' if tcp.get('client_connected') else 'not connected'}, "
+                  f"triggers {tcp.get('trigger_count', 0)}")
+
+    def run_startup_benchmark(self, timeout_s: float) -> bool:
+        """
+        等待第一次推論（未設定模型時等待第一帧）後列印啟動時間報告
+
+        Parameters:
+            timeout_s: 最長等待秒數
+
+        Returns:
+            bool: 是否在時限內到達
+        """
+        milestone = startup_timing.FIRST_INFERENCE if self.config.model.weights else startup_timing.FIRST_FRAME
+        deadline = time.monotonic() + timeout_s
+        while startup_timing.elapsed_ms(milestone) is None:
+            if self.stop_event.is_set() or time.monotonic() > deadline:
+                print(f"[HeadlessRunner] Startup benchmark: {milestone} not reached within {timeout_s:.0f} s")
+                startup_timing.print_startup_report()
+                return False
+            time.sleep(0.01)
+        if milestone == startup_timing.FIRST_FRAME:
+            startup_timing.print_startup_report()   # 第一次推論時擷取迴圈已自行列印
+        return True
+
+    def stop(self) -> None:
+        """依啟動的相反順序停止"""
+        print("[HeadlessRunner] Stopping...")
+        self.stop_event.set()
+        if self.control_socket is not None:
+            self.control_socket.close()
+        if self.camera is not None:
+            if self.camera.b_start_grabbing:
+                self.camera.Stop_grabbing()
+            if self.camera.b_open_device:
+                self.camera.Close_device()
+            self.camera.print_trigger_statistics()
+        if self.recorder is not None:
+            set_raw_frame_recorder(None)
+            self.recorder.close()
+            self.recorder.print_statistics()
+        stop_frame_streamer()
+        if self.sender is not None:
+            set_auto_share(False)
+            set_shared_memory_sender(None)
+            self.sender.close()
+        shutdown_image_writer()
+        stop_tcp_server()
+        stop_frame_tracer(self.config.trace.export_on_stop)
+        stop_frame_budget_watchdog()
+        stop_imgsz_controller()
+        stop_model_loader()
+        metrics.unregister_collector('headless')
+        stop_metrics_server()
+        print("[HeadlessRunner] Stopped")
+        stop_pipeline_logging()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless NIR camera sorting pipeline")
+    parser.add_argument("--config", default=None, help="JSON config file")
+    parser.add_argument("--replay", default=None, help="Replay a raw frame log instead of a camera")
+    parser.add_argument("--record", default=None, help="Record raw Bayer frames to this directory")
+    parser.add_argument("--print-config", action="store_true", help="Print the effective config and exit")
+    parser.add_argument("--startup-benchmark", action="store_true",
+                        help="Exit after the first inference (or first frame) and report startup timing")
+    parser.add_argument("--benchmark-timeout", type=float, default=300.0)
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    if args.replay:
+        config.camera.replay_dir = args.replay
+    if args.record:
+        config.camera.record_dir = args.record
+    if args.print_config:
+        print(json.dumps(asdict(config), indent=4, ensure_ascii=False))
+        return 0
+
+    runner = HeadlessRunner(config)
+    # SIGTERM（服務管理員停止）與 Ctrl+C 都走同一個停止流程
+    signal.signal(signal.SIGINT, lambda *_: runner.stop_event.set())
+    signal.signal(signal.SIGTERM, lambda *_: runner.stop_event.set())
+    try:
+        runner.start()
+    except StartupError as e:
+        print(f"[錯誤] 啟動失敗: {e}")
+        runner.stop()
+        return 1
+    except BaseException:
+        # 其他例外（設定錯誤、Ctrl+C 等）也要停止已啟動的採集，擷取執行緒不是 daemon
+        runner.stop()
+        raise
+    if args.startup_benchmark:
+        reached = runner.run_startup_benchmark(args.benchmark_timeout)
+        runner.stop()
+        return 0 if reached else 1
+    runner.run()
+    runner.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,26 +1,47 @@
 """
 共享內存接收端程式 (配合 SharedMemorySender 使用)
-- 透過 TCP 接收 metadata (共享內存名稱、shape、dtype、trigger_num)
-- attach 到共享內存讀取影像
+- 透過 TCP 接收環形緩衝區名稱與每帧的槽位編號（行分幀或長度分幀）
+- 持續連上環形緩衝區，從槽位標頭讀取 shape、dtype、trigger_num
+- receive_lease() 回傳零複製租用，用完需 release()；receive_image() 回傳複本
+- 同機使用時指定 ring_name，不建立 TCP 連線，直接等待環形標頭的門鈴計數器
+- 每個槽位附帶該帧的偵測表（lease.detections），顯示時直接畫框，不需要重新推論
 """
 
 import socket
 import numpy as np
 import cv2
-from multiprocessing import shared_memory
 from datetime import datetime
 
+from shm_ring import DET_FLAG_TRIGGERED, ShmRingReader, TornFrameError
+from stream_framing import FramedSocketReader
+
 class SharedMemoryReceiver:
-    def __init__(self, host='127.0.0.1', port=9999):
+    def __init__(self, host='127.0.0.1', port=9999, framing='line', ring_name=None,
+                 policy='latest', max_lag=4):
         self.host = host
+        self.ring_name = ring_name
+        self.policy = policy      # 'latest' 只取最新帧，'every' 依序處理每一帧
+        self.max_lag = max_lag    # every 策略下發送端最多保留的未處理帧數
         self.port = port
+        self.framing = framing
         self.server_socket = None
         self.client_socket = None
+        self.records = None
+        self.reader = None
         self.is_running = False
         self.received_count = 0
 
     def start(self):
-        """啟動接收服務器，等待發送端連線"""
+        """啟動接收服務器，等待發送端連線（同機門鈴模式則直接連上環形緩衝區）"""
+        if self.ring_name is not None:
+            try:
+                self.reader = ShmRingReader(self.ring_name, policy=self.policy, max_lag=self.max_lag)
+                self.is_running = True
+                print(f"✅ 已連上環形緩衝區 {self.ring_name}（門鈴模式）\n")
+                return True
+            except FileNotFoundError:
+                print(f"❌ 環形緩衝區 {self.ring_name} 尚未建立")
+                return False
         try:
             self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
@@ -33,6 +54,7 @@ class SharedMemoryReceiver:
             print(f"⏳ 等待發送端連接...\n")
 
             self.client_socket, addr = self.server_socket.accept()
+            self.records = FramedSocketReader(self.client_socket, self.framing)
             print(f"✅ 發送端已連接: {addr}\n")
             print("=" * 60)
 
@@ -42,40 +64,77 @@ class SharedMemoryReceiver:
             print(f"❌ 啟動失敗: {e}")
             return False
 
-    def receive_image(self):
-        """接收圖像"""
-        try:
-            # 接收數據（增加緩衝區大小）
-            data = self.client_socket.recv(4096).decode("utf-8").strip()
-            if not data:
-                return None, None
-    
-            # 解析 metadata: shm_name,trigger_num,shape_str,dtype_str
-            parts = data.split(",")
-            if len(parts) < 4:
-                print(f"⚠️ Invalid metadata format: {data}")
-                return None, None
-    
-            shm_name = parts[0]
-            trigger_num = int(parts[1])
+    def _next_frame(self):
+        """
+        讀取下一筆槽位記錄（途中處理環形緩衝區宣告）
+        
+        Returns:
+            Tuple[int, int]: (slot, seq)，連線中斷時為 None
+        """
+        if self.ring_name is not None:
+            return self.reader.next_frame()
+        while True:
+            record = self.records.read_record()
+            if record is None:
+                return None
+            parts = record.decode("utf-8").strip().split(",")
             
-            # 解析 shape（例如 "480x640x3" -> (480, 640, 3)）
-            shape_str = parts[2]
-            shape = tuple(map(int, shape_str.split('x')))
+            # 環形緩衝區宣告: RING,ring_name,num_slots
+            if parts[0] == "RING" and len(parts) >= 3:
+                if self.reader is None or self.reader.ring_name != parts[1]:
+                    if self.reader is not None:
+                        self.reader.close()
+                    self.reader = ShmRingReader(parts[1], policy=self.policy, max_lag=self.max_lag)
+                    print(f"🔗 已連上環形緩衝區 {parts[1]} ({self.reader.ring.num_slots} 槽位)")
+                continue
             
-            dtype = np.dtype(parts[3])
+            # 每帧: slot,seq
+            if len(parts) < 2 or self.reader is None:
+                print(f"⚠️ Invalid metadata format: {parts}")
+                continue
+            return int(parts[0]), int(parts[1])
     
-            # Attach 到共享內存
-            shm = shared_memory.SharedMemory(name=shm_name)
-            image = np.ndarray(shape, dtype=dtype, buffer=shm.buf).copy()
-            shm.close()
+    def receive_lease(self):
+        """
+        接收下一帧的零複製租用（被覆寫的帧自動跳過）
+        
+        Returns:
+            FrameLease: 租用（用完需 release() 或使用 with），連線中斷時為 None
+        """
+        while True:
+            frame = self._next_frame()
+            if frame is None:
+                return None
+            try:
+                lease = self.reader.lease(*frame)
+            except TornFrameError as e:
+                print(f"⚠️ 跳過第 {frame[1]} 幀: {e}")
+                continue
+            self.received_count += 1
+            return lease
+    
+    def receive_image(self):
+        """接收圖像（複製模式，回傳的影像可長期保存）"""
+        try:
+            while True:
+                frame = self._next_frame()
+                if frame is None:
+                    return None, None
+                try:
+                    image, info = self.reader.read_copy(*frame)
+                except TornFrameError as e:
+                    # 發送端已繞回覆寫此槽位，跳過這一帧
+                    print(f"⚠️ 跳過第 {frame[1]} 幀: {e}")
+                    continue
+                break
     
             self.received_count += 1
+            trigger_num = info['trigger_num']
     
             print(f"📥 接收第 {self.received_count} 幀")
             print(f"   觸發計數: {trigger_num}")
-            print(f"   圖像尺寸: {shape}")
-            print(f"   dtype: {dtype}")
+            print(f"   圖像尺寸: {info['shape']}")
+            print(f"   dtype: {info['dtype']}")
             print(f"   時間戳: {datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]}")
             print("-" * 60)
     
@@ -90,13 +149,17 @@ class SharedMemoryReceiver:
     def close(self):
         """關閉連接"""
         self.is_running = False
+        torn_count = self.reader.torn if self.reader is not None else 0
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
         if self.client_socket:
             self.client_socket.close()
             print("✅ 客戶端連接已關閉")
         if self.server_socket:
             self.server_socket.close()
             print("✅ 服務器已關閉")
-        print(f"📊 總共接收: {self.received_count} 幀")
+        print(f"📊 總共接收: {self.received_count} 幀 (跳過被覆寫的 {torn_count} 幀)")
 
 def main():
     HOST = "127.0.0.1"
@@ -111,14 +174,30 @@ def main():
 
     try:
         while receiver.is_running:
-            image, trigger_num = receiver.receive_image()
-            if image is None:
+            # 顯示只需要縮圖，直接從租用的零複製視圖縮放後立即釋放
+            lease = receiver.receive_lease()
+            if lease is None:
                 print("⚠️ 連接中斷")
                 break
 
+            with lease:
+                trigger_num = lease.trigger_num
+                detections = lease.copy_detections()
+                height, width = lease.image.shape[:2]
+                display_image = cv2.resize(lease.image, (640, 480)) if DISPLAY_IMAGES else None
+
             if DISPLAY_IMAGES:
-                display_image = cv2.resize(image, (640, 480))
-                cv2.putText(display_image, f"Frame {trigger_num}", (10, 30),
+                # 偵測表與影像來自同一槽位，不需要重新推論
+                sx, sy = 640 / width, 480 / height
+                for det in detections:
+                    color = (0, 0, 255) if det['flags'] & DET_FLAG_TRIGGERED else (0, 255, 0)
+                    cv2.rectangle(display_image,
+                                  (int(det['x1'] * sx), int(det['y1'] * sy)),
+                                  (int(det['x2'] * sx), int(det['y2'] * sy)), color, 2)
+                    label = f"{det['class_id']}#{det['track_id']}" if det['track_id'] >= 0 else f"{det['class_id']}"
+                    cv2.putText(display_image, label, (int(det['x1'] * sx), int(det['y1'] * sy) - 4),
+                                cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1)
+                cv2.putText(display_image, f"Frame {trigger_num} ({len(detections)} det)", (10, 30),
                             cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
                 cv2.imshow("Shared Memory Receiver", display_image)
 
@@ -0,0 +1,245 @@
+# image_writer.py
+"""
+非同步影像寫檔
+擷取執行緒只把影像（或 FrameHandle 參考）放進有界佇列，編碼與寫檔由背景執行緒完成，
+佇列滿時丟棄新帧並計數，開啟存檔不會降低推論帧率
+
+- 編碼格式: jpeg（品質）、png（壓縮等級）、raw（NumPy .npy，不編碼）
+- 日期資料夾: <base_dir>/YYYYMMDD，日期改變時才建立一次
+- 固定檔名（持續覆寫）時先寫暫存檔再取代，且較舊的帧不會覆蓋較新的帧
+"""
+
+import datetime
+import os
+import queue
+import threading
+import time
+from typing import Dict, Optional
+
+import cv2
+import numpy as np
+
+from frame_pool import FrameHandle
+from pipeline_metrics import LatencyStats
+
+IMAGE_CODECS = ("jpeg", "png", "raw")
+CODEC_EXTENSIONS = {"jpeg": ".jpg", "png": ".png", "raw": ".npy"}
+
+
+class AsyncImageWriter:
+    """有界佇列的背景寫檔執行緒池"""
+
+    def __init__(self,
+                 base_dir: Optional[str] = None,
+                 codec: str = "jpeg",
+                 jpeg_quality: int = 95,
+                 png_level: int = 3,
+                 num_workers: int = 2,
+                 queue_size: int = 16,
+                 date_subdir: bool = True):
+        """
+        初始化寫檔執行緒池
+
+        Parameters:
+            base_dir: 儲存根目錄（自動命名時使用）
+            codec: "jpeg"、"png" 或 "raw"
+            jpeg_quality: JPEG 品質（0~100）
+            png_level: PNG 壓縮等級（0~9，越小越快）
+            num_workers: 寫檔執行緒數
+            queue_size: 待寫入佇列上限，滿時丟棄新帧
+            date_subdir: 自動命名時是否依日期分資料夾
+        """
+        self.base_dir = base_dir
+        self.date_subdir = date_subdir
+        self.set_codec(codec, jpeg_quality, png_level)
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._latest_seq: Dict[str, int] = {}
+        self._dir_key = None
+        self._dir_path = None
+
+        # 統計資訊
+        self.submitted = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.bytes_written = 0
+        self.write_ms = LatencyStats()
+        self._start_time = time.monotonic()
+
+        self._workers = [
+            threading.Thread(target=self._run, name=f"ImageWriter-{i}", daemon=True)
+            for i in range(num_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+        print(f"[AsyncImageWriter] Initialized: {codec}, {num_workers} workers, queue={queue_size}")
+
+    def set_codec(self, codec: str, jpeg_quality: int = 95, png_level: int = 3) -> None:
+        """
+        設定編碼格式（之後提交的帧生效）
+
+        Parameters:
+            codec: "jpeg"、"png" 或 "raw"
+            jpeg_quality: JPEG 品質（0~100）
+            png_level: PNG 壓縮等級（0~9）
+        """
+        if codec not in IMAGE_CODECS:
+            raise ValueError(f"Unknown codec '{codec}', expected one of {IMAGE_CODECS}")
+        self.codec = codec
+        self.jpeg_quality = int(jpeg_quality)
+        self.png_level = int(png_level)
+
+    def submit(self,
+               image,
+               filename: Optional[str] = None,
+               is_rgb: bool = True,
+               seq: Optional[int] = None) -> bool:
+        """
+        排入寫檔工作（不阻塞）
+
+        Parameters:
+            image: 影像，或 FrameHandle（被接受時 retain()，寫完後 release()）；
+                   一般 ndarray 由寫檔執行緒持有，呼叫端之後不得修改
+            filename: 完整檔名，None 表示依時間自動命名於 base_dir（副檔名依編碼格式）
+            is_rgb: image 是否為 RGB（jpeg / png 編碼前轉為 BGR）
+            seq: 帧序號，指定時同一檔名只保留較新的帧（持續覆寫同一檔案時使用）
+
+        Returns:
+            bool: 是否排入，佇列已滿或未設定儲存路徑時為 False
+        """
+        if filename is None and not self.base_dir:
+            return False
+        self.submitted += 1
+        # 在擷取執行緒上只記錄時間，檔名與資料夾在寫檔執行緒產生
+        job = (image, filename, is_rgb, seq, datetime.datetime.now(),
+               self.codec, self.jpeg_quality, self.png_level)
+        if isinstance(image, FrameHandle):
+            image.retain()
+        try:
+            self.queue.put_nowait(job)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            if isinstance(image, FrameHandle):
+                image.release()
+            return False
+
+    def _auto_filename(self, now: datetime.datetime, codec: str) -> str:
+        """<base_dir>/YYYYMMDD/image_YYYYMMDD_HHMMSS_mmm.<ext>（日期資料夾只在日期改變時建立）"""
+        directory = self.base_dir
+        if self.date_subdir:
+            key = (self.base_dir, now.date())
+            with self._lock:
+                if key != self._dir_key:
+                    self._dir_path = os.path.join(self.base_dir, now.strftime("%Y%m%d"))
+                    os.makedirs(self._dir_path, exist_ok=True)
+                    self._dir_key = key
+                directory = self._dir_path
+        timestamp = now.strftime("%Y%m%d_%H%M%S_%f")[:-3]
+        return os.path.join(directory, f"image_{timestamp}{CODEC_EXTENSIONS[codec]}")
+
+    def _run(self) -> None:
+        while True:
+            job = self.queue.get()
+            if job is None:
+                break
+            image, filename, is_rgb, seq, now, codec, jpeg_quality, png_level = job
+            try:
+                self._write(image.array if isinstance(image, FrameHandle) else image,
+                            filename, is_rgb, seq, now, codec, jpeg_quality, png_level)
+            except Exception as e:
+                self.failed += 1
+                print(f"[AsyncImageWriter] Failed to save '{filename}': {e}")
+            finally:
+                if isinstance(image, FrameHandle):
+                    image.release()
+
+    def _write(self, image, filename, is_rgb, seq, now, codec, jpeg_quality, png_level) -> None:
+        if seq is not None:
+            with self._lock:
+                # 多個執行緒寫同一檔名時，較舊的帧不覆蓋較新的帧
+                if seq <= self._latest_seq.get(filename, 0):
+                    return
+                self._latest_seq[filename] = seq
+
+        start = time.perf_counter()
+        if filename is None:
+            filename = self._auto_filename(now, codec)
+
+        if codec == "raw":
+            data = None
+        else:
+            if is_rgb and image.ndim == 3:
+                image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+            if codec == "png":
+                ok, encoded = cv2.imencode(".png", image, [int(cv2.IMWRITE_PNG_COMPRESSION), png_level])
+            else:
+                ok, encoded = cv2.imencode(".jpg", image, [int(cv2.IMWRITE_JPEG_QUALITY), jpeg_quality])
+            if not ok:
+                raise IOError(f"{codec} encoding failed")
+            data = encoded.tobytes()
+
+        # 覆寫同一檔案時先寫暫存檔再取代，讀取端不會看到寫到一半的檔案
+        target = filename
+        if seq is not None:
+            root, ext = os.path.splitext(filename)
+            target = f"{root}.{threading.current_thread().name}.tmp{ext}"
+        with open(target, "wb") as f:
+            if data is None:
+                np.save(f, image)
+            else:
+                f.write(data)
+            nbytes = f.tell()
+        if target != filename:
+            os.replace(target, filename)
+
+        self.written += 1
+        self.bytes_written += nbytes
+        self.write_ms.add((time.perf_counter() - start) * 1000.0)
+
+    def get_statistics(self) -> Dict:
+        """
+        獲取統計資訊
+
+        Returns:
+            dict: 統計資訊
+        """
+        elapsed = max(time.monotonic() - self._start_time, 1e-9)
+        return {
+            'codec': self.codec,
+            'queue_depth': self.queue.qsize(),
+            'submitted': self.submitted,
+            'written': self.written,
+            'dropped': self.dropped,
+            'failed': self.failed,
+            'written_mb': self.bytes_written / 1e6,
+            'write_fps': self.written / elapsed,
+            'write_mb_per_s': self.bytes_written / elapsed / 1e6,
+            'write_ms': self.write_ms.quantiles()
+        }
+
+    def print_statistics(self) -> None:
+        """列印統計資訊"""
+        stats = self.get_statistics()
+        print("\n" + "=" * 60)
+        print("Async Image Writer Statistics")
+        print("=" * 60)
+        print(f"Codec:             {stats['codec']}")
+        print(f"Submitted:         {stats['submitted']}")
+        print(f"Written:           {stats['written']} ({stats['write_fps']:.1f} fps, "
+              f"{stats['write_mb_per_s']:.1f} MB/s, {stats['written_mb']:.1f} MB)")
+        print(f"Dropped (queue):   {stats['dropped']}")
+        print(f"Failed:            {stats['failed']}")
+        print(f"Queue depth:       {stats['queue_depth']}")
+        print(f"Write ms:          p50={stats['write_ms'].get('p50', 0.0):.1f} p99={stats['write_ms'].get('p99', 0.0):.1f}")
+        print("=" * 60 + "\n")
+
+    def close(self) -> None:
+        """等待佇列清空後停止所有執行緒"""
+        for _ in self._workers:
+            self.queue.put(None)
+        for worker in self._workers:
+            worker.join()
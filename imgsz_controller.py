@@ -0,0 +1,452 @@
+# imgsz_controller.py
+"""
+推論尺寸自動調整
+在幾個預先暖機的推論尺寸（預設 640 / 960 / 1280）之間切換，讓推論延遲維持在目標以內，
+並在有餘裕或辨識品質變差時回到較大的尺寸；每次切換都記錄在日誌與指標（nircam_inference_imgsz*）
+
+每個尺寸各自保留:
+- 推論延遲（EWMA，毫秒）與最後一次量測的時間
+- 平均信心指數（EWMA，只計有偵測到物體的帧）
+- 偵測數量帧間跳動（EWMA，每個視窗更新）
+
+每個評估視窗（window 帧，只計目前尺寸的帧）依序判斷:
+    latency_high   p90 延遲超過目標 → 降一級
+    headroom       上一級的預估 p90 低於目標的 headroom_ratio 倍，連續 recover_windows 個視窗 → 升一級
+    quality        同 headroom 的條件，且這些視窗的平均信心都比上一級低 conf_drop 以上，
+                   或偵測數量跳動都比上一級多 max_count_flicker 以上（只影響記錄的原因）
+上一級的預估 p90 = 目前 p90 × 兩級延遲 EWMA 的比值，上一級量測已超過 stale_s 秒時改用面積比
+（避免一次尖峰之後永遠回不去）；每次切換後都要等滿一個視窗才再次評估
+
+使用者在介面設定的影像大小是上限：控制器只會在不超過該值的尺寸中選擇
+目標延遲未設定時取帧預算（frame_budget）的 budget_fraction 倍；兩者都沒有時不切換
+
+使用方式:
+    controller = start_imgsz_controller(levels=(640, 960, 1280))
+    controller.warm_up(lambda image, imgsz: detect_objects(model, image, imgsz=imgsz))
+    imgsz = controller.choose(requested_imgsz)
+    results = detect_objects(model, image, imgsz=imgsz)
+    controller.observe(imgsz, latency_ms, results)
+"""
+
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from frame_budget import get_frame_budget_watchdog
+from pipeline_logging import get_pipeline_logger
+from pipeline_metrics import metrics
+
+INFERENCE_IMGSZ = metrics.gauge('nircam_inference_imgsz', 'Inference size in use (controller choice or degradation cap)')
+IMGSZ_CHANGES = metrics.counter('nircam_imgsz_changes_total', 'Inference size changes', ('direction', 'reason'))
+IMGSZ_REASON = metrics.gauge('nircam_imgsz_reason', 'Reason for the current inference size (1 = current)',
+                             ('reason',))
+IMGSZ_LATENCY = metrics.gauge('nircam_inference_latency_ewma_seconds', 'Smoothed inference latency per size',
+                              ('imgsz',))
+DETECTION_CONFIDENCE = metrics.gauge('nircam_detection_confidence_mean', 'Recent mean detection confidence')
+
+REASONS = ('initial', 'user_limit', 'latency_high', 'quality', 'headroom', 'degradation_cap')
+DEFAULT_WARM_UP_SHAPE = (1024, 1280, 3)     # MV-CA016 解析度（高, 寬, 通道）
+
+
+def warm_up_levels(detect: Callable[[np.ndarray, int], object], levels: Sequence[int],
+                   image_shape: Tuple[int, int, int] = DEFAULT_WARM_UP_SHAPE, runs: int = 2,
+                   logger=None) -> Dict[int, float]:
+    """
+    每個尺寸先推論幾次（建立 CUDA kernel / 記憶體配置），回傳最後一次的時間
+
+    Parameters:
+        detect: detect(image, imgsz) 執行一次推論，回傳 None 表示失敗
+        levels: 推論尺寸
+        image_shape: 暖機影像尺寸（建議與相機解析度相同）
+        runs: 每個尺寸的推論次數
+        logger: 記錄失敗的 logger
+
+    Returns:
+        Dict[int, float]: 尺寸 → 暖機延遲（毫秒），失敗的尺寸不列入
+    """
+    image = np.zeros(image_shape, dtype=np.uint8)
+    measured = {}
+    for level in levels:
+        elapsed_ms = None
+        for _ in range(max(1, runs)):
+            start = time.perf_counter()
+            try:
+                ok = detect(image, level) is not None
+            except Exception as e:
+                ok = False
+                if logger is not None:
+                    logger.warning("Warm-up at imgsz %d failed: %s", level, e)
+            if not ok:
+                elapsed_ms = None
+                break
+            elapsed_ms = (time.perf_counter() - start) * 1000.0
+        if elapsed_ms is not None:
+            measured[level] = elapsed_ms
+    return measured
+
+
+class ImgszController:
+    """推論尺寸控制器（擷取執行緒呼叫，不需加鎖）"""
+
+    def __init__(self,
+                 levels: Sequence[int] = (640, 960, 1280),
+                 target_ms: Optional[float] = None,
+                 budget_fraction: float = 0.6,
+                 window: int = 30,
+                 headroom_ratio: float = 0.7,
+                 recover_windows: int = 3,
+                 conf_drop: float = 0.08,
+                 max_count_flicker: float = 0.3,
+                 stale_s: float = 60.0):
+        """
+        初始化推論尺寸控制器
+
+        Parameters:
+            levels: 可選的推論尺寸（會取 32 的倍數並排序）
+            target_ms: 目標推論延遲（毫秒），None 表示取帧預算的 budget_fraction 倍
+            budget_fraction: 未指定目標時，推論可佔帧預算的比例
+            window: 評估的帧數（每次切換後也要等滿一個視窗才再次評估）
+            headroom_ratio: 上一級預估 p90 低於目標的這個倍數時才考慮升級（品質變差時也一樣）
+            recover_windows: 連續幾個視窗都有餘裕才升一級（避免來回切換）
+            conf_drop: 平均信心比上一級低這麼多時視為品質變差
+            max_count_flicker: 偵測數量帧間平均變化 / 平均數量比上一級高出此值時視為不穩定
+            stale_s: 其他尺寸的延遲量測超過這麼久就改用面積比推算
+        """
+        self.levels: List[int] = sorted({max(32, int(level) // 32 * 32) for level in levels})
+        if not self.levels:
+            raise ValueError("ImgszController needs at least one level")
+        self.target_ms = target_ms
+        self.budget_fraction = budget_fraction
+        self.window = window
+        self.headroom_ratio = headroom_ratio
+        self.recover_windows = recover_windows
+        self.conf_drop = conf_drop
+        self.max_count_flicker = max_count_flicker
+        self.stale_s = stale_s
+
+        self.index = len(self.levels) - 1
+        self.reason = 'initial'
+        self.latency_ewma: Dict[int, float] = {}        # 尺寸 → 推論延遲 EWMA（毫秒）
+        self.latency_time: Dict[int, float] = {}        # 尺寸 → 最後量測時間（perf_counter 秒）
+        self.conf_ewma: Dict[int, float] = {}           # 尺寸 → 平均信心 EWMA
+        self.flicker_ewma: Dict[int, float] = {}        # 尺寸 → 偵測數量帧間跳動 EWMA
+        self.latencies = deque(maxlen=window)           # 目前尺寸的延遲（毫秒）
+        self.confidences = deque(maxlen=window)         # 目前尺寸每帧的平均信心（有偵測時）
+        self.counts = deque(maxlen=window)              # 目前尺寸每帧的偵測數量
+        self._frames_since_change = 0
+        self._headroom_windows = 0
+        self._quality_windows = 0
+        self.changes: List[Dict] = []
+        self.warmed_up = False
+        self.capped_imgsz: Optional[int] = None         # 降載上限小於控制器選擇時實際使用的尺寸
+
+        self.logger = get_pipeline_logger("ImgszController")
+        self._publish()
+        print(f"[ImgszController] Initialized: levels = {self.levels}, "
+              f"target = {f'{target_ms:.1f} ms' if target_ms is not None else f'{budget_fraction:.0%} of frame budget'}")
+
+    @property
+    def imgsz(self) -> int:
+        """目前選擇的推論尺寸"""
+        return self.levels[self.index]
+
+    # ========== 暖機 ==========
+
+    def warm_up(self, detect: Callable[[np.ndarray, int], object],
+                image_shape: Tuple[int, int, int] = DEFAULT_WARM_UP_SHAPE, runs: int = 2) -> Dict[int, float]:
+        """
+        對每個尺寸暖機，並以暖機時間作為初始延遲
+
+        Parameters:
+            detect: detect(image, imgsz) 執行一次推論
+            image_shape: 暖機影像尺寸（建議與相機解析度相同）
+            runs: 每個尺寸的推論次數
+
+        Returns:
+            Dict[int, float]: 尺寸 → 暖機延遲（毫秒）
+        """
+        measured = warm_up_levels(detect, self.levels, image_shape, runs, self.logger)
+        self.seed_latencies(measured)
+        return measured
+
+    def seed_latencies(self, measured: Dict[int, float]) -> None:
+        """
+        以外部暖機（例如 ModelLoader）量到的時間作為初始延遲
+
+        Parameters:
+            measured: 尺寸 → 暖機延遲（毫秒），不在 levels 內的尺寸忽略
+        """
+        for level, elapsed_ms in measured.items():
+            if level in self.levels:
+                self._update_latency(level, elapsed_ms, smoothing=1.0)
+        self.warmed_up = True
+        print(f"[ImgszController] Warm-up: "
+              f"{', '.join(f'{level}={self.latency_ewma[level]:.1f} ms' for level in self.levels if level in self.latency_ewma) or 'failed'}")
+
+    # ========== 每帧呼叫 ==========
+
+    @property
+    def effective_target_ms(self) -> Optional[float]:
+        """目前的目標推論延遲（毫秒），尚無資料時為 None"""
+        if self.target_ms is not None:
+            return self.target_ms
+        watchdog = get_frame_budget_watchdog()
+        if watchdog is None or watchdog.budget_ms is None:
+            return None
+        return watchdog.budget_ms * self.budget_fraction
+
+    def choose(self, requested_imgsz: int) -> int:
+        """
+        選擇本帧的推論尺寸
+
+        Parameters:
+            requested_imgsz: 使用者設定的影像大小（上限）
+
+        Returns:
+            int: 推論尺寸（使用者設定小於所有尺寸時直接使用設定值）
+        """
+        if requested_imgsz < self.levels[0]:
+            return requested_imgsz
+        if self.imgsz > requested_imgsz:
+            allowed = max(i for i, level in enumerate(self.levels) if level <= requested_imgsz)
+            self._change(allowed, 'user_limit', None, None)
+        return self.imgsz
+
+    def observe(self, imgsz: int, latency_ms: float, results, capped: bool = False) -> None:
+        """
+        一次推論完成時呼叫
+
+        Parameters:
+            imgsz: 實際使用的推論尺寸（降載可能再縮小）
+            latency_ms: 推論時間（毫秒）
+            results: detect_objects 的回傳值（None 表示推論失敗）
+            capped: 降載上限是否把尺寸縮小到控制器選擇以下
+        """
+        capped_imgsz = imgsz if capped else None
+        if capped_imgsz != self.capped_imgsz:
+            self.capped_imgsz = capped_imgsz
+            self._publish()
+        if imgsz not in self.levels:
+            return
+        self._update_latency(imgsz, latency_ms)
+        count, mean_conf = _summarize(results)
+        if mean_conf is not None:
+            previous = self.conf_ewma.get(imgsz)
+            self.conf_ewma[imgsz] = mean_conf if previous is None else previous + 0.05 * (mean_conf - previous)
+        if imgsz != self.imgsz:
+            return
+
+        self.latencies.append(latency_ms)
+        self.counts.append(count)
+        if mean_conf is not None:
+            self.confidences.append(mean_conf)
+        self._frames_since_change += 1
+        if self._frames_since_change >= self.window:
+            self._evaluate()
+
+    # ========== 判斷 ==========
+
+    def _update_latency(self, imgsz: int, latency_ms: float, smoothing: float = 0.1) -> None:
+        previous = self.latency_ewma.get(imgsz)
+        value = latency_ms if previous is None else previous + smoothing * (latency_ms - previous)
+        self.latency_ewma[imgsz] = value
+        self.latency_time[imgsz] = time.perf_counter()
+        IMGSZ_LATENCY.labels(imgsz).set(value / 1000.0)
+
+    def _predict_p90(self, index: int, current_p90: float) -> float:
+        """
+        預估某一級的 p90 推論延遲
+        目前 p90 乘上兩級延遲 EWMA 的比值（保留目前的尾端延遲），該級量測太舊時改乘面積比
+        """
+        level = self.levels[index]
+        measured_at = self.latency_time.get(level)
+        current_ewma = self.latency_ewma.get(self.imgsz)
+        if (measured_at is not None and time.perf_counter() - measured_at < self.stale_s
+                and current_ewma):
+            return current_p90 * self.latency_ewma[level] / current_ewma
+        return current_p90 * (level / self.imgsz) ** 2
+
+    def _window_flicker(self) -> Optional[float]:
+        """本視窗偵測數量的帧間平均變化 / 平均數量（數量太少時為 None）"""
+        counts = np.asarray(self.counts, dtype=np.float64)
+        if len(counts) < 2 or counts.mean() < 1.0:
+            return None
+        return float(np.abs(np.diff(counts)).mean() / counts.mean())
+
+    def _quality_low(self, flicker: Optional[float]) -> bool:
+        """目前尺寸的辨識品質是否明顯比上一級差（信心與數量穩定度都和上一級自己的紀錄比較）"""
+        if self.index + 1 >= len(self.levels):
+            return False
+        upper = self.levels[self.index + 1]
+        if self.confidences:
+            current_conf = float(np.mean(self.confidences))
+            upper_conf = self.conf_ewma.get(upper)
+            if upper_conf is not None and current_conf < upper_conf - self.conf_drop:
+                return True
+        upper_flicker = self.flicker_ewma.get(upper)
+        if flicker is not None and upper_flicker is not None:
+            if flicker > upper_flicker + self.max_count_flicker:
+                return True
+        return False
+
+    def _evaluate(self) -> None:
+        self._frames_since_change = 0
+        if self.confidences:
+            DETECTION_CONFIDENCE.set(float(np.mean(self.confidences)))
+        flicker = self._window_flicker()
+        quality_low = self._quality_low(flicker)
+        if flicker is not None:
+            previous = self.flicker_ewma.get(self.imgsz)
+            self.flicker_ewma[self.imgsz] = flicker if previous is None else previous + 0.3 * (flicker - previous)
+        target = self.effective_target_ms
+        if target is None:
+            return
+        p90 = sorted(self.latencies)[int(len(self.latencies) * 0.9)]
+
+        if p90 > target:
+            self._reset_upgrade_windows()
+            if self.index > 0:
+                self._change(self.index - 1, 'latency_high', p90, target)
+            return
+        if self.index + 1 >= len(self.levels):
+            self._reset_upgrade_windows()
+            return
+        # 品質變差也要有同樣的餘裕才升級，否則升上去的下一個視窗又因延遲降回來
+        if self._predict_p90(self.index + 1, p90) < target * self.headroom_ratio:
+            self._headroom_windows += 1
+            self._quality_windows = self._quality_windows + 1 if quality_low else 0
+            if self._headroom_windows >= self.recover_windows:
+                reason = 'quality' if self._quality_windows >= self.recover_windows else 'headroom'
+                self._reset_upgrade_windows()
+                self._change(self.index + 1, reason, p90, target)
+        else:
+            self._reset_upgrade_windows()
+
+    def _reset_upgrade_windows(self) -> None:
+        self._headroom_windows = 0
+        self._quality_windows = 0
+
+    def _change(self, index: int, reason: str, p90: Optional[float], target: Optional[float]) -> None:
+        previous = self.imgsz
+        self.index = index
+        self.reason = reason
+        self._frames_since_change = 0
+        self._reset_upgrade_windows()
+        self.latencies.clear()
+        self.confidences.clear()
+        self.counts.clear()
+
+        direction = 'up' if self.imgsz > previous else 'down'
+        IMGSZ_CHANGES.labels(direction, reason).inc()
+        self._publish()
+        self.changes.append({
+            'time': time.time(),
+            'from': previous,
+            'to': self.imgsz,
+            'reason': reason,
+            'p90_ms': p90,
+            'target_ms': target
+        })
+        if p90 is None:
+            self.logger.info("imgsz %d → %d (%s)", previous, self.imgsz, reason)
+        else:
+            self.logger.warning("imgsz %d → %d (%s: p90 %.1f ms, target %.1f ms)",
+                                previous, self.imgsz, reason, p90, target)
+
+    @property
+    def effective_imgsz(self) -> int:
+        """實際使用的推論尺寸（降載上限優先於控制器選擇）"""
+        return self.capped_imgsz if self.capped_imgsz is not None else self.imgsz
+
+    @property
+    def effective_reason(self) -> str:
+        """實際使用尺寸的原因"""
+        return 'degradation_cap' if self.capped_imgsz is not None else self.reason
+
+    def _publish(self) -> None:
+        INFERENCE_IMGSZ.set(self.effective_imgsz)
+        effective_reason = self.effective_reason
+        for reason in REASONS:
+            IMGSZ_REASON.labels(reason).set(1 if reason == effective_reason else 0)
+
+    # ========== 統計 ==========
+
+    def get_statistics(self) -> Dict:
+        """
+        獲取統計資訊
+
+        Returns:
+            dict: 統計資訊
+        """
+        return {
+            'imgsz': self.imgsz,
+            'reason': self.reason,
+            'effective_imgsz': self.effective_imgsz,
+            'effective_reason': self.effective_reason,
+            'target_ms': self.effective_target_ms,
+            'latency_ms': dict(self.latency_ewma),
+            'confidence': dict(self.conf_ewma),
+            'count_flicker': dict(self.flicker_ewma),
+            'changes': len(self.changes),
+            'last_change': self.changes[-1] if self.changes else None
+        }
+
+    def print_statistics(self) -> None:
+        """列印統計資訊"""
+        stats = self.get_statistics()
+        print("\n" + "=" * 60)
+        print("Adaptive Inference Size Statistics")
+        print("=" * 60)
+        target = f"{stats['target_ms']:.1f} ms" if stats['target_ms'] is not None else "n/a"
+        print(f"Current imgsz:   {stats['imgsz']} ({stats['reason']})")
+        if stats['effective_imgsz'] != stats['imgsz']:
+            print(f"Effective imgsz: {stats['effective_imgsz']} ({stats['effective_reason']})")
+        print(f"Target latency:  {target}")
+        for level in self.levels:
+            latency = stats['latency_ms'].get(level)
+            conf = stats['confidence'].get(level)
+            print(f"  {level:>5}: {f'{latency:.1f} ms' if latency is not None else 'n/a':>10}, "
+                  f"conf {f'{conf:.3f}' if conf is not None else 'n/a'}")
+        print(f"Changes:         {stats['changes']}")
+        print("=" * 60 + "\n")
+
+
+def _summarize(results) -> Tuple[int, Optional[float]]:
+    """(偵測數量, 平均信心)；沒有偵測時平均信心為 None"""
+    if not results or getattr(results[0], 'boxes', None) is None:
+        return 0, None
+    boxes = results[0].boxes
+    count = len(boxes)
+    if count == 0:
+        return 0, None
+    try:
+        return count, float(boxes.conf.mean())
+    except Exception:
+        return count, None
+
+
+# 全域推論尺寸控制器實例（None 表示固定使用介面設定的尺寸）
+imgsz_controller = None
+
+
+def start_imgsz_controller(levels=(640, 960, 1280), **kwargs):
+    """啟動推論尺寸控制器"""
+    global imgsz_controller
+    if imgsz_controller is None:
+        imgsz_controller = ImgszController(levels, **kwargs)
+    return imgsz_controller
+
+
+def get_imgsz_controller():
+    """獲取推論尺寸控制器實例"""
+    return imgsz_controller
+
+
+def stop_imgsz_controller():
+    """停止推論尺寸控制器（恢復固定尺寸）"""
+    global imgsz_controller
+    if imgsz_controller:
+        imgsz_controller.print_statistics()
+        imgsz_controller = None
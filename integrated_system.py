@@ -10,6 +10,7 @@ import time
 from typing import Optional
 from simple_tracker import SimpleTracker
 from two_band_filter import TwoBandFilter
+from overlay_compositor import OverlayScene, compose_overlay
 from tcp_server import get_tcp_server, start_tcp_server
 
 
@@ -122,74 +123,46 @@ class IntegratedTriggerSystem:
                 print(f"[IntegratedSystem] Filter processing error: {e}")
                 result['filter_result'] = {}
         
-        # 4. 視覺化（可選）
+        # 4. 視覺化（可選）：區域、追蹤與統計合成一次，只複製一次影像
         if visualize:
-            vis_frame = frame.copy()
+            h, w = frame.shape[:2]
+            scene = OverlayScene(w, h, rgb=False)
             
             # 繪製區域邊界
-            vis_frame = self.filter_system.visualize_zones(vis_frame)
+            self.filter_system.add_zones_to_overlay(scene)
             
             # 繪製追蹤結果
             if tracker_results:
-                filter_input = [
-                    (track_id, np.concatenate([bbox, [conf, cls]]))
-                    for track_id, bbox, conf, cls in tracker_results
-                ]
-                vis_frame = self.filter_system.draw_tracks(vis_frame, filter_input)
+                self.filter_system.add_tracks_to_overlay(scene, tracker_results)
             
             # 繪製統計資訊
-            vis_frame = self._draw_statistics(vis_frame, result)
+            self._add_statistics(scene, result)
             
-            result['vis_frame'] = vis_frame
+            result['vis_frame'] = compose_overlay(frame.copy(), scene)
         
         return result
     
-    def _draw_statistics(self, frame: np.ndarray, result: dict) -> np.ndarray:
+    def _add_statistics(self, scene: OverlayScene, result: dict) -> None:
         """
-        在影像上繪製統計資訊
+        將統計資訊加入疊圖場景（左上角半透明面板）
         
         Parameters:
-            frame: 輸入影像
+            scene: 疊圖場景
             result: 處理結果
-            
-        Returns:
-            帶有統計資訊的影像
         """
-        h, w = frame.shape[:2]
-        
-        # 創建半透明背景
-        overlay = frame.copy()
-        cv2.rectangle(overlay, (10, 10), (350, 150), (0, 0, 0), -1)
-        frame = cv2.addWeighted(overlay, 0.5, frame, 0.5, 0)
-        
-        # 繪製統計文字
-        y_offset = 35
-        line_height = 25
-        
         # 追蹤器統計
         tracker_stats = self.tracker.get_statistics()
-        cv2.putText(frame, f"Active Tracks: {tracker_stats['active_tracks']}", 
-                    (20, y_offset), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
-        y_offset += line_height
-        
-        cv2.putText(frame, f"Total Tracks: {tracker_stats['total_tracks']}", 
-                    (20, y_offset), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
-        y_offset += line_height
+        scene.add_stat(f"Active Tracks: {tracker_stats['active_tracks']}", scene.color((0, 255, 0)))
+        scene.add_stat(f"Total Tracks: {tracker_stats['total_tracks']}", scene.color((0, 255, 0)))
         
         # Two-Band Filter 統計
         if 'filter_result' in result and result['filter_result']:
             filter_result = result['filter_result']
             triggered = len(filter_result.get('triggered_this_frame', []))
             
-            cv2.putText(frame, f"Triggered: {triggered}", 
-                        (20, y_offset), cv2.FONT_HERSHEY_SIMPLEX, 0.6, 
-                        (0, 255, 255) if triggered > 0 else (255, 255, 255), 2)
-            y_offset += line_height
-            
-            cv2.putText(frame, f"Frame: {filter_result.get('frame_count', 0)}", 
-                        (20, y_offset), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
-        
-        return frame
+            scene.add_stat(f"Triggered: {triggered}",
+                           scene.color((0, 255, 255) if triggered > 0 else (255, 255, 255)))
+            scene.add_stat(f"Frame: {filter_result.get('frame_count', 0)}", scene.color((255, 255, 255)))
     
     def run_with_camera(self, camera_operation, visualize: bool = True):
         """
@@ -0,0 +1,135 @@
+# lazy_import.py
+"""
+延遲匯入
+較重的模組（detect → ultralytics / torch、simple_tracker → scipy、two_band_filter）在第一次使用時才匯入，
+只擷取影像、不辨識或不啟用觸發系統時不付出匯入成本；也可在介面建立時以背景執行緒預先匯入
+
+- 同一模組名稱共用一個 LazyImport（lazy_module 取得），匯入時間記錄在 get_import_statistics()
+- 匯入失敗（ImportError）只記錄一次並回傳 None，呼叫端照舊以 None 判斷功能是否可用
+- peek() 不觸發匯入：模組若已在別處匯入完成就直接使用（例如 tcp_server 由入口匯入）
+
+使用方式:
+    _detect = lazy_module('detect')
+    detect = _detect.load()          # 第一次呼叫時匯入
+    if detect is not None:
+        detect.detect_objects(model, image)
+
+    prefetch_modules('simple_tracker', 'two_band_filter')   # 背景預先匯入
+"""
+
+import importlib
+import sys
+import threading
+import time
+from typing import Dict, Optional
+
+
+class LazyImport:
+    """第一次使用時才匯入的模組"""
+
+    def __init__(self, module_name: str):
+        """
+        Parameters:
+            module_name: 模組名稱
+        """
+        self.module_name = module_name
+        self.module = None
+        self.error: Optional[str] = None
+        self.import_ms: Optional[float] = None     # 由本物件匯入時的耗時（已在別處匯入時為 None）
+        self.thread_name: Optional[str] = None     # 實際匯入的執行緒
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self.module is not None
+
+    def load(self):
+        """
+        取得模組（必要時匯入）
+
+        Returns:
+            module: 模組，匯入失敗時為 None
+        """
+        module = self.module
+        if module is not None or self.error is not None:
+            return module
+        with self._lock:
+            if self.module is None and self.error is None:
+                already_imported = self.module_name in sys.modules
+                start = time.perf_counter()
+                try:
+                    self.module = importlib.import_module(self.module_name)
+                except ImportError as e:
+                    self.error = str(e)
+                    print(f"Warning: {self.module_name} module not found ({e}). Related features will be disabled.")
+                if not already_imported:
+                    self.import_ms = (time.perf_counter() - start) * 1000.0
+                    self.thread_name = threading.current_thread().name
+        return self.module
+
+    def peek(self):
+        """
+        已匯入完成時回傳模組，否則回傳 None（不觸發匯入）
+
+        Returns:
+            module: 模組或 None
+        """
+        if self.module is None:
+            module = sys.modules.get(self.module_name)
+            spec = getattr(module, '__spec__', None)
+            if module is not None and not getattr(spec, '_initializing', False):
+                self.module = module
+        return self.module
+
+
+_lazy_imports: Dict[str, LazyImport] = {}
+_registry_lock = threading.Lock()
+
+
+def lazy_module(module_name: str) -> LazyImport:
+    """取得（必要時建立）模組的 LazyImport"""
+    with _registry_lock:
+        lazy = _lazy_imports.get(module_name)
+        if lazy is None:
+            lazy = LazyImport(module_name)
+            _lazy_imports[module_name] = lazy
+        return lazy
+
+
+def prefetch_modules(*module_names: str) -> threading.Thread:
+    """
+    在背景執行緒依序匯入模組（之後的 load() 直接取得）
+
+    Parameters:
+        module_names: 模組名稱
+
+    Returns:
+        threading.Thread: 匯入執行緒
+    """
+    lazies = [lazy_module(name) for name in module_names]
+
+    def run():
+        for lazy in lazies:
+            lazy.load()
+
+    thread = threading.Thread(target=run, name="ImportPrefetch", daemon=True)
+    thread.start()
+    return thread
+
+
+def get_import_statistics() -> Dict[str, Dict]:
+    """
+    各延遲匯入模組的狀態
+
+    Returns:
+        dict: 模組名稱 → {'loaded', 'import_ms', 'thread', 'error'}
+    """
+    return {
+        name: {
+            'loaded': lazy.loaded,
+            'import_ms': lazy.import_ms,
+            'thread': lazy.thread_name,
+            'error': lazy.error
+        }
+        for name, lazy in _lazy_imports.items()
+    }
@@ -0,0 +1,314 @@
+# model_loader.py
+"""
+背景模型載入與暖機
+載入 YOLO 權重與暖機都在背景執行緒進行，介面與擷取迴圈不會被阻塞；
+暖機完成後才以 set_ai_model 換上新模型（換上之前舊模型照常辨識），
+因此切換模型後的第一帧不會付出建圖與記憶體配置的成本
+
+重新暖機（rewarm）同樣載入一個新的模型實例，不會在擷取執行緒使用中的模型上推論（YOLO 預測器非執行緒安全）；
+新的影像大小在換上之後才由 imgsz 公布，呼叫端在 notify 成功時才改用
+
+暖機的推論尺寸:
+- 目前設定的影像大小
+- 推論尺寸控制器（imgsz_controller）不超過該值的各級
+- 帧預算降載階梯中的 imgsz 上限
+
+狀態: idle → loading → warming → ready（失敗時為 failed，舊模型保持不變）
+
+使用方式:
+    loader = start_model_loader(notify=signals.model_ready.emit)
+    loader.load(weights, conf_thres=0.4, imgsz=1280)
+    loader.wait(timeout=120)        # 無介面模式等待就緒
+    loader.is_ready
+    loader.imgsz                    # 已換上的模型暖機時的影像大小
+"""
+
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from frame_budget import get_frame_budget_watchdog
+from imgsz_controller import DEFAULT_WARM_UP_SHAPE, get_imgsz_controller, warm_up_levels
+from lazy_import import lazy_module
+from pipeline_logging import get_pipeline_logger
+from pipeline_metrics import metrics
+from startup_timing import MODEL_READY as STARTUP_MODEL_READY, mark as mark_startup
+
+MODEL_READY = metrics.gauge('nircam_model_ready', 'Whether a warmed-up model is installed (1 = ready)')
+MODEL_LOAD_TIME = metrics.gauge('nircam_model_load_seconds', 'Time to load the last model weights')
+MODEL_WARM_UP_TIME = metrics.gauge('nircam_model_warm_up_seconds', 'Time to warm up the last model at every imgsz')
+MODEL_LOADS = metrics.counter('nircam_model_loads_total', 'Model load attempts', ('result',))
+
+STATES = ('idle', 'loading', 'warming', 'ready', 'failed')
+
+
+class ModelLoader:
+    """背景模型載入器（同一時間只執行一個載入工作）"""
+
+    def __init__(self,
+                 image_shape: Tuple[int, int, int] = DEFAULT_WARM_UP_SHAPE,
+                 runs: int = 2,
+                 notify: Optional[Callable[[bool, str], None]] = None):
+        """
+        初始化模型載入器
+
+        Parameters:
+            image_shape: 暖機影像尺寸（高, 寬, 通道），開啟相機後可用 set_image_shape 更新
+            runs: 每個尺寸的暖機推論次數
+            notify: 載入完成時呼叫 notify(成功與否, 說明)（在背景執行緒呼叫，介面請傳入 signal.emit）；
+                    成功時新的影像大小已公布於 imgsz
+        """
+        self.image_shape = tuple(image_shape)
+        self.runs = runs
+        self.notify = notify
+
+        self.state = 'idle'
+        self.model = None                   # 目前已換上的模型
+        self.weights: Optional[str] = None  # 目前已換上的權重路徑
+        self.imgsz: Optional[int] = None    # 目前已換上的模型暖機時的影像大小
+        self.pending_weights: Optional[str] = None
+        self.load_ms: Optional[float] = None
+        self.warm_up_ms: Optional[float] = None
+        self.warm_up_levels: Dict[int, float] = {}
+        self.error: Optional[str] = None
+        self.history: List[Dict] = []
+        self._thread: Optional[threading.Thread] = None
+        self._done = threading.Event()
+        self._done.set()
+        self._cancelled = False
+
+        self.logger = get_pipeline_logger("ModelLoader")
+        print(f"[ModelLoader] Initialized: warm-up shape = {self.image_shape}, runs = {runs}")
+
+    @property
+    def is_ready(self) -> bool:
+        """是否已換上暖機完成的模型（載入新模型期間舊模型仍可用時也為 True）"""
+        return self.model is not None
+
+    @property
+    def busy(self) -> bool:
+        """是否正在載入或暖機"""
+        return self.state in ('loading', 'warming')
+
+    def set_image_shape(self, height: int, width: int) -> None:
+        """更新暖機影像尺寸（下一次暖機生效）"""
+        self.image_shape = (int(height), int(width), 3)
+
+    # ========== 載入 ==========
+
+    def load(self, weights: str, conf_thres: float = 0.4, imgsz: int = 1280) -> bool:
+        """
+        在背景載入並暖機新權重，完成後換上
+
+        Parameters:
+            weights: 權重檔路徑
+            conf_thres: 暖機使用的信心指數閾值
+            imgsz: 目前設定的影像大小
+
+        Returns:
+            bool: 是否已開始（正在載入其他模型時回傳 False）
+        """
+        return self._start(weights, conf_thres, imgsz)
+
+    def rewarm(self, conf_thres: float = 0.4, imgsz: int = 1280) -> bool:
+        """
+        以目前的權重載入新的模型實例並重新暖機後換上（例如啟用推論尺寸自動調整、設定變更之後）
+        使用中的模型不會被背景執行緒呼叫；新的影像大小在完成後才公布於 imgsz
+
+        Returns:
+            bool: 是否已開始（沒有模型或正在載入時回傳 False）
+        """
+        if self.model is None or self.weights is None:
+            return False
+        return self._start(self.weights, conf_thres, imgsz)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        等待目前的載入工作結束
+
+        Parameters:
+            timeout: 最長等待秒數，None 表示不限
+
+        Returns:
+            bool: 是否已就緒
+        """
+        self._done.wait(timeout)
+        return self.is_ready and not self.busy
+
+    def cancel(self) -> None:
+        """取消進行中的載入（背景工作結束後不換上模型）"""
+        self._cancelled = True
+
+    def _start(self, weights: str, conf_thres: float, imgsz: int) -> bool:
+        if self.busy:
+            self.logger.warning("Model load already in progress (%s)", self.pending_weights)
+            return False
+        self.state = 'loading'
+        self.pending_weights = weights
+        self.error = None
+        self._done.clear()
+        self._thread = threading.Thread(target=self._run, args=(weights, conf_thres, imgsz),
+                                        name="ModelLoader", daemon=True)
+        self._thread.start()
+        return True
+
+    def warm_up_sizes(self, imgsz: int) -> List[int]:
+        """需要暖機的推論尺寸（設定值、控制器各級、降載上限，皆不超過設定值）"""
+        sizes = {int(imgsz)}
+        controller = get_imgsz_controller()
+        if controller is not None:
+            sizes.update(level for level in controller.levels if level <= imgsz)
+        watchdog = get_frame_budget_watchdog()
+        if watchdog is not None:
+            sizes.update(max(32, int(step.value) // 32 * 32) for step in watchdog.ladder
+                         if step.action == 'imgsz' and step.value < imgsz)
+        return sorted(sizes)
+
+    def _run(self, weights: str, conf_thres: float, imgsz: int) -> None:
+        # 任何例外都要結束載入，否則 state 停在 loading、wait() 永遠等不到
+        try:
+            self._load(weights, conf_thres, imgsz)
+        except Exception as e:
+            self.logger.exception("Model load failed")
+            self._finish(False, f"Model load failed: {e}")
+
+    def _load(self, weights: str, conf_thres: float, imgsz: int) -> None:
+        # ultralytics / torch 在這個背景執行緒匯入，不佔用介面或擷取執行緒
+        detect = lazy_module('detect').load()
+        if detect is None:
+            self._finish(False, "detect module not available")
+            return
+
+        # 每次都載入新的實例，暖機期間擷取執行緒仍獨佔目前的模型
+        start = time.perf_counter()
+        model = detect.load_model(weights)
+        load_ms = (time.perf_counter() - start) * 1000.0
+        if model is None:
+            self._finish(False, f"Failed to load model '{weights}'")
+            return
+        self.state = 'warming'
+
+        sizes = self.warm_up_sizes(imgsz)
+        start = time.perf_counter()
+        measured = warm_up_levels(
+            lambda image, size: detect.detect_objects(model, image, conf_thres=conf_thres, imgsz=size),
+            sizes, self.image_shape, self.runs, self.logger)
+        warm_up_ms = (time.perf_counter() - start) * 1000.0
+        if not measured:
+            self._finish(False, f"Warm-up failed at every imgsz {sizes}")
+            return
+
+        if self._cancelled:
+            self._finish(False, "Model load cancelled")
+            return
+
+        # 暖機完成後才換上（單一指定，擷取執行緒每帧只讀一次）
+        from CamOperation_class import set_ai_model
+        set_ai_model(model)
+        self.model = model
+        self.weights = weights
+        self.imgsz = int(imgsz)
+        self.load_ms = load_ms
+        self.warm_up_ms = warm_up_ms
+        self.warm_up_levels = measured
+        controller = get_imgsz_controller()
+        if controller is not None:
+            controller.seed_latencies(measured)
+
+        mark_startup(STARTUP_MODEL_READY)
+        MODEL_LOAD_TIME.set(load_ms / 1000.0)
+        MODEL_WARM_UP_TIME.set(warm_up_ms / 1000.0)
+        levels = ', '.join(f"{size}: {ms:.0f} ms" for size, ms in measured.items())
+        message = (f"{self.weights} ready at imgsz {self.imgsz} "
+                   f"(load {load_ms:.0f} ms, warm-up {warm_up_ms:.0f} ms; {levels})")
+        self._finish(True, message)
+
+    def _finish(self, success: bool, message: str) -> None:
+        self.state = 'ready' if success else 'failed'
+        if not success:
+            self.error = message
+            self.logger.error(message)
+        else:
+            self.logger.info(message)
+        MODEL_READY.set(1 if self.is_ready else 0)
+        MODEL_LOADS.labels('ok' if success else 'failed').inc()
+        self.history.append({
+            'time': time.time(),
+            'weights': self.pending_weights,
+            'success': success,
+            'load_ms': self.load_ms if success else None,
+            'warm_up_ms': self.warm_up_ms if success else None,
+            'message': message
+        })
+        self.pending_weights = None
+        self._done.set()
+        if self.notify is not None:
+            try:
+                self.notify(success, message)
+            except Exception as e:
+                self.logger.warning("Model ready notification failed: %s", e)
+
+    # ========== 統計 ==========
+
+    def get_statistics(self) -> Dict:
+        """
+        獲取統計資訊
+
+        Returns:
+            dict: 統計資訊
+        """
+        return {
+            'state': self.state,
+            'ready': self.is_ready,
+            'weights': self.weights,
+            'imgsz': self.imgsz,
+            'pending_weights': self.pending_weights,
+            'load_ms': self.load_ms,
+            'warm_up_ms': self.warm_up_ms,
+            'warm_up_levels': dict(self.warm_up_levels),
+            'error': self.error,
+            'loads': len(self.history)
+        }
+
+    def print_statistics(self) -> None:
+        """列印統計資訊"""
+        stats = self.get_statistics()
+        print("\n" + "=" * 60)
+        print("Model Loader Statistics")
+        print("=" * 60)
+        print(f"State:           {stats['state']} ({'ready' if stats['ready'] else 'not ready'})")
+        print(f"Weights:         {stats['weights']} (imgsz {stats['imgsz']})")
+        if stats['load_ms'] is not None:
+            print(f"Load time:       {stats['load_ms']:.0f} ms")
+        if stats['warm_up_ms'] is not None:
+            print(f"Warm-up time:    {stats['warm_up_ms']:.0f} ms "
+                  f"({', '.join(f'{size}={ms:.0f} ms' for size, ms in stats['warm_up_levels'].items())})")
+        if stats['error']:
+            print(f"Last error:      {stats['error']}")
+        print("=" * 60 + "\n")
+
+
+# 全域模型載入器實例
+model_loader = None
+
+
+def start_model_loader(image_shape=DEFAULT_WARM_UP_SHAPE, runs=2, notify=None):
+    """啟動模型載入器"""
+    global model_loader
+    if model_loader is None:
+        model_loader = ModelLoader(image_shape, runs, notify)
+    return model_loader
+
+
+def get_model_loader():
+    """獲取模型載入器實例"""
+    return model_loader
+
+
+def stop_model_loader():
+    """停止模型載入器（進行中的載入會在背景結束，不再換上模型）"""
+    global model_loader
+    if model_loader:
+        model_loader.cancel()
+        model_loader.print_statistics()
+        model_loader = None
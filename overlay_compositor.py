@@ -0,0 +1,148 @@
+# overlay_compositor.py
+"""
+疊圖合成
+偵測框、區域、追蹤軌跡與統計文字先記錄成 OverlayScene（推論解析度座標，不碰影像），
+再由 compose_overlay() 依目標影像大小縮放座標，一次畫到預覽解析度的緩衝區上
+
+- 推論用的影像永遠不會被修改或複製
+- 只有顯示端需要這一帧時才合成（PreviewPipeline 在縮圖後呼叫）
+- 文字大小以目標影像像素為準，縮小的預覽上仍然可讀
+
+使用方式:
+    scene = OverlayScene(width, height)
+    scene.add_box(x1, y1, x2, y2, (0, 255, 0), label="PET 0.91")
+    scene.add_hline(top_line_y, (255, 255, 0), 3)
+    scene.add_stat("Active Tracks: 3")
+    compose_overlay(preview_image, scene)
+"""
+
+from dataclasses import dataclass, field
+from typing import List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+Color = Tuple[int, int, int]
+
+FONT = cv2.FONT_HERSHEY_SIMPLEX
+STATS_ORIGIN = (10, 10)         # 統計面板左上角（目標影像像素）
+STATS_WIDTH = 340               # 統計面板寬度
+STATS_LINE_HEIGHT = 25          # 統計文字行距
+
+
+@dataclass
+class OverlayBox:
+    """偵測框或追蹤框"""
+    x1: float
+    y1: float
+    x2: float
+    y2: float
+    color: Color
+    thickness: int = 2
+    label: Optional[str] = None         # 框上方的文字
+    label_filled: bool = True           # True: 文字放在實心底色上；False: 文字以框的顏色直接繪製
+    center_marker: bool = False         # 是否在中心畫實心圓點
+
+
+@dataclass
+class OverlayScene:
+    """一帧的疊圖內容（座標皆為推論影像的像素）"""
+    width: int                                                  # 推論影像寬度
+    height: int                                                 # 推論影像高度
+    rgb: bool = True                                            # 目標影像是否為 RGB（False 表示 BGR）
+    boxes: List[OverlayBox] = field(default_factory=list)
+    hlines: List[Tuple[float, Color, int]] = field(default_factory=list)              # (y, 顏色, 線寬)
+    zones: List[Tuple[float, float, Color, int]] = field(default_factory=list)        # (上緣 y, 下緣 y, 顏色, 線寬)
+    texts: List[Tuple[float, float, str, Color, float]] = field(default_factory=list) # (x, y, 文字, 顏色, 字體大小)
+    trails: List[Tuple[np.ndarray, Color, int]] = field(default_factory=list)        # (N x 2 中心點, 顏色, 線寬)
+    stats: List[Tuple[str, Color]] = field(default_factory=list)                      # 統計面板文字
+
+    def color(self, bgr: Color) -> Color:
+        """將 BGR 顏色轉為此場景目標影像的通道順序"""
+        return (bgr[2], bgr[1], bgr[0]) if self.rgb else tuple(bgr)
+
+    def add_box(self, x1, y1, x2, y2, color: Color, thickness: int = 2, label: Optional[str] = None,
+                label_filled: bool = True, center_marker: bool = False) -> None:
+        self.boxes.append(OverlayBox(float(x1), float(y1), float(x2), float(y2), color, thickness,
+                                     label, label_filled, center_marker))
+
+    def add_hline(self, y, color: Color, thickness: int = 2) -> None:
+        self.hlines.append((float(y), color, thickness))
+
+    def add_zone(self, top, bottom, color: Color, thickness: int = 2) -> None:
+        self.zones.append((float(top), float(bottom), color, thickness))
+
+    def add_text(self, x, y, text: str, color: Color, font_scale: float = 0.6) -> None:
+        self.texts.append((float(x), float(y), text, color, font_scale))
+
+    def add_trail(self, points: Sequence[Tuple[float, float]], color: Color, thickness: int = 2) -> None:
+        if len(points) > 1:
+            self.trails.append((np.asarray(points, dtype=np.float32), color, thickness))
+
+    def add_stat(self, text: str, color: Color = (255, 255, 255)) -> None:
+        self.stats.append((text, color))
+
+
+def compose_overlay(image: np.ndarray, scene: OverlayScene) -> np.ndarray:
+    """
+    將場景一次畫到 image 上（直接修改 image）
+
+    Parameters:
+        image: 目標影像（通常是預覽解析度的緩衝區），大小可與推論影像不同
+        scene: 疊圖內容
+
+    Returns:
+        np.ndarray: image
+    """
+    h, w = image.shape[:2]
+    sx = w / scene.width if scene.width else 1.0
+    sy = h / scene.height if scene.height else 1.0
+    # 線寬依縮放比例縮小，但至少 1 像素
+    line_scale = min(sx, sy)
+
+    def px(x, y):
+        return int(round(x * sx)), int(round(y * sy))
+
+    def lw(thickness):
+        return thickness if thickness < 0 else max(1, int(round(thickness * line_scale)))
+
+    for top, bottom, color, thickness in scene.zones:
+        cv2.rectangle(image, px(0, top), (w, int(round(bottom * sy))), color, lw(thickness))
+
+    for y, color, thickness in scene.hlines:
+        y_px = int(round(y * sy))
+        cv2.line(image, (0, y_px), (w, y_px), color, lw(thickness))
+
+    for points, color, thickness in scene.trails:
+        scaled = np.round(points * (sx, sy)).astype(np.int32).reshape(-1, 1, 2)
+        cv2.polylines(image, [scaled], False, color, lw(thickness))
+
+    for box in scene.boxes:
+        p1, p2 = px(box.x1, box.y1), px(box.x2, box.y2)
+        cv2.rectangle(image, p1, p2, box.color, lw(box.thickness))
+        if box.center_marker:
+            center = ((p1[0] + p2[0]) // 2, (p1[1] + p2[1]) // 2)
+            cv2.circle(image, center, max(2, int(round(5 * line_scale))), box.color, -1)
+        if box.label:
+            if box.label_filled:
+                (text_w, text_h), baseline = cv2.getTextSize(box.label, FONT, 0.5, 1)
+                cv2.rectangle(image, (p1[0], p1[1] - text_h - baseline - 5), (p1[0] + text_w, p1[1]),
+                              box.color, -1)
+                cv2.putText(image, box.label, (p1[0], p1[1] - baseline - 2), FONT, 0.5, (0, 0, 0), 1)
+            else:
+                cv2.putText(image, box.label, (p1[0], p1[1] - 10), FONT, 0.5, box.color, 2)
+
+    for x, y, text, color, font_scale in scene.texts:
+        cv2.putText(image, text, px(x, y), FONT, font_scale, color, 2)
+
+    if scene.stats:
+        # 半透明底色只處理面板區域，不複製整張影像
+        x0, y0 = STATS_ORIGIN
+        panel = image[y0:y0 + 15 + STATS_LINE_HEIGHT * len(scene.stats), x0:x0 + STATS_WIDTH]
+        np.right_shift(panel, 1, out=panel)
+        y_text = y0 + 25
+        for text, color in scene.stats:
+            cv2.putText(image, text, (x0 + 10, y_text), FONT, 0.6, color, 2)
+            y_text += STATS_LINE_HEIGHT
+
+    return image
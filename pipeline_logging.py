@@ -0,0 +1,225 @@
+# pipeline_logging.py
+"""
+熱路徑的非同步日誌
+擷取 / 推論執行緒只把 LogRecord 放進有界佇列，格式化與寫入主控台由背景執行緒（QueueListener）完成，
+Windows 主控台輸出變慢時擷取執行緒也不會被阻塞；佇列滿時丟棄並計數
+
+- 每個類別（logger 名稱）有自己的等級，例如 TrackManager 只輸出 WARNING
+- 每則訊息模板可設定速率上限（token bucket）或取樣（每 N 則保留 1 則），被略過的數量附加在下一則輸出
+- 低於等級的訊息在呼叫端只做一次等級比較，不建立字串（請用 logger.debug("x=%d", x) 而不是 f-string）
+- 訊息參數在背景執行緒才格式化，請只傳入之後不會被修改的值（數字、字串、tuple）
+
+使用方式:
+    from pipeline_logging import get_pipeline_logger
+    logger = get_pipeline_logger("TrackManager")
+    logger.info("New track ID=%d", track_id)
+
+    configure_pipeline_logging(levels={"TrackManager": "WARNING"},
+                               rate_limits={"TCPServer": 2.0},
+                               sampling={"CamOperation": 30})
+"""
+
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+from typing import Dict, Optional
+
+LOG_FORMAT = '[%(name)s] %(message)s'
+DEFAULT_QUEUE_SIZE = 4096
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    依訊息模板限制輸出速率或取樣
+    同一模板（logger 名稱 + 未格式化的訊息）共用一個 token bucket；WARNING 以上不受限制
+    """
+
+    def __init__(self, rate_per_s: Optional[float] = None, burst: int = 5, sample_every: int = 1):
+        """
+        Parameters:
+            rate_per_s: 每個模板每秒最多輸出幾則，None 表示不限速
+            burst: 突發上限
+            sample_every: 每 N 則保留 1 則（1 表示不取樣）
+        """
+        super().__init__()
+        self.rate_per_s = rate_per_s
+        self.burst = burst
+        self.sample_every = max(1, int(sample_every))
+        self._buckets: Dict[tuple, list] = {}   # key -> [tokens, last_time, seen, suppressed]
+        self._lock = threading.Lock()
+        self.suppressed_total = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [float(self.burst), now, 0, 0]
+            bucket[2] += 1
+            allowed = (bucket[2] - 1) % self.sample_every == 0
+            if allowed and self.rate_per_s is not None:
+                bucket[0] = min(float(self.burst), bucket[0] + (now - bucket[1]) * self.rate_per_s)
+                bucket[1] = now
+                if bucket[0] >= 1.0:
+                    bucket[0] -= 1.0
+                else:
+                    allowed = False
+            if not allowed:
+                bucket[3] += 1
+                self.suppressed_total += 1
+                return False
+            suppressed, bucket[3] = bucket[3], 0
+        if suppressed:
+            record.msg = f"{record.msg} (+{suppressed} suppressed)"
+        return True
+
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """佇列滿時丟棄，且不在呼叫端格式化訊息"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 預設的 prepare() 會在呼叫端執行 format()；格式化留給背景執行緒
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class PipelineLogging:
+    """共用的日誌佇列與背景輸出執行緒"""
+
+    def __init__(self, queue_size: int = DEFAULT_QUEUE_SIZE, handler: Optional[logging.Handler] = None):
+        """
+        Parameters:
+            queue_size: 佇列上限（則數），滿時丟棄新訊息
+            handler: 實際輸出的 handler，預設為主控台
+        """
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.queue_handler = _NonBlockingQueueHandler(self.queue)
+        if handler is None:
+            handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        self.output_handler = handler
+        self.listener = logging.handlers.QueueListener(self.queue, handler, respect_handler_level=True)
+        self.listener.start()
+        self.filters: Dict[str, RateLimitFilter] = {}
+        self.loggers: Dict[str, logging.Logger] = {}
+
+    def get_logger(self, name: str, level=logging.INFO, rate_per_s: Optional[float] = None) -> logging.Logger:
+        """取得（必要時設定）經由佇列輸出的 logger"""
+        logger = self.loggers.get(name)
+        if logger is None:
+            logger = logging.getLogger(name)
+            # 移除舊的同步 handler，避免同一則訊息在擷取執行緒上再輸出一次
+            for handler in list(logger.handlers):
+                logger.removeHandler(handler)
+            logger.addHandler(self.queue_handler)
+            logger.propagate = False
+            logger.setLevel(level)
+            self.loggers[name] = logger
+            if rate_per_s is not None:
+                self.set_rate_limit(name, rate_per_s)
+        return logger
+
+    def set_rate_limit(self, name: str, rate_per_s: Optional[float] = None,
+                       burst: int = 5, sample_every: int = 1) -> None:
+        """設定類別的速率上限 / 取樣（取代之前的設定）"""
+        logger = self.get_logger(name)
+        old = self.filters.pop(name, None)
+        if old is not None:
+            logger.removeFilter(old)
+        if rate_per_s is None and sample_every <= 1:
+            return
+        rate_filter = RateLimitFilter(rate_per_s, burst, sample_every)
+        logger.addFilter(rate_filter)
+        self.filters[name] = rate_filter
+
+    def get_statistics(self) -> Dict:
+        """
+        獲取統計資訊
+
+        Returns:
+            dict: 統計資訊
+        """
+        return {
+            'queue_depth': self.queue.qsize(),
+            'dropped': self.queue_handler.dropped,
+            'levels': {name: logging.getLevelName(logger.level) for name, logger in self.loggers.items()},
+            'suppressed': {name: f.suppressed_total for name, f in self.filters.items()}
+        }
+
+    def stop(self) -> None:
+        """輸出佇列中剩餘的訊息後停止背景執行緒"""
+        self.listener.stop()
+
+
+# 全域日誌實例（第一次取得 logger 時建立）
+pipeline_logging = None
+_init_lock = threading.Lock()
+
+
+def _get_pipeline_logging() -> PipelineLogging:
+    global pipeline_logging
+    if pipeline_logging is None:
+        with _init_lock:
+            if pipeline_logging is None:
+                pipeline_logging = PipelineLogging()
+    return pipeline_logging
+
+
+def get_pipeline_logger(name: str, level=logging.INFO, rate_per_s: Optional[float] = None) -> logging.Logger:
+    """
+    取得經由背景執行緒輸出的 logger（取代各類別自行加上 StreamHandler 的寫法）
+
+    Parameters:
+        name: 類別名稱（輸出為 "[name] message"）
+        level: 初始等級（已設定過的類別保持原等級）
+        rate_per_s: 預設的每個訊息模板每秒最多則數（已設定過的類別保持原設定）
+
+    Returns:
+        logging.Logger: logger
+    """
+    return _get_pipeline_logging().get_logger(name, level, rate_per_s)
+
+
+def configure_pipeline_logging(levels: Optional[Dict[str, str]] = None,
+                               rate_limits: Optional[Dict[str, float]] = None,
+                               sampling: Optional[Dict[str, int]] = None) -> None:
+    """
+    設定各類別的等級、速率上限與取樣
+
+    Parameters:
+        levels: {類別: "DEBUG" / "INFO" / "WARNING" / ...}
+        rate_limits: {類別: 每個訊息模板每秒最多則數}
+        sampling: {類別: 每 N 則保留 1 則}
+    """
+    logs = _get_pipeline_logging()
+    for name, level in (levels or {}).items():
+        logs.get_logger(name).setLevel(level.upper() if isinstance(level, str) else level)
+    for name in set(rate_limits or {}) | set(sampling or {}):
+        logs.set_rate_limit(name, (rate_limits or {}).get(name), sample_every=(sampling or {}).get(name, 1))
+
+
+def get_logging_statistics() -> Dict:
+    """獲取日誌佇列統計資訊"""
+    return _get_pipeline_logging().get_statistics()
+
+
+def stop_pipeline_logging() -> None:
+    """輸出剩餘訊息後停止日誌執行緒"""
+    global pipeline_logging
+    if pipeline_logging is not None:
+        pipeline_logging.stop()
+        pipeline_logging = None
@@ -0,0 +1,361 @@
+# pipeline_metrics.py
+"""
+管線健康指標（Prometheus 文字格式）
+計數器在事件發生時遞增（擷取、推論、觸發、ACK 各自更新），抓取時只把現值轉成文字，不重新計算；
+佇列深度、消費者 lag 等瞬時值由註冊的 collector 在抓取時讀取
+
+- 只監聽本機（預設 127.0.0.1:9108），GET /metrics
+- 不依賴 prometheus_client；Counter / Gauge / Histogram 只做加法與指定，無鎖
+  （每個指標通常只由一個執行緒更新，偶發的並行更新最多少算一次）
+- 逐階段延遲分位數來自 frame_trace 的直方圖（需啟動 FrameTracer）
+- LatencyStats 保留最近樣本供各模組 get_statistics 計算分位數（不匯出）
+
+使用方式:
+    from pipeline_metrics import metrics
+    FRAMES = metrics.counter('nircam_frames_grabbed_total', 'Frames received from the camera')
+    FRAMES.inc()
+    SKIPS = metrics.counter('nircam_trigger_skips_total', 'Trigger skips', ('reason',))
+    SKIPS.labels('low_confidence').inc()
+
+    start_metrics_server(port=9108)
+    curl http://127.0.0.1:9108/metrics
+"""
+
+import bisect
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from frame_trace import STAGE_NAMES, get_frame_tracer
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_PORT = 9108
+
+# collector 回傳 [(名稱, 類型, 說明, [(標籤字典, 值), ...]), ...]
+Sample = Tuple[Dict[str, str], float]
+Family = Tuple[str, str, str, List[Sample]]
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    """指標的共同部分（名稱、說明、標籤）"""
+    kind = 'untyped'
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[tuple, '_Metric'] = {}
+
+    def labels(self, *values):
+        """取得某組標籤值的子指標（第一次使用時建立）"""
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            child = self._new_child()
+            self._children = {**self._children, key: child}
+        return child
+
+    def _new_child(self):
+        return type(self)(self.name, self.help)
+
+    def _series(self):
+        """[(標籤字典, 子指標), ...]"""
+        if not self.labelnames:
+            return [({}, self)]
+        return [(dict(zip(self.labelnames, key)), child) for key, child in self._children.items()]
+
+
+class Counter(_Metric):
+    """單調遞增的計數器"""
+    kind = 'counter'
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help_text, labelnames)
+        self.value = 0
+
+    def inc(self, amount=1) -> None:
+        self.value += amount
+
+    def samples(self) -> List[Sample]:
+        return [(labels, child.value) for labels, child in self._series()]
+
+
+class Gauge(_Metric):
+    """瞬時值（可指定讀值函式，抓取時呼叫）"""
+    kind = 'gauge'
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help_text, labelnames)
+        self.value = 0.0
+        self._function: Optional[Callable[[], float]] = None
+
+    def set(self, value) -> None:
+        self.value = value
+
+    def set_function(self, function: Optional[Callable[[], float]]) -> None:
+        self._function = function
+
+    def samples(self) -> List[Sample]:
+        result = []
+        for labels, child in self._series():
+            value = child.value
+            if child._function is not None:
+                try:
+                    value = child._function()
+                except Exception:
+                    continue
+            result.append((labels, value))
+        return result
+
+
+class Histogram(_Metric):
+    """固定分界的直方圖（observe 只做一次二分搜尋與兩次加法）"""
+    kind = 'histogram'
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+
+    def _new_child(self):
+        return Histogram(self.name, self.help, buckets=self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def render(self, lines: List[str]) -> None:
+        for labels, child in self._series():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), child.counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': _format_value(bound)})} "
+                             f"{cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(child.sum)}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {cumulative}")
+
+
+class LatencyStats:
+    """保留最近 N 筆延遲樣本並計算分位數"""
+
+    def __init__(self, max_samples: int = 4096):
+        self.samples = deque(maxlen=max_samples)
+        self.count = 0
+
+    def add(self, value_ms: float) -> None:
+        """加入一筆延遲樣本（毫秒）"""
+        self.samples.append(value_ms)
+        self.count += 1
+
+    def quantiles(self, points=(0.5, 0.99, 0.999)) -> Dict[str, float]:
+        """
+        計算分位數
+
+        Returns:
+            dict: {'p50': ..., 'p99': ..., 'p99.9': ..., 'max': ...}（毫秒），無樣本時為空
+        """
+        if not self.samples:
+            return {}
+        ordered = sorted(self.samples)
+        result = {}
+        for p in points:
+            index = min(len(ordered) - 1, int(p * len(ordered)))
+            result[f"p{p * 100:g}"] = ordered[index]
+        result['max'] = ordered[-1]
+        return result
+
+
+class MetricsRegistry:
+    """指標與 collector 的集合"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: Dict[str, Callable[[], List[Family]]] = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name: str, help_text: str, labelnames: Sequence[str], **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = cls(name, help_text, labelnames, **kwargs)
+                self._metrics = {**self._metrics, name: metric}
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric '{name}' already registered as {metric.kind}")
+            return metric
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+        """取得（必要時建立）計數器"""
+        return self._get_or_create(Counter, name, help_text, labelnames)
+
+    def gauge(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Gauge:
+        """取得（必要時建立）瞬時值"""
+        return self._get_or_create(Gauge, name, help_text, labelnames)
+
+    def histogram(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)) -> Histogram:
+        """取得（必要時建立）直方圖"""
+        return self._get_or_create(Histogram, name, help_text, labelnames, buckets=buckets)
+
+    def register_collector(self, key: str, collector: Callable[[], List[Family]]) -> None:
+        """
+        註冊抓取時才讀取的指標（同一 key 會取代之前的 collector）
+
+        Parameters:
+            key: collector 名稱
+            collector: 回傳 [(名稱, 類型, 說明, [(標籤字典, 值), ...]), ...]
+        """
+        with self._lock:
+            self._collectors = {**self._collectors, key: collector}
+
+    def unregister_collector(self, key: str) -> None:
+        """移除 collector"""
+        with self._lock:
+            self._collectors = {k: c for k, c in self._collectors.items() if k != key}
+
+    def render(self) -> str:
+        """
+        輸出 Prometheus 文字格式
+
+        Returns:
+            str: 所有指標
+        """
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            if isinstance(metric, Histogram):
+                metric.render(lines)
+                continue
+            for labels, value in metric.samples():
+                lines.append(f"{metric.name}{_format_labels(labels)} {_format_value(value)}")
+        for key, collector in self._collectors.items():
+            try:
+                families = collector()
+            except Exception as e:
+                lines.append(f"# collector '{key}' failed: {e}")
+                continue
+            for name, kind, help_text, samples in families:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+def collect_stage_latency() -> List[Family]:
+    """FrameTracer 的逐階段延遲（summary，秒）"""
+    tracer = get_frame_tracer()
+    if tracer is None:
+        return []
+    samples = []
+    counts = []
+    for stage, name in enumerate(STAGE_NAMES):
+        quantiles = tracer.quantiles(stage)
+        if not quantiles:
+            continue
+        for key, quantile in (('p50', '0.5'), ('p99', '0.99'), ('p99.9', '0.999')):
+            samples.append(({'stage': name, 'quantile': quantile}, quantiles[key] / 1000.0))
+        counts.append(({'stage': name}, int(tracer.histograms[stage].sum())))
+    return [
+        ('nircam_stage_latency_seconds', 'summary', 'Per-frame stage latency from the frame tracer', samples),
+        ('nircam_stage_samples_total', 'counter', 'Per-frame stage samples recorded by the frame tracer', counts),
+    ]
+
+
+# 全域指標（模組載入時即存在，各模組直接遞增；伺服器另外啟動）
+metrics = MetricsRegistry()
+metrics.register_collector('stage_latency', collect_stage_latency)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry: MetricsRegistry = metrics
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass   # 每次抓取不輸出存取記錄
+
+
+class MetricsServer:
+    """本機 HTTP 指標端點"""
+
+    def __init__(self, registry: MetricsRegistry = metrics, host: str = '127.0.0.1', port: int = DEFAULT_PORT):
+        """
+        初始化並啟動指標伺服器
+
+        Parameters:
+            registry: 指標集合
+            host: 監聽位址（預設只接受本機）
+            port: 監聽埠（0 表示由系統分配）
+        """
+        handler = type('MetricsHandler', (_MetricsHandler,), {'registry': registry})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.host = host
+        self.port = self.httpd.server_address[1]
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="MetricsServer", daemon=True)
+        self._thread.start()
+
+        print(f"[MetricsServer] Initialized: http://{host}:{self.port}/metrics")
+
+    def stop(self) -> None:
+        """停止伺服器"""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+# 全域指標伺服器實例
+metrics_server = None
+
+
+def start_metrics_server(host='127.0.0.1', port=DEFAULT_PORT):
+    """啟動指標伺服器"""
+    global metrics_server
+    if metrics_server is None:
+        metrics_server = MetricsServer(metrics, host, port)
+    return metrics_server
+
+
+def get_metrics_server():
+    """獲取指標伺服器實例"""
+    return metrics_server
+
+
+def stop_metrics_server():
+    """停止指標伺服器"""
+    global metrics_server
+    if metrics_server:
+        metrics_server.stop()
+        metrics_server = None
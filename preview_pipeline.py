@@ -0,0 +1,320 @@
+# preview_pipeline.py
+"""
+Qt 顯示用的預覽管線
+擷取執行緒只提交影像參考，縮圖與色彩轉換在背景執行緒完成，GUI 執行緒只負責把已縮好的 RGB 小圖貼上
+
+- 縮到顯示元件大小（INTER_AREA，保持長寬比），GUI 執行緒不再做全解析度的 QImage 複製、rgbSwapped 與平滑縮放
+- 每個通道（例如 original / processed）有 fps 上限，超出時 submit() 直接返回
+- 訊號合併：同一通道同時只有一個「有新預覽」通知在 Qt 佇列中，GUI 用 take() 取最新的一張，
+  GUI 忙碌時中間的帧直接被取代，不會累積在事件佇列
+- 不可見的通道（隱藏的分頁）submit() 直接返回，不做任何轉換
+- 疊圖（OverlayScene）在縮圖之後畫在預覽緩衝區上，推論用的影像不被修改
+
+使用方式（GUI 端）:
+    preview = start_preview_pipeline(max_fps=15, notify=signals.preview_ready.emit)
+    preview.set_target('original', label.width(), label.height(), label.isVisible())
+    # preview_ready(name) 槽函式中: image = preview.take(name)
+"""
+
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+import cv2
+import numpy as np
+
+from frame_pool import FrameHandle
+from overlay_compositor import compose_overlay
+
+
+class _PreviewChannel:
+    """單一顯示目標的狀態"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.width = 0
+        self.height = 0
+        self.visible = True
+        self.next_due = 0.0
+        self.pending = None         # (image 或 FrameHandle, is_rgb, overlay)，尚未縮圖的最新帧
+        self.preview = None         # 已縮好、尚未被 GUI 取走的 RGB 預覽
+        self.notified = False       # 是否已有通知在 GUI 佇列中
+
+        # 統計資訊
+        self.submitted = 0
+        self.hidden = 0             # 不可見而略過
+        self.rate_limited = 0       # 超過 fps 上限而略過
+        self.replaced = 0           # 尚未縮圖 / 尚未顯示就被新帧取代
+        self.rendered = 0
+        self.painted = 0
+
+
+class PreviewPipeline:
+    """背景縮圖 + fps 上限 + 訊號合併"""
+
+    def __init__(self,
+                 max_fps: float = 15.0,
+                 notify: Optional[Callable[[str], None]] = None,
+                 interpolation: int = cv2.INTER_AREA):
+        """
+        初始化預覽管線
+
+        Parameters:
+            max_fps: 每個通道的預覽帧率上限
+            notify: 有新預覽時呼叫 notify(name)（通常是 Qt 訊號的 emit，以佇列方式交給 GUI 執行緒）
+            interpolation: 縮圖插值方式
+        """
+        self.max_fps = max_fps
+        self.fps_cap: Optional[float] = None    # 暫時的帧率上限（帧預算降載時設定），None 表示不限制
+        self.notify = notify
+        self.interpolation = interpolation
+        self.channels: Dict[str, _PreviewChannel] = {}
+        self.render_ms_total = 0.0
+        self._cond = threading.Condition()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="PreviewPipeline", daemon=True)
+        self._thread.start()
+
+        print(f"[PreviewPipeline] Initialized: max {max_fps} fps per channel")
+
+    def _channel(self, name: str) -> _PreviewChannel:
+        channel = self.channels.get(name)
+        if channel is None:
+            channel = _PreviewChannel(name)
+            self.channels = {**self.channels, name: channel}
+        return channel
+
+    def set_target(self, name: str, width: int, height: int, visible: Optional[bool] = None) -> None:
+        """
+        設定通道的顯示大小（GUI 執行緒呼叫）
+
+        Parameters:
+            name: 通道名稱
+            width, height: 顯示元件大小（像素）
+            visible: 是否可見，None 表示不變
+        """
+        with self._cond:
+            channel = self._channel(name)
+            channel.width, channel.height = int(width), int(height)
+            if visible is not None:
+                self._set_visible(channel, visible)
+
+    def set_visible(self, name: str, visible: bool) -> None:
+        """設定通道是否可見（隱藏的分頁不做任何預覽處理）"""
+        with self._cond:
+            self._set_visible(self._channel(name), visible)
+
+    def _set_visible(self, channel: _PreviewChannel, visible: bool) -> None:
+        channel.visible = bool(visible)
+        if not channel.visible:
+            self._drop_pending(channel)
+            channel.preview = None
+
+    def _drop_pending(self, channel: _PreviewChannel) -> None:
+        if channel.pending is not None:
+            image = channel.pending[0]
+            if isinstance(image, FrameHandle):
+                image.release()
+            channel.pending = None
+
+    def wants(self, name: str) -> bool:
+        """
+        此通道現在是否需要新帧（可見且已到 fps 間隔），讓呼叫端在需要時才準備影像
+
+        Returns:
+            bool: 是否需要
+        """
+        channel = self.channels.get(name)
+        if channel is None:
+            return True
+        return channel.visible and time.monotonic() >= channel.next_due
+
+    def submit(self, name: str, image, is_rgb: bool = True, overlay=None) -> bool:
+        """
+        提交一帧（擷取執行緒呼叫，不阻塞、不轉換）
+
+        Parameters:
+            name: 通道名稱
+            image: 影像，或 FrameHandle（被接受時 retain()，縮圖後 release()）；
+                   一般 ndarray 由預覽執行緒持有，呼叫端之後不得修改
+            is_rgb: image 是否為 RGB（False 表示 BGR）
+            overlay: OverlayScene，縮圖後畫在預覽上（座標為 image 的像素），None 表示不疊圖
+
+        Returns:
+            bool: 是否被接受
+        """
+        now = time.monotonic()
+        with self._cond:
+            channel = self._channel(name)
+            channel.submitted += 1
+            if not channel.visible:
+                channel.hidden += 1
+                return False
+            if now < channel.next_due:
+                channel.rate_limited += 1
+                return False
+            max_fps = self.max_fps if self.fps_cap is None else min(self.max_fps, self.fps_cap)
+            if max_fps > 0:
+                period = 1.0 / max_fps
+                channel.next_due = max(channel.next_due, now - period) + period
+            if channel.pending is not None:
+                channel.replaced += 1
+                self._drop_pending(channel)
+            if isinstance(image, FrameHandle):
+                image.retain()
+            channel.pending = (image, is_rgb, overlay)
+            self._cond.notify()
+        return True
+
+    def take(self, name: str) -> Optional[np.ndarray]:
+        """
+        取出最新的預覽（GUI 執行緒在收到通知後呼叫）
+
+        Returns:
+            np.ndarray: RGB 預覽（已縮至顯示大小、連續記憶體），沒有新預覽時為 None
+        """
+        with self._cond:
+            channel = self._channel(name)
+            channel.notified = False
+            preview, channel.preview = channel.preview, None
+            if preview is not None:
+                channel.painted += 1
+            return preview
+
+    def _next_job(self):
+        with self._cond:
+            while self._running:
+                for channel in self.channels.values():
+                    if channel.pending is not None:
+                        job = (channel, channel.width, channel.height) + channel.pending
+                        channel.pending = None
+                        return job
+                self._cond.wait()
+        return None
+
+    def _run(self) -> None:
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            channel, width, height, image, is_rgb, overlay = job
+            start = time.perf_counter()
+            try:
+                preview = self._render(image.array if isinstance(image, FrameHandle) else image,
+                                       width, height, is_rgb)
+                if overlay is not None:
+                    compose_overlay(preview, overlay)
+            except Exception as e:
+                print(f"[PreviewPipeline] Failed to render '{channel.name}': {e}")
+                continue
+            finally:
+                if isinstance(image, FrameHandle):
+                    image.release()
+            self.render_ms_total += (time.perf_counter() - start) * 1000.0
+
+            with self._cond:
+                if not channel.visible:
+                    continue
+                if channel.preview is not None:
+                    channel.replaced += 1
+                channel.preview = preview
+                channel.rendered += 1
+                # 已有通知在 GUI 佇列中時只替換預覽，不再發通知
+                send = not channel.notified
+                channel.notified = True
+            if send and self.notify is not None:
+                self.notify(channel.name)
+
+    def _render(self, image: np.ndarray, width: int, height: int, is_rgb: bool) -> np.ndarray:
+        """縮到顯示大小（只縮小不放大）並轉為 RGB"""
+        src_h, src_w = image.shape[:2]
+        if width > 0 and height > 0:
+            scale = min(width / src_w, height / src_h, 1.0)
+        else:
+            scale = 1.0
+        if scale < 1.0:
+            size = (max(1, int(src_w * scale)), max(1, int(src_h * scale)))
+            image = cv2.resize(image, size, interpolation=self.interpolation)
+        if image.ndim == 2:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
+        elif not is_rgb:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        elif scale >= 1.0:
+            # 沒有經過任何轉換時需複製，來源緩衝區交還後可能被下一帧覆寫
+            image = image.copy()
+        return np.ascontiguousarray(image)
+
+    def get_statistics(self) -> Dict:
+        """
+        獲取統計資訊
+
+        Returns:
+            dict: 每個通道的統計資訊
+        """
+        stats = {}
+        for name, channel in self.channels.items():
+            stats[name] = {
+                'visible': channel.visible,
+                'target': (channel.width, channel.height),
+                'submitted': channel.submitted,
+                'hidden': channel.hidden,
+                'rate_limited': channel.rate_limited,
+                'replaced': channel.replaced,
+                'rendered': channel.rendered,
+                'painted': channel.painted
+            }
+        rendered = sum(channel.rendered for channel in self.channels.values())
+        stats['avg_render_ms'] = self.render_ms_total / rendered if rendered else 0.0
+        return stats
+
+    def print_statistics(self) -> None:
+        """列印統計資訊"""
+        stats = self.get_statistics()
+        print("\n" + "=" * 60)
+        print("Preview Pipeline Statistics")
+        print("=" * 60)
+        for name, channel in stats.items():
+            if name == 'avg_render_ms':
+                continue
+            print(f"{name}: target={channel['target'][0]}x{channel['target'][1]} "
+                  f"visible={channel['visible']} submitted={channel['submitted']} "
+                  f"hidden={channel['hidden']} rate_limited={channel['rate_limited']} "
+                  f"replaced={channel['replaced']} rendered={channel['rendered']} "
+                  f"painted={channel['painted']}")
+        print(f"Avg render ms:     {stats['avg_render_ms']:.2f}")
+        print("=" * 60 + "\n")
+
+    def stop(self) -> None:
+        """停止預覽執行緒並釋放尚未處理的帧"""
+        with self._cond:
+            self._running = False
+            for channel in self.channels.values():
+                self._drop_pending(channel)
+            self._cond.notify_all()
+        self._thread.join(timeout=2.0)
+
+
+# 全域預覽管線實例
+preview_pipeline = None
+
+
+def start_preview_pipeline(max_fps=15.0, notify=None, **kwargs):
+    """啟動預覽管線"""
+    global preview_pipeline
+    if preview_pipeline is None:
+        preview_pipeline = PreviewPipeline(max_fps, notify, **kwargs)
+    return preview_pipeline
+
+
+def get_preview_pipeline():
+    """獲取預覽管線實例"""
+    return preview_pipeline
+
+
+def stop_preview_pipeline():
+    """停止預覽管線"""
+    global preview_pipeline
+    if preview_pipeline:
+        preview_pipeline.stop()
+        preview_pipeline.print_statistics()
+        preview_pipeline = None
@@ -0,0 +1,491 @@
+# raw_frame_log.py
+"""
+原始 Bayer 帧記錄與重播
+將相機送出的原始感測器資料（buf_grab_image）與 MV_FRAME_OUT_INFO_EX 中繼資料附加寫入分段記錄檔，
+比存成解馬賽克後的 RGB JPEG 小約 4 倍且不需要編碼，適合收集資料集與事故重播
+
+檔案配置（一個資料夾一份記錄）:
+    manifest.json              版本、索引 dtype、時間戳頻率
+    segment_00000.raw          原始帧資料，逐帧緊接附加
+    segment_00000.idx          INDEX_DTYPE 固定長度索引列，可直接 np.memmap
+    segment_00001.raw / .idx   超過 max_segment_bytes 後換下一段
+
+寫入順序為「資料 → 索引列」，索引列存在即代表資料完整，讀取端可在錄製中途開啟記錄（refresh() 取得新帧）
+
+RawFrameLog 依帧序號或時間戳隨機存取；ReplayCamera 以同一介面模擬 MvCamera，
+可直接交給 CameraOperation 當作相機後端，依原始時間間隔即時重播或以最快速度重播
+"""
+
+import ctypes
+import json
+import mmap
+import os
+import queue
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from MvImport.MvErrorDefine_const import MV_E_NODATA, MV_E_SUPPORT, MV_OK
+from pipeline_metrics import LatencyStats
+
+LOG_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+
+INDEX_DTYPE = np.dtype([
+    ('frame_num', '<u4'),       # 相機帧號（nFrameNum）
+    ('width', '<u2'),
+    ('height', '<u2'),
+    ('pixel_type', '<u4'),      # enPixelType
+    ('frame_len', '<u4'),       # 資料位元組數（nFrameLen）
+    ('dev_timestamp', '<u8'),   # 相機裝置時間戳（nDevTimeStampHigh << 32 | nDevTimeStampLow）
+    ('host_timestamp', '<i8'),  # SDK 主機時間戳（nHostTimeStamp）
+    ('received_ns', '<u8'),     # 錄製端收到此帧的時間（time.time_ns()）
+    ('offset', '<u8'),          # 在資料段中的位移
+    ('trigger_index', '<u4'),   # 觸發計數（nTriggerIndex）
+    ('lost_packets', '<u4'),    # 本帧丟包數（nLostPacket）
+    ('exposure_us', '<f4'),     # 曝光時間（fExposureTime）
+    ('gain', '<f4'),            # 增益（fGain）
+], align=True)
+
+
+def _segment_paths(directory: str, segment: int) -> Tuple[str, str]:
+    """資料段與索引檔路徑"""
+    base = os.path.join(directory, f"segment_{segment:05d}")
+    return base + ".raw", base + ".idx"
+
+
+class RawFrameRecorder:
+    """
+    原始帧記錄器
+    record() 只在擷取執行緒上複製一次原始資料並排入佇列，寫檔由背景執行緒完成；
+    佇列滿時丟棄並計數（磁碟跟不上時不拖慢擷取）
+    """
+
+    def __init__(self,
+                 directory: str,
+                 max_segment_bytes: int = 1 << 30,
+                 queue_size: int = 64,
+                 timestamp_tick_hz: float = 1e9):
+        """
+        初始化記錄器
+
+        Parameters:
+            directory: 記錄資料夾（已有記錄時接在最後一段之後）
+            max_segment_bytes: 每個資料段的大小上限
+            queue_size: 待寫入佇列上限（帧數）
+            timestamp_tick_hz: 裝置時間戳頻率，寫入 manifest 供重播使用
+        """
+        self.directory = directory
+        self.max_segment_bytes = max_segment_bytes
+        os.makedirs(directory, exist_ok=True)
+
+        manifest_path = os.path.join(directory, MANIFEST_NAME)
+        if not os.path.exists(manifest_path):
+            with open(manifest_path, "w", encoding="utf-8") as f:
+                json.dump({
+                    'version': LOG_VERSION,
+                    'index_dtype': INDEX_DTYPE.descr,
+                    'index_itemsize': INDEX_DTYPE.itemsize,
+                    'timestamp_tick_hz': timestamp_tick_hz,
+                    'created_ns': time.time_ns()
+                }, f, indent=2)
+
+        self.segment = 0
+        while os.path.exists(_segment_paths(directory, self.segment + 1)[0]):
+            self.segment += 1
+        self._data_file = None
+        self._index_file = None
+        self._open_segment()
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.recorded = 0
+        self.dropped = 0
+        self.bytes_written = 0
+        self.write_ms = LatencyStats()
+        self._thread = threading.Thread(target=self._run, name="RawFrameRecorder", daemon=True)
+        self._thread.start()
+
+        print(f"[RawFrameRecorder] Recording to {directory} (segment {self.segment}, "
+              f"{max_segment_bytes / 1e6:.0f} MB per segment)")
+
+    def _open_segment(self) -> None:
+        """開啟（或接續）目前的資料段"""
+        if self._data_file is not None:
+            self._data_file.close()
+            self._index_file.close()
+        data_path, index_path = _segment_paths(self.directory, self.segment)
+        self._data_file = open(data_path, "ab")
+        self._index_file = open(index_path, "ab")
+        # 丟棄中斷錄製留下的半筆索引列
+        valid = self._index_file.tell() // INDEX_DTYPE.itemsize * INDEX_DTYPE.itemsize
+        if valid != self._index_file.tell():
+            self._index_file.truncate(valid)
+            self._index_file.seek(valid)
+
+    def record(self, buffer, frame_info) -> bool:
+        """
+        記錄一帧（擷取執行緒呼叫，不阻塞）
+
+        Parameters:
+            buffer: 原始資料緩衝區（ctypes 陣列，例如 buf_grab_image）
+            frame_info: MV_FRAME_OUT_INFO_EX
+
+        Returns:
+            bool: 是否排入，佇列已滿時為 False
+        """
+        frame_len = int(frame_info.nFrameLen)
+        # 擷取緩衝區會被下一帧覆寫，必須在這裡複製
+        data = ctypes.string_at(ctypes.addressof(buffer), frame_len)
+        row = np.zeros((), dtype=INDEX_DTYPE)
+        row['frame_num'] = frame_info.nFrameNum
+        row['width'] = frame_info.nWidth
+        row['height'] = frame_info.nHeight
+        row['pixel_type'] = frame_info.enPixelType
+        row['frame_len'] = frame_len
+        row['dev_timestamp'] = (int(frame_info.nDevTimeStampHigh) << 32) | int(frame_info.nDevTimeStampLow)
+        row['host_timestamp'] = frame_info.nHostTimeStamp
+        row['received_ns'] = time.time_ns()
+        row['trigger_index'] = frame_info.nTriggerIndex
+        row['lost_packets'] = frame_info.nLostPacket
+        row['exposure_us'] = frame_info.fExposureTime
+        row['gain'] = frame_info.fGain
+        try:
+            self.queue.put_nowait((row, data))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def _run(self) -> None:
+        while True:
+            job = self.queue.get()
+            if job is None:
+                break
+            row, data = job
+            start = time.perf_counter()
+            if self._data_file.tell() + len(data) > self.max_segment_bytes and self._data_file.tell() > 0:
+                self.segment += 1
+                self._open_segment()
+            row['offset'] = self._data_file.tell()
+            self._data_file.write(data)
+            self._data_file.flush()
+            # 資料寫完後才寫索引列
+            self._index_file.write(row.tobytes())
+            self._index_file.flush()
+            self.recorded += 1
+            self.bytes_written += len(data)
+            self.write_ms.add((time.perf_counter() - start) * 1000.0)
+
+    def get_statistics(self) -> Dict:
+        """
+        獲取統計資訊
+
+        Returns:
+            dict: 統計資訊
+        """
+        return {
+            'directory': self.directory,
+            'segment': self.segment,
+            'recorded': self.recorded,
+            'dropped': self.dropped,
+            'queue_depth': self.queue.qsize(),
+            'written_mb': self.bytes_written / 1e6,
+            'write_ms': self.write_ms.quantiles()
+        }
+
+    def print_statistics(self) -> None:
+        """列印統計資訊"""
+        stats = self.get_statistics()
+        print("\n" + "=" * 60)
+        print("Raw Frame Recorder Statistics")
+        print("=" * 60)
+        print(f"Directory:         {stats['directory']}")
+        print(f"Segments:          {stats['segment'] + 1}")
+        print(f"Recorded:          {stats['recorded']} ({stats['written_mb']:.1f} MB)")
+        print(f"Dropped (queue):   {stats['dropped']}")
+        print(f"Write ms:          p50={stats['write_ms'].get('p50', 0.0):.1f} "
+              f"p99={stats['write_ms'].get('p99', 0.0):.1f}")
+        print("=" * 60 + "\n")
+
+    def close(self) -> None:
+        """寫完佇列中的帧後關閉檔案"""
+        self.queue.put(None)
+        self._thread.join()
+        self._data_file.close()
+        self._index_file.close()
+
+
+class RawFrameLog:
+    """原始帧記錄讀取端（索引以 memmap 開啟，資料以 mmap 零複製存取）"""
+
+    def __init__(self, directory: str):
+        """
+        Parameters:
+            directory: 記錄資料夾
+        """
+        self.directory = directory
+        with open(os.path.join(directory, MANIFEST_NAME), encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        if self.manifest.get('version') != LOG_VERSION:
+            raise ValueError(f"Unsupported frame log version {self.manifest.get('version')}")
+        self.timestamp_tick_hz = float(self.manifest.get('timestamp_tick_hz', 1e9))
+
+        self._segments: List[Tuple[np.ndarray, Optional[mmap.mmap]]] = []
+        self.index = np.empty(0, dtype=INDEX_DTYPE)
+        self.segment_of = np.empty(0, dtype=np.int32)
+        self.refresh()
+
+    def refresh(self) -> int:
+        """
+        重新讀取索引（錄製中的記錄會有新帧）
+
+        Returns:
+            int: 目前的帧數
+        """
+        for segment_files in self._segments:
+            self._close_segment(segment_files)
+        self._segments = []
+        indexes, owners = [], []
+        segment = 0
+        while True:
+            data_path, index_path = _segment_paths(self.directory, segment)
+            if not os.path.exists(index_path):
+                break
+            rows = os.path.getsize(index_path) // INDEX_DTYPE.itemsize
+            index = (np.memmap(index_path, dtype=INDEX_DTYPE, mode='r', shape=(rows,))
+                     if rows else np.empty(0, dtype=INDEX_DTYPE))
+            data = None
+            if os.path.getsize(data_path):
+                with open(data_path, "rb") as f:
+                    data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._segments.append((index, data))
+            indexes.append(index)
+            owners.append(np.full(rows, segment, dtype=np.int32))
+            segment += 1
+        if indexes:
+            self.index = np.concatenate(indexes)
+            self.segment_of = np.concatenate(owners)
+        return len(self.index)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def frame(self, position: int) -> Tuple[np.ndarray, Dict]:
+        """
+        讀取第 position 帧（依錄製順序，零複製）
+
+        Returns:
+            Tuple[np.ndarray, dict]: (原始資料視圖, 索引列)；8 位元格式的 shape 為 (height, width)，
+                                     其他格式為一維位元組
+        """
+        row = self.index[position]
+        _, data = self._segments[int(self.segment_of[position])]
+        raw = np.frombuffer(data, dtype=np.uint8, count=int(row['frame_len']), offset=int(row['offset']))
+        width, height = int(row['width']), int(row['height'])
+        if raw.size == width * height:
+            raw = raw.reshape(height, width)
+        return raw, {name: row[name].item() for name in INDEX_DTYPE.names}
+
+    def find_frame(self, frame_num: int) -> int:
+        """
+        依相機帧號尋找位置
+
+        Returns:
+            int: 位置，找不到時為 -1
+        """
+        matches = np.flatnonzero(self.index['frame_num'] == frame_num)
+        return int(matches[0]) if len(matches) else -1
+
+    def find_time(self, timestamp_ns: int, field: str = 'received_ns') -> int:
+        """
+        尋找時間最接近（不晚於）timestamp_ns 的帧
+
+        Parameters:
+            timestamp_ns: 時間（與 field 相同單位）
+            field: 'received_ns'（錄製端 time.time_ns()）或 'dev_timestamp'（裝置時間戳）
+
+        Returns:
+            int: 位置，早於第一帧時為 0
+        """
+        times = self.index[field]
+        position = int(np.searchsorted(times, timestamp_ns, side='right')) - 1
+        return max(0, min(position, len(times) - 1))
+
+    @staticmethod
+    def _close_segment(segment_files) -> None:
+        index, data = segment_files
+        if isinstance(index, np.memmap) and index._mmap is not None:
+            index._mmap.close()
+        if data is not None:
+            try:
+                data.close()
+            except BufferError:
+                # 仍有外部視圖參考此資料段，交由垃圾回收
+                pass
+
+    def close(self) -> None:
+        """關閉所有映射"""
+        self.index = np.empty(0, dtype=INDEX_DTYPE)
+        for segment_files in self._segments:
+            self._close_segment(segment_files)
+        self._segments = []
+
+
+class ReplayCamera:
+    """
+    以原始帧記錄模擬 MvCamera（CameraOperation 使用到的介面）
+    realtime=True 時依錄製時的間隔（received_ns）除以 speed 送出帧，False 時以最快速度送出
+    """
+
+    is_replay = True
+
+    def __init__(self,
+                 log: RawFrameLog,
+                 realtime: bool = True,
+                 speed: float = 1.0,
+                 loop: bool = False,
+                 start: int = 0):
+        """
+        Parameters:
+            log: 原始帧記錄
+            realtime: 是否依原始時間間隔重播
+            speed: 重播速度倍率（realtime 時有效）
+            loop: 播完後是否從頭開始
+            start: 起始位置
+        """
+        self.log = log
+        self.realtime = realtime
+        self.speed = speed
+        self.loop = loop
+        self.start = start
+        self.position = start
+        self.frames_delivered = 0
+        self._clock_origin = None
+        self._log_origin = None
+        self.payload_size = int(log.index['frame_len'].max()) if len(log) else 0
+
+    # ---- 裝置生命週期（重播時不需要實際動作） ----
+    def MV_CC_CreateHandle(self, *args):
+        return MV_OK
+
+    def MV_CC_DestroyHandle(self, *args):
+        return MV_OK
+
+    def MV_CC_OpenDevice(self, *args):
+        return MV_OK
+
+    def MV_CC_CloseDevice(self, *args):
+        return MV_OK
+
+    def MV_CC_StartGrabbing(self, *args):
+        self._clock_origin = None
+        return MV_OK
+
+    def MV_CC_StopGrabbing(self, *args):
+        return MV_OK
+
+    def MV_CC_GetOptimalPacketSize(self, *args):
+        return 0
+
+    # ---- 參數（設定一律接受並忽略，讀取回傳記錄中的值） ----
+    def MV_CC_SetEnumValue(self, *args):
+        return MV_OK
+
+    def MV_CC_SetEnumValueByString(self, *args):
+        return MV_OK
+
+    def MV_CC_SetFloatValue(self, *args):
+        return MV_OK
+
+    def MV_CC_SetIntValue(self, *args):
+        return MV_OK
+
+    def MV_CC_SetBoolValue(self, *args):
+        return MV_OK
+
+    def MV_CC_SetCommandValue(self, *args):
+        return MV_OK
+
+    def MV_CC_SaveImageToFile(self, *args):
+        return MV_E_SUPPORT
+
+    def MV_CC_GetIntValueEx(self, name, value):
+        if not len(self.log):
+            return MV_E_NODATA
+        first = self.log.index[min(self.position, len(self.log) - 1)]
+        values = {
+            'PayloadSize': self.payload_size,
+            'Width': int(first['width']),
+            'Height': int(first['height']),
+            'GevTimestampTickFrequency': int(self.log.timestamp_tick_hz),
+        }
+        if name not in values:
+            return MV_E_SUPPORT
+        value.nCurValue = values[name]
+        return MV_OK
+
+    def MV_CC_GetFloatValue(self, name, value):
+        if not len(self.log):
+            return MV_E_NODATA
+        row = self.log.index[min(self.position, len(self.log) - 1)]
+        values = {'ExposureTime': float(row['exposure_us']), 'Gain': float(row['gain'])}
+        if name in ('AcquisitionFrameRate', 'ResultingFrameRate') and len(self.log) > 1:
+            span_s = (int(self.log.index['received_ns'][-1]) - int(self.log.index['received_ns'][0])) / 1e9
+            values[name] = (len(self.log) - 1) / span_s * self.speed if span_s > 0 else 0.0
+        if name not in values:
+            return MV_E_SUPPORT
+        value.fCurValue = values[name]
+        return MV_OK
+
+    # ---- 取圖 ----
+    def MV_CC_GetOneFrameTimeout(self, buffer, buffer_size, frame_info, timeout_ms=1000):
+        """
+        取得下一帧（與 MvCamera.MV_CC_GetOneFrameTimeout 相同的介面）
+
+        Returns:
+            int: MV_OK；播完（且不循環）或即時重播尚未到時間時為 MV_E_NODATA
+        """
+        if self.position >= len(self.log):
+            if not self.loop or not len(self.log):
+                time.sleep(timeout_ms / 1000.0)
+                return MV_E_NODATA
+            self.position = self.start
+            self._clock_origin = None
+
+        raw, row = self.log.frame(self.position)
+        if self.realtime:
+            now = time.monotonic()
+            if self._clock_origin is None:
+                self._clock_origin, self._log_origin = now, row['received_ns']
+            due = self._clock_origin + (row['received_ns'] - self._log_origin) / 1e9 / self.speed
+            wait = due - now
+            if wait > timeout_ms / 1000.0:
+                time.sleep(timeout_ms / 1000.0)
+                return MV_E_NODATA
+            if wait > 0:
+                time.sleep(wait)
+
+        frame_len = min(row['frame_len'], buffer_size)
+        ctypes.memmove(buffer, raw.ctypes.data, frame_len)
+        frame_info.nWidth = row['width']
+        frame_info.nHeight = row['height']
+        frame_info.enPixelType = row['pixel_type']
+        frame_info.nFrameNum = row['frame_num']
+        frame_info.nDevTimeStampHigh = row['dev_timestamp'] >> 32
+        frame_info.nDevTimeStampLow = row['dev_timestamp'] & 0xFFFFFFFF
+        frame_info.nHostTimeStamp = row['host_timestamp']
+        frame_info.nFrameLen = frame_len
+        frame_info.nTriggerIndex = row['trigger_index']
+        frame_info.nLostPacket = row['lost_packets']
+        frame_info.fExposureTime = row['exposure_us']
+        frame_info.fGain = row['gain']
+        self.position += 1
+        self.frames_delivered += 1
+        return MV_OK
+
+    def seek(self, position: int) -> None:
+        """跳到指定位置（即時重播的時鐘從該帧重新起算）"""
+        self.position = max(0, min(position, len(self.log)))
+        self._clock_origin = None
@@ -1,137 +1,282 @@
-import cv2
-import numpy as np
-from multiprocessing import shared_memory
+"""
+共享記憶體批次接收工具（配合 SharedMemorySender 使用）
+- 單一持續連線：發送端斷線後回到 accept 等待重連，不再每帧重新連線
+- 自描述標頭：shape、dtype、trigger_num 皆由環形緩衝區槽位標頭提供，不猜測解析度
+- 批次處理：一次取出所有已到達的槽位記錄，latest 模式只處理其中最新的一帧
+- 背景寫檔：固定數量的寫檔執行緒與有界佇列，佇列滿時丟棄新帧而不阻塞接收
+- 吞吐量報告：定期輸出接收/寫檔 fps、MB/s、複製耗時與丟帧統計
+
+用法:
+    python recive.py                           # 持續覆寫 sharedmemory.jpg
+    python recive.py --output-dir frames       # 每帧一個檔案
+    python recive.py --ring-name nircam_ring   # 同機門鈴模式，不使用 TCP
+"""
+
+import argparse
+import os
 import socket
+import time
+
+from image_writer import AsyncImageWriter
+from shm_ring import ShmRingReader, TornFrameError
+from stream_framing import FramedSocketReader
+from pipeline_metrics import LatencyStats
+
+
+class BatchReceiver:
+    """持續連線的共享記憶體接收端"""
+
+    def __init__(self,
+                 host: str = '127.0.0.1',
+                 port: int = 65432,
+                 framing: str = 'line',
+                 ring_name: str = None,
+                 output_filename: str = 'sharedmemory.jpg',
+                 output_dir: str = None,
+                 every_frame: bool = False,
+                 num_writers: int = 2,
+                 writer_queue_size: int = 8,
+                 report_interval_s: float = 5.0):
+        """
+        Parameters:
+            host, port: 監聽位址（發送端以 SharedMemorySender 連線）
+            framing: "line" 或 "length"，需與發送端一致
+            ring_name: 指定時改用同機門鈴模式，不建立 TCP 連線
+            output_filename: 未指定 output_dir 時持續覆寫的檔名
+            output_dir: 指定時每帧寫入一個檔案
+            every_frame: 是否處理每一帧（預設每批只處理最新的一帧）
+            num_writers: 寫檔執行緒數
+            writer_queue_size: 寫檔佇列上限
+            report_interval_s: 吞吐量報告間隔（秒）
+        """
+        self.host = host
+        self.port = port
+        self.framing = framing
+        self.ring_name = ring_name
+        self.output_filename = output_filename
+        self.output_dir = output_dir
+        self.every_frame = every_frame
+        self.report_interval_s = report_interval_s
+
+        self.reader = None
+        self.writers = AsyncImageWriter(num_workers=num_writers, queue_size=writer_queue_size)
+        self.is_running = False
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+
+        # 統計資訊
+        self.received = 0
+        self.skipped = 0
+        self.bytes_received = 0
+        self.connections = 0
+        self.copy_ms = LatencyStats()
+        self._start_time = None
+        self._last_report = None
+        self._last_counts = (0, 0, 0)
 
-def receive_shared_memory_name_via_tcpip(host='127.0.0.1', port=65432):
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.bind((host, port))
-        s.listen()
-        print(f"Listening for connection on {host}:{port}...")
-        while True:
-            print("Waiting for a connection...")
-            conn, addr = s.accept()
-            print(f"Connected by {addr}")
-            with conn:
-                # 接收合併後的資料
-                data = conn.recv(1024).decode()
-                if not data:
-                    print("Failed to receive data.")
-                    continue
-                
-                print(f"Raw data received: '{data}'")
-                print(f"Data length: {len(data)}")
-                
-                # 將資料分割成 shm_name 和 trigger_num
-                try:
-                    parts = data.split(',')
-                    print(f"Split into {len(parts)} parts: {parts}")
-                    
-                    if len(parts) >= 2:
-                        shm_name = parts[0].strip()
-                        trigger_num = int(parts[1].strip())
-                        print(f"Received shared memory name: {shm_name}")
-                        print(f"Received trigger number: {trigger_num}")
-                    else:
-                        print(f"Error: Expected at least 2 parts, got {len(parts)}")
-                        continue
-                except ValueError as e:
-                    print(f"Error parsing data: {e}")
-                    continue
-                
-                return shm_name, trigger_num  # 返回共享記憶體名稱和 trigger_num 並退出循環
-
-
-def process_image_from_shared_memory(shm_name, image_shape, output_filename='sharedmemory.jpg'):
-    try:
-        print(f"Attempting to connect to shared memory: {shm_name[0]}")
-        existing_shm = shared_memory.SharedMemory(name=shm_name[0])
-        print(f"Successfully connected to shared memory '{shm_name[0]}'")
-        print(f"Shared memory size: {existing_shm.size} bytes")
-        
-        image_flatten = np.ndarray(existing_shm.size, dtype=np.uint8, buffer=existing_shm.buf)
-        
-        # 檢查尺寸是否匹配，如果不匹配則嘗試自動計算
-        expected_size = np.prod(image_shape)
-        if image_flatten.size != expected_size:
-            print(f"Warning: Size mismatch. Expected {expected_size}, got {image_flatten.size}")
-            
-            # 嘗試自動計算可能的圖像尺寸（假設是3通道RGB）
-            if image_flatten.size % 3 == 0:
-                total_pixels = image_flatten.size // 3
-                print(f"Total pixels (assuming 3 channels): {total_pixels}")
-                
-                # 嘗試找到合理的寬高比
-                height = int(np.sqrt(total_pixels / (2200/2048)))  # 使用原始比例估算
-                width = total_pixels // height
-                
-                if height * width * 3 == image_flatten.size:
-                    image_shape = (height, width, 3)
-                    print(f"Auto-detected image shape: {image_shape}")
+        print(f"[BatchReceiver] Initialized: "
+              f"{'doorbell ' + ring_name if ring_name else f'{host}:{port} ({framing} framing)'}, "
+              f"{'every frame' if every_frame else 'latest frame'}, {num_writers} writers")
+
+    def run(self) -> None:
+        """接收直到 Ctrl+C"""
+        self.is_running = True
+        self._start_time = self._last_report = time.monotonic()
+        try:
+            if self.ring_name is not None:
+                self._run_doorbell()
+            else:
+                self._run_tcp()
+        except KeyboardInterrupt:
+            print("\nKeyboard interrupt received. Exiting...")
+        finally:
+            self.close()
+
+    def _run_tcp(self) -> None:
+        """單一監聽 socket，發送端斷線後等待重連"""
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server:
+            server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            server.bind((self.host, self.port))
+            server.listen(1)
+            print(f"Listening for sender on {self.host}:{self.port}...")
+            while self.is_running:
+                conn, addr = server.accept()
+                self.connections += 1
+                print(f"Connected by {addr}")
+                conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                with conn:
+                    self._serve(FramedSocketReader(conn, self.framing))
+                print("Sender disconnected, waiting for reconnection...")
+
+    def _serve(self, records: FramedSocketReader) -> None:
+        """處理一個連線上的所有記錄"""
+        while self.is_running:
+            batch = records.read_records()
+            if batch is None:
+                return
+            frames = []
+            for record in batch:
+                parts = record.decode('utf-8').strip().split(',')
+                # 環形緩衝區宣告: RING,ring_name,num_slots
+                if parts[0] == 'RING' and len(parts) >= 3:
+                    self._attach(parts[1])
+                elif len(parts) >= 2 and self.reader is not None:
+                    frames.append((int(parts[0]), int(parts[1])))
                 else:
-                    # 如果計算不精確，直接使用實際大小
-                    print(f"Trying to reshape with actual size...")
-                    # 嘗試常見的解析度
-                    possible_shapes = [
-                        (2048, image_flatten.size // (2048 * 3), 3),
-                        (2176, image_flatten.size // (2176 * 3), 3),
-                        (2200, image_flatten.size // (2200 * 3), 3),
-                    ]
-                    for shape in possible_shapes:
-                        if np.prod(shape) == image_flatten.size:
-                            image_shape = shape
-                            print(f"Found matching shape: {image_shape}")
-                            break
+                    print(f"Invalid record: {record!r}")
+            self._process_batch(frames)
+
+    def _run_doorbell(self) -> None:
+        """同機門鈴模式"""
+        self.reader = ShmRingReader(self.ring_name, policy='every' if self.every_frame else 'latest')
+        print(f"Attached to ring '{self.ring_name}' (doorbell)")
+        while self.is_running:
+            frame = self.reader.next_frame(timeout=self.report_interval_s)
+            if frame is not None:
+                self._process_batch([frame])
             else:
-                print(f"Error: Image size is not divisible by 3 (not RGB)")
-                existing_shm.close()
-                return False
+                self._maybe_report()
 
-        # 將一維數組重新變形為圖片
-        try:
-            image = image_flatten.reshape(image_shape)
-            
-            # 儲存圖片而不是顯示
-            cv2.imwrite(output_filename, image)
-            print(f"Image saved to '{output_filename}'. Shape: {image.shape}, Trigger number: {shm_name[1]}")
-            
-        except Exception as e:
-            print(f"Error reshaping/saving image: {e}")
-            existing_shm.close()
-            return False
-
-        # 釋放共享記憶體
-        existing_shm.close()
-        return True
-        
-    except FileNotFoundError:
-        print(f"Shared memory '{shm_name[0]}' not found.")
-        return False
-    except Exception as e:
-        print(f"Error connecting to shared memory: {e}")
-        return False
-
-
-# 使用範例
-image_shape = (2048, 2448, 3)  # 根據實際檢測到的圖像尺寸
-output_filename = 'sharedmemory.jpg'
-
-print(f"Starting image receiver. Images will be saved to '{output_filename}' and continuously updated.")
-print("Press Ctrl+C to exit.")
-
-try:
-    while True:
-        shm_name = receive_shared_memory_name_via_tcpip()
-        if shm_name:
-            success = process_image_from_shared_memory(shm_name, image_shape, output_filename)
-            
-            if not success:
-                print("Failed to process image, but continuing to listen...")
-        else:
-            print("No shared memory name received.")
-            break
-            
-except KeyboardInterrupt:
-    print("\nKeyboard interrupt received. Exiting...")
-finally:
-    print("Program terminated.")
\ No newline at end of file
+    def _attach(self, ring_name: str) -> None:
+        """連上（或切換到）發送端宣告的環形緩衝區"""
+        if self.reader is not None and self.reader.ring_name == ring_name:
+            return
+        if self.reader is not None:
+            self.reader.close()
+        self.reader = ShmRingReader(ring_name, policy='every' if self.every_frame else 'latest')
+        print(f"Attached to ring '{ring_name}' ({self.reader.ring.num_slots} slots)")
+
+    def _process_batch(self, frames) -> None:
+        """
+        複製並排入寫檔
+
+        Parameters:
+            frames: [(slot, seq), ...]，依到達順序
+        """
+        if not self.every_frame and len(frames) > 1:
+            self.skipped += len(frames) - 1
+            frames = frames[-1:]
+
+        for slot, seq in frames:
+            start = time.perf_counter()
+            try:
+                image, info = self.reader.read_copy(slot, seq)
+            except TornFrameError:
+                # 發送端已繞回覆寫此槽位
+                continue
+            self.copy_ms.add((time.perf_counter() - start) * 1000.0)
+            self.received += 1
+            self.bytes_received += image.nbytes
+
+            if self.output_dir:
+                filename = os.path.join(self.output_dir, f"frame_{info['trigger_num']:08d}.jpg")
+            else:
+                filename = self.output_filename
+            # 影像由 read_copy 複製而來，直接交給寫檔執行緒持有
+            self.writers.submit(image, filename, is_rgb=False, seq=None if self.output_dir else seq)
+
+        self._maybe_report()
+
+    def _maybe_report(self) -> None:
+        """每 report_interval_s 秒輸出一次吞吐量"""
+        now = time.monotonic()
+        elapsed = now - self._last_report
+        if elapsed < self.report_interval_s:
+            return
+        received, written, nbytes = self._last_counts
+        torn = self.reader.torn if self.reader is not None else 0
+        copy_q = self.copy_ms.quantiles()
+        write_q = self.writers.write_ms.quantiles()
+        print(f"[{now - self._start_time:7.1f}s] "
+              f"recv {(self.received - received) / elapsed:6.1f} fps "
+              f"{(self.bytes_received - nbytes) / elapsed / 1e6:7.1f} MB/s | "
+              f"write {(self.writers.written - written) / elapsed:6.1f} fps | "
+              f"copy p50 {copy_q.get('p50', 0.0):.2f} ms p99 {copy_q.get('p99', 0.0):.2f} ms | "
+              f"write p50 {write_q.get('p50', 0.0):.1f} ms | "
+              f"queue {self.writers.queue.qsize()} | "
+              f"skipped {self.skipped} torn {torn} write-dropped {self.writers.dropped}")
+        self._last_report = now
+        self._last_counts = (self.received, self.writers.written, self.bytes_received)
+
+    def get_statistics(self) -> dict:
+        """
+        獲取統計資訊
+
+        Returns:
+            dict: 統計資訊
+        """
+        elapsed = max(time.monotonic() - self._start_time, 1e-9) if self._start_time else 0.0
+        return {
+            'connections': self.connections,
+            'received': self.received,
+            'written': self.writers.written,
+            'skipped': self.skipped,
+            'torn': self.reader.torn if self.reader is not None else 0,
+            'write_dropped': self.writers.dropped,
+            'write_failed': self.writers.failed,
+            'avg_fps': self.received / elapsed if elapsed else 0.0,
+            'avg_mb_per_s': self.bytes_received / elapsed / 1e6 if elapsed else 0.0,
+            'copy_ms': self.copy_ms.quantiles(),
+            'write_ms': self.writers.write_ms.quantiles()
+        }
+
+    def print_statistics(self) -> None:
+        """列印統計資訊"""
+        stats = self.get_statistics()
+        print("\n" + "=" * 60)
+        print("Batch Receiver Statistics")
+        print("=" * 60)
+        print(f"Connections:       {stats['connections']}")
+        print(f"Frames received:   {stats['received']} ({stats['avg_fps']:.1f} fps, "
+              f"{stats['avg_mb_per_s']:.1f} MB/s)")
+        print(f"Frames written:    {stats['written']}")
+        print(f"Skipped (latest):  {stats['skipped']}")
+        print(f"Torn frames:       {stats['torn']}")
+        print(f"Write dropped:     {stats['write_dropped']}")
+        print(f"Write failed:      {stats['write_failed']}")
+        print(f"Copy ms:           p50={stats['copy_ms'].get('p50', 0.0):.2f} p99={stats['copy_ms'].get('p99', 0.0):.2f}")
+        print(f"Write ms:          p50={stats['write_ms'].get('p50', 0.0):.1f} p99={stats['write_ms'].get('p99', 0.0):.1f}")
+        print("=" * 60 + "\n")
+
+    def close(self) -> None:
+        """等待寫檔完成並釋放環形緩衝區"""
+        self.is_running = False
+        self.writers.close()
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+        self.print_statistics()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared-memory batch image receiver")
+    parser.add_argument("--host", default="127.0.0.1", help="Listen address")
+    parser.add_argument("--port", type=int, default=65432, help="Listen port")
+    parser.add_argument("--framing", choices=("line", "length"), default="line", help="Record framing")
+    parser.add_argument("--ring-name", default=None, help="Attach to a local ring by name (no TCP)")
+    parser.add_argument("--output", default="sharedmemory.jpg", help="File continuously overwritten")
+    parser.add_argument("--output-dir", default=None, help="Write every frame to this directory")
+    parser.add_argument("--every-frame", action="store_true", help="Process every frame, not just the latest")
+    parser.add_argument("--writers", type=int, default=2, help="Background writer threads")
+    parser.add_argument("--queue", type=int, default=8, help="Writer queue size")
+    parser.add_argument("--report", type=float, default=5.0, help="Throughput report interval (s)")
+    args = parser.parse_args()
+
+    receiver = BatchReceiver(
+        host=args.host,
+        port=args.port,
+        framing=args.framing,
+        ring_name=args.ring_name,
+        output_filename=args.output,
+        output_dir=args.output_dir,
+        every_frame=args.every_frame or args.output_dir is not None,
+        num_writers=args.writers,
+        writer_queue_size=args.queue,
+        report_interval_s=args.report
+    )
+    print("Press Ctrl+C to exit.")
+    receiver.run()
+
+
+if __name__ == "__main__":
+    main()
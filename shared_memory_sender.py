@@ -1,63 +1,171 @@
+import os
 import numpy as np
-from multiprocessing import shared_memory
 import socket
 import time
 
+from shm_ring import (DET_FLAG_BLOWN, DET_FLAG_MERGED, DET_FLAG_TRIGGERED, DETECTION_DTYPE,
+                      RingFullError, ShmRing)
+from stream_framing import pack_record
+from pipeline_metrics import LatencyStats
+
+
+def _box_iou(boxes: np.ndarray, box: np.ndarray) -> np.ndarray:
+    """一個框對多個框的 IoU"""
+    x1 = np.maximum(boxes[:, 0], box[0])
+    y1 = np.maximum(boxes[:, 1], box[1])
+    x2 = np.minimum(boxes[:, 2], box[2])
+    y2 = np.minimum(boxes[:, 3], box[3])
+    intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    box_area = (box[2] - box[0]) * (box[3] - box[1])
+    return intersection / (area + box_area - intersection + 1e-6)
+
+
+def build_detection_table(detections, tracker_results=None, filter_result=None,
+                          triggered_track_ids=None, iou_threshold: float = 0.3) -> np.ndarray:
+    """
+    將 YOLO 偵測、追蹤與觸發結果整理為共享記憶體的偵測表
+
+    Parameters:
+        detections: YOLO 偵測結果
+        tracker_results: 追蹤器結果 [(track_id, bbox, confidence, class_id), ...]，
+                         以 IoU 對應到偵測框
+        filter_result: TwoBandFilter.process_frame() 的回傳值，用於標記本帧觸發
+        triggered_track_ids: 先前已觸發過的追蹤 ID
+        iou_threshold: 追蹤框與偵測框對應的最低 IoU
+
+    Returns:
+        np.ndarray: DETECTION_DTYPE 結構化陣列
+    """
+    if not detections or not hasattr(detections[0], 'boxes') or detections[0].boxes is None:
+        return np.empty(0, dtype=DETECTION_DTYPE)
+
+    boxes = detections[0].boxes
+    xyxy = boxes.xyxy.cpu().numpy().reshape(-1, 4)
+    table = np.zeros(len(xyxy), dtype=DETECTION_DTYPE)
+    if not len(table):
+        return table
+    table['x1'], table['y1'], table['x2'], table['y2'] = xyxy.T
+    table['confidence'] = boxes.conf.cpu().numpy()
+    table['class_id'] = boxes.cls.cpu().numpy().astype(np.int32)
+    table['track_id'] = -1
+
+    # 每個偵測框保留 IoU 最高的追蹤
+    matched_iou = np.zeros(len(table), dtype=np.float32)
+    for track_id, bbox, *_ in tracker_results or ():
+        iou = _box_iou(xyxy, np.asarray(bbox[:4], dtype=np.float32))
+        best = int(np.argmax(iou))
+        if iou[best] >= iou_threshold and iou[best] > matched_iou[best]:
+            matched_iou[best] = iou[best]
+            table['track_id'][best] = int(track_id)
+
+    flags = {}
+    for track_id in triggered_track_ids or ():
+        flags[int(track_id)] = DET_FLAG_BLOWN
+    for trigger in (filter_result or {}).get('triggered_this_frame', []):
+        flag = DET_FLAG_TRIGGERED | (DET_FLAG_MERGED if trigger.get('merged') else 0)
+        flags[int(trigger['track_id'])] = flags.get(int(trigger['track_id']), 0) | flag
+    for row, track_id in enumerate(table['track_id']):
+        if track_id >= 0:
+            table['flags'][row] = flags.get(int(track_id), 0)
+    return table
+
+
 class SharedMemorySender:
     """
-    獨立的共享內存發送器，負責將 NumPy 圖像數據寫入共享內存，
-    並通過 Socket 發送名稱和元數據給接收端。
+    獨立的共享內存發送器，將 NumPy 圖像原地寫入預先配置的環形緩衝區，
+    並通過 Socket 只發送槽位編號給接收端。
+    
+    Socket 訊息（framing="line" 時每行一筆，"length" 時每筆前置 4 位元組長度）:
+        RING,<ring_name>,<num_slots>   連線或環形緩衝區重建時發送一次
+        <slot>,<seq>                   每帧發送，接收端從槽位標頭讀取 shape / dtype / 觸發編號
+    
+    每個槽位同時攜帶該帧的偵測表（框、信度、類別、追蹤 ID、觸發旗標），
+    接收端以 lease.detections 取得，不需要重新推論
+    
+    同機接收端可不經 TCP：指定 ring_name 並將 host 設為 None，
+    接收端以 ShmRingReader(ring_name).wait_for_frame() 等待環形標頭的門鈴計數器
     """
-    def __init__(self, host: str, port: int):
+    def __init__(self, host, port: int = 0, num_slots: int = 8, framing: str = "line",
+                 ring_name: str = None, backpressure_timeout_ms: float = 2.0):
         self.host = host
         self.port = port
-        self.shm = None
+        self.num_slots = num_slots
+        self.framing = framing
+        self.ring_name = ring_name
+        self.backpressure_timeout_ms = backpressure_timeout_ms  # every 接收端來不及時最多等待的時間
+        self.publish_us = LatencyStats()  # 每帧寫入並發布的耗時（微秒）
+        self.dropped_frames = 0  # 所有槽位都被接收端租用而丟棄的帧數
+        self.ring = None
         self.shm_name = None
         self.trigger_count = 0  # 添加這行
         self.socket = None
-        self.connect()  # 啟動時就連線
-        print(f"SharedMemorySender initialized. Target: {self.host}:{self.port}")
+        self._ring_announced = False
+        self._ring_generation = 0
+        if self.host is not None:
+            self.connect()  # 啟動時就連線
+            print(f"SharedMemorySender initialized. Target: {self.host}:{self.port}")
+        else:
+            print(f"SharedMemorySender initialized. Local doorbell only (ring '{self.ring_name}')")
     def connect(self):
         try:
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.socket.connect((self.host, self.port))
+            self._ring_announced = False
             print(f"✅ Connected to receiver at {self.host}:{self.port}")
         except Exception as e:
             print(f"❌ Failed to connect to receiver: {e}")
             self.socket = None
     def is_connected(self):
-        """檢查是否已連接"""
-        return self.socket is not None  # 添加這個方法    
+        """檢查是否已連接（僅同機門鈴模式時永遠可發送）"""
+        return self.host is None or self.socket is not None
 
-    def send_image(self, image: np.ndarray, trigger_num: int):
-        """發送圖像到共享內存"""
-        self.trigger_num = trigger_num
+    def _ensure_ring(self, image: np.ndarray):
+        """建立環形緩衝區（首帧或影像變大時），之後所有帧原地寫入"""
+        if self.ring is not None and image.nbytes <= self.ring.slot_capacity:
+            return
+        if self.ring is not None:
+            self.ring.close()
+        self._ring_generation += 1
+        name = self.ring_name or f"nircam_ring_{os.getpid()}_{self._ring_generation}"
+        self.ring = ShmRing.create(name, self.num_slots, image.nbytes)
+        self.shm_name = self.ring.name
+        self._ring_announced = False
+        print(f"Shared memory ring {self.shm_name} created: "
+              f"{self.num_slots} slots x {self.ring.slot_capacity} bytes")
+
+    def send_image(self, image: np.ndarray, trigger_num: int, detections: np.ndarray = None):
+        """
+        發送圖像到共享內存
         
-        # 1. 清理舊共享內存
-        if self.shm is not None:
-            try:
-                self.shm.close()
-                self.shm.unlink()
-            except:
-                pass
-            self.shm = None
-            self.shm_name = None
+        Parameters:
+            image: 影像
+            trigger_num: 觸發編號
+            detections: 此帧的偵測表（build_detection_table() 的回傳值），與影像寫入同一槽位
+        """
+        self.trigger_num = trigger_num
     
         try:
-            # 2. 確保圖像是連續的內存塊
+            # 1. 確保圖像是連續的內存塊
             if not image.flags['C_CONTIGUOUS']:
                 image = np.ascontiguousarray(image)
             
-            # 3. 創建共享內存
-            self.shm = shared_memory.SharedMemory(create=True, size=image.nbytes)
-            self.shm_name = self.shm.name
-            
-            # 4. 寫入數據
-            shm_array = np.ndarray(image.shape, dtype=image.dtype, buffer=self.shm.buf)
-            shm_array[:] = image[:]
+            # 2. 寫入環形緩衝區的下一個槽位（原地寫入，不重新建立共享內存）
+            self._ensure_ring(image)
+            start_ns = time.perf_counter_ns()
+            try:
+                slot, seq = self.ring.write(image, trigger_num,
+                                            backpressure_timeout_s=self.backpressure_timeout_ms / 1000.0,
+                                            detections=detections)
+            except RingFullError:
+                # 接收端仍租用所有槽位，不覆寫其正在使用的帧
+                self.dropped_frames += 1
+                return None
+            self.publish_us.add((time.perf_counter_ns() - start_ns) / 1000.0)
             
-            # 5. 發送 metadata
-            self._send_shared_memory_name(self.shm_name, trigger_num, image.shape, image.dtype)
+            # 3. 發送槽位編號給遠端接收端（同機接收端已由門鈴計數器得知）
+            if self.host is not None:
+                self._send_slot_index(slot, seq)
             
             return self.shm_name
     
@@ -67,8 +175,8 @@ class SharedMemorySender:
             traceback.print_exc()
             return None
     
-    def _send_shared_memory_name(self, shm_name: str, trigger_num: int, shape, dtype):
-        """發送 metadata"""
+    def _send_slot_index(self, slot: int, seq: int):
+        """發送槽位編號（必要時先宣告環形緩衝區名稱）"""
         if not self.is_connected():
             print("⚠️ Not connected, retrying...")
             self.connect()
@@ -76,13 +184,13 @@ class SharedMemorySender:
                 return
     
         try:
-            # 將 shape 轉換為字符串，用逗號分隔
-            shape_str = 'x'.join(map(str, shape))  # 例如: "480x640x3"
-            dtype_str = str(dtype)
-            message = f"{shm_name},{trigger_num},{shape_str},{dtype_str}\n"  # 加換行符
+            message = b""
+            if not self._ring_announced:
+                message += pack_record(f"RING,{self.shm_name},{self.ring.num_slots}".encode('utf-8'), self.framing)
+            message += pack_record(f"{slot},{seq}".encode('utf-8'), self.framing)
             
-            self.socket.sendall(message.encode('utf-8'))
-            print(f"📤 Sent metadata: trigger={trigger_num}, shape={shape}, dtype={dtype}")
+            self.socket.sendall(message)
+            self._ring_announced = True
             
         except Exception as e:
             print(f"❌ Socket send failed: {e}")
@@ -92,18 +200,33 @@ class SharedMemorySender:
                 pass
             self.socket = None
 
+    def get_statistics(self):
+        """
+        獲取統計資訊
+        
+        Returns:
+            dict: 統計資訊
+        """
+        return {
+            'ring_name': self.shm_name,
+            'frames_published': self.ring.write_seq if self.ring is not None else 0,
+            'dropped_frames': self.dropped_frames,
+            'truncated_detections': int(self.ring.header['truncated_detections']) if self.ring is not None else 0,
+            'publish_us': self.publish_us.quantiles(),
+            'consumers': self.ring.consumer_metrics() if self.ring is not None else []
+        }
+
     def close(self):
         """
         在程式結束時調用，釋放和刪除共享內存。
         """
-        if self.shm is not None:
+        if self.ring is not None:
             try:
-                self.shm.close()
-                self.shm.unlink()
+                self.ring.close()
                 print(f"Shared memory {self.shm_name} successfully closed and unlinked.")
             except Exception as e:
                 pass # 忽略清理時的錯誤
-            self.shm = None
+            self.ring = None
             self.shm_name = None
 
 # end of shared_memory_sender.py
\ No newline at end of file
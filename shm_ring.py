@@ -0,0 +1,918 @@
+# shm_ring.py
+"""
+共享記憶體環形緩衝區
+發送端建立一次、之後原地寫入的 N 個預先配置槽位，
+每個槽位有自己的標頭（序號、shape、dtype、時間戳、seqlock 世代計數），
+讀取端以世代計數偵測讀到一半被覆寫（torn）或已被新帧取代的槽位
+
+記憶體配置:
+    [環形標頭 RING_HEADER_DTYPE]               位移 0
+    [消費者表 CONSUMER_DTYPE × MAX_CONSUMERS]   位移 RING_HEADER_SIZE
+    [槽位標頭 SLOT_HEADER_DTYPE × N]            位移 slot_headers_offset
+    [偵測表 DETECTION_DTYPE × max_detections × N] 位移 detections_offset
+    [槽位資料 slot_capacity × N]                位移 data_offset（頁對齊）
+
+偵測表:
+    每個槽位附帶該帧的偵測結果（框、信度、類別）、追蹤 ID 與觸發旗標，
+    與影像在同一個 seqlock 世代內寫入，接收端一次租用即可同時取得影像與偵測，
+    下游 QA 程式不需要重新推論
+
+seqlock 寫入順序:
+    generation += 1（奇數，寫入中）→ 檢查租用 → 寫資料、偵測表與標頭 → generation += 1（偶數）→ 更新 write_seq / last_slot
+讀取時前後兩次讀到相同的偶數 generation 才代表資料完整
+
+租用（lease）:
+    每個接收端在消費者表佔一列，只寫自己那一列。租用時先在 pinned_seq[slot] 寫入帧序號，
+    再確認 generation 為偶數且序號相符；發送端在將 generation 設為奇數之後檢查所有列的 pinned_seq，
+    被租用的槽位會被跳過，因此零複製視圖在釋放前不會被覆寫。
+    超過 pin_timeout_s 沒有更新 heartbeat_ns 的列視為已離線，其租用不再阻擋發送端
+
+多消費者:
+    每個消費者各自的 cursor（已處理到的帧序號）與策略:
+    - latest：每次直接取最新帧，中間略過的帧計入 dropped
+    - every：依序處理每一帧，發送端保留其 cursor 之後最多 max_lag 帧不覆寫；
+      找不到可寫槽位時發送端最多等待 backpressure_timeout，之後覆寫並在該消費者的 overruns 計數，
+      不會讓其他消費者跟著丟帧。overruns 由發送端寫入，其餘欄位由消費者寫入
+
+門鈴（doorbell）:
+    同機接收端不需要 TCP 訊息：環形標頭的 write_seq 即為門鈴計數器，
+    ShmRingReader.wait_for_frame() 先短暫自旋、再以遞增的睡眠間隔輪詢（futex 式），
+    並以標頭中的 publish_ns 計算發布到察覺的延遲（微秒）。
+    發送端重建或關閉環形緩衝區時設定 closed，接收端據此重新連上同名區段
+"""
+
+import os
+import time
+from multiprocessing import shared_memory
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from pipeline_metrics import LatencyStats
+
+RING_MAGIC = 0x5252494E  # "NIRR"
+RING_VERSION = 5
+PAGE_SIZE = 4096
+MAX_NDIM = 4
+MAX_SLOTS = 32
+MAX_CONSUMERS = 8
+MAX_DETECTIONS = 128
+
+RING_HEADER_DTYPE = np.dtype([
+    ('magic', '<u4'),
+    ('version', '<u4'),
+    ('num_slots', '<u4'),
+    ('sender_pid', '<u4'),
+    ('slot_capacity', '<u8'),   # 每個槽位的資料容量（位元組）
+    ('data_offset', '<u8'),     # 第一個槽位資料的位移
+    ('write_seq', '<u8'),       # 最新已發布的帧序號（0 表示尚未發布）
+    ('last_slot', '<i4'),       # 最新已發布的槽位（-1 表示尚未發布）
+    ('publish_ns', '<u8'),      # 最新發布時間（time.perf_counter_ns()）
+    ('dropped_pinned', '<u8'),  # 所有槽位都被租用而丟棄的帧數
+    ('closed', '<u4'),          # 發送端已關閉或以新區段取代此環形緩衝區
+    ('max_detections', '<u4'),  # 每個槽位偵測表的列數
+    ('detections_offset', '<u8'),  # 第一個槽位偵測表的位移
+    ('truncated_detections', '<u8'),  # 超過 max_detections 而未寫入的偵測數
+], align=True)
+RING_HEADER_SIZE = 256
+
+CONSUMER_DTYPE = np.dtype([
+    ('pid', '<u4'),             # 佔用此列的行程 ID（0 表示空閒）
+    ('token', '<u4'),           # 佔用確認用的亂數
+    ('heartbeat_ns', '<u8'),    # 最近活動時間（time.monotonic_ns()）
+    ('pinned_seq', '<u8', (MAX_SLOTS,)),  # 各槽位被租用的帧序號（0 表示未租用）
+    ('policy', '<u4'),          # 消費策略（POLICY_LATEST / POLICY_EVERY）
+    ('max_lag', '<u4'),         # every 策略下發送端保留的最大未處理帧數
+    ('cursor', '<u8'),          # 已處理到的帧序號
+    ('consumed', '<u8'),        # 已處理的帧數
+    ('dropped', '<u8'),         # 略過或來不及處理的帧數
+    ('overruns', '<u8'),        # 發送端等待逾時後覆寫其未處理帧的次數（發送端寫入）
+], align=True)
+
+POLICY_LATEST = 0
+POLICY_EVERY = 1
+POLICY_NAMES = {'latest': POLICY_LATEST, 'every': POLICY_EVERY}
+
+SLOT_HEADER_DTYPE = np.dtype([
+    ('generation', '<u8'),      # seqlock 世代計數，奇數表示寫入中
+    ('seq', '<u8'),             # 帧序號（單調遞增，從 1 開始）
+    ('trigger_num', '<u8'),     # 觸發編號
+    ('timestamp_ns', '<u8'),    # 影像時間（time.time_ns()）
+    ('publish_ns', '<u8'),      # 發布時間（time.perf_counter_ns()）
+    ('nbytes', '<u8'),          # 影像資料位元組數
+    ('ndim', '<u4'),
+    ('shape', '<u4', (MAX_NDIM,)),
+    ('dtype', 'S8'),
+    ('num_detections', '<u4'),  # 偵測表中有效的列數
+], align=True)
+
+DETECTION_DTYPE = np.dtype([
+    ('x1', '<f4'),
+    ('y1', '<f4'),
+    ('x2', '<f4'),
+    ('y2', '<f4'),
+    ('confidence', '<f4'),
+    ('class_id', '<i4'),
+    ('track_id', '<i4'),        # 追蹤 ID（-1 表示未追蹤）
+    ('flags', '<u4'),           # DET_FLAG_* 位元旗標
+], align=True)
+
+DET_FLAG_TRIGGERED = 0x1    # 此帧送出氣吹
+DET_FLAG_MERGED = 0x2       # 併入同閥門的其他氣吹
+DET_FLAG_BLOWN = 0x4        # 追蹤先前已觸發過
+
+
+class TornFrameError(RuntimeError):
+    """讀取期間槽位正在寫入或已被覆寫"""
+
+
+class FrameOverwrittenError(TornFrameError):
+    """槽位中已不是預期的帧（發送端已繞回覆寫）"""
+
+
+class RingFullError(RuntimeError):
+    """所有槽位都被租用（發送端）或消費者表已滿（接收端）"""
+
+
+def _align(value: int, alignment: int = PAGE_SIZE) -> int:
+    """向上對齊"""
+    return (value + alignment - 1) // alignment * alignment
+
+
+def ring_layout(num_slots: int,
+                slot_capacity: int,
+                max_detections: int = MAX_DETECTIONS) -> Tuple[int, int, int, int]:
+    """
+    計算環形緩衝區配置
+
+    Parameters:
+        num_slots: 槽位數
+        slot_capacity: 每個槽位的資料容量（位元組）
+        max_detections: 每個槽位偵測表的列數
+
+    Returns:
+        Tuple[int, int, int, int]: (槽位標頭位移, 偵測表位移, 資料位移, 總大小)
+    """
+    slot_headers_offset = RING_HEADER_SIZE + CONSUMER_DTYPE.itemsize * MAX_CONSUMERS
+    detections_offset = _align(slot_headers_offset + SLOT_HEADER_DTYPE.itemsize * num_slots, 64)
+    data_offset = _align(detections_offset + DETECTION_DTYPE.itemsize * max_detections * num_slots)
+    slot_capacity = _align(slot_capacity)
+    return slot_headers_offset, detections_offset, data_offset, data_offset + slot_capacity * num_slots
+
+
+class ShmRing:
+    """
+    共享記憶體環形緩衝區
+    發送端以 create() 建立並以 write() 寫入，接收端以 attach() 連上並以 read() 讀取
+    """
+
+    def __init__(self, shm: shared_memory.SharedMemory, owner: bool, pin_timeout_s: float = 5.0):
+        self.shm = shm
+        self.name = shm.name
+        self.owner = owner
+
+        self.header = np.ndarray((), dtype=RING_HEADER_DTYPE, buffer=shm.buf)
+        if int(self.header['magic']) != RING_MAGIC:
+            raise ValueError(f"Shared memory '{shm.name}' is not a frame ring")
+        if int(self.header['version']) != RING_VERSION:
+            raise ValueError(f"Unsupported ring version {int(self.header['version'])}")
+
+        self.num_slots = int(self.header['num_slots'])
+        self.slot_capacity = int(self.header['slot_capacity'])
+        self.data_offset = int(self.header['data_offset'])
+        self.max_detections = int(self.header['max_detections'])
+        slot_headers_offset = RING_HEADER_SIZE + CONSUMER_DTYPE.itemsize * MAX_CONSUMERS
+        self.consumers = np.ndarray((MAX_CONSUMERS,), dtype=CONSUMER_DTYPE,
+                                    buffer=shm.buf, offset=RING_HEADER_SIZE)
+        self.slots = np.ndarray((self.num_slots,), dtype=SLOT_HEADER_DTYPE,
+                                buffer=shm.buf, offset=slot_headers_offset)
+        self.detections = np.ndarray((self.num_slots, self.max_detections), dtype=DETECTION_DTYPE,
+                                     buffer=shm.buf, offset=int(self.header['detections_offset']))
+        self._generation = self.slots['generation']
+        self._seq = self.slots['seq']
+        self._pins = self.consumers['pinned_seq']
+        self._next_slot = 0
+        self.pin_timeout_ns = int(pin_timeout_s * 1e9)
+
+    @classmethod
+    def create(cls,
+               name: Optional[str],
+               num_slots: int,
+               slot_capacity: int,
+               max_detections: int = MAX_DETECTIONS) -> 'ShmRing':
+        """
+        建立新的環形緩衝區（同名的殘留區段會先被移除）
+
+        Parameters:
+            name: 共享記憶體名稱，None 表示自動命名
+            num_slots: 槽位數
+            slot_capacity: 每個槽位的資料容量（位元組）
+            max_detections: 每個槽位偵測表的列數
+
+        Returns:
+            ShmRing: 環形緩衝區（擁有者）
+        """
+        if not 2 <= num_slots <= MAX_SLOTS:
+            raise ValueError(f"num_slots must be between 2 and {MAX_SLOTS}")
+        _, detections_offset, data_offset, total_size = ring_layout(num_slots, slot_capacity, max_detections)
+
+        if name is not None:
+            try:
+                stale = shared_memory.SharedMemory(name=name)
+                stale.close()
+                stale.unlink()
+            except FileNotFoundError:
+                pass
+
+        shm = shared_memory.SharedMemory(name=name, create=True, size=total_size)
+        header = np.ndarray((), dtype=RING_HEADER_DTYPE, buffer=shm.buf)
+        header['version'] = RING_VERSION
+        header['num_slots'] = num_slots
+        header['sender_pid'] = os.getpid()
+        header['slot_capacity'] = _align(slot_capacity)
+        header['data_offset'] = data_offset
+        header['max_detections'] = max_detections
+        header['detections_offset'] = detections_offset
+        header['last_slot'] = -1
+        # magic 最後寫入，避免接收端連上初始化到一半的區段
+        header['magic'] = RING_MAGIC
+        del header
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name: str) -> 'ShmRing':
+        """
+        連上既有的環形緩衝區
+
+        Parameters:
+            name: 共享記憶體名稱
+
+        Returns:
+            ShmRing: 環形緩衝區（非擁有者）
+        """
+        return cls(shared_memory.SharedMemory(name=name), owner=False)
+
+    @property
+    def write_seq(self) -> int:
+        """最新已發布的帧序號"""
+        return int(self.header['write_seq'])
+
+    @property
+    def last_slot(self) -> int:
+        """最新已發布的槽位"""
+        return int(self.header['last_slot'])
+
+    def slot_data(self, index: int, shape, dtype) -> np.ndarray:
+        """
+        取得槽位資料區的 NumPy 視圖（不複製）
+
+        Parameters:
+            index: 槽位編號
+            shape: 影像 shape
+            dtype: 影像 dtype
+
+        Returns:
+            np.ndarray: 指向共享記憶體的視圖
+        """
+        return np.ndarray(shape, dtype=dtype, buffer=self.shm.buf,
+                          offset=self.data_offset + index * self.slot_capacity)
+
+    def slot_detections(self, index: int, count: Optional[int] = None) -> np.ndarray:
+        """
+        取得槽位偵測表的視圖（不複製）
+
+        Parameters:
+            index: 槽位編號
+            count: 列數，None 表示槽位標頭記錄的有效列數
+
+        Returns:
+            np.ndarray: DETECTION_DTYPE 結構化陣列視圖
+        """
+        if count is None:
+            count = int(self.slots[index]['num_detections'])
+        return self.detections[index, :count]
+
+    def write(self,
+              image: np.ndarray,
+              trigger_num: int,
+              timestamp_ns: Optional[int] = None,
+              backpressure_timeout_s: float = 0.0,
+              detections: Optional[np.ndarray] = None) -> Tuple[int, int]:
+        """
+        將影像原地寫入下一個槽位並發布
+
+        Parameters:
+            image: 影像（需 C 連續）
+            trigger_num: 觸發編號
+            timestamp_ns: 影像時間（time.time_ns()），None 表示現在
+            backpressure_timeout_s: every 消費者來不及處理時最多等待的秒數
+            detections: 此帧的偵測表（DETECTION_DTYPE），超過 max_detections 的列會被截斷
+
+        Returns:
+            Tuple[int, int]: (槽位編號, 帧序號)
+
+        Raises:
+            RingFullError: 所有槽位都被接收端租用，此帧未寫入
+        """
+        if image.nbytes > self.slot_capacity:
+            raise ValueError(f"Image of {image.nbytes} bytes exceeds slot capacity {self.slot_capacity}")
+        if image.ndim > MAX_NDIM:
+            raise ValueError(f"Image ndim {image.ndim} exceeds {MAX_NDIM}")
+
+        index, generation = self._acquire_slot(backpressure_timeout_s)
+        seq = self.write_seq + 1
+
+        self.slot_data(index, image.shape, image.dtype)[...] = image
+        num_detections = 0
+        if detections is not None and len(detections):
+            num_detections = min(len(detections), self.max_detections)
+            self.detections[index, :num_detections] = detections[:num_detections]
+            if len(detections) > num_detections:
+                self.header['truncated_detections'] += len(detections) - num_detections
+        slot = self.slots[index]
+        slot['num_detections'] = num_detections
+        slot['seq'] = seq
+        slot['trigger_num'] = trigger_num
+        slot['timestamp_ns'] = timestamp_ns if timestamp_ns is not None else time.time_ns()
+        slot['nbytes'] = image.nbytes
+        slot['ndim'] = image.ndim
+        slot['shape'] = tuple(image.shape) + (0,) * (MAX_NDIM - image.ndim)
+        slot['dtype'] = image.dtype.str.encode('ascii')
+        publish_ns = time.perf_counter_ns()
+        slot['publish_ns'] = publish_ns
+
+        self._generation[index] = generation + 2   # 偶數：完成
+
+        self.header['last_slot'] = index
+        self.header['publish_ns'] = publish_ns
+        self.header['write_seq'] = seq
+        return index, seq
+
+    def _acquire_slot(self, backpressure_timeout_s: float = 0.0) -> Tuple[int, int]:
+        """
+        取得下一個可寫入的槽位，並將其 generation 設為奇數
+        被租用的槽位一律跳過；every 消費者未處理的帧最多等待 backpressure_timeout_s，之後覆寫最舊的一帧
+
+        Returns:
+            Tuple[int, int]: (槽位編號, 寫入前的 generation)
+        """
+        deadline_ns = time.perf_counter_ns() + int(backpressure_timeout_s * 1e9)
+        while True:
+            acquired = self._try_acquire_slot(respect_backlog=True)
+            if acquired is not None:
+                return acquired
+            if time.perf_counter_ns() >= deadline_ns:
+                break
+            time.sleep(50e-6)
+
+        acquired = self._try_acquire_slot(respect_backlog=False)
+        if acquired is not None:
+            return acquired
+        self.header['dropped_pinned'] += 1
+        raise RingFullError("All slots are leased")
+
+    def _live_consumers(self) -> np.ndarray:
+        """仍在活動中的消費者（布林陣列）"""
+        now_ns = time.monotonic_ns()
+        return (self.consumers['pid'] != 0) & \
+               (now_ns - self.consumers['heartbeat_ns'].astype(np.int64) < self.pin_timeout_ns)
+
+    def _try_acquire_slot(self, respect_backlog: bool) -> Optional[Tuple[int, int]]:
+        """
+        嘗試取得可寫入的槽位
+
+        Parameters:
+            respect_backlog: 是否保留 every 消費者未處理的帧；False 時改挑最舊的未租用槽位，
+                             並對被覆寫的消費者計入 overruns
+
+        Returns:
+            Tuple[int, int]: (槽位編號, 寫入前的 generation)，沒有可用槽位時為 None
+        """
+        live = self._live_consumers()
+        every = live & (self.consumers['policy'] == POLICY_EVERY)
+        cursors = self.consumers['cursor']
+        max_lag = self.consumers['max_lag']
+
+        if respect_backlog:
+            order = [(self._next_slot + step) % self.num_slots for step in range(self.num_slots)]
+        else:
+            order = sorted(range(self.num_slots), key=lambda i: int(self._seq[i]))
+
+        for index in order:
+            generation = int(self._generation[index])
+            self._generation[index] = generation + 1   # 奇數：寫入中
+            current_seq = int(self._seq[index])
+            if current_seq == 0:
+                self._next_slot = (index + 1) % self.num_slots
+                return index, generation
+
+            leased = np.any(live & (self._pins[:, index] == current_seq))
+            backlog = every & (cursors < current_seq) & (current_seq <= cursors + max_lag)
+            if not leased and (not respect_backlog or not np.any(backlog)):
+                if np.any(backlog):
+                    self.consumers['overruns'][backlog] += 1
+                self._next_slot = (index + 1) % self.num_slots
+                return index, generation
+            self._generation[index] = generation        # 不可覆寫：還原並嘗試下一個
+        return None
+
+    def register_consumer(self, policy: int = POLICY_LATEST, max_lag: int = 0) -> int:
+        """
+        在消費者表佔用一列
+
+        Parameters:
+            policy: 消費策略（POLICY_LATEST / POLICY_EVERY）
+            max_lag: every 策略下發送端保留的最大未處理帧數（上限為槽位數 - 1）
+
+        Returns:
+            int: 消費者編號
+
+        Raises:
+            RingFullError: 消費者表已滿
+        """
+        pid = os.getpid()
+        token = int.from_bytes(os.urandom(4), 'little') or 1
+        now_ns = time.monotonic_ns()
+        for index in range(MAX_CONSUMERS):
+            row = self.consumers[index]
+            stale = now_ns - int(row['heartbeat_ns']) > self.pin_timeout_ns
+            if int(row['pid']) != 0 and not stale:
+                continue
+            row['token'] = token
+            row['pid'] = pid
+            time.sleep(0.001)
+            # 兩個接收端同時搶同一列時，只有最後寫入 token 的一方保留
+            if int(row['token']) == token and int(row['pid']) == pid:
+                self._pins[index, :] = 0
+                row['policy'] = policy
+                row['max_lag'] = min(max_lag, self.num_slots - 1) if policy == POLICY_EVERY else 0
+                row['cursor'] = self.write_seq
+                row['consumed'] = 0
+                row['dropped'] = 0
+                row['overruns'] = 0
+                row['heartbeat_ns'] = time.monotonic_ns()
+                return index
+        raise RingFullError(f"All {MAX_CONSUMERS} consumer entries are in use")
+
+    def unregister_consumer(self, consumer: int) -> None:
+        """釋放消費者表的一列（同時釋放所有租用）"""
+        self._pins[consumer, :] = 0
+        self.consumers[consumer]['pid'] = 0
+
+    def advance_consumer(self, consumer: int, seq: int) -> None:
+        """
+        更新消費者的 cursor（中間略過的帧計入 dropped）
+
+        Parameters:
+            consumer: 消費者編號
+            seq: 剛處理的帧序號
+        """
+        row = self.consumers[consumer]
+        cursor = int(row['cursor'])
+        if seq > cursor + 1:
+            row['dropped'] += seq - cursor - 1
+        if seq > cursor:
+            row['cursor'] = seq
+        row['consumed'] += 1
+
+    def oldest_seq_after(self, seq: int) -> int:
+        """
+        環形緩衝區中仍保存、且晚於 seq 的最舊帧序號
+
+        Returns:
+            int: 帧序號，沒有時為 0
+        """
+        newer = self._seq[self._seq > seq]
+        return int(newer.min()) if len(newer) else 0
+
+    def consumer_metrics(self) -> list:
+        """
+        各消費者的 lag 與丟帧統計（發送端使用）
+
+        Returns:
+            list: 每個活動中消費者的統計字典
+        """
+        write_seq = self.write_seq
+        live = self._live_consumers()
+        metrics = []
+        for index in np.flatnonzero(live):
+            row = self.consumers[index]
+            policy = int(row['policy'])
+            metrics.append({
+                'consumer': int(index),
+                'pid': int(row['pid']),
+                'policy': 'every' if policy == POLICY_EVERY else 'latest',
+                'max_lag': int(row['max_lag']),
+                'cursor': int(row['cursor']),
+                'lag': max(0, write_seq - int(row['cursor'])),
+                'consumed': int(row['consumed']),
+                'dropped': int(row['dropped']),
+                'overruns': int(row['overruns']),
+                'leases': int(np.count_nonzero(self._pins[index])),
+            })
+        return metrics
+
+    def touch_consumer(self, consumer: int) -> None:
+        """更新消費者的活動時間"""
+        self.consumers['heartbeat_ns'][consumer] = time.monotonic_ns()
+
+    def pin(self, consumer: int, index: int, seq: int) -> Dict:
+        """
+        租用槽位：寫入租用標記後確認槽位仍是預期且完整的帧
+
+        Returns:
+            dict: 槽位標頭
+
+        Raises:
+            TornFrameError / FrameOverwrittenError: 無法租用（標記已清除）
+        """
+        self.touch_consumer(consumer)
+        self._pins[consumer, index] = seq
+        generation = int(self._generation[index])
+        if generation & 1:
+            self._pins[consumer, index] = 0
+            raise TornFrameError(f"Slot {index} is being written")
+        info = self.slot_info(index)
+        if info['seq'] != seq or int(self._generation[index]) != generation:
+            self._pins[consumer, index] = 0
+            raise FrameOverwrittenError(f"Slot {index} holds seq {info['seq']}, expected {seq}")
+        return info
+
+    def unpin(self, consumer: int, index: int) -> None:
+        """解除租用"""
+        self._pins[consumer, index] = 0
+
+    def slot_info(self, index: int) -> Dict:
+        """
+        讀取槽位標頭
+
+        Returns:
+            dict: {'generation', 'seq', 'trigger_num', 'timestamp_ns', 'publish_ns', 'shape', 'dtype',
+                   'num_detections'}
+        """
+        slot = self.slots[index]
+        ndim = int(slot['ndim'])
+        return {
+            'generation': int(slot['generation']),
+            'seq': int(slot['seq']),
+            'trigger_num': int(slot['trigger_num']),
+            'timestamp_ns': int(slot['timestamp_ns']),
+            'publish_ns': int(slot['publish_ns']),
+            'shape': tuple(int(v) for v in slot['shape'][:ndim]),
+            'dtype': np.dtype(bytes(slot['dtype']).decode('ascii')),
+            'num_detections': int(slot['num_detections'])
+        }
+
+    def read(self, index: int, expected_seq: Optional[int] = None) -> Tuple[np.ndarray, Dict]:
+        """
+        以 seqlock 複製讀取槽位
+
+        Parameters:
+            index: 槽位編號
+            expected_seq: 預期的帧序號，None 表示不檢查
+
+        Returns:
+            Tuple[np.ndarray, dict]: (影像複本, 槽位標頭)，標頭的 'detections' 為偵測表複本
+
+        Raises:
+            TornFrameError: 讀取期間槽位正在寫入或被覆寫
+            FrameOverwrittenError: 槽位中已不是預期的帧
+        """
+        generation = int(self._generation[index])
+        if generation & 1:
+            raise TornFrameError(f"Slot {index} is being written")
+        info = self.slot_info(index)
+        if expected_seq is not None and info['seq'] != expected_seq:
+            raise FrameOverwrittenError(f"Slot {index} holds seq {info['seq']}, expected {expected_seq}")
+        image = self.slot_data(index, info['shape'], info['dtype']).copy()
+        info['detections'] = self.slot_detections(index, info['num_detections']).copy()
+        if int(self._generation[index]) != generation:
+            raise TornFrameError(f"Slot {index} was overwritten during read")
+        return image, info
+
+    def slot_for_seq(self, seq: int) -> int:
+        """
+        尋找存放指定帧序號的槽位
+
+        Returns:
+            int: 槽位編號，已被覆寫時為 -1
+        """
+        matches = np.flatnonzero(self._seq == seq)
+        return int(matches[0]) if len(matches) else -1
+
+    @property
+    def closed(self) -> bool:
+        """發送端是否已關閉此環形緩衝區"""
+        return bool(self.header['closed'])
+
+    def close(self) -> None:
+        """關閉映射（擁有者同時移除區段）"""
+        if self.owner and self.header is not None:
+            self.header['closed'] = 1
+        self.header = None
+        self.slots = None
+        self.detections = None
+        self.consumers = None
+        self._generation = None
+        self._seq = None
+        self._pins = None
+        try:
+            self.shm.close()
+        except BufferError:
+            # 仍有外部視圖參考此區段，交由垃圾回收
+            pass
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+class FrameLease:
+    """
+    槽位租用：持有期間 image 與 detections 為指向共享記憶體的唯讀零複製視圖，發送端不會覆寫該槽位
+    用完必須 release()（或使用 with 區塊）；需要長期保存請呼叫 copy()
+    """
+
+    def __init__(self,
+                 reader: 'ShmRingReader',
+                 slot: int,
+                 seq: int,
+                 image: np.ndarray,
+                 info: Dict,
+                 detections: Optional[np.ndarray] = None):
+        self.reader = reader
+        self.ring = reader.ring
+        self.consumer = reader.consumer
+        self.slot = slot
+        self.seq = seq
+        self.image = image
+        self.detections = detections if detections is not None else np.empty(0, dtype=DETECTION_DTYPE)
+        self.info = info
+        self.released = False
+
+    @property
+    def trigger_num(self) -> int:
+        """觸發編號"""
+        return self.info['trigger_num']
+
+    def copy(self) -> np.ndarray:
+        """複製影像（可在釋放後繼續使用）"""
+        return self.image.copy()
+
+    def copy_detections(self) -> np.ndarray:
+        """複製偵測表（可在釋放後繼續使用）"""
+        return self.detections.copy()
+
+    def release(self) -> None:
+        """釋放租用"""
+        if not self.released:
+            self.released = True
+            self.image = None
+            self.detections = None
+            self.reader._release(self)
+
+    def __enter__(self) -> 'FrameLease':
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.release()
+
+    def __del__(self):
+        if not self.released:
+            self.release()
+
+
+class ShmRingReader:
+    """
+    環形緩衝區接收端函式庫
+    持續連上發送端的環形緩衝區，提供零複製租用（lease）與複製讀取（read_copy）兩種模式
+    """
+
+    def __init__(self, ring_name: str, pin_timeout_s: float = 5.0, policy: str = 'latest', max_lag: int = 4):
+        """
+        Parameters:
+            ring_name: 環形緩衝區名稱（發送端以 RING 訊息宣告）
+            pin_timeout_s: 超過此時間沒有活動的租用會被發送端忽略
+            policy: 'latest'（只取最新帧）或 'every'（依序處理每一帧，發送端最多保留 max_lag 帧）
+            max_lag: every 策略下允許落後的帧數
+        """
+        if policy not in POLICY_NAMES:
+            raise ValueError(f"Unknown policy '{policy}', expected one of {tuple(POLICY_NAMES)}")
+        self.policy = policy
+        self.max_lag = max_lag
+        self.ring = ShmRing(shared_memory.SharedMemory(name=ring_name), owner=False,
+                            pin_timeout_s=pin_timeout_s)
+        self.ring_name = ring_name
+        self.pin_timeout_s = pin_timeout_s
+        self.consumer = self.ring.register_consumer(POLICY_NAMES[policy], max_lag)
+        self.active_leases = 0
+        self.last_seq = self.ring.write_seq
+
+        # 統計資訊
+        self.leased = 0
+        self.copied = 0
+        self.torn = 0
+        self.notify_latency_us = LatencyStats()  # 發布到察覺的延遲（微秒）
+
+    def lease(self, slot: int, seq: int) -> FrameLease:
+        """
+        租用指定槽位的帧（零複製）
+
+        Returns:
+            FrameLease: 租用，影像為唯讀視圖
+
+        Raises:
+            TornFrameError: 槽位已被覆寫或正在寫入
+        """
+        try:
+            info = self.ring.pin(self.consumer, slot, seq)
+        except TornFrameError:
+            self.torn += 1
+            raise
+        image = self.ring.slot_data(slot, info['shape'], info['dtype'])
+        image.flags.writeable = False
+        detections = self.ring.slot_detections(slot, info['num_detections'])
+        detections.flags.writeable = False
+        self.ring.advance_consumer(self.consumer, seq)
+        self.leased += 1
+        self.active_leases += 1
+        return FrameLease(self, slot, seq, image, info, detections)
+
+    def lease_latest(self) -> Optional[FrameLease]:
+        """
+        租用最新已發布的帧
+
+        Returns:
+            FrameLease: 租用，尚無帧時為 None
+        """
+        for _ in range(3):
+            slot, seq = self.ring.last_slot, self.ring.write_seq
+            if slot < 0:
+                return None
+            try:
+                return self.lease(slot, seq)
+            except TornFrameError:
+                continue
+        return None
+
+    def read_copy(self, slot: int, seq: int) -> Tuple[np.ndarray, Dict]:
+        """
+        複製讀取指定槽位（不租用，適合需要保存帧的接收端）
+
+        Returns:
+            Tuple[np.ndarray, dict]: (影像複本, 槽位標頭)
+
+        Raises:
+            TornFrameError: 槽位已被覆寫或正在寫入
+        """
+        self.ring.touch_consumer(self.consumer)
+        try:
+            image, info = self.ring.read(slot, expected_seq=seq)
+        except TornFrameError:
+            self.torn += 1
+            raise
+        self.ring.advance_consumer(self.consumer, seq)
+        self.copied += 1
+        return image, info
+
+    def wait_for_frame(self,
+                       after_seq: Optional[int] = None,
+                       timeout: Optional[float] = None,
+                       spin_us: float = 50.0,
+                       max_sleep_s: float = 0.001) -> Optional[Tuple[int, int]]:
+        """
+        等待門鈴計數器（write_seq）超過 after_seq
+
+        Parameters:
+            after_seq: 已處理到的帧序號，None 表示上次回傳的序號
+            timeout: 逾時秒數，None 表示一直等待
+            spin_us: 先自旋的時間（微秒），涵蓋大多數發布間隔極短的情況
+            max_sleep_s: 輪詢睡眠間隔上限
+
+        Returns:
+            Tuple[int, int]: (slot, seq)，指向最新的帧；逾時或發送端關閉時為 None
+        """
+        if after_seq is None:
+            after_seq = self.last_seq
+        start_ns = time.perf_counter_ns()
+        spin_until = start_ns + int(spin_us * 1000)
+        deadline = start_ns + int(timeout * 1e9) if timeout is not None else None
+        sleep_s = 0.0
+
+        while True:
+            seq = self.ring.write_seq
+            if seq > after_seq:
+                now_ns = time.perf_counter_ns()
+                self.notify_latency_us.add((now_ns - int(self.ring.header['publish_ns'])) / 1000.0)
+                slot = self.ring.slot_for_seq(seq)
+                if slot >= 0:
+                    self.last_seq = seq
+                    return slot, seq
+                continue
+            if self.ring.closed and not self._reattach():
+                return None
+
+            now_ns = time.perf_counter_ns()
+            if deadline is not None and now_ns >= deadline:
+                return None
+            if now_ns < spin_until:
+                continue
+            time.sleep(sleep_s)
+            sleep_s = min(max_sleep_s, sleep_s * 2 if sleep_s else 50e-6)
+            self.ring.touch_consumer(self.consumer)
+
+    def next_frame(self, timeout: Optional[float] = None) -> Optional[Tuple[int, int]]:
+        """
+        依消費策略取得下一個要處理的帧（同機門鈴模式）
+        latest 直接取最新帧；every 取 cursor 的下一帧，已被覆寫時跳到仍保存的最舊帧
+
+        Returns:
+            Tuple[int, int]: (slot, seq)，逾時或發送端關閉時為 None
+        """
+        if self.policy == 'latest':
+            return self.wait_for_frame(after_seq=int(self.ring.consumers['cursor'][self.consumer]),
+                                       timeout=timeout)
+
+        while True:
+            cursor = int(self.ring.consumers['cursor'][self.consumer])
+            if self.ring.write_seq <= cursor:
+                if self.wait_for_frame(after_seq=cursor, timeout=timeout) is None:
+                    return None
+                cursor = int(self.ring.consumers['cursor'][self.consumer])
+            target = cursor + 1
+            slot = self.ring.slot_for_seq(target)
+            if slot < 0:
+                target = self.ring.oldest_seq_after(cursor)
+                if target == 0:
+                    continue
+                slot = self.ring.slot_for_seq(target)
+                if slot < 0:
+                    continue
+            return slot, target
+
+    def lease_next(self, timeout: Optional[float] = None) -> Optional[FrameLease]:
+        """
+        依消費策略租用下一帧（同機門鈴模式）
+
+        Returns:
+            FrameLease: 租用，逾時或發送端關閉時為 None
+        """
+        while True:
+            frame = self.next_frame(timeout)
+            if frame is None:
+                return None
+            try:
+                return self.lease(*frame)
+            except TornFrameError:
+                continue
+
+    def _reattach(self) -> bool:
+        """發送端以同名新區段取代環形緩衝區時重新連上"""
+        try:
+            ring = ShmRing(shared_memory.SharedMemory(name=self.ring_name), owner=False,
+                           pin_timeout_s=self.pin_timeout_s)
+        except (FileNotFoundError, ValueError):
+            return False
+        if ring.closed:
+            ring.close()
+            return False
+        # 仍有租用時保留舊映射，待租用全部釋放後由垃圾回收
+        self.ring.unregister_consumer(self.consumer)
+        if not self.active_leases:
+            self.ring.close()
+        self.ring = ring
+        self.consumer = ring.register_consumer(POLICY_NAMES[self.policy], self.max_lag)
+        self.last_seq = 0
+        return True
+
+    def _release(self, lease: FrameLease) -> None:
+        """由 FrameLease.release() 呼叫"""
+        if lease.ring._pins is not None:
+            lease.ring.unpin(lease.consumer, lease.slot)
+        self.active_leases -= 1
+
+    def get_statistics(self) -> Dict:
+        """
+        獲取統計資訊
+
+        Returns:
+            dict: 統計資訊
+        """
+        return {
+            'ring_name': self.ring_name,
+            'consumer': self.consumer,
+            'leased': self.leased,
+            'copied': self.copied,
+            'torn': self.torn,
+            'active_leases': self.active_leases,
+            'notify_latency_us': self.notify_latency_us.quantiles()
+        }
+
+    def close(self) -> None:
+        """釋放消費者列並關閉映射"""
+        if self.ring is None:
+            return
+        self.ring.unregister_consumer(self.consumer)
+        self.ring.close()
+        self.ring = None
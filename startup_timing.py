@@ -0,0 +1,157 @@
+# startup_timing.py
+"""
+啟動時間量測
+入口（BasicDemo / headless_runner）第一個匯入本模組，之後各里程碑第一次發生時記錄距離啟動的時間，
+並輸出為指標 nircam_startup_seconds{milestone}
+
+里程碑:
+    imports            入口模組匯入完成
+    ui_ready           介面建立完成（BasicDemo）
+    pipeline_started   所有啟動步驟完成（headless_runner）
+    model_ready        模型載入並暖機完成
+    first_frame        擷取迴圈取得第一帧
+    first_inference    第一次推論完成
+
+命令列（冷啟動匯入時間，每個模組在新的直譯器中匯入）:
+    python startup_timing.py                        # 預設模組清單
+    python startup_timing.py CamOperation_class detect --repeat 5
+"""
+
+import time
+
+PROCESS_START = time.perf_counter()     # 本模組第一次匯入的時間（入口的第一個匯入）
+
+import argparse
+import statistics
+import subprocess
+import sys
+from typing import Dict, Optional
+
+from lazy_import import get_import_statistics
+from pipeline_metrics import metrics
+
+IMPORTS = 'imports'
+UI_READY = 'ui_ready'
+PIPELINE_STARTED = 'pipeline_started'
+MODEL_READY = 'model_ready'
+FIRST_FRAME = 'first_frame'
+FIRST_INFERENCE = 'first_inference'
+
+STARTUP_TIME = metrics.gauge('nircam_startup_seconds', 'Time from process start to each startup milestone',
+                             ('milestone',))
+
+_marks: Dict[str, float] = {}           # 里程碑 → 距離啟動的毫秒
+
+
+def mark(milestone: str) -> bool:
+    """
+    記錄里程碑（只記錄第一次）
+
+    Parameters:
+        milestone: 里程碑名稱
+
+    Returns:
+        bool: 是否為第一次
+    """
+    if milestone in _marks:
+        return False
+    elapsed_ms = (time.perf_counter() - PROCESS_START) * 1000.0
+    _marks[milestone] = elapsed_ms
+    STARTUP_TIME.labels(milestone).set(elapsed_ms / 1000.0)
+    return True
+
+
+def elapsed_ms(milestone: str) -> Optional[float]:
+    """里程碑距離啟動的毫秒，尚未發生時為 None"""
+    return _marks.get(milestone)
+
+
+def get_startup_statistics() -> Dict:
+    """
+    獲取啟動時間統計
+
+    Returns:
+        dict: {'milestones_ms': {...}, 'lazy_imports': {...}}
+    """
+    return {
+        'milestones_ms': dict(sorted(_marks.items(), key=lambda item: item[1])),
+        'lazy_imports': get_import_statistics()
+    }
+
+
+def print_startup_report() -> None:
+    """列印啟動時間報告"""
+    stats = get_startup_statistics()
+    print("\n" + "=" * 60)
+    print("Startup Timing")
+    print("=" * 60)
+    for milestone, ms in stats['milestones_ms'].items():
+        print(f"{milestone + ':':<18} {ms:8.0f} ms")
+    for name, info in stats['lazy_imports'].items():
+        if info['error']:
+            state = f"failed ({info['error']})"
+        elif info['import_ms'] is not None:
+            state = f"{info['import_ms']:.0f} ms on {info['thread']}"
+        else:
+            state = "already imported" if info['loaded'] else "not imported"
+        print(f"  import {name:<18} {state}")
+    print("=" * 60 + "\n")
+
+
+# ========== 冷啟動匯入量測 ==========
+
+DEFAULT_MODULES = ('CamOperation_class', 'headless_runner', 'tcp_server', 'simple_tracker',
+                   'two_band_filter', 'detect', 'cv2')
+HEAVY_MODULES = ('torch', 'ultralytics', 'scipy', 'cv2')
+
+_PROBE = (
+    "import sys, time\n"
+    "start = time.perf_counter()\n"
+    "import {module}\n"
+    "elapsed = (time.perf_counter() - start) * 1000.0\n"
+    "print(elapsed, ','.join(m for m in {heavy!r} if m in sys.modules))\n"
+)
+
+
+def measure_cold_import(module: str, repeat: int = 3) -> Dict:
+    """
+    在新的直譯器中匯入模組，量測匯入時間與連帶匯入的重模組
+
+    Parameters:
+        module: 模組名稱
+        repeat: 重複次數（取中位數）
+
+    Returns:
+        dict: {'module', 'median_ms', 'heavy', 'error'}
+    """
+    times = []
+    heavy = ''
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, '-c', _PROBE.format(module=module, heavy=HEAVY_MODULES)],
+                                capture_output=True, text=True)
+        if result.returncode != 0:
+            error = (result.stderr.strip().splitlines() or ['failed'])[-1]
+            return {'module': module, 'median_ms': None, 'heavy': '', 'error': error}
+        elapsed, _, heavy = result.stdout.strip().splitlines()[-1].partition(' ')
+        times.append(float(elapsed))
+    return {'module': module, 'median_ms': statistics.median(times), 'heavy': heavy, 'error': None}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure cold import time of pipeline modules")
+    parser.add_argument("modules", nargs='*', default=list(DEFAULT_MODULES))
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'module':<22} {'import':>10}  heavy modules pulled in")
+    for module in args.modules:
+        result = measure_cold_import(module, args.repeat)
+        if result['error']:
+            print(f"{module:<22} {'error':>10}  {result['error']}")
+        else:
+            print(f"{module:<22} {result['median_ms']:>7.0f} ms  {result['heavy'] or '-'}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+# stream_framing.py
+"""
+TCP 串流訊息分幀
+recv() 可能把多筆記錄合併或把一筆記錄切開，接收端必須自行分幀：
+- 行分幀：每筆記錄以換行結尾（文字記錄，例如共享記憶體槽位編號）
+- 長度分幀：每筆記錄前置 4 位元組大端序長度（二進位記錄，例如 JPEG）
+"""
+
+import socket
+import struct
+from collections import deque
+from typing import List, Optional
+
+LENGTH_PREFIX = struct.Struct("!I")
+FRAMING_MODES = ("line", "length")
+
+
+def pack_length_prefixed(payload: bytes) -> bytes:
+    """
+    加上長度前綴
+
+    Parameters:
+        payload: 記錄內容
+
+    Returns:
+        bytes: 長度前綴 + 記錄內容
+    """
+    return LENGTH_PREFIX.pack(len(payload)) + payload
+
+
+def pack_record(payload: bytes, framing: str = "line") -> bytes:
+    """
+    依分幀方式封裝一筆記錄
+
+    Parameters:
+        payload: 記錄內容（行分幀時不得包含換行）
+        framing: "line" 或 "length"
+
+    Returns:
+        bytes: 封裝後的記錄
+    """
+    if framing == "length":
+        return pack_length_prefixed(payload)
+    return payload + b"\n"
+
+
+def read_exact(sock: socket.socket, size: int) -> Optional[bytes]:
+    """
+    從 socket 讀取剛好 size 位元組
+
+    Returns:
+        bytes: 讀到的資料，對方關閉連線時為 None
+    """
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:], size - received)
+        if count == 0:
+            return None
+        received += count
+    return bytes(buffer)
+
+
+class LineFramer:
+    """行分幀器：累積資料並切出完整的行（不含換行）"""
+
+    def __init__(self, max_line: int = 1 << 20):
+        self._buffer = bytearray()
+        self.max_line = max_line
+
+    def feed(self, data: bytes) -> List[bytes]:
+        """
+        加入收到的資料
+
+        Returns:
+            List[bytes]: 已完整的記錄
+        """
+        self._buffer += data
+        records = []
+        start = 0
+        while True:
+            end = self._buffer.find(b"\n", start)
+            if end < 0:
+                break
+            records.append(bytes(self._buffer[start:end]).rstrip(b"\r"))
+            start = end + 1
+        del self._buffer[:start]
+        if len(self._buffer) > self.max_line:
+            raise ValueError(f"Line exceeds {self.max_line} bytes without newline")
+        return records
+
+
+class LengthFramer:
+    """長度分幀器：累積資料並切出完整的長度前綴記錄"""
+
+    def __init__(self, max_record: int = 64 << 20):
+        self._buffer = bytearray()
+        self.max_record = max_record
+
+    def feed(self, data: bytes) -> List[bytes]:
+        """
+        加入收到的資料
+
+        Returns:
+            List[bytes]: 已完整的記錄
+        """
+        self._buffer += data
+        records = []
+        start = 0
+        while len(self._buffer) - start >= LENGTH_PREFIX.size:
+            (length,) = LENGTH_PREFIX.unpack_from(self._buffer, start)
+            if length > self.max_record:
+                raise ValueError(f"Record of {length} bytes exceeds {self.max_record}")
+            end = start + LENGTH_PREFIX.size + length
+            if len(self._buffer) < end:
+                break
+            records.append(bytes(self._buffer[start + LENGTH_PREFIX.size:end]))
+            start = end
+        del self._buffer[:start]
+        return records
+
+
+def make_framer(framing: str = "line"):
+    """
+    建立分幀器
+
+    Parameters:
+        framing: "line" 或 "length"
+
+    Returns:
+        LineFramer 或 LengthFramer
+    """
+    if framing not in FRAMING_MODES:
+        raise ValueError(f"Unknown framing '{framing}', expected one of {FRAMING_MODES}")
+    return LengthFramer() if framing == "length" else LineFramer()
+
+
+class FramedSocketReader:
+    """包裝 socket，逐筆回傳完整記錄"""
+
+    def __init__(self, sock: socket.socket, framing: str = "line", recv_size: int = 65536):
+        self.sock = sock
+        self.framer = make_framer(framing)
+        self.recv_size = recv_size
+        self._pending = deque()
+
+    def read_record(self) -> Optional[bytes]:
+        """
+        讀取下一筆記錄（阻塞）
+
+        Returns:
+            bytes: 記錄內容，對方關閉連線時為 None
+        """
+        while not self._pending:
+            data = self.sock.recv(self.recv_size)
+            if not data:
+                return None
+            self._pending.extend(self.framer.feed(data))
+        return self._pending.popleft()
+
+    def read_records(self) -> Optional[List[bytes]]:
+        """
+        讀取目前已到達的所有完整記錄（至少一筆，阻塞）
+
+        Returns:
+            List[bytes]: 記錄內容，對方關閉連線時為 None
+        """
+        first = self.read_record()
+        if first is None:
+            return None
+        records = [first]
+        records.extend(self._pending)
+        self._pending.clear()
+        return records
@@ -2,19 +2,386 @@
 import socket
 import threading
 import json
+import logging
 import time
+from collections import deque
+
+from pipeline_logging import get_pipeline_logger
+from udp_transport import UDPSender
+
+# 訂閱者角色
+ROLE_ACTUATOR = "actuator"    # 執行端（LabVIEW 控制器），接收氣吹指令
+ROLE_OBSERVER = "observer"    # 觀察端（監控程式），接收偵測串流
+
+# 訊息主題
+TOPIC_BLOW = "blow"            # 氣吹 / 觸發指令
+TOPIC_DETECTION = "detection"  # 逐帧偵測結果串流
+
+# 支援的訊息格式
+MESSAGE_FORMATS = ("csv", "json")
+
+# 支援的傳輸方式（UDP 訂閱者仍以 TCP 連線宣告角色並偵測斷線）
+TRANSPORTS = ("tcp", "udp")
+
+# 各角色預設訂閱的主題
+DEFAULT_TOPICS = {
+    ROLE_ACTUATOR: (TOPIC_BLOW,),
+    ROLE_OBSERVER: (TOPIC_DETECTION,),
+}
+
+
+class OutboundMessage:
+    """
+    一則待發送的訊息
+    每種格式只序列化一次，編碼後的 bytes 由所有訂閱者共用
+    """
+    
+    def __init__(self, topic, line, payload=None, seq=0):
+        """
+        Parameters:
+            topic: 訊息主題
+            line: CSV 格式的訊息字串（LabVIEW 原始格式，含換行）
+            payload: JSON 格式使用的結構化資料，None 表示以原始字串包裝
+            seq: 訊息序號
+        """
+        self.topic = topic
+        self.line = line
+        self.payload = payload
+        self.seq = seq
+        self.timestamp = time.time()
+        self._encoded = {}
+    
+    def encode(self, fmt):
+        """取得指定格式的編碼結果（首次呼叫時序列化並快取）"""
+        data = self._encoded.get(fmt)
+        if data is None:
+            if fmt == "json":
+                body = {'topic': self.topic, 'seq': self.seq, 'timestamp': self.timestamp}
+                if self.payload is not None:
+                    body.update(self.payload)
+                else:
+                    body['raw'] = self.line.rstrip("\n")
+                text = json.dumps(body, separators=(',', ':')) + "\n"
+            else:
+                text = self.line
+            data = text.encode('utf-8')
+            self._encoded[fmt] = data
+        return data
+
+
+class Subscriber:
+    """
+    單一 TCP 訂閱者
+    擁有自己的佇列與發送線程，發送端只做非阻塞的入列；
+    觀察端佇列滿時丟棄最舊的訊息，慢速的訂閱者不會拖慢其他訂閱者；
+    執行端佇列滿時拒絕新訊息（由發送端暫存），斷線時尚未送出的訊息交回發送端（on_unsent），
+    對方停止讀取期間已逾期（deadline）的訊息在取出時捨棄並通知發送端（on_expired）
+    設定 datagram_channel 時訊息改以 UDP 直接送出，TCP 連線只用於控制訊息與斷線偵測
+    """
+    
+    def __init__(self, sock, address, role=ROLE_ACTUATOR, fmt="csv", topics=None, queue_size=64,
+                 datagram_channel=None, initial_data=b""):
+        self.sock = sock
+        self.datagram_channel = datagram_channel
+        self.address = address
+        self.role = role
+        self.fmt = fmt
+        self.topics = set(topics) if topics else set(DEFAULT_TOPICS[role])
+        self.queue_size = queue_size
+        self.connected = True
+        self.connected_at = time.time()
+        
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._inbound = bytearray(initial_data)  # 握手時已讀取、尚未處理的資料
+        self.on_line = None                      # 收到完整一行時呼叫 on_line(subscriber, line)
+        self._on_closed = None
+        self._writer_thread = None
+        self._reader_thread = None
+        
+        # 統計資訊
+        self.messages_sent = 0
+        self.bytes_sent = 0
+        self.messages_dropped = 0
+        self.messages_expired = 0
+        self.messages_rejected = 0
+    
+    def start(self, on_closed=None):
+        """啟動發送與接收線程"""
+        self._on_closed = on_closed
+        self._writer_thread = threading.Thread(target=self._write_loop, daemon=True)
+        self._reader_thread = threading.Thread(target=self._read_loop, daemon=True)
+        self._writer_thread.start()
+        self._reader_thread.start()
+    
+    def enqueue(self, data, on_unsent=None, deadline=None, on_expired=None):
+        """
+        非阻塞入列（UDP 訂閱者直接送出資料包）
+        
+        Parameters:
+            data: 編碼後的訊息
+            on_unsent: 斷線時此訊息尚未送出則呼叫 on_unsent()
+            deadline: 最晚送出時間（time.monotonic() 秒），None 表示不逾期
+            on_expired: 逾期未送出而被捨棄時呼叫 on_expired()
+        
+        Returns:
+            bool: 是否入列成功（已斷線或執行端佇列已滿時為 False）
+        """
+        if self.datagram_channel is not None:
+            if not self.connected or not self.datagram_channel.send(data):
+                return False
+            self.messages_sent += 1
+            self.bytes_sent += len(data)
+            return True
+        return self.enqueue_control(data, on_unsent, deadline, on_expired)
+    
+    def enqueue_control(self, data, on_unsent=None, deadline=None, on_expired=None):
+        """
+        經由 TCP 連線入列（控制訊息，例如連線成功通知）
+        觀察端佇列滿時丟棄最舊的訊息；執行端先清除已逾期的訊息，仍滿時拒絕新訊息
+        
+        Returns:
+            bool: 是否入列成功（已斷線或執行端佇列已滿時為 False）
+        """
+        expired = []
+        accepted = True
+        with self._cond:
+            if not self.connected:
+                return False
+            if len(self._queue) >= self.queue_size and self.role != ROLE_ACTUATOR:
+                self._queue.popleft()
+                self.messages_dropped += 1
+            elif len(self._queue) >= self.queue_size:
+                expired = self._take_expired(time.monotonic())
+                if len(self._queue) >= self.queue_size:
+                    self.messages_rejected += 1
+                    accepted = False
+            if accepted:
+                self._queue.append((data, on_unsent, deadline, on_expired))
+                self._cond.notify()
+        self._notify_expired(expired)
+        return accepted
+    
+    def _take_expired(self, now):
+        """移除佇列中已逾期的訊息（呼叫端持有 _cond），回傳被移除的項目"""
+        expired = [entry for entry in self._queue if entry[2] is not None and entry[2] <= now]
+        if expired:
+            kept = [entry for entry in self._queue if entry[2] is None or entry[2] > now]
+            self._queue.clear()
+            self._queue.extend(kept)
+            self.messages_expired += len(expired)
+        return expired
+    
+    @staticmethod
+    def _notify_expired(entries):
+        """通知發送端逾期被捨棄的訊息（不持有 _cond 時呼叫）"""
+        for entry in entries:
+            if entry[3] is not None:
+                try:
+                    entry[3]()
+                except Exception as e:
+                    print(f"Expired message handler error: {e}")
+    
+    def _write_loop(self):
+        """發送線程：依序送出佇列中的訊息"""
+        while True:
+            with self._cond:
+                while self.connected and not self._queue:
+                    self._cond.wait()
+                if not self.connected:
+                    return
+                entry = self._queue.popleft()
+            if entry[2] is not None and entry[2] <= time.monotonic():
+                # 對方停止讀取期間逾期的訊息不再送出（例如過時的氣吹指令）
+                self.messages_expired += 1
+                self._notify_expired([entry])
+                continue
+            data = entry[0]
+            try:
+                self.sock.sendall(data)
+                self.messages_sent += 1
+                self.bytes_sent += len(data)
+            except OSError as e:
+                print(f"Failed to send message to {self.address}: {e}")
+                # 送出失敗的訊息放回佇列，由 close() 交回發送端（已關閉時直接交回）
+                with self._cond:
+                    if self.connected:
+                        self._queue.appendleft(entry)
+                        entry = None
+                if entry is not None and entry[1] is not None:
+                    entry[1]()
+                self.close()
+                return
+    
+    def _read_loop(self):
+        """接收線程：逐行處理對方送來的資料（含握手時多讀的部分），並偵測對方關閉連線"""
+        self._handle_inbound(b"")
+        while self.connected:
+            try:
+                data = self.sock.recv(4096)
+            except OSError:
+                data = b""
+            if not data:
+                self.close()
+                return
+            self._handle_inbound(data)
+    
+    def _handle_inbound(self, data):
+        """累積收到的資料，每個完整的行交給 on_line"""
+        self._inbound.extend(data)
+        while True:
+            end = self._inbound.find(b"\n")
+            if end < 0:
+                return
+            line = bytes(self._inbound[:end]).decode('utf-8', errors='ignore').strip()
+            del self._inbound[:end + 1]
+            if line and self.on_line is not None:
+                try:
+                    self.on_line(self, line)
+                except Exception as e:
+                    print(f"Inbound message handler error: {e}")
+    
+    def close(self):
+        """關閉連線並通知伺服器"""
+        with self._cond:
+            if not self.connected:
+                return
+            self.connected = False
+            unsent = [entry[1] for entry in self._queue if entry[1] is not None]
+            self._queue.clear()
+            self._cond.notify_all()
+        if self.datagram_channel is not None:
+            self.datagram_channel.close()
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+        for on_unsent in unsent:
+            try:
+                on_unsent()
+            except Exception as e:
+                print(f"Unsent message handler error: {e}")
+        if self._on_closed:
+            self._on_closed(self)
+    
+    def get_status(self):
+        """取得訂閱者狀態"""
+        status = {
+            'address': self.address,
+            'role': self.role,
+            'format': self.fmt,
+            'transport': 'udp' if self.datagram_channel is not None else 'tcp',
+            'topics': sorted(self.topics),
+            'queued': len(self._queue),
+            'sent': self.messages_sent,
+            'bytes_sent': self.bytes_sent,
+            'dropped': self.messages_dropped,
+            'expired': self.messages_expired,
+            'rejected': self.messages_rejected,
+        }
+        if self.datagram_channel is not None:
+            status.update(self.datagram_channel.get_status())
+        return status
+
 
 class TCPServer:
-    def __init__(self, host='localhost', port=8888):
+    def __init__(self, host='localhost', port=8888,
+                 hello_timeout=0.3, actuator_queue_size=256, observer_queue_size=16, udp_port=0):
+        """
+        Parameters:
+            host: 監聽位址
+            port: 監聽埠
+            hello_timeout: 等待客戶端宣告角色的秒數，逾時則視為執行端（LabVIEW）
+            actuator_queue_size: 執行端佇列長度（滿時拒絕新訊息，由發送端暫存）
+            observer_queue_size: 觀察端佇列長度（滿時丟棄最舊的訊息）
+            udp_port: UDP 訂閱者的發送埠（ACK 回到此埠），0 表示由系統分配
+        """
         self.host = host
         self.port = port
+        self.hello_timeout = hello_timeout
+        self.actuator_queue_size = actuator_queue_size
+        self.observer_queue_size = observer_queue_size
         self.server_socket = None
-        self.client_socket = None
-        self.client_address = None
         self.is_running = False
-        self.is_connected = False
         self.server_thread = None
         self.trigger_count = 0  # 觸發計數器
+        self.stream_count = 0   # 偵測串流計數器
+        # 每帧的發送紀錄經由背景執行緒輸出並限速；逐物件與原始訊息為 DEBUG
+        self.logger = get_pipeline_logger("TCPServer", rate_per_s=5.0)
+        
+        self.subscribers = []
+        self._subscribers_lock = threading.Lock()
+        self._message_seq = 0
+        self._connection_listeners = []
+        self._message_listeners = []
+        self._handshakes = {}         # 握手中的連線 -> 接受連線的時間（time.monotonic()）
+        self.last_handshake_s = 0.0   # 最近一個執行端從接受連線到註冊完成的秒數
+        self.udp_sender = UDPSender(host if host != 'localhost' else '127.0.0.1', udp_port)
+        
+    @property
+    def is_connected(self):
+        """是否有執行端（LabVIEW）連線"""
+        return any(s.connected and s.role == ROLE_ACTUATOR for s in self.subscribers)
+    
+    def add_connection_listener(self, callback):
+        """
+        註冊連線事件回呼，連線建立或中斷時立即呼叫（取代週期性心跳檢查）
+        
+        Parameters:
+            callback: callback(role, connected)，role 為 actuator / observer
+        """
+        if callback not in self._connection_listeners:
+            self._connection_listeners = self._connection_listeners + [callback]
+    
+    def remove_connection_listener(self, callback):
+        """移除連線事件回呼"""
+        self._connection_listeners = [c for c in self._connection_listeners if c != callback]
+    
+    def add_message_listener(self, callback):
+        """
+        註冊訊息回呼，訂閱者送來的每一行（例如執行端的 ACK）在其接收線程中呼叫
+        
+        Parameters:
+            callback: callback(role, line)，line 為去除換行後的字串
+        """
+        if callback not in self._message_listeners:
+            self._message_listeners = self._message_listeners + [callback]
+    
+    def remove_message_listener(self, callback):
+        """移除訊息回呼"""
+        self._message_listeners = [c for c in self._message_listeners if c != callback]
+    
+    def _on_subscriber_line(self, subscriber, line):
+        """將訂閱者送來的一行交給所有訊息回呼"""
+        for callback in self._message_listeners:
+            try:
+                callback(subscriber.role, line)
+            except Exception as e:
+                print(f"Message listener error: {e}")
+    
+    def _notify_connection(self, role, connected):
+        """通知所有連線事件回呼"""
+        for callback in self._connection_listeners:
+            try:
+                callback(role, connected)
+            except Exception as e:
+                print(f"Connection listener error: {e}")
+    
+    def handshake_elapsed(self):
+        """
+        目前最久的一個握手已等待的秒數（沒有握手中的連線時為 0）
+        斷線暫存的指令不把這段時間算入有效時間，舊版 LabVIEW 不送宣告時要等滿 hello_timeout 才註冊
+        """
+        started = list(self._handshakes.values())
+        return time.monotonic() - min(started) if started else 0.0
+    
+    def has_subscribers(self, topic):
+        """是否有訂閱指定主題的連線"""
+        return any(s.connected and topic in s.topics for s in self.subscribers)
         
     def start_server(self):
         """啟動TCP伺服器"""
@@ -22,14 +389,14 @@ class TCPServer:
             self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             self.server_socket.bind((self.host, self.port))
-            self.server_socket.listen(1)
+            self.server_socket.listen(8)
             self.is_running = True
             
             print(f"TCP Server started on {self.host}:{self.port}")
             print("Waiting for LabVIEW client connection...")
             
-            # 在新線程中等待連接
-            self.server_thread = threading.Thread(target=self._wait_for_connection)
+            # 在新線程中接受連接
+            self.server_thread = threading.Thread(target=self._accept_loop)
             self.server_thread.daemon = True
             self.server_thread.start()
             
@@ -39,50 +406,243 @@ class TCPServer:
             print(f"Failed to start TCP server: {e}")
             return False
     
-    def _wait_for_connection(self):
-        """等待客戶端連接"""
+    def _accept_loop(self):
+        """接受客戶端連接，每個連線各自完成角色宣告"""
         while self.is_running:
             try:
-                self.client_socket, self.client_address = self.server_socket.accept()
-                self.is_connected = True
-                print(f"LabVIEW client connected from {self.client_address}")
-                
-                # 發送連線成功訊息
-                welcome_message = "TCP_CONNECTION_SUCCESS\n"
-                self.send_message(welcome_message)
-                
-                # 保持連接活躍
-                self._keep_connection_alive()
-                
+                client_socket, client_address = self.server_socket.accept()
             except socket.error as e:
                 if self.is_running:
                     print(f"Connection error: {e}")
                 break
+            
+            threading.Thread(
+                target=self._register_client,
+                args=(client_socket, client_address, time.monotonic()),
+                daemon=True
+            ).start()
     
-    def _keep_connection_alive(self):
-        """保持連接活躍"""
-        while self.is_connected and self.is_running:
-            try:
-                # 每5秒發送一次心跳
-                time.sleep(5)
-                if self.is_connected:
-                    heartbeat = "HEARTBEAT\n"
-                    print(f"{heartbeat}")
-                    #self.send_message(heartbeat)
-            except:
-                break
+    def _register_client(self, client_socket, client_address, accepted_at=None):
+        """完成握手並註冊訂閱者，握手期間記錄於 _handshakes"""
+        key = object()
+        accepted_at = time.monotonic() if accepted_at is None else accepted_at
+        with self._subscribers_lock:
+            self._handshakes[key] = accepted_at
+        try:
+            self._handshake_client(client_socket, client_address, key, accepted_at)
+        finally:
+            self._end_handshake(key)
+    
+    def _end_handshake(self, key):
+        with self._subscribers_lock:
+            self._handshakes.pop(key, None)
     
-    def send_message(self, message):
-        """發送訊息到LabVIEW"""
-        if self.is_connected and self.client_socket:
+    def _handshake_client(self, client_socket, client_address, key, accepted_at):
+        """
+        讀取可選的角色宣告並註冊訂閱者
+        
+        宣告格式（單行）: HELLO role=observer format=json topics=detection,blow
+        改用 UDP 接收:    HELLO role=actuator transport=udp udp_port=9000 ack=1
+        未在 hello_timeout 內收到宣告的連線視為執行端（LabVIEW），使用 CSV 格式
+        宣告之後（或非宣告的第一則訊息）已讀到的資料交給訂閱者的接收線程處理
+        """
+        role, fmt, topics = ROLE_ACTUATOR, "csv", None
+        transport, udp_port, request_ack = "tcp", None, False
+        try:
+            first = self._read_first_line(client_socket)
+            end = first.find(b"\n")
+            line = first[:end if end >= 0 else len(first)].decode('utf-8', errors='ignore').strip()
+            leftover = first
+            if line.upper().startswith("HELLO"):
+                leftover = first[end + 1:] if end >= 0 else b""
+                options = dict(
+                    token.split("=", 1) for token in line.split()[1:] if "=" in token
+                )
+                role = options.get('role', role).lower()
+                fmt = options.get('format', fmt).lower()
+                if 'topics' in options:
+                    topics = [t for t in options['topics'].lower().split(",") if t]
+                transport = options.get('transport', transport).lower()
+                if 'udp_port' in options and options['udp_port'].isdigit():
+                    udp_port = int(options['udp_port'])
+                request_ack = options.get('ack', '0') in ('1', 'true', 'yes')
+            
+            if (role not in DEFAULT_TOPICS or fmt not in MESSAGE_FORMATS
+                    or transport not in TRANSPORTS or (transport == "udp" and not udp_port)):
+                client_socket.sendall(b"TCP_CONNECTION_REJECTED\n")
+                client_socket.close()
+                print(f"Rejected client {client_address}: role={role}, format={fmt}, transport={transport}")
+                return
+            
+            client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except OSError as e:
+            print(f"Connection error: {e}")
+            client_socket.close()
+            return
+        
+        queue_size = self.actuator_queue_size if role == ROLE_ACTUATOR else self.observer_queue_size
+        datagram_channel = None
+        if transport == "udp":
             try:
-                self.client_socket.send(message.encode('utf-8'))
-                return True
-            except socket.error as e:
-                print(f"Failed to send message: {e}")
-                self.is_connected = False
-                return False
-        return False
+                datagram_channel = self.udp_sender.open_channel((client_address[0], udp_port), request_ack)
+            except OSError as e:
+                print(f"Failed to open UDP channel for {client_address}: {e}")
+                client_socket.close()
+                return
+        subscriber = Subscriber(client_socket, client_address, role, fmt, topics, queue_size,
+                                datagram_channel=datagram_channel, initial_data=leftover)
+        subscriber.on_line = self._on_subscriber_line
+        
+        # 發送連線成功訊息
+        subscriber.enqueue_control(b"TCP_CONNECTION_SUCCESS\n")
+        with self._subscribers_lock:
+            if not self.is_running:
+                client_socket.close()
+                return
+            self.subscribers = self.subscribers + [subscriber]
+        subscriber.start(on_closed=self._on_subscriber_closed)
+        
+        if role == ROLE_ACTUATOR:
+            via = f" (UDP -> {datagram_channel.address})" if datagram_channel is not None else ""
+            print(f"LabVIEW client connected from {client_address}{via}")
+        else:
+            print(f"Observer connected from {client_address} "
+                  f"(format={fmt}, topics={','.join(sorted(subscriber.topics))})")
+        
+        if role == ROLE_ACTUATOR:
+            self.last_handshake_s = time.monotonic() - accepted_at
+        self._end_handshake(key)
+        self._notify_connection(role, True)
+    
+    def _read_first_line(self, client_socket, max_bytes=1024):
+        """
+        在 hello_timeout 內讀到第一個換行為止（逾時、對方關閉或超過 max_bytes 時回傳已讀到的資料）
+        
+        Returns:
+            bytes: 已讀取的資料（可能包含第一行之後的部分）
+        """
+        data = b""
+        deadline = time.monotonic() + self.hello_timeout
+        try:
+            while b"\n" not in data and len(data) < max_bytes:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                client_socket.settimeout(remaining)
+                try:
+                    chunk = client_socket.recv(max_bytes)
+                except socket.timeout:
+                    break
+                if not chunk:
+                    break
+                data += chunk
+        finally:
+            client_socket.settimeout(None)
+        return data
+    
+    def _on_subscriber_closed(self, subscriber):
+        """訂閱者斷線時移除"""
+        with self._subscribers_lock:
+            self.subscribers = [s for s in self.subscribers if s is not subscriber]
+        print(f"{subscriber.role.capitalize()} disconnected: {subscriber.address}")
+        self._notify_connection(subscriber.role, False)
+    
+    def publish(self, topic, line, payload=None, on_unsent=None, deadline=None, on_expired=None):
+        """
+        將訊息發送給所有訂閱此主題的連線
+        訊息依各訂閱者使用的格式各序列化一次，入列不阻塞
+        
+        Parameters:
+            topic: 訊息主題
+            line: CSV 格式的訊息字串（含換行）
+            payload: JSON 格式使用的結構化資料
+            on_unsent: 執行端斷線時此訊息仍在其佇列中則呼叫 on_unsent()
+            deadline: 執行端佇列中的最晚送出時間（time.monotonic() 秒），逾期則捨棄並呼叫 on_expired()
+            
+        Returns:
+            int: 成功入列的訂閱者數量
+        """
+        targets = [s for s in self.subscribers if s.connected and topic in s.topics]
+        if not targets:
+            return 0
+        
+        self._message_seq += 1
+        message = OutboundMessage(topic, line, payload, self._message_seq)
+        delivered = 0
+        for subscriber in targets:
+            if subscriber.role == ROLE_ACTUATOR:
+                queued = subscriber.enqueue(message.encode(subscriber.fmt), on_unsent, deadline, on_expired)
+            else:
+                queued = subscriber.enqueue(message.encode(subscriber.fmt))
+            if queued:
+                delivered += 1
+        return delivered
+    
+    def send_message(self, message, topic=TOPIC_BLOW, payload=None, on_unsent=None, deadline=None,
+                     on_expired=None):
+        """發送訊息到LabVIEW（以及訂閱同一主題的觀察端）"""
+        return self.publish(topic, message, payload, on_unsent, deadline, on_expired) > 0
+    
+    @staticmethod
+    def _objects_payload(trigger_num, image_width, image_height, detection_data, keys):
+        """將扁平的物件資料轉為 JSON 結構"""
+        step = len(keys)
+        return {
+            'trigger': trigger_num,
+            'width': image_width,
+            'height': image_height,
+            'objects': [
+                dict(zip(keys, detection_data[i:i + step]))
+                for i in range(0, len(detection_data), step)
+            ]
+        }
+    
+    def publish_detection_stream(self, detections, image_width, image_height, frame_num=None):
+        """
+        發送逐帧偵測結果給觀察端（無訂閱者時不做任何序列化）
+        
+        格式: ;,frame_num,照片寬度,照片高度,物件數量,label1,x1,y1,x2,y2,...,結尾4個點(0,0,0,0)
+        
+        Returns:
+            bool: 是否有觀察端收到
+        """
+        if not self.has_subscribers(TOPIC_DETECTION):
+            return False
+        
+        self.stream_count += 1
+        if frame_num is None:
+            frame_num = self.stream_count
+        
+        detection_data = []
+        confidences = []
+        for detection in detections or []:
+            if hasattr(detection, 'boxes') and detection.boxes is not None:
+                boxes = detection.boxes.xyxy.cpu().numpy()
+                confs = detection.boxes.conf.cpu().numpy()
+                classes = detection.boxes.cls.cpu().numpy()
+                for (box, conf, cls) in zip(boxes, confs, classes):
+                    x1, y1, x2, y2 = box
+                    detection_data.extend([
+                        int(cls),
+                        max(0, min(int(x1), image_width - 1)),
+                        max(0, min(int(y1), image_height - 1)),
+                        max(0, min(int(x2), image_width - 1)),
+                        max(0, min(int(y2), image_height - 1))
+                    ])
+                    confidences.append(round(float(conf), 4))
+        
+        object_count = len(confidences)
+        message_parts = [";", frame_num, image_width, image_height, object_count]
+        message_parts.extend(detection_data)
+        message_parts.extend([0, 0, 0, 0])
+        message = ",".join(map(str, message_parts)) + "\n"
+        
+        payload = self._objects_payload(frame_num, image_width, image_height, detection_data,
+                                        ('label', 'x1', 'y1', 'x2', 'y2'))
+        for obj, conf in zip(payload['objects'], confidences):
+            obj['conf'] = conf
+        
+        return self.publish(TOPIC_DETECTION, message, payload) > 0
     
     def send_detection_result(self, detections, image_width, image_height):
         """發送辨識結果到LabVIEW
@@ -91,8 +651,8 @@ class TCPServer:
         """
         self.trigger_count += 1
         
-        if not self.is_connected:
-            print("No LabVIEW client connected")
+        if not self.has_subscribers(TOPIC_BLOW):
+            self.logger.info("No LabVIEW client connected")
             return False
         
         try:
@@ -140,24 +700,30 @@ class TCPServer:
             # 轉換成字串
             message = ",".join(map(str, message_parts)) + "\n"
             
-            if self.send_message(message):
+            payload = self._objects_payload(self.trigger_count, image_width, image_height,
+                                            detection_data, ('label', 'x1', 'y1', 'x2', 'y2'))
+            if self.send_message(message, payload=payload):
                 if object_count > 0:
-                    print(f"Sent to LabVIEW1122: Trigger {self.trigger_count}, Image({image_width}x{image_height}), {object_count} objects detected")
+                    self.logger.info("Sent to LabVIEW1122: Trigger %d, Image(%dx%d), %d objects detected",
+                                     self.trigger_count, image_width, image_height, object_count)
                     # 顯示每個物件的像素座標
-                    for i in range(object_count):
-                        idx = 5 + i * 5  # 跳過trigger_num, width, height, count
-                        label = message_parts[idx]
-                        x1, y1, x2, y2 = message_parts[idx+1:idx+5]
-                        print(f"  Object {i+1}: Label={label}, BBox=({x1},{y1})-({x2},{y2}) pixels")
+                    if self.logger.isEnabledFor(logging.DEBUG):
+                        for i in range(object_count):
+                            idx = 5 + i * 5  # 跳過trigger_num, width, height, count
+                            label = message_parts[idx]
+                            x1, y1, x2, y2 = message_parts[idx+1:idx+5]
+                            self.logger.debug("  Object %d: Label=%s, BBox=(%s,%s)-(%s,%s) pixels",
+                                              i + 1, label, x1, y1, x2, y2)
                 else:
-                    print(f"Sent to LabVIEW0099: Trigger {self.trigger_count}, Image({image_width}x{image_height}), no objects detected")
-                print(f"Raw message: {message.strip()}")
+                    self.logger.info("Sent to LabVIEW0099: Trigger %d, Image(%dx%d), no objects detected",
+                                     self.trigger_count, image_width, image_height)
+                self.logger.debug("Raw message: %s", message.strip())
                 return True
             else:
                 return False
                     
         except Exception as e:
-            print(f"Error sending detection result: {e}")
+            self.logger.error("Error sending detection result: %s", e)
             return False
     
     def send_filtered_detection_result(self, filtered_boxes, image_width, image_height):
@@ -172,8 +738,8 @@ class TCPServer:
         """
         self.trigger_count += 1
         
-        if not self.is_connected:
-            print("No LabVIEW client connected")
+        if not self.has_subscribers(TOPIC_BLOW):
+            self.logger.info("No LabVIEW client connected")
             return False
         
         try:
@@ -210,21 +776,26 @@ class TCPServer:
             # 轉換成字串
             message = ",".join(map(str, message_parts)) + "\n"
             
-            if self.send_message(message):
-                print(f"Sent FILTERED to LabVIEW: Trigger {self.trigger_count}, Image({image_width}x{image_height}), {object_count} objects touching boundary lines")
+            payload = self._objects_payload(self.trigger_count, image_width, image_height,
+                                            detection_data, ('label', 'x1', 'y1', 'x2', 'y2'))
+            if self.send_message(message, payload=payload):
+                self.logger.info("Sent FILTERED to LabVIEW: Trigger %d, Image(%dx%d), %d objects touching boundary lines",
+                                 self.trigger_count, image_width, image_height, object_count)
                 # 顯示每個物件的像素座標
-                for i in range(object_count):
-                    idx = 5 + i * 5  # 跳過trigger_num, width, height, count
-                    label = message_parts[idx]
-                    x1, y1, x2, y2 = message_parts[idx+1:idx+5]
-                    print(f"  Object {i+1}: Label={label}, BBox=({x1},{y1})-({x2},{y2}) pixels [觸碰邊界線]")
-                print(f"Raw message: {message.strip()}")
+                if self.logger.isEnabledFor(logging.DEBUG):
+                    for i in range(object_count):
+                        idx = 5 + i * 5  # 跳過trigger_num, width, height, count
+                        label = message_parts[idx]
+                        x1, y1, x2, y2 = message_parts[idx+1:idx+5]
+                        self.logger.debug("  Object %d: Label=%s, BBox=(%s,%s)-(%s,%s) pixels [觸碰邊界線]",
+                                          i + 1, label, x1, y1, x2, y2)
+                self.logger.debug("Raw message: %s", message.strip())
                 return True
             else:
                 return False
                     
         except Exception as e:
-            print(f"Error sending filtered detection result: {e}")
+            self.logger.error("Error sending filtered detection result: %s", e)
             return False
     
     def send_detection_result_with_center_and_size(self, detections, image_width, image_height):
@@ -234,8 +805,8 @@ class TCPServer:
         """
         self.trigger_count += 1
         
-        if not self.is_connected:
-            print("No LabVIEW client connected")
+        if not self.has_subscribers(TOPIC_BLOW):
+            self.logger.info("No LabVIEW client connected")
             return False
         
         try:
@@ -286,42 +857,55 @@ class TCPServer:
             # 轉換成字串
             message = ",".join(map(str, message_parts)) + "\n"
             
-            if self.send_message(message):
+            payload = self._objects_payload(self.trigger_count, image_width, image_height,
+                                            detection_data, ('label', 'center_x', 'center_y', 'width', 'height'))
+            if self.send_message(message, payload=payload):
                 if object_count > 0:
-                    print(f"Sent to LabVIEW1234: Trigger {self.trigger_count}, Image({image_width}x{image_height}), {object_count} objects detected")
+                    self.logger.info("Sent to LabVIEW1234: Trigger %d, Image(%dx%d), %d objects detected",
+                                     self.trigger_count, image_width, image_height, object_count)
                     # 顯示每個物件的像素座標
-                    for i in range(object_count):
-                        idx = 4 + i * 5  # 跳過trigger_num, width, height, count
-                        label = message_parts[idx]
-                        center_x, center_y, width, height = message_parts[idx+1:idx+5]
-                        print(f"  Object {i+1}: Label={label}, Center=({center_x},{center_y}), Size={width}x{height} pixels")
+                    if self.logger.isEnabledFor(logging.DEBUG):
+                        for i in range(object_count):
+                            idx = 4 + i * 5  # 跳過trigger_num, width, height, count
+                            label = message_parts[idx]
+                            center_x, center_y, width, height = message_parts[idx+1:idx+5]
+                            self.logger.debug("  Object %d: Label=%s, Center=(%s,%s), Size=%sx%s pixels",
+                                              i + 1, label, center_x, center_y, width, height)
                 else:
-                    print(f"Sent to LabVIEW5678: Trigger {self.trigger_count}, Image({image_width}x{image_height}), no objects detected")
-                print(f"Raw message: {message.strip()}")
+                    self.logger.info("Sent to LabVIEW5678: Trigger %d, Image(%dx%d), no objects detected",
+                                     self.trigger_count, image_width, image_height)
+                self.logger.debug("Raw message: %s", message.strip())
                 return True
             else:
                 return False
                     
         except Exception as e:
-            print(f"Error sending detection result: {e}")
+            self.logger.error("Error sending detection result: %s", e)
             return False
     
     def get_connection_status(self):
         """獲取連接狀態"""
+        subscribers = list(self.subscribers)
         return {
             'server_running': self.is_running,
             'client_connected': self.is_connected,
-            'trigger_count': self.trigger_count
+            'trigger_count': self.trigger_count,
+            'actuators': sum(1 for s in subscribers if s.role == ROLE_ACTUATOR),
+            'observers': sum(1 for s in subscribers if s.role == ROLE_OBSERVER),
+            'subscribers': [s.get_status() for s in subscribers]
         }
     
     def stop_server(self):
         """停止TCP伺服器"""
         self.is_running = False
-        self.is_connected = False
         
         try:
-            if self.client_socket:
-                self.client_socket.close()
+            with self._subscribers_lock:
+                subscribers, self.subscribers = self.subscribers, []
+            for subscriber in subscribers:
+                subscriber._on_closed = None
+                subscriber.close()
+            self.udp_sender.stop()
                 
             if self.server_socket:
                 self.server_socket.close()
@@ -7,6 +7,7 @@
 from dataclasses import dataclass, field
 from typing import List, Tuple, Dict, Optional
 import numpy as np
+from pipeline_logging import get_pipeline_logger
 
 
 @dataclass
@@ -14,10 +15,12 @@ class TrackState:
     """單一物體的追蹤狀態"""
     track_id: int                                       # 追蹤 ID
     triggered: bool = False                             # 是否已觸發氣吹
+    blow_held: bool = False                             # 氣吹指令暫存中（執行端斷線），補送後才算觸發
     missing_frames: int = 0                             # 連續未偵測到的帧數
     last_center: Optional[Tuple[float, float]] = None   # 上一帧的中心點
     center_history: List[Tuple[float, float]] = field(default_factory=list)  # 最近 3 帧中心點歷史
     confidence_history: List[float] = field(default_factory=list)            # 信度歷史
+    time_history: List[float] = field(default_factory=list)                  # 與 center_history 對應的曝光時間（秒）
     class_id: Optional[int] = None                      # 類別 ID
     first_seen_frame: int = 0                           # 第一次出現的帧號
     last_seen_frame: int = 0                            # 最後一次出現的帧號
@@ -56,6 +59,9 @@ class TrackManager:
         self.trigger_zone_bottom = image_height * 0.625
         self.exit_zone_top = image_height * 0.625
         
+        # 每帧都可能輸出的追蹤事件經由背景執行緒輸出並限速
+        self.logger = get_pipeline_logger("TrackManager", rate_per_s=20.0)
+        
         print(f"[TrackManager] Initialized with {lens_type} lens")
         print(f"[TrackManager] Image height: {image_height}px")
         print(f"[TrackManager] Center tolerance: ±{self.center_tolerance}px")
@@ -66,7 +72,8 @@ class TrackManager:
                      cx: float, 
                      cy: float, 
                      confidence: float,
-                     class_id: int) -> None:
+                     class_id: int,
+                     timestamp: Optional[float] = None) -> None:
         """
         更新追蹤狀態
         
@@ -75,6 +82,7 @@ class TrackManager:
             cx, cy: 中心點座標
             confidence: 類別信度
             class_id: 類別 ID
+            timestamp: 此帧的曝光時間（time.monotonic() 秒），None 表示不記錄
         """
         if track_id not in self.tracks:
             # 新追蹤物體
@@ -83,7 +91,7 @@ class TrackManager:
                 class_id=class_id,
                 first_seen_frame=self.current_frame
             )
-            print(f"[TrackManager] New track ID={track_id}, class={class_id}, pos=({cx:.1f}, {cy:.1f})")
+            self.logger.info("New track ID=%d, class=%s, pos=(%.1f, %.1f)", track_id, class_id, cx, cy)
         
         state = self.tracks[track_id]
         state.missing_frames = 0
@@ -96,6 +104,11 @@ class TrackManager:
         if len(state.center_history) > 3:
             state.center_history.pop(0)
         
+        if timestamp is not None:
+            state.time_history.append(timestamp)
+            if len(state.time_history) > 3:
+                state.time_history.pop(0)
+        
         state.confidence_history.append(confidence)
         if len(state.confidence_history) > 3:
             state.confidence_history.pop(0)
@@ -148,7 +161,8 @@ class TrackManager:
         if track_id in self.tracks:
             state = self.tracks[track_id]
             reason = "Exit Zone" if state.last_center and state.last_center[1] > self.exit_zone_top else "Timeout"
-            print(f"[TrackManager] Removed track ID={track_id}, reason={reason}, frames={state.last_seen_frame - state.first_seen_frame}")
+            self.logger.info("Removed track ID=%d, reason=%s, frames=%d",
+                             track_id, reason, state.last_seen_frame - state.first_seen_frame)
             del self.tracks[track_id]
     
     def check_center_drift(self, track_id: int) -> bool:
@@ -174,7 +188,7 @@ class TrackManager:
             drift = np.sqrt((curr[0] - prev[0])**2 + (curr[1] - prev[1])**2)
             
             if drift > drift_threshold:
-                print(f"[TrackManager] Track ID={track_id} drift={drift:.1f}px > threshold={drift_threshold}px")
+                self.logger.info("Track ID=%d drift=%.1fpx > threshold=%spx", track_id, drift, drift_threshold)
                 return False  # 飄移過大
         
         return True
@@ -204,7 +218,7 @@ class TrackManager:
         
         # 如果前一帧低於閾值，等待一帧確認穩定
         if prev_conf < self.confidence_threshold:
-            print(f"[TrackManager] Track ID={track_id} confidence unstable: {prev_conf:.2f} -> {current_confidence:.2f}")
+            self.logger.info("Track ID=%d confidence unstable: %.2f -> %.2f", track_id, prev_conf, current_confidence)
             return False
         
         return True
@@ -5,10 +5,19 @@ Two-Band Filter 觸發系統
 """
 
 import numpy as np
-import logging
 from typing import List, Tuple, Dict, Optional, Any
+from frame_trace import get_frame_tracer
+from pipeline_logging import get_pipeline_logger
+from pipeline_metrics import metrics
 from track_manager import TrackManager
 from blow_controller import BlowController
+from blow_scheduler import BlowScheduler
+
+
+# 觸發判斷的健康指標（事件發生時遞增）
+TRIGGERS = metrics.counter('nircam_triggers_total', 'Tracks that triggered a blow')
+TRIGGER_SKIPS = metrics.counter('nircam_trigger_skips_total', 'Tracks not triggered this frame, by reason', ('reason',))
+ACTIVE_TRACKS = metrics.gauge('nircam_active_tracks', 'Tracks currently followed by the Two-Band Filter')
 
 
 class TwoBandFilter:
@@ -20,7 +29,13 @@ class TwoBandFilter:
                  lens_type: str = "12mm",
                  confidence_threshold: float = 0.75,
                  tracking_timeout_frames: int = 15,
-                 tcp_server=None):
+                 tcp_server=None,
+                 num_valves: int = 16,
+                 valve_min_dwell_ms: float = 50.0,
+                 nozzle_distance_px: Optional[float] = None,
+                 timestamp_tick_hz: float = 1e9,
+                 backlog_size: int = 64,
+                 command_ttl_ms: float = 300.0):
         """
         初始化 Two-Band Filter
         
@@ -31,6 +46,12 @@ class TwoBandFilter:
             confidence_threshold: 信度閾值
             tracking_timeout_frames: 追蹤超時帧數
             tcp_server: TCP 伺服器實例
+            num_valves: 噴嘴陣列閥門數量（沿圖像寬度均分）
+            valve_min_dwell_ms: 同一閥門的最小駐留時間（毫秒）
+            nozzle_distance_px: 噴嘴線與圖像下緣的距離（像素），用於預測到達噴嘴的時間
+            timestamp_tick_hz: 相機裝置時間戳頻率（GevTimestampTickFrequency）
+            backlog_size: LabVIEW 斷線期間暫存的氣吹指令上限
+            command_ttl_ms: 無法預測到達時間時，暫存指令的有效時間（毫秒）
         """
         self.image_width = image_width
         self.image_height = image_height
@@ -49,7 +70,20 @@ class TwoBandFilter:
         self.blow_controller = BlowController(
             tcp_server=tcp_server,
             ack_timeout_ms=200,
-            blow_delay_ms=(80, 120)
+            blow_delay_ms=(80, 120),
+            nozzle_distance_px=nozzle_distance_px,
+            timestamp_tick_hz=timestamp_tick_hz,
+            backlog_size=backlog_size,
+            command_ttl_ms=command_ttl_ms
+        )
+        
+        # 初始化氣吹排程器（每帧合併為單一訊息）
+        self.blow_scheduler = BlowScheduler(
+            blow_controller=self.blow_controller,
+            image_width=image_width,
+            image_height=image_height,
+            num_valves=num_valves,
+            min_dwell_ms=valve_min_dwell_ms
         )
         
         # 區域邊界
@@ -61,15 +95,10 @@ class TwoBandFilter:
         self.detection_count = 0
         self.trigger_count = 0
         self.skip_count = 0  # 因各種原因跳過的次數
+        self.skip_reasons: Dict[str, int] = {}  # 依原因分類的跳過次數
         
         # 設置日誌
-        self.logger = logging.getLogger("TwoBandFilter")
-        if not self.logger.handlers:
-            handler = logging.StreamHandler()
-            formatter = logging.Formatter('[%(name)s] %(message)s')
-            handler.setFormatter(formatter)
-            self.logger.addHandler(handler)
-            self.logger.setLevel(logging.INFO)
+        self.logger = get_pipeline_logger("TwoBandFilter")
         
         print("\n" + "="*60)
         print("TWO-BAND FILTER INITIALIZED")
@@ -90,7 +119,11 @@ class TwoBandFilter:
         """
         self.blow_controller.set_tcp_server(tcp_server)
     
-    def process_frame(self, detections: Any, tracker_results: List[Tuple]) -> Dict:
+    def process_frame(self,
+                      detections: Any,
+                      tracker_results: List[Tuple],
+                      device_timestamp: Optional[int] = None,
+                      received_at: Optional[float] = None) -> Dict:
         """
         處理單帧
         
@@ -98,12 +131,18 @@ class TwoBandFilter:
             detections: YOLO 偵測結果
             tracker_results: 追蹤器結果 [(track_id, bbox), ...]
                             bbox 格式: [x1, y1, x2, y2] 或 [x1, y1, x2, y2, conf, class_id]
+            device_timestamp: 相機裝置時間戳（MV_FRAME_OUT_INFO_EX 的 nDevTimeStampHigh/Low）
+            received_at: 主機取得此帧的 time.monotonic() 時間，None 表示現在
         
         Returns:
             dict: 包含處理結果的字典
         """
         self.frame_count += 1
         self.track_manager.increment_frame()
+        capture_time = self.blow_controller.capture_time_for(device_timestamp, received_at)
+        tracer = get_frame_tracer()
+        if tracer is not None:
+            tracer.record_exposure(capture_time)
         
         # 更新所有追蹤狀態
         current_track_ids = set()
@@ -136,7 +175,8 @@ class TwoBandFilter:
                     
                     # 更新追蹤狀態
                     self.track_manager.update_track(
-                        track_id, cx, cy, confidence, class_id
+                        track_id, cx, cy, confidence, class_id,
+                        timestamp=capture_time
                     )
                     
                     # 檢查是否應該移除（進入 Exit Zone）
@@ -150,30 +190,54 @@ class TwoBandFilter:
                     )
                     
                     if should_trigger:
-                        # 發送氣吹指令
-                        success = self.blow_controller.send_blow_command(
+                        # 交給排程器，於本帧結束時統一發送
+                        self.blow_scheduler.add_trigger(
+                            track_id=track_id,
                             cx=cx,
                             cy=cy,
                             class_id=class_id,
-                            track_id=track_id,
                             confidence=confidence,
-                            image_width=self.image_width,
-                            image_height=self.image_height
+                            capture_time=capture_time
                         )
-                        
-                        if success:
-                            self.track_manager.tracks[track_id].triggered = True
-                            self.trigger_count += 1
-                            triggered_this_frame.append({
-                                'track_id': track_id,
-                                'cx': cx,
-                                'cy': cy,
-                                'class_id': class_id,
-                                'confidence': confidence
-                            })
                     else:
-                        if reason != "already_triggered":
+                        if reason not in ("already_triggered", "blow_held"):
                             self.skip_count += 1
+                            self.skip_reasons[reason] = self.skip_reasons.get(reason, 0) + 1
+                            TRIGGER_SKIPS.labels(reason).inc()
+        
+        # 以追蹤歷史更新傳送帶速度，再發送本帧合併後的氣吹指令
+        self.blow_controller.update_belt_velocity(self.track_manager.tracks.values())
+        for trigger in self.blow_scheduler.flush() + self._collect_held_results():
+            if trigger['deferred']:
+                # 閥門仍在駐留時間內：追蹤保持未觸發，下一帧再以新位置排程
+                self.skip_count += 1
+                self.skip_reasons['valve_dwell'] = self.skip_reasons.get('valve_dwell', 0) + 1
+                TRIGGER_SKIPS.labels('valve_dwell').inc()
+                continue
+            state = self.track_manager.tracks.get(trigger['track_id'])
+            if trigger['held']:
+                # 執行端斷線，指令暫存：補送成功才算觸發，暫存期間不再重複觸發
+                if state is not None:
+                    state.blow_held = True
+                continue
+            if not trigger['sent']:
+                continue
+            if state is not None:
+                state.triggered = True
+                state.blow_held = False
+            elif not trigger.get('replayed'):
+                continue
+            self.trigger_count += 1
+            TRIGGERS.inc()
+            triggered_this_frame.append({
+                'track_id': trigger['track_id'],
+                'cx': trigger['cx'],
+                'cy': trigger['cy'],
+                'class_id': trigger['class_id'],
+                'confidence': trigger['confidence'],
+                'valve_index': trigger['valve_index'],
+                'merged': trigger['merged']
+            })
         
         # 標記未在當前帧出現的追蹤為 missing
         for track_id in list(self.track_manager.tracks.keys()):
@@ -186,6 +250,7 @@ class TwoBandFilter:
         
         # 檢查氣吹超時
         timeout_blows = self.blow_controller.check_timeouts()
+        ACTIVE_TRACKS.set(len(self.track_manager.tracks))
         
         # 返回處理結果
         return {
@@ -196,6 +261,28 @@ class TwoBandFilter:
             'timeout_blows': timeout_blows
         }
     
+    def _collect_held_results(self) -> List[Dict]:
+        """
+        取出暫存指令的結果：補送成功的轉為已送出的觸發（sent=True, replayed=True），
+        逾期或被擠掉的記為跳過，追蹤恢復為可觸發
+        
+        Returns:
+            List[Dict]: 補送成功的觸發（欄位同 BlowScheduler.flush() 的結果）
+        """
+        replayed = []
+        for result in self.blow_controller.collect_held_results():
+            state = self.track_manager.tracks.get(result['track_id'])
+            if state is not None:
+                state.blow_held = False
+            if result['status'] == 'replayed':
+                replayed.append(dict(result, merged=False, sent=True, deferred=False, held=False, replayed=True))
+            else:
+                reason = f"blow_{result['status']}"
+                self.skip_count += 1
+                self.skip_reasons[reason] = self.skip_reasons.get(reason, 0) + 1
+                TRIGGER_SKIPS.labels(reason).inc()
+        return replayed
+    
     def _should_trigger(self, 
                        track_id: int, 
                        cx: float, 
@@ -220,9 +307,11 @@ class TwoBandFilter:
         if not self.track_manager.is_in_trigger_zone(cy):
             return False, "not_in_trigger_zone"
         
-        # 條件 2: 尚未觸發
+        # 條件 2: 尚未觸發（含指令暫存等待補送中）
         if state.triggered:
             return False, "already_triggered"
+        if state.blow_held:
+            return False, "blow_held"
         
         # 條件 3: 信度達標
         if confidence < self.confidence_threshold:
@@ -280,7 +369,7 @@ class TwoBandFilter:
                 if len(confs) > best_idx and len(classes) > best_idx:
                     return float(confs[best_idx]), int(classes[best_idx])
         except Exception as e:
-            self.logger.warning(f"Error finding detection info: {e}")
+            self.logger.warning("Error finding detection info: %s", e)
         
         return 0.0, 0
     
@@ -292,15 +381,18 @@ class TwoBandFilter:
             dict: 統計資訊
         """
         blow_stats = self.blow_controller.get_statistics()
+        scheduler_stats = self.blow_scheduler.get_statistics()
         
         return {
             'frame_count': self.frame_count,
             'detection_count': self.detection_count,
             'trigger_count': self.trigger_count,
             'skip_count': self.skip_count,
+            'skip_reasons': dict(self.skip_reasons),
             'active_tracks': self.track_manager.get_active_tracks_count(),
             'triggered_tracks': self.track_manager.get_triggered_tracks_count(),
-            'blow_stats': blow_stats
+            'blow_stats': blow_stats,
+            'scheduler_stats': scheduler_stats
         }
     
     def print_statistics(self) -> None:
@@ -315,6 +407,11 @@ class TwoBandFilter:
         print(f"Triggered Tracks:    {stats['triggered_tracks']}")
         print(f"Total Triggers:      {stats['trigger_count']}")
         print(f"Skipped (Reasons):   {stats['skip_count']}")
+        for reason, count in sorted(stats['skip_reasons'].items(), key=lambda item: -item[1]):
+            print(f"  {reason:<18} {count}")
+        print(f"Valve Messages:      {stats['scheduler_stats']['messages_sent']}")
+        print(f"Merged Triggers:     {stats['scheduler_stats']['triggers_merged']}")
+        print(f"Deferred (Dwell):    {stats['scheduler_stats']['triggers_deferred']}")
         print("-"*60)
         
         self.blow_controller.print_statistics()
@@ -325,83 +422,34 @@ class TwoBandFilter:
         self.detection_count = 0
         self.trigger_count = 0
         self.skip_count = 0
+        self.skip_reasons.clear()
         self.blow_controller.reset_statistics()
+        self.blow_scheduler.reset_statistics()
         self.logger.info("Statistics reset")
     
-    def visualize_zones(self, image: np.ndarray) -> np.ndarray:
+    def add_zones_to_overlay(self, scene) -> None:
         """
-        在圖像上繪製區域邊界（用於除錯）
+        將區域邊界加入疊圖場景（overlay_compositor.OverlayScene）
         
         Parameters:
-            image: 輸入圖像
-            
-        Returns:
-            np.ndarray: 帶有區域標記的圖像
+            scene: 疊圖場景
         """
-        import cv2
-        
-        img_copy = image.copy()
-        h, w = img_copy.shape[:2]
-        
+        top, bottom = self.trigger_zone_top, self.trigger_zone_bottom
         # 繪製 Trigger Zone
-        cv2.rectangle(
-            img_copy,
-            (0, int(self.trigger_zone_top)),
-            (w, int(self.trigger_zone_bottom)),
-            (0, 255, 0),  # 綠色
-            2
-        )
-        
+        scene.add_zone(top, bottom, scene.color((0, 255, 0)), 2)  # 綠色
         # 添加文字標記
-        cv2.putText(
-            img_copy,
-            "ENTRY ZONE",
-            (10, int(self.trigger_zone_top) - 10),
-            cv2.FONT_HERSHEY_SIMPLEX,
-            0.6,
-            (255, 255, 0),
-            2
-        )
-        
-        cv2.putText(
-            img_copy,
-            "TRIGGER ZONE",
-            (10, int((self.trigger_zone_top + self.trigger_zone_bottom) / 2)),
-            cv2.FONT_HERSHEY_SIMPLEX,
-            0.8,
-            (0, 255, 0),
-            2
-        )
-        
-        cv2.putText(
-            img_copy,
-            "EXIT ZONE",
-            (10, int(self.trigger_zone_bottom) + 25),
-            cv2.FONT_HERSHEY_SIMPLEX,
-            0.6,
-            (255, 255, 0),
-            2
-        )
-        
-        return img_copy
+        scene.add_text(10, top - 10, "ENTRY ZONE", scene.color((255, 255, 0)), 0.6)
+        scene.add_text(10, (top + bottom) / 2, "TRIGGER ZONE", scene.color((0, 255, 0)), 0.8)
+        scene.add_text(10, bottom + 25, "EXIT ZONE", scene.color((255, 255, 0)), 0.6)
     
-    def draw_tracks(self, 
-                    image: np.ndarray, 
-                    tracker_results: List[Tuple]) -> np.ndarray:
+    def add_tracks_to_overlay(self, scene, tracker_results: List[Tuple]) -> None:
         """
-        在圖像上繪製追蹤結果
+        將追蹤框、中心點與軌跡加入疊圖場景
         
         Parameters:
-            image: 輸入圖像
-            tracker_results: 追蹤器結果
-            
-        Returns:
-            np.ndarray: 帶有追蹤標記的圖像
+            scene: 疊圖場景
+            tracker_results: 追蹤器結果 [(track_id, bbox, ...), ...]
         """
-        import cv2
-        
-        img_copy = image.copy()
-        
         for track_result in tracker_results:
             if len(track_result) >= 2:
                 track_id = int(track_result[0])
@@ -409,7 +457,6 @@ class TwoBandFilter:
                 
                 if len(bbox) >= 4:
                     x1, y1, x2, y2 = bbox[:4]
-                    cx = (x1 + x2) / 2
                     cy = (y1 + y2) / 2
                     
                     # 獲取追蹤狀態
@@ -418,37 +465,14 @@ class TwoBandFilter:
                     if track_info:
                         # 根據狀態選擇顏色
                         if track_info['triggered']:
-                            color = (0, 0, 255)  # 紅色 - 已觸發
+                            color = scene.color((0, 0, 255))  # 紅色 - 已觸發
                         elif self.track_manager.is_in_trigger_zone(cy):
-                            color = (0, 255, 0)  # 綠色 - 在觸發區
+                            color = scene.color((0, 255, 0))  # 綠色 - 在觸發區
                         else:
-                            color = (255, 255, 0)  # 黃色 - 其他區域
-                        
-                        # 繪製 bounding box
-                        cv2.rectangle(
-                            img_copy,
-                            (int(x1), int(y1)),
-                            (int(x2), int(y2)),
-                            color,
-                            2
-                        )
-                        
-                        # 繪製中心點
-                        cv2.circle(
-                            img_copy,
-                            (int(cx), int(cy)),
-                            5,
-                            color,
-                            -1
-                        )
+                            color = scene.color((255, 255, 0))  # 黃色 - 其他區域
                         
                         # 繪製軌跡
-                        if len(track_info.get('center_history', [])) > 1:
-                            state = self.track_manager.tracks[track_id]
-                            for i in range(1, len(state.center_history)):
-                                pt1 = tuple(map(int, state.center_history[i-1]))
-                                pt2 = tuple(map(int, state.center_history[i]))
-                                cv2.line(img_copy, pt1, pt2, color, 2)
+                        scene.add_trail(self.track_manager.tracks[track_id].center_history, color, 2)
                         
                         # 繪製資訊文字
                         label = f"ID:{track_id}"
@@ -456,14 +480,43 @@ class TwoBandFilter:
                             label += " [TRIGGERED]"
                         label += f" {track_info['confidence']:.2f}"
                         
-                        cv2.putText(
-                            img_copy,
-                            label,
-                            (int(x1), int(y1) - 10),
-                            cv2.FONT_HERSHEY_SIMPLEX,
-                            0.5,
-                            color,
-                            2
-                        )
+                        # bounding box 與中心點
+                        scene.add_box(x1, y1, x2, y2, color, 2, label=label,
+                                      label_filled=False, center_marker=True)
+    
+    def visualize_zones(self, image: np.ndarray) -> np.ndarray:
+        """
+        在圖像上繪製區域邊界（用於除錯）
+        
+        Parameters:
+            image: 輸入圖像
+            
+        Returns:
+            np.ndarray: 帶有區域標記的圖像
+        """
+        from overlay_compositor import OverlayScene, compose_overlay
+        
+        h, w = image.shape[:2]
+        scene = OverlayScene(w, h, rgb=False)
+        self.add_zones_to_overlay(scene)
+        return compose_overlay(image.copy(), scene)
+    
+    def draw_tracks(self, 
+                    image: np.ndarray, 
+                    tracker_results: List[Tuple]) -> np.ndarray:
+        """
+        在圖像上繪製追蹤結果
+        
+        Parameters:
+            image: 輸入圖像
+            tracker_results: 追蹤器結果
+            
+        Returns:
+            np.ndarray: 帶有追蹤標記的圖像
+        """
+        from overlay_compositor import OverlayScene, compose_overlay
         
-        return img_copy
+        h, w = image.shape[:2]
+        scene = OverlayScene(w, h, rgb=False)
+        self.add_tracks_to_overlay(scene, tracker_results)
+        return compose_overlay(image.copy(), scene)
@@ -0,0 +1,446 @@
+# udp_transport.py
+"""
+UDP 傳輸
+氣吹指令對延遲尾端比對送達保證更敏感（遲到的氣吹本來就無效），
+因此提供 UDP 作為 TCP 之外的選擇：每個資料包帶序號與發送時間，
+可要求接收端回覆 ACK 資料包，並統計遺失、亂序與來回延遲
+
+資料包格式（網路位元組順序）:
+    magic(2s) "NB" | flags(B) | seq(I) | timestamp_ns(Q) | payload
+    - flags bit0: 要求回覆 ACK
+    - flags bit1: 此資料包為 ACK（payload 為空，seq 與 timestamp_ns 原樣回傳）
+    - timestamp_ns: 發送端 time.monotonic_ns()，ACK 回傳後用於計算來回延遲
+    - payload: 與 TCP 相同編碼器產生的訊息（CSV 或 JSON 一行）
+"""
+
+import socket
+import struct
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+from frame_trace import get_frame_tracer
+from pipeline_metrics import LatencyStats, metrics
+
+HEADER = struct.Struct("!2sBIQ")
+MAGIC = b"NB"
+FLAG_ACK_REQUEST = 0x01
+FLAG_ACK = 0x02
+MAX_DATAGRAM_SIZE = 65507
+
+ACK_LATENCY = metrics.histogram('nircam_ack_latency_seconds', 'Command send to ACK latency', ('transport',),
+                                buckets=(0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5))
+
+
+def pack_datagram(seq: int, payload: bytes, flags: int = 0, timestamp_ns: Optional[int] = None) -> bytes:
+    """
+    組成資料包
+
+    Parameters:
+        seq: 序號（32 位元，自動取餘數）
+        payload: 訊息內容
+        flags: 旗標
+        timestamp_ns: 發送時間，None 表示現在（time.monotonic_ns()）
+
+    Returns:
+        bytes: 資料包
+    """
+    if timestamp_ns is None:
+        timestamp_ns = time.monotonic_ns()
+    return HEADER.pack(MAGIC, flags, seq & 0xFFFFFFFF, timestamp_ns) + payload
+
+
+def unpack_datagram(data: bytes) -> Optional[Tuple[int, int, int, bytes]]:
+    """
+    解析資料包
+
+    Parameters:
+        data: 收到的資料
+
+    Returns:
+        Tuple[int, int, int, bytes]: (flags, seq, timestamp_ns, payload)，格式不符時為 None
+    """
+    if len(data) < HEADER.size:
+        return None
+    magic, flags, seq, timestamp_ns = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        return None
+    return flags, seq, timestamp_ns, data[HEADER.size:]
+
+
+class UDPChannel:
+    """單一 UDP 訂閱者的發送通道（各自獨立的序號與 ACK 統計）"""
+
+    def __init__(self, sender: 'UDPSender', address: Tuple[str, int], request_ack: bool = False):
+        self.sender = sender
+        self.address = address
+        self.request_ack = request_ack
+        self.seq = 0
+
+        # 統計資訊
+        self.datagrams_sent = 0
+        self.send_errors = 0
+        self.acks_received = 0
+        self.rtt = LatencyStats()
+
+    def send(self, payload: bytes) -> bool:
+        """
+        發送一個資料包（非阻塞）
+
+        Returns:
+            bool: 是否交給系統送出
+        """
+        if len(payload) + HEADER.size > MAX_DATAGRAM_SIZE:
+            self.send_errors += 1
+            return False
+        self.seq = (self.seq + 1) & 0xFFFFFFFF
+        flags = FLAG_ACK_REQUEST if self.request_ack else 0
+        try:
+            self.sender.sock.sendto(pack_datagram(self.seq, payload, flags), self.address)
+        except OSError:
+            self.send_errors += 1
+            return False
+        self.datagrams_sent += 1
+        if self.request_ack:
+            tracer = get_frame_tracer()
+            if tracer is not None:
+                tracer.expect_ack((self.address, self.seq))
+        return True
+
+    def _on_ack(self, seq: int, timestamp_ns: int) -> None:
+        """收到 ACK 時更新來回延遲"""
+        self.acks_received += 1
+        rtt_ms = (time.monotonic_ns() - timestamp_ns) / 1e6
+        self.rtt.add(rtt_ms)
+        ACK_LATENCY.labels('udp').observe(rtt_ms / 1000.0)
+        tracer = get_frame_tracer()
+        if tracer is not None:
+            tracer.ack((self.address, seq))
+
+    def close(self) -> None:
+        """關閉通道"""
+        self.sender.close_channel(self)
+
+    def get_status(self) -> Dict:
+        """取得通道統計"""
+        status = {
+            'udp_address': self.address,
+            'datagrams_sent': self.datagrams_sent,
+            'send_errors': self.send_errors,
+        }
+        if self.request_ack:
+            status['acks_received'] = self.acks_received
+            status['ack_rate'] = (self.acks_received / self.datagrams_sent) if self.datagrams_sent else 0.0
+            status['rtt_ms'] = self.rtt.quantiles()
+        return status
+
+
+class UDPSender:
+    """
+    伺服器端共用的 UDP socket
+    所有 UDP 訂閱者共用同一個非阻塞 socket 發送，背景線程接收 ACK
+    """
+
+    def __init__(self, host: str = '0.0.0.0', port: int = 0):
+        """
+        Parameters:
+            host: 綁定位址
+            port: 綁定埠（0 表示由系統分配，ACK 會回到此埠）
+        """
+        self.host = host
+        self.port = port
+        self.sock = None
+        self.is_running = False
+        self._channels: Dict[Tuple[str, int], UDPChannel] = {}
+        self._ack_thread = None
+
+    def start(self) -> None:
+        """建立 socket 並啟動 ACK 接收線程"""
+        if self.is_running:
+            return
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if hasattr(socket, 'SIO_UDP_CONNRESET'):
+            # Windows: 接收端埠未開啟時的 ICMP port unreachable 不再讓 recvfrom 回報 WSAECONNRESET
+            self.sock.ioctl(socket.SIO_UDP_CONNRESET, False)
+        self.sock.bind((self.host, self.port))
+        self.sock.settimeout(0.5)
+        self.port = self.sock.getsockname()[1]
+        self.is_running = True
+        self._ack_thread = threading.Thread(target=self._ack_loop, daemon=True)
+        self._ack_thread.start()
+
+    def open_channel(self, address: Tuple[str, int], request_ack: bool = False) -> UDPChannel:
+        """
+        建立發送通道
+
+        Parameters:
+            address: 接收端 (host, port)
+            request_ack: 是否要求接收端回覆 ACK
+
+        Returns:
+            UDPChannel: 發送通道
+        """
+        self.start()
+        channel = UDPChannel(self, address, request_ack)
+        self._channels = {**self._channels, address: channel}
+        return channel
+
+    def close_channel(self, channel: UDPChannel) -> None:
+        """移除發送通道"""
+        self._channels = {a: c for a, c in self._channels.items() if c is not channel}
+
+    def _ack_loop(self) -> None:
+        """接收 ACK 資料包"""
+        while self.is_running:
+            try:
+                data, address = self.sock.recvfrom(2048)
+            except socket.timeout:
+                continue
+            except ConnectionResetError:
+                # 某個接收端暫時不在（ICMP port unreachable），其他通道的 ACK 照常接收
+                continue
+            except OSError:
+                if not self.is_running:
+                    break
+                continue
+            parsed = unpack_datagram(data)
+            if parsed is None or not parsed[0] & FLAG_ACK:
+                continue
+            channel = self._channels.get(address)
+            if channel is not None:
+                channel._on_ack(parsed[1], parsed[2])
+
+    def stop(self) -> None:
+        """停止接收並關閉 socket"""
+        self.is_running = False
+        self._channels = {}
+        if self.sock:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+
+
+class UDPReceiver:
+    """
+    UDP 接收端（供 LabVIEW 端參考實作與本機模擬器使用）
+    依序號統計遺失、亂序與重複，並在發送端要求時回覆 ACK
+    """
+
+    def __init__(self, host: str = '0.0.0.0', port: int = 9000, send_ack: bool = True, reorder_window: int = 1024):
+        """
+        Parameters:
+            host: 綁定位址
+            port: 綁定埠
+            send_ack: 是否回覆 ACK（發送端有要求時）
+            reorder_window: 記住多少個缺號以判斷晚到的資料包
+        """
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((host, port))
+        self.port = self.sock.getsockname()[1]
+        self.send_ack = send_ack
+
+        self.highest_seq: Optional[int] = None
+        self._missing = deque(maxlen=reorder_window)
+
+        # 統計資訊
+        self.received = 0
+        self.lost = 0
+        self.reordered = 0
+        self.duplicates = 0
+        self.invalid = 0
+
+    def receive(self, timeout: Optional[float] = None) -> Optional[Tuple[int, int, bytes]]:
+        """
+        接收一個資料包
+
+        Parameters:
+            timeout: 逾時秒數，None 表示一直等待
+
+        Returns:
+            Tuple[int, int, bytes]: (seq, timestamp_ns, payload)，逾時或格式不符時為 None
+        """
+        self.sock.settimeout(timeout)
+        try:
+            data, address = self.sock.recvfrom(MAX_DATAGRAM_SIZE)
+        except socket.timeout:
+            return None
+
+        parsed = unpack_datagram(data)
+        if parsed is None or parsed[0] & FLAG_ACK:
+            self.invalid += 1
+            return None
+        flags, seq, timestamp_ns, payload = parsed
+
+        if self.send_ack and flags & FLAG_ACK_REQUEST:
+            try:
+                self.sock.sendto(pack_datagram(seq, b"", FLAG_ACK, timestamp_ns), address)
+            except OSError:
+                pass
+
+        self._account(seq)
+        return seq, timestamp_ns, payload
+
+    def _account(self, seq: int) -> None:
+        """依序號更新遺失 / 亂序 / 重複統計"""
+        self.received += 1
+        if self.highest_seq is None:
+            self.highest_seq = seq
+            return
+
+        gap = (seq - self.highest_seq) & 0xFFFFFFFF
+        if gap == 0:
+            self.duplicates += 1
+        elif gap < 0x80000000:
+            # 比目前最大序號新，中間缺少的先計為遺失
+            for missing in range(1, min(gap, self._missing.maxlen + 1)):
+                self._missing.append((self.highest_seq + missing) & 0xFFFFFFFF)
+            self.lost += gap - 1
+            self.highest_seq = seq
+        elif seq in self._missing:
+            # 晚到的資料包：從遺失改記為亂序
+            self._missing.remove(seq)
+            self.lost -= 1
+            self.reordered += 1
+        else:
+            self.duplicates += 1
+
+    def get_statistics(self) -> Dict:
+        """
+        獲取統計資訊
+
+        Returns:
+            dict: 統計資訊
+        """
+        expected = self.received - self.duplicates + self.lost
+        return {
+            'received': self.received,
+            'lost': self.lost,
+            'reordered': self.reordered,
+            'duplicates': self.duplicates,
+            'invalid': self.invalid,
+            'loss_rate': (self.lost / expected) if expected > 0 else 0.0
+        }
+
+    def close(self) -> None:
+        """關閉 socket"""
+        self.sock.close()
+
+
+def run_latency_comparison(host: str = '127.0.0.1',
+                           port: int = 18888,
+                           count: int = 2000,
+                           rate_hz: float = 200.0,
+                           udp_port: int = 0) -> Dict[str, Dict]:
+    """
+    本機模擬器：同時以 TCP 與 UDP 執行端連上 TCPServer，
+    發送相同的氣吹訊息並比較單向延遲的分位數
+
+    Parameters:
+        host: TCPServer 位址
+        port: TCPServer 埠
+        count: 發送的訊息數
+        rate_hz: 發送頻率
+        udp_port: UDP 接收端埠（0 表示由系統分配）
+
+    Returns:
+        dict: {'tcp': {...}, 'udp': {...}}，各含延遲分位數（毫秒）與遺失統計
+    """
+    from tcp_server import TCPServer
+
+    server = TCPServer(host, port, hello_timeout=0.1)
+    if not server.start_server():
+        return {}
+
+    send_times: Dict[int, int] = {}
+    tcp_latency = LatencyStats(count)
+    udp_latency = LatencyStats(count)
+    udp_receiver = UDPReceiver(host, udp_port)
+
+    tcp_client = socket.create_connection((host, port))
+    udp_client = socket.create_connection((host, port))
+    udp_client.sendall(f"HELLO role=actuator transport=udp udp_port={udp_receiver.port} ack=1\n".encode())
+    # 等待兩個執行端註冊完成
+    deadline = time.monotonic() + 2.0
+    while len(server.subscribers) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    def trigger_of(line: bytes) -> Optional[int]:
+        parts = line.split(b",")
+        return int(parts[1]) if len(parts) > 1 and parts[0] == b";" else None
+
+    def tcp_reader():
+        buffer = b""
+        while len(tcp_latency.samples) < count:
+            try:
+                data = tcp_client.recv(65536)
+            except OSError:
+                return
+            if not data:
+                return
+            now = time.monotonic_ns()
+            buffer += data
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                trigger = trigger_of(line)
+                if trigger in send_times:
+                    tcp_latency.add((now - send_times[trigger]) / 1e6)
+
+    def udp_reader():
+        while udp_receiver.received < count:
+            packet = udp_receiver.receive(timeout=1.0)
+            if packet is None:
+                if not server.is_running:
+                    return
+                continue
+            now = time.monotonic_ns()
+            trigger = trigger_of(packet[2].rstrip(b"\n"))
+            if trigger in send_times:
+                udp_latency.add((now - send_times[trigger]) / 1e6)
+
+    readers = [threading.Thread(target=tcp_reader, daemon=True),
+               threading.Thread(target=udp_reader, daemon=True)]
+    for reader in readers:
+        reader.start()
+
+    interval = 1.0 / rate_hz
+    next_send = time.monotonic()
+    for trigger in range(1, count + 1):
+        send_times[trigger] = time.monotonic_ns()
+        server.send_message(f";,{trigger},1280,1024,1,0,640,512,1,0,0,0,0,0\n")
+        next_send += interval
+        delay = next_send - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    for reader in readers:
+        reader.join(timeout=2.0)
+
+    udp_status = next((s.get_status() for s in server.subscribers if s.datagram_channel), {})
+    result = {
+        'tcp': {'received': tcp_latency.count, **tcp_latency.quantiles()},
+        'udp': {**udp_receiver.get_statistics(), **udp_latency.quantiles(),
+                'ack_rtt_ms': udp_status.get('rtt_ms', {})}
+    }
+
+    tcp_client.close()
+    udp_client.close()
+    udp_receiver.close()
+    server.stop_server()
+    return result
+
+
+if __name__ == "__main__":
+    results = run_latency_comparison()
+    print("\n" + "="*60)
+    print("TCP vs UDP ACTUATOR LATENCY (local simulator)")
+    print("="*60)
+    for transport, stats in results.items():
+        print(f"[{transport.upper()}]")
+        for key, value in stats.items():
+            if isinstance(value, float):
+                print(f"  {key:<12} {value:.3f}")
+            else:
+                print(f"  {key:<12} {value}")
+    print("="*60 + "\n")